@@ -11,8 +11,11 @@ If you need to work directly with the auth handler or permissions handler,
 this is the plugin you want to get from the plugin manager.
 """
 
+from twisted.internet.defer import inlineCallbacks
+
 from plugins.auth import auth_handler
 from plugins.auth import permissions_handler
+from plugins.auth.hashing import HashingPool
 
 from system.events.general import PreCommand
 from system.plugins.plugin import PluginObject
@@ -40,6 +43,7 @@ class AuthPlugin(PluginObject):
 
     auth_h = None
     perms_h = None
+    hashing_pool = None
 
     def setup(self):
         """
@@ -93,8 +97,12 @@ class AuthPlugin(PluginObject):
                 self.logger.exception(_("Unable to load user accounts. They "
                                         "will be unavailable!"))
             else:
+                self.hashing_pool = HashingPool(
+                    self.config.get("hash-processes", 2)
+                )
                 self.auth_h = auth_handler.authHandler(self, self.passwords,
-                                                       self.blacklist)
+                                                       self.blacklist,
+                                                       self.hashing_pool)
                 result = self.commands.set_auth_handler(self.auth_h)
                 if not result:
                     self.logger.warn(_("Unable to set auth handler!"))
@@ -150,6 +158,7 @@ class AuthPlugin(PluginObject):
             done = donestr.join(split_)
             event.printable = done
 
+    @inlineCallbacks
     def login_command(self, protocol, caller, source, command, raw_args,
                       parsed_args):
         """
@@ -167,7 +176,18 @@ class AuthPlugin(PluginObject):
             username = args[0]
             password = args[1]
 
-            result = self.auth_h.login(caller, protocol, username, password)
+            try:
+                result = yield self.auth_h.login_async(
+                    caller, protocol, username, password
+                )
+            except Exception:
+                self.logger.exception(_("Error checking login for %s")
+                                      % username)
+                caller.respond(__("Something went wrong when logging you "
+                                  "in! You should ask the bot operators "
+                                  "about this."))
+                return
+
             if not result:
                 self.logger.warn(_("%s failed to login as %s")
                                  % (caller.nickname, username))
@@ -190,6 +210,7 @@ class AuthPlugin(PluginObject):
         else:
             caller.respond(__("You're not logged in."))
 
+    @inlineCallbacks
     def register_command(self, protocol, caller, source, command, raw_args,
                          parsed_args):
         """
@@ -222,17 +243,27 @@ class AuthPlugin(PluginObject):
                               "Try another!"))
             return
 
-        if self.auth_h.create_user(username, password):
+        try:
+            result = yield self.auth_h.create_user_async(username, password)
+        except Exception:
+            self.logger.exception(_("Error creating account %s") % username)
+            result = False
+
+        if result:
             caller.respond(__("Your account has been created and you will now "
                               "be logged in. Thanks for registering!"))
-            self.perms_h.create_user(username)
-            self.login_command(caller, source, [username, password], protocol,
-                               raw_args, parsed_args)
+
+            if self.perms_h:
+                self.perms_h.create_user(username)
+
+            yield self.login_command(protocol, caller, source, "login",
+                                     "%s %s" % (username, password), None)
         else:
             caller.respond(__("Something went wrong when creating your "
                               "account! You should ask the bot operators "
                               "about this."))
 
+    @inlineCallbacks
     def passwd_command(self, protocol, caller, source, command, raw_args,
                        parsed_args):
         """
@@ -259,7 +290,18 @@ class AuthPlugin(PluginObject):
                               "another!"))
             return
 
-        if self.auth_h.change_password(username, old, new):
+        try:
+            result = yield self.auth_h.change_password_async(username, old,
+                                                             new)
+        except Exception:
+            self.logger.exception(_("Error changing the password for %s")
+                                  % username)
+            caller.respond(__("Something went wrong when changing your "
+                              "password! You should ask the bot operators "
+                              "about this."))
+            return
+
+        if result:
             caller.respond(__("Your password has been changed successfully."))
         else:
             caller.respond(__("Old password incorrect - please try again!"))
@@ -289,8 +331,13 @@ class AuthPlugin(PluginObject):
 
     def deactivate(self):
         """
-        Called when the plugin is deactivated. Does nothing right now.
+        Called when the plugin is deactivated. Unsets our handlers and stops
+        the hashing processes.
         """
+
+        if self.hashing_pool is not None:
+            self.hashing_pool.close()
+
         if self.config["use-auth"]:
             if isinstance(
                     self.commands.auth_handler, auth_handler.authHandler
@@ -1,11 +1,18 @@
 # coding=utf-8
 
+import hashlib
+import hmac
+import os
+
+from twisted.internet import defer
+from weakreflist.weakreflist import WeakList
+
 from plugins.auth.crypto import get_algo
+from plugins.auth.hashing import HashingPool
 from system.translations import Translations
+from utils.cache import LRUCache
 from utils.password import mkpasswd
 
-from weakreflist.weakreflist import WeakList
-
 """
 Authorization handler. This is in charge of logins and accounts.
 
@@ -18,6 +25,12 @@ also includes a rudimentary password blacklist system.
 
 If you want to write your own auth handler, be sure to implement all the
 documented methods.
+
+Hashing passwords is slow, so there are also Deferred-returning variants of
+the methods that hash - check_login_async, create_user_async,
+change_password_async and login_async. These do the hashing in worker
+processes, leaving the reactor free, and should be used in preference to the
+blocking versions wherever possible.
 """
 
 __author__ = 'Gareth Coles'
@@ -31,18 +44,36 @@ class authHandler(object):
 
     users = {}
 
-    def __init__(self, plugin, data, blacklist):
+    def __init__(self, plugin, data, blacklist, hashing_pool=None):
         """
         Initialise the auth handler.
 
         This will also create a default account and default password
         blacklist if one doesn't already exist.
+
+        If no hashing pool is given, the async methods will hash passwords
+        in this process.
+
+        :type hashing_pool: plugins.auth.hashing.HashingPool
         """
 
         self.data = data
         self.blacklist = blacklist
         self.plugin = plugin
 
+        if hashing_pool is None:
+            hashing_pool = HashingPool(0)
+
+        self.hashing_pool = hashing_pool
+
+        # Results of recent password checks, so repeated identical attempts
+        # don't have to be hashed again. Passwords are only stored as an HMAC
+        # with a key that's never saved anywhere.
+        self.verified = LRUCache(
+            256, self.plugin.config.get("login-cache-ttl", 30)
+        )
+        self._verified_key = os.urandom(32)
+
         get_algo(self.algo)  # To be sure that it works
 
         self.create_superadmin_account()
@@ -248,6 +279,97 @@ class authHandler(object):
 
         return result
 
+    def _fingerprint(self, password):
+        if isinstance(password, unicode):
+            password = password.encode("UTF-8")
+
+        return hmac.new(self._verified_key, password, hashlib.sha256).digest()
+
+    def _get_verified(self, username, user_data, password):
+        """
+        Get the cached result of checking a password, or None if we don't
+        have one. Results are only used while the stored hash is unchanged.
+        """
+
+        cached = self.verified.get(username)
+
+        if cached is None:
+            return None
+
+        fingerprint, hashed, result = cached
+
+        if hashed != user_data["password"]:
+            return None
+
+        if not hmac.compare_digest(fingerprint, self._fingerprint(password)):
+            return None
+
+        return result
+
+    def _set_verified(self, username, hashed, password, result):
+        self.verified.set(
+            username, (self._fingerprint(password), hashed, result)
+        )
+
+    @defer.inlineCallbacks
+    def check_login_async(self, username, password):
+        """
+        Check whether a password is the valid login for a user, without
+        blocking the reactor.
+
+        The result is cached for a short time, so repeated attempts with the
+        same password don't need hashing again.
+
+        :param username: The username to check against
+        :param password: The attempted password
+
+        :type username: str
+        :type password: str
+
+        :return: Deferred that fires with whether the password was correct
+        :rtype: Deferred
+        """
+
+        username = username.lower()
+
+        if username not in self.data:
+            defer.returnValue(False)
+
+        user_data = dict(self.data[username])
+        result = self._get_verified(username, user_data, password)
+
+        if result is not None:
+            defer.returnValue(result)
+
+        algo = user_data.get("algo", "sha512")
+
+        result = yield self.hashing_pool.check_password(
+            algo, user_data["password"], password, user_data["salt"]
+        )
+
+        if self.data.get(username, {}).get("password") \
+                != user_data["password"]:
+            # The account changed while we were hashing
+            defer.returnValue(False)
+
+        if self.replace_hashes and algo != self.algo and result:
+            salt, hashed = yield self.hashing_pool.hash_password(
+                self.algo, password
+            )
+
+            with self.data:
+                if username in self.data:
+                    self.data[username] = {
+                        "algo": self.algo,
+                        "salt": salt,
+                        "password": hashed
+                    }
+
+            user_data["password"] = hashed
+
+        self._set_verified(username, user_data["password"], password, result)
+        defer.returnValue(result)
+
     def create_user(self, username, password):
         """
         Create a new user account with a given username and password.
@@ -281,8 +403,52 @@ class authHandler(object):
                 "algo": self.algo
             }
 
+        self.verified.pop(username)
         return True
 
+    @defer.inlineCallbacks
+    def create_user_async(self, username, password):
+        """
+        Create a new user account with a given username and password, without
+        blocking the reactor.
+
+        See create_user for more information.
+
+        :param username: The username of the account
+        :param password: The password to be used
+
+        :type username: str
+        :type password: str
+
+        :return: Deferred that fires with whether the account was created
+            successfully
+        :rtype: Deferred
+        """
+
+        username = username.lower()
+
+        if username in self.data:
+            defer.returnValue(False)
+
+        algo = self.algo
+        salt, hashed = yield self.hashing_pool.hash_password(algo, password)
+
+        with self.data:
+            if username in self.data:
+                # Someone else got there while we were hashing
+                defer.returnValue(False)
+
+            self.data[username] = {
+                "password": hashed,
+                "salt": salt,
+                "algo": algo
+            }
+
+        # We know the password is right, so there's no need to hash it again
+        # when the user logs in
+        self._set_verified(username, hashed, password, True)
+        defer.returnValue(True)
+
     def change_password(self, username, old, new):
         """
         Change a user's password.
@@ -322,8 +488,58 @@ class authHandler(object):
                 "salt": salt,
                 "algo": self.data[username]["algo"]
             }
+
+        self.verified.pop(username)
         return True
 
+    @defer.inlineCallbacks
+    def change_password_async(self, username, old, new):
+        """
+        Change a user's password, without blocking the reactor.
+
+        See change_password for more information.
+
+        :param username: The username of the account
+        :param old: The old password to check
+        :param new: The new password to change to
+
+        :type username: str
+        :type old: str
+        :type new: str
+
+        :return: Deferred that fires with whether the password was changed
+        :rtype: Deferred
+        """
+
+        username = username.lower()
+
+        result = yield self.check_login_async(username, old)
+
+        if not result:
+            defer.returnValue(False)
+
+        if username not in self.data:
+            defer.returnValue(False)
+
+        algo = self.data[username]["algo"]
+        previous = self.data[username]["password"]
+
+        salt, hashed = yield self.hashing_pool.hash_password(algo, new)
+
+        with self.data:
+            if self.data.get(username, {}).get("password") != previous:
+                # The account changed while we were hashing
+                defer.returnValue(False)
+
+            self.data[username] = {
+                "password": hashed,
+                "salt": salt,
+                "algo": algo
+            }
+
+        self._set_verified(username, hashed, new, True)
+        defer.returnValue(True)
+
     def delete_user(self, username):
         """
         Delete a user's account.
@@ -341,6 +557,7 @@ class authHandler(object):
         with self.data:
             if username in self.data:
                 del self.data[username]
+                self.verified.pop(username)
                 return True
         return False
 
@@ -366,13 +583,45 @@ class authHandler(object):
         """
 
         if self.check_login(username, password):
-            user.authorized = True
-            user.auth_name = username
-
-            self.add_logged_in_user(username, user)
+            self._logged_in(user, username)
             return True
         return False
 
+    @defer.inlineCallbacks
+    def login_async(self, user, protocol, username, password):
+        """
+        Log a user in, without blocking the reactor.
+
+        See login for more information.
+
+        :param user: The User object of the person trying to log in
+        :param protocol: The Protocol object relating to the User
+        :param username: The username of the account that's being tried
+        :param password: The password of the account
+
+        :type user: User
+        :type protocol: Protocol
+        :type username: str
+        :type password: str
+
+        :return: Deferred that fires with whether the user was logged in
+            successfully
+        :rtype: Deferred
+        """
+
+        result = yield self.check_login_async(username, password)
+
+        if result:
+            self._logged_in(user, username)
+
+        defer.returnValue(result)
+
+    def _logged_in(self, user, username):
+        user.authorized = True
+        user.auth_name = username
+
+        self.add_logged_in_user(username, user)
+
     def logout(self, user, protocol):
         """
         Log a logged-in user out.
@@ -0,0 +1,141 @@
+# coding=utf-8
+
+"""
+Password hashing in worker processes.
+
+Hashing algorithms like bcrypt are slow on purpose, so hashing a password on
+the reactor thread stalls every connected protocol until it's done. Threads
+don't help much either, as hashing holds the GIL. Instead, this hands the
+work to a small pool of worker processes and returns Deferreds.
+
+With no worker processes, hashing happens in-process instead, which is
+useful for tests and for systems where multiprocessing isn't available.
+"""
+
+__author__ = 'Gareth Coles'
+
+import multiprocessing
+import signal
+
+from twisted.internet import defer, reactor
+
+from plugins.auth.crypto import get_algo
+
+
+def hash_password(algo, password):
+    """
+    Generate a salt and hash a password with it.
+
+    :param algo: The name of the algorithm to use
+    :param password: The password to hash
+
+    :return: Tuple of (salt, hash)
+    :rtype: tuple
+    """
+
+    algo_obj = get_algo(algo)
+    salt = algo_obj.gen_salt()
+
+    return salt, algo_obj.hash(password, salt)
+
+
+def check_password(algo, hashed, password, salt):
+    """
+    Check a password against a hash.
+
+    :param algo: The name of the algorithm the hash was made with
+    :param hashed: The stored hash
+    :param password: The password to check
+    :param salt: The stored salt
+
+    :return: Whether the password matches
+    :rtype: bool
+    """
+
+    return get_algo(algo).check(hashed, password, salt)
+
+
+def _init_worker():
+    # Workers forked while the reactor is running inherit its signal
+    # handlers, which would stop them from being terminated
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.set_wakeup_fd(-1)
+
+
+def _call(func, args):
+    # Exceptions raised in the workers are returned instead, as Python 2's
+    # Pool.apply_async has no error callback
+    try:
+        return True, func(*args)
+    except Exception as e:
+        return False, e
+
+
+class HashingPool(object):
+    """
+    Bounded pool of processes that hash and check passwords.
+    """
+
+    pool = None
+
+    def __init__(self, processes=2):
+        """
+        :param processes: How many worker processes to start - with 0,
+            passwords will be hashed in this process instead
+        """
+
+        self.processes = processes
+
+        if processes > 0:
+            self.pool = multiprocessing.Pool(processes, _init_worker)
+            reactor.addSystemEventTrigger("before", "shutdown", self.close)
+
+    def hash_password(self, algo, password):
+        """
+        Generate a salt and hash a password with it, in a worker process.
+
+        :return: Deferred that fires with a tuple of (salt, hash)
+        :rtype: Deferred
+        """
+
+        return self._run(hash_password, algo, password)
+
+    def check_password(self, algo, hashed, password, salt):
+        """
+        Check a password against a hash, in a worker process.
+
+        :return: Deferred that fires with whether the password matches
+        :rtype: Deferred
+        """
+
+        return self._run(check_password, algo, hashed, password, salt)
+
+    def _run(self, func, *args):
+        if self.pool is None:
+            return defer.maybeDeferred(func, *args)
+
+        d = defer.Deferred()
+
+        def done(result):
+            # This is called from the pool's result thread
+            success, value = result
+
+            if success:
+                reactor.callFromThread(d.callback, value)
+            else:
+                reactor.callFromThread(d.errback, value)
+
+        self.pool.apply_async(_call, (func, args), callback=done)
+        return d
+
+    def close(self):
+        """
+        Stop the worker processes. Hashing that's still in progress is
+        abandoned.
+        """
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
@@ -20,18 +20,143 @@ import re
 from system.protocols.generic.user import User
 from system.translations import Translations
 
+from utils.cache import LRUCache
 from utils.misc import str_to_regex_flags as s2rf
 
 _ = Translations().get()
 __ = Translations().get_m()
 
+#: Characters that make a permission node a wildcard node
+WILDCARD_CHARS = frozenset("*?[")
+
+
+class NodeSet(object):
+    """
+    A compiled set of permission nodes.
+
+    Plain nodes are kept in a hash set, nodes whose only wildcard is a
+    trailing "*" are kept in a prefix trie and everything else (regex nodes
+    and complex wildcards) is compiled to a regex up-front.
+    """
+
+    pattern = re.compile(r"/(.*)/(.*)")
+
+    def __init__(self, nodes, wildcard=True, regex=True):
+        self.exact = set()
+        self.trie = {}
+        self.regexes = []
+
+        for node in nodes:
+            self.add(node, wildcard, regex)
+
+    def add(self, node, wildcard=True, regex=True):
+        """
+        Compile a single permission node into the set.
+        """
+
+        if regex:
+            result = self.pattern.match(node)
+
+            if result:
+                pattern, flags = result.groups()
+                self.regexes.append(re.compile(pattern, s2rf(flags)).match)
+                return
+
+        node = node.lower()
+
+        if not wildcard or not WILDCARD_CHARS.intersection(node):
+            self.exact.add(node)
+        elif node.endswith("*") and \
+                not WILDCARD_CHARS.intersection(node[:-1]):
+            current = self.trie
+
+            for char in node[:-1]:
+                current = current.setdefault(char, {})
+            current[None] = True
+        else:
+            self.regexes.append(re.compile(fnmatch.translate(node)).match)
+
+    def match(self, perm):
+        """
+        Check whether a lowercased permission matches any node in the set.
+
+        :param perm: The permission to check
+        :type perm: str
+
+        :rtype: bool
+        """
+
+        if perm in self.exact:
+            return True
+
+        current = self.trie
+
+        if current:
+            if None in current:
+                return True
+
+            for char in perm:
+                current = current.get(char)
+
+                if current is None:
+                    break
+                if None in current:
+                    return True
+
+        for regex in self.regexes:
+            if regex(perm):
+                return True
+
+        return False
+
+
+class PermissionMatcher(object):
+    """
+    A list of permission nodes (including deny nodes), compiled once so that
+    it can be checked against repeatedly.
+    """
+
+    def __init__(self, permissions, wildcard=True, deny_nodes=True,
+                 regex=True):
+        grant = []
+        deny = []
+
+        for element in permissions:
+            if element.startswith("^"):
+                if deny_nodes:
+                    deny.append(element[1:])
+            else:
+                grant.append(element)
+
+        self.grant = NodeSet(grant, wildcard, regex)
+        self.deny = NodeSet(deny, wildcard, regex)
+
+    def match(self, perm):
+        """
+        Check whether a permission is granted (and not denied).
+
+        :param perm: The permission to check
+        :type perm: str
+
+        :rtype: bool
+        """
+
+        perm = perm.lower()
+
+        if self.deny.match(perm):
+            return False
+        return self.grant.match(perm)
+
 
 class permissionsHandler(object):
     """
     Permissions handler class
     """
 
-    pattern = re.compile(r"/(.*)/(.*)")
+    pattern = NodeSet.pattern
+
+    #: Maximum number of compiled effective permission sets to keep
+    cache_size = 8192
 
     def __init__(self, plugin, data):
         """
@@ -43,6 +168,12 @@ class permissionsHandler(object):
         self.data = data
         self.plugin = plugin
 
+        # Compiled effective permissions, keyed by
+        # (kind, name, protocol, source). This is flushed whenever the data
+        # file's revision changes, which covers both mutation and reloads.
+        self._matchers = LRUCache(self.cache_size)
+        self._revision = None
+
         with self.data:
             if "users" not in self.data:
                 self.data["users"] = {}
@@ -102,6 +233,24 @@ class permissionsHandler(object):
 
         return self.data.reload()
 
+    def _get_matcher(self, key, builder):
+        """
+        Get a compiled effective permission set from the cache, building it
+        with *builder* if it isn't there or the data file has changed.
+        """
+
+        if self._revision != self.data.revision:
+            self._matchers.clear()
+            self._revision = self.data.revision
+
+        matcher = self._matchers.get(key)
+
+        if matcher is None:
+            matcher = PermissionMatcher(builder())
+            self._matchers.set(key, matcher)
+
+        return matcher
+
     def check(self, permission, caller, source, protocol):
         """
         Check whether someone has a specified permission.
@@ -498,20 +647,26 @@ class permissionsHandler(object):
                 if self.get_user_option(user, "superadmin"):
                     return True
 
-            user_perms = self.data["users"][user]["permissions"]
+            def _build():
+                user_perms = self.data["users"][user]["permissions"]
 
-            _protos = self.data["users"][user].get("protocols", {})
+                _protos = self.data["users"][user].get("protocols", {})
 
-            if protocol:
-                _proto = _protos.get(protocol, {})
-                user_perms = user_perms + _proto.get("permissions", [])
+                if protocol:
+                    _proto = _protos.get(protocol, {})
+                    user_perms = user_perms + _proto.get("permissions", [])
 
-                _sources = _protos.get("sources", {})
+                    _sources = _protos.get("sources", {})
 
-                if source:
-                    user_perms = user_perms + _sources.get(source, [])
+                    if source:
+                        user_perms = user_perms + _sources.get(source, [])
+                return user_perms
+
+            matcher = self._get_matcher(
+                ("user", user, protocol, source), _build
+            )
 
-            if self.compare_permissions(permission, user_perms):
+            if matcher.match(permission):
                 return True
 
         if check_group:
@@ -709,53 +864,70 @@ class permissionsHandler(object):
         group = group.lower()
         permission = permission.lower()
 
-        groups = []
-        all_perms = set()
-
-        self.plugin.logger.debug(_("Checking group perms..."))
-        self.plugin.logger.debug(_("GROUP | %s") % group)
-        self.plugin.logger.debug(_("PERMI | %s") % permission)
-        self.plugin.logger.debug(_("SOURC | %s") % source)
-        self.plugin.logger.debug(_("PROTO | %s") % protocol)
-
-        def _recur(_group):
-            if _group is None:
-                self.plugin.logger.debug(_("Group is None."))
-                return
-            if _group in self.data["groups"]:
-                if _group not in groups:
-                    groups.append(_group)
-                    perms_list = self.data["groups"][_group]["permissions"]
-                    all_perms.update(set(perms_list))
+        if group not in self.data["groups"]:
+            return False
+
+        def _build():
+            groups = []
+            all_perms = set()
+
+            self.plugin.logger.debug(_("Compiling group perms..."))
+            self.plugin.logger.debug(_("GROUP | %s") % group)
+            self.plugin.logger.debug(_("SOURC | %s") % source)
+            self.plugin.logger.debug(_("PROTO | %s") % protocol)
+
+            def _recur(_group):
+                if _group is None:
+                    self.plugin.logger.debug(_("Group is None."))
+                    return
+                if _group in self.data["groups"]:
+                    if _group not in groups:
+                        groups.append(_group)
+                        perms_list = self.data["groups"][_group][
+                            "permissions"
+                        ]
+                        all_perms.update(set(perms_list))
+
+                        _protos = self.data["groups"][_group].get(
+                            "protocols", {}
+                        )
+
+                        if _protos is None:
+                            self.plugin.logger.debug(_("Protocols are None."))
+                            return
 
-                    _protos = self.data["groups"][_group].get("protocols", {})
+                        if protocol:
+                            _proto = _protos.get(protocol, {})
 
-                    if _protos is None:
-                        self.plugin.logger.debug(_("Protocols are None."))
-                        return
+                            all_perms.update(
+                                set(_proto.get("permissions", []))
+                            )
 
-                    if protocol:
-                        _proto = _protos.get(protocol, {})
+                            _sources = _proto.get("sources", {})
 
-                        all_perms.update(set(_proto.get("permissions", [])))
+                            if _sources is None:
+                                self.plugin.logger.debug(
+                                    _("Sources are None.")
+                                )
+                                return
 
-                        _sources = _proto.get("sources", {})
+                            if source:
+                                all_perms.update(
+                                    set(_sources.get(source, []))
+                                )
 
-                        if _sources is None:
-                            self.plugin.logger.debug(_("Sources are None."))
-                            return
+                        inherit = self.get_group_inheritance(_group)
+                        if inherit:
+                            _recur(inherit)
 
-                        if source:
-                            all_perms.update(set(_sources.get(source, [])))
+            _recur(group)
+            return list(all_perms)
 
-                    inherit = self.get_group_inheritance(_group)
-                    if inherit:
-                        _recur(inherit)
+        matcher = self._get_matcher(
+            ("group", group, protocol, source), _build
+        )
 
-        if group in self.data["groups"]:
-            _recur(group)
-            return self.compare_permissions(permission, list(all_perms))
-        return False
+        return matcher.match(permission)
 
     # Permissions comparisons
     def compare_permissions(self, perm, permissions, wildcard=True,
@@ -782,47 +954,5 @@ class permissionsHandler(object):
         :return: Whether the permission has been matched or not
         :rtype: bool
         """
-        perm = perm.lower()
-
-        grant = []
-        deny = []
-        for element in permissions:
-            if element.startswith("^"):
-                deny.append(element[1:])
-            else:
-                grant.append(element)
-
-        if deny_nodes:
-            for element in deny:
-                result = False
-
-                if regex:
-                    result = self.pattern.match(element)
-
-                    if result:
-                        pattern, flags = result.groups()
-                        if re.match(pattern, perm, s2rf(flags)):
-                            return False
-                if not result:
-                    if wildcard and fnmatch.fnmatch(perm, element.lower()):
-                        return False
-                    elif (not wildcard) and perm == element.lower():
-                        return False
-
-        for element in grant:
-            result = False
-
-            if regex:
-                result = self.pattern.match(element)
-
-                if result:
-                    pattern, flags = result.groups()
-                    if re.match(pattern, perm, s2rf(flags)):
-                        return True
-            if not result:
-                if wildcard and fnmatch.fnmatch(perm, element.lower()):
-                    return True
-                elif (not wildcard) and perm == element.lower():
-                    return True
-
-        return False
+        matcher = PermissionMatcher(permissions, wildcard, deny_nodes, regex)
+        return matcher.match(perm)
@@ -16,6 +16,9 @@ from system.events.irc import UserJoinedEvent, UserKickedEvent, \
     UserPartedEvent, UserQuitEvent
 from system.events.mumble import UserJoined, UserMoved, UserRemove
 
+from plugins.bridge.relay import RelayQueue
+from plugins.bridge.rules import RuleIndex, obfuscate
+
 from system.plugins.plugin import PluginObject
 from system.protocols.generic.channel import Channel
 from system.protocols.generic.user import User
@@ -39,6 +42,14 @@ class BridgePlugin(PluginObject):
 
     rules = {}
 
+    #: Compiled rules, indexed by source
+    #: :type: plugins.bridge.rules.RuleIndex
+    index = None
+
+    #: Queue of relayed lines waiting to be sent
+    #: :type: plugins.bridge.relay.RelayQueue
+    relay_queue = None
+
     @property
     def rules(self):
         """
@@ -47,6 +58,15 @@ class BridgePlugin(PluginObject):
 
         return self.config["rules"]
 
+    def compile_rules(self):
+        """
+        Compile the bridging rules into an index. This is done whenever the
+        configuration is reloaded.
+        """
+
+        self.index = RuleIndex(self.rules or {})
+        self.logger.debug(_("Compiled %s bridging rules") % len(self.index))
+
     def setup(self):
         """
         Called when the plugin is loaded. Performs initial setup.
@@ -68,6 +88,11 @@ class BridgePlugin(PluginObject):
             self._disable_self()
             return
 
+        self.compile_rules()
+        self.config.add_callback(self.compile_rules)
+
+        self.relay_queue = RelayQueue(self.factory_manager, self.logger)
+
         # General
 
         self.events.add_callback("PreMessageReceived", self, self.handle_msg,
@@ -114,6 +139,14 @@ class BridgePlugin(PluginObject):
         self.events.add_callback("Mumble/UserMoved", self,
                                  self.handle_mumble_move, 1000)
 
+    def deactivate(self):
+        """
+        Called when the plugin is unloaded. Sends any queued relays.
+        """
+
+        if self.relay_queue is not None:
+            self.relay_queue.flush()
+
     def handle_irc_join(self, event=UserJoinedEvent):
         """
         Event handler for IRC join events
@@ -266,99 +299,65 @@ class BridgePlugin(PluginObject):
         if not f_str:
             f_str = ["general", "message"]
 
-        c_name = caller.name.lower()  # Protocol
-        s_name = source.nickname  # User
         if isinstance(target, Channel):
+            rules = self.index.match(caller.name, "channel", target.name)
             t_name = target.name  # Channel
-        else:
+        elif isinstance(target, User):
+            if not from_user:
+                self.logger.trace(_("Function was called with relaying "
+                                    "from users disabled."))
+                return
+            rules = self.index.match(caller.name, "user")
             t_name = target.nickname
+        else:
+            self.logger.trace(_("Target isn't a known type."))
+            return
 
-        for rule, data in self.rules.items():
-            self.logger.debug(_("Checking rule: %s - %s") % (rule, data))
-            from_ = data["from"]
-            to_ = data["to"]
+        if not rules:
+            return
 
-            if c_name != from_["protocol"].lower():
-                self.logger.trace(_("Protocol doesn't match."))
-                continue
+        s_name = source.nickname  # User
+        format_key = (f_str[0], f_str[1])
+        lines = None
 
-            if not self.factory_manager.get_protocol(to_["protocol"]):
-                self.logger.trace(_("Target protocol doesn't exist."))
-                continue
+        for rule in rules:
+            self.logger.trace(_("Matched rule: %s") % rule.name)
 
-            if isinstance(target, User):
-                # We ignore the source name since there can only ever be one
-                #     user: us.
-                if not from_user:
-                    self.logger.trace(_("Function was called with relaying "
-                                        "from users disabled."))
-                    continue
-                if from_["source-type"].lower() != "user":
-                    self.logger.trace(_("Target type isn't a user."))
-                    continue
-            elif isinstance(target, Channel):
-                if from_["source-type"].lower() != "channel":
-                    self.logger.trace(_("Target type isn't a Channel."))
-                    continue
-                if from_["source"].lower() != "*" \
-                   and from_["source"].lower() != t_name.lower():
-                    self.logger.trace(_("Target name doesn't match the "
-                                        "source."))
-                    continue
-            else:
-                self.logger.trace(_("Target isn't a known type."))
+            template = rule.formatting.get(format_key)
+
+            if template is None:
+                self.logger.trace(_("Not relaying message as the format "
+                                    "string was empty or missing."))
                 continue
 
-            if to_["target"] == "user" and not to_user:
+            if rule.target_type == "user" and not to_user:
                 self.logger.trace(_("Function was called with relaying to "
                                     "users disabled."))
                 continue
 
-            # If we get this far, we've matched the incoming rule.
+            if not self.factory_manager.get_protocol(rule.protocol):
+                self.logger.trace(_("Target protocol doesn't exist."))
+                continue
 
-            format_string = None
+            user = tokens.get("USER", s_name)
+            target_name = tokens.get("TARGET", t_name)
 
-            formatting = data["formatting"]
-            if f_str[0] in formatting:
-                if f_str[1] in formatting[f_str[0]]:
-                    format_string = formatting[f_str[0]][f_str[1]]
+            if rule.obfuscate_source:
+                user = obfuscate(user)
+            if rule.obfuscate_target:
+                target_name = obfuscate(target_name)
 
-            if not format_string:
-                self.logger.trace(_("Not relaying message as the format "
-                                    "string was empty or missing."))
-                continue
+            values = dict(tokens)
+            values["USER"] = user
+            values["TARGET"] = target_name
+            values["PROTOCOL"] = caller.name
+
+            if lines is None:
+                lines = msg.strip("\r").split("\n")
+
+            for line in lines:
+                values["MESSAGE"] = line
 
-            else:
-                sf_name = s_name
-                tf_name = t_name
-                if from_.get("obfuscate-names", False):
-                    sf_name = s_name[:-1] + "_" + s_name[-1]
-                    if "USER" in tokens:
-                        _u = tokens["USER"]
-                        tokens["USER"] = _u[:-1] + "_" + _u[-1]
-
-                if to_.get("obfuscate-names", False):
-                    tf_name = t_name[:-1] + "_" + t_name[-1]
-                    if "TARGET" in tokens:
-                        _u = tokens["TARGET"]
-                        tokens["TARGET"] = _u[:-1] + "_" + _u[-1]
-
-                if "disconnected" in format_string:
-                    pass
-
-                for line in msg.strip("\r").split("\n"):
-                    format_string = formatting[f_str[0]][f_str[1]]
-
-                    for k, v in tokens.items():
-                        format_string = format_string.replace("{%s}" % k, v)
-
-                    format_string = format_string.replace("{MESSAGE}", line)
-                    format_string = format_string.replace("{USER}", sf_name)
-                    format_string = format_string.replace("{TARGET}", tf_name)
-                    format_string = format_string.replace("{PROTOCOL}",
-                                                          caller.name)
-
-                    prot = self.factory_manager.get_protocol(to_["protocol"])
-                    prot.send_msg(to_["target"], format_string,
-                                  target_type=to_["target-type"],
-                                  use_event=use_event)
+                self.relay_queue.add(rule.protocol, rule.target,
+                                     rule.target_type, template.render(values),
+                                     use_event)
@@ -0,0 +1,132 @@
+# coding=utf-8
+
+"""
+Batched sending of relayed messages.
+
+Every line that's relayed in one iteration of the reactor is queued up, and
+the queue is sent at the start of the next iteration. Lines for the same
+target are coalesced, so a burst of activity turns into one send per target
+rather than one per line per rule.
+"""
+
+__author__ = "Gareth Coles"
+
+from collections import OrderedDict
+
+from twisted.internet import reactor
+
+from system.protocols.capabilities import Capabilities
+
+
+class RelayQueue(object):
+    """
+    Queue of relayed lines, grouped by target.
+
+    Protocols that support multi-line messages get the lines for a target
+    joined into as few messages as their message length allows. Other
+    protocols get one message per line, which they send through their own
+    flood-limited output queues.
+    """
+
+    def __init__(self, factory_manager, logger, clock=None):
+        """
+        :param factory_manager: The factory manager, to look up protocols
+        :param logger: Logger to report failed sends to
+        :param clock: Object providing callLater (default: the reactor)
+        """
+
+        if clock is None:
+            clock = reactor
+
+        self.factory_manager = factory_manager
+        self.logger = logger
+        self.clock = clock
+
+        self._queue = OrderedDict()
+        self._call = None
+
+    def __len__(self):
+        return sum(len(lines) for lines in self._queue.itervalues())
+
+    def add(self, protocol, target, target_type, line, use_event=False):
+        """
+        Queue a line to be relayed.
+
+        :param protocol: Name of the protocol to send to
+        :param target: Name of the user or channel to send to
+        :param target_type: "channel" or "user"
+        :param line: The line to send
+        :param use_event: Whether to throw a MessageSent event
+        """
+
+        key = (protocol, target, target_type, use_event)
+        self._queue.setdefault(key, []).append(line)
+
+        if self._call is None:
+            self._call = self.clock.callLater(0, self.flush)
+
+    def flush(self):
+        """
+        Send everything that's queued, right now.
+        """
+
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+
+        queue = self._queue
+        self._queue = OrderedDict()
+
+        for (name, target, target_type, use_event), lines in queue.items():
+            protocol = self.factory_manager.get_protocol(name)
+
+            if not protocol:
+                continue
+
+            for message in self.batch(protocol, lines):
+                try:
+                    protocol.send_msg(target, message,
+                                      target_type=target_type,
+                                      use_event=use_event)
+                except Exception:
+                    self.logger.exception(
+                        "Error relaying message to %s on %s"
+                        % (target, name)
+                    )
+
+    def batch(self, protocol, lines):
+        """
+        Group lines into messages for a protocol.
+
+        :param protocol: The protocol the lines are being sent to
+        :param lines: List of lines
+
+        :return: List of messages
+        """
+
+        if not protocol.has_capability(Capabilities.MULTILINE_MESSAGE):
+            return lines
+
+        limit = getattr(protocol, "message_length", None)
+
+        if not limit or limit < 0:
+            return ["\n".join(lines)]
+
+        messages = []
+        current = []
+        length = 0
+
+        for line in lines:
+            if current and length + len(line) + 1 > limit:
+                messages.append("\n".join(current))
+                current = []
+                length = 0
+
+            current.append(line)
+            length += len(line) + 1
+
+        if current:
+            messages.append("\n".join(current))
+
+        return messages
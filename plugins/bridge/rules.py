@@ -0,0 +1,151 @@
+# coding=utf-8
+
+"""
+Compiled bridging rules.
+
+The rules in the bridge configuration are compiled when it's loaded, into an
+index keyed by the protocol, type and name of the source they match. That
+way, relaying a message only has to look at the rules that could match it.
+"""
+
+__author__ = "Gareth Coles"
+
+import re
+
+from collections import namedtuple
+
+TOKEN_REGEX = re.compile(r"\{([^{}]+)\}")
+
+#: A compiled bridging rule
+Rule = namedtuple(
+    "Rule", "name order protocol target target_type obfuscate_source "
+            "obfuscate_target formatting"
+)
+
+
+def obfuscate(name):
+    """
+    Break up a name so that relaying it won't highlight anyone.
+
+    :param name: The name to obfuscate
+    :return: The obfuscated name
+    """
+
+    if not name:
+        return name
+    return name[:-1] + "_" + name[-1]
+
+
+class Template(object):
+    """
+    A pre-parsed format string, with {TOKEN} style placeholders.
+
+    Tokens are all substituted in one pass, so text that's substituted in -
+    a relayed message, for example - is never treated as a placeholder.
+    Tokens without a value are left as they are.
+    """
+
+    __slots__ = ["parts"]
+
+    def __init__(self, format_string):
+        #: Literal text at even indices, token names at odd ones
+        self.parts = TOKEN_REGEX.split(format_string)
+
+    def render(self, values):
+        """
+        Fill in the template.
+
+        :param values: Dict of token names to values
+        :type values: dict
+
+        :return: The formatted string
+        """
+
+        parts = self.parts
+        result = [parts[0]]
+
+        for i in xrange(1, len(parts), 2):
+            name = parts[i]
+            value = values.get(name)
+
+            if value is None:
+                result.append("{%s}" % name)
+            else:
+                result.append(value)
+
+            result.append(parts[i + 1])
+
+        return "".join(result)
+
+
+class RuleIndex(object):
+    """
+    Bridging rules indexed by the protocol, source type and source name they
+    match. Channel rules with a source of "*" match every channel.
+    """
+
+    def __init__(self, rules):
+        """
+        :param rules: Dict of rules, as found in the bridge configuration
+        """
+
+        self._index = {}
+
+        for order, (name, data) in enumerate(sorted(rules.items())):
+            from_ = data["from"]
+            to_ = data["to"]
+
+            source_type = from_["source-type"].lower()
+
+            if source_type == "user":
+                # There can only ever be one user: us
+                source = "*"
+            else:
+                source = from_["source"].lower()
+
+            formatting = {}
+
+            for section, strings in (data.get("formatting") or {}).items():
+                for kind, format_string in (strings or {}).items():
+                    if format_string:
+                        formatting[section, kind] = Template(format_string)
+
+            rule = Rule(
+                name, order, to_["protocol"], to_["target"],
+                to_["target-type"], from_.get("obfuscate-names", False),
+                to_.get("obfuscate-names", False), formatting
+            )
+
+            key = (from_["protocol"].lower(), source_type, source)
+            self._index.setdefault(key, []).append(rule)
+
+    def __len__(self):
+        return sum(len(rules) for rules in self._index.itervalues())
+
+    def match(self, protocol, source_type, source=None):
+        """
+        Get the rules matching a message's origin.
+
+        :param protocol: Name of the protocol the message came from
+        :param source_type: "channel" or "user"
+        :param source: Name of the channel, if it's a channel
+
+        :return: List of matching rules, in name order
+        :rtype: list
+        """
+
+        protocol = protocol.lower()
+        index = self._index
+
+        if source_type == "user":
+            return index.get((protocol, "user", "*"), [])
+
+        named = index.get((protocol, "channel", source.lower()), [])
+        wildcard = index.get((protocol, "channel", "*"), [])
+
+        if not named:
+            return wildcard
+        if not wildcard:
+            return named
+
+        return sorted(named + wildcard, key=lambda r: r.order)
@@ -44,7 +44,8 @@ class DialectizerPlugin(PluginObject):
         """The list of bridging rules"""
 
         self.data = self.storage.get_file(
-            self, "data", YAML, "plugins/dialectizer/settings.yml"
+            self, "data", YAML, "plugins/dialectizer/settings.yml",
+            flush_interval=10
         )
 
         self.events.add_callback(
@@ -13,6 +13,7 @@ from system.storage.formats import DBAPI, YAML
 from system.translations import Translations
 
 from utils import tokens
+from utils.cache import LRUCache
 
 _ = Translations().get()
 __ = Translations().get_m()
@@ -23,6 +24,9 @@ __all__ = [
     "InvalidMethodError", "MissingFactoidError", "NoPermissionError"
 ]
 
+# Returned by the cache for lookups it doesn't have
+_NOT_CACHED = object()
+
 # Remember kids:
 # * Stay in drugs
 # * Eat your school
@@ -48,6 +52,17 @@ class FactoidsPlugin(PluginObject):
 
     config = None
 
+    #: Cache of factoid lookups, keyed by
+    #: (factoid_key, location, protocol, channel). Values are
+    #: (factoid_name, (entry, entry, ...)), or None if there's no such
+    #: factoid.
+    #: :type: LRUCache
+    cache = None
+
+    # Bumped whenever the cache is invalidated, so that lookups which were
+    # running at the time don't cache stale results
+    _cache_generation = 0
+
     def setup(self):
         try:
             self.config = self.storage.get_file(self, "config", YAML,
@@ -60,6 +75,10 @@ class FactoidsPlugin(PluginObject):
                     _("Unable to find config/plugins/factoids.yml")
                 )
 
+        cache_config = self._config_get("cache", {})
+        self.cache = LRUCache(cache_config.get("size", 1024),
+                              cache_config.get("ttl", 300))
+
         # ## Set up database
         self.database = self.storage.get_file(
             self,
@@ -116,6 +135,10 @@ class FactoidsPlugin(PluginObject):
                         "info TEXT, "
                         "UNIQUE(factoid_key, location, protocol, channel) "
                         "ON CONFLICT REPLACE)")
+            db.runQuery("CREATE INDEX IF NOT EXISTS factoids_factoid_key "
+                        "ON factoids (factoid_key)")
+
+        self.invalidate_cache()
 
     # region Util functions
 
@@ -167,6 +190,81 @@ class FactoidsPlugin(PluginObject):
                                            "used inside a channel"))
         return True
 
+    def invalidate_cache(self, factoid_key=None, location=None,
+                         protocol=None, channel=None):
+        """
+        Remove cached lookups that may be affected by a change to a factoid.
+
+        With no arguments, the whole cache is cleared. Otherwise, lookups of
+        the given factoid from everywhere the changed location applies to
+        are removed - a global factoid can be seen from every protocol, but
+        a channel factoid is only seen from that channel.
+        """
+
+        self._cache_generation += 1
+
+        if factoid_key is None:
+            self.cache.clear()
+            return
+
+        if location == self.GLOBAL:
+            def predicate(key):
+                return key[0] == factoid_key
+        elif location == self.PROTOCOL:
+            def predicate(key):
+                return key[0] == factoid_key and key[2] == protocol
+        else:
+            where = (protocol, channel)
+
+            def predicate(key):
+                return key[0] == factoid_key and key[2:4] == where
+
+        removed = self.cache.discard_where(predicate)
+        self.logger.trace(_("Invalidated %s cached lookups of factoid '%s'"),
+                          removed, factoid_key)
+
+    def cache_stats(self):
+        """
+        Get the size of the factoid cache and its hit and miss counts.
+
+        :rtype: dict
+        """
+
+        return self.cache.stats()
+
+    def _invalidate_after(self, d, factoid_key, location, protocol, channel):
+        """
+        Invalidate the cache once a change to the database has finished.
+        """
+
+        def _invalidate(result):
+            self.invalidate_cache(factoid_key, location, protocol, channel)
+            return result
+
+        return d.addBoth(_invalidate)
+
+    def _cache_lookup(self, d, cache_key):
+        """
+        Cache the result of a factoid lookup, unless the cache was
+        invalidated while it was running.
+        """
+
+        generation = self._cache_generation
+
+        def _success(result):
+            if generation == self._cache_generation:
+                self.cache.set(cache_key, (result[0], tuple(result[1])))
+            return result
+
+        def _failure(failure):
+            missing = failure.check(MissingFactoidError)
+
+            if missing and generation == self._cache_generation:
+                self.cache.set(cache_key, None)
+            return failure
+
+        return d.addCallbacks(_success, _failure)
+
     # endregion
 
     # region API functions to access factoids
@@ -337,13 +435,16 @@ class FactoidsPlugin(PluginObject):
                 NoPermissionError(_("User does not have required permission"))
             )
         with self.database as db:
-            return db.runInteraction(self._add_factoid_interaction,
-                                     factoid_key,
-                                     location,
-                                     protocol_key,
-                                     channel_key,
-                                     factoid,
-                                     info)
+            d = db.runInteraction(self._add_factoid_interaction,
+                                  factoid_key,
+                                  location,
+                                  protocol_key,
+                                  channel_key,
+                                  factoid,
+                                  info)
+
+        return self._invalidate_after(d, factoid_key, location, protocol_key,
+                                      channel_key)
 
     def set_factoid(self, caller, source, protocol, location, factoid, info):
         location = location.lower()
@@ -362,7 +463,7 @@ class FactoidsPlugin(PluginObject):
                 NoPermissionError(_("User does not have required permission"))
             )
         with self.database as db:
-            return db.runQuery(
+            d = db.runQuery(
                 "INSERT INTO factoids VALUES(?, ?, ?, ?, ?, ?)",
                 (
                     to_unicode(factoid_key),
@@ -373,6 +474,9 @@ class FactoidsPlugin(PluginObject):
                     to_unicode(info)
                 ))
 
+        return self._invalidate_after(d, factoid_key, location, protocol_key,
+                                      channel_key)
+
     def delete_factoid(self, caller, source, protocol, location, factoid):
         location = location.lower()
         factoid_key = factoid.lower()
@@ -390,11 +494,14 @@ class FactoidsPlugin(PluginObject):
                 NoPermissionError(_("User does not have required permission"))
             )
         with self.database as db:
-            return db.runInteraction(self._delete_factoid_interaction,
-                                     factoid_key,
-                                     location,
-                                     protocol_key,
-                                     channel_key)
+            d = db.runInteraction(self._delete_factoid_interaction,
+                                  factoid_key,
+                                  location,
+                                  protocol_key,
+                                  channel_key)
+
+        return self._invalidate_after(d, factoid_key, location, protocol_key,
+                                      channel_key)
 
     def get_factoid(self, caller, source, protocol, location, factoid):
         if location is not None:
@@ -413,12 +520,27 @@ class FactoidsPlugin(PluginObject):
             return defer.fail(
                 NoPermissionError(_("User does not have required permission"))
             )
+
+        cache_key = (factoid_key, location, protocol_key, channel_key)
+
+        cached = self.cache.get(cache_key, _NOT_CACHED)
+
+        if cached is None:
+            return defer.fail(
+                MissingFactoidError(_("Factoid '%s' does not exist")
+                                    % factoid_key)
+            )
+        elif cached is not _NOT_CACHED:
+            return defer.succeed((cached[0], list(cached[1])))
+
         with self.database as db:
-            return db.runInteraction(self._get_factoid_interaction,
-                                     factoid_key,
-                                     location,
-                                     protocol_key,
-                                     channel_key)
+            d = db.runInteraction(self._get_factoid_interaction,
+                                  factoid_key,
+                                  location,
+                                  protocol_key,
+                                  channel_key)
+
+        return self._cache_lookup(d, cache_key)
 
     # endregion
 
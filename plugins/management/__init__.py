@@ -13,6 +13,7 @@ import os
 from twisted.internet.defer import inlineCallbacks
 
 from system.enums import PluginState, ProtocolState
+from system.metrics.instrumentation import Instrumentation
 from system.plugins.plugin import PluginObject
 from system.translations import Translations
 
@@ -61,6 +62,12 @@ class ManagementPlugin(PluginObject):
 
         * Allow listing of users and password resets
         * Allow management of blacklisted passwords
+
+    * Instrumentation
+
+        * Allow enabling and disabling instrumentation
+        * Allow viewing reactor lag, the slowest callbacks and commands, and
+          protocol counters
     """
 
     @property
@@ -92,6 +99,10 @@ class ManagementPlugin(PluginObject):
                                        ["us", "user"])
         self.commands.register_command("shutdown", self.shutdown_command, self,
                                        "management.shutdown")
+        self.commands.register_command("instrumentation",
+                                       self.instrumentation_command, self,
+                                       "management.instrumentation",
+                                       ["in", "instr"])
 
     def storage_command(self, protocol, caller, source, command, raw_args,
                         args):
@@ -521,6 +532,104 @@ class ManagementPlugin(PluginObject):
         operation = args[0]
         caller.respond(__("Unknown operation: %s") % operation)
 
+    def instrumentation_command(self, protocol, caller, source, command,
+                                raw_args, args):
+        """
+        Command handler for the instrumentation command
+        """
+
+        if args is None:
+            args = raw_args.split()
+
+        if len(args) < 1:
+            caller.respond(__("Usage: {CHARS}%s <operation> [params]")
+                           % command)
+            caller.respond(__("Operations: on, off, status, lag, callbacks, "
+                              "commands, counters, queues, save, reset"))
+            return
+
+        instrumentation = Instrumentation()
+        operation = args[0].lower()
+
+        if operation == "on":
+            instrumentation.enable()
+            caller.respond(__("Instrumentation enabled."))
+        elif operation == "off":
+            instrumentation.disable()
+            caller.respond(__("Instrumentation disabled."))
+        elif operation == "status":
+            if instrumentation.enabled:
+                caller.respond(__("Instrumentation is enabled."))
+            else:
+                caller.respond(__("Instrumentation is disabled."))
+        elif operation == "lag":
+            lag = instrumentation.lag.snapshot()
+
+            caller.respond(
+                __("Reactor lag over %s samples - average: %.1fms, "
+                   "max: %.1fms")
+                % (lag["count"], lag["average_ms"], lag["max_ms"])
+            )
+        elif operation in ["callbacks", "commands"]:
+            try:
+                count = int(args[1]) if len(args) > 1 else 5
+            except ValueError:
+                caller.respond(__("Usage: {CHARS}%s %s [count]")
+                               % (command, operation))
+                return
+
+            slowest = instrumentation.slowest(operation, count)
+
+            if not slowest:
+                caller.respond(__("Nothing has been recorded yet."))
+                return
+
+            for key, timings in slowest:
+                if isinstance(key, tuple):
+                    key = "/".join(key)
+
+                caller.respond(
+                    __("%s - %s calls, total: %.1fms, average: %.2fms, "
+                       "max: %.1fms")
+                    % (key, timings.count, timings.total * 1000,
+                       timings.total / timings.count * 1000,
+                       timings.max * 1000)
+                )
+        elif operation == "counters":
+            counters = instrumentation.counters.get("protocols", {})
+
+            if not counters:
+                caller.respond(__("Nothing has been recorded yet."))
+                return
+
+            for (name, kind), counter in sorted(counters.iteritems()):
+                caller.respond("%s %s: %s" % (name, kind, counter.total))
+        elif operation == "queues":
+            queues = instrumentation.read_gauges("queues")
+
+            if not queues:
+                caller.respond(__("No protocols have a send queue."))
+                return
+
+            for name, lanes in sorted(queues.iteritems()):
+                caller.respond(
+                    "%s - %s" % (name, ", ".join(
+                        __("%s: %s queued, %s sent, max wait: %.1fs")
+                        % (lane, stats["depth"], stats["sent"],
+                           stats["max_wait"])
+                        for lane, stats in sorted(lanes.iteritems())
+                    ))
+                )
+        elif operation == "save":
+            instrumentation.write_snapshot()
+            caller.respond(__("Snapshot written to data/%s")
+                           % instrumentation.snapshot_path)
+        elif operation == "reset":
+            instrumentation.reset()
+            caller.respond(__("Instrumentation data has been reset."))
+        else:
+            caller.respond(__("Unknown operation: %s") % operation)
+
     def shutdown_command(self, protocol, caller, source, command, raw_args,
                          args):
         """
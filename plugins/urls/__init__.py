@@ -8,9 +8,11 @@ from collections import defaultdict
 from kitchen.text.converters import to_unicode
 from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
 from twisted.python.failure import Failure
-from txrequests import Session
+from plugins.urls.http_pool import HTTPPool, PoolFullError
 from plugins.urls.lazy import LazyRequest
 from plugins.urls.priority import Priority
+from plugins.urls.rules import DomainRules
+from plugins.urls.shortened import ShortenedURLs
 from plugins.urls.shorteners.exceptions import ShortenerDown
 from system.protocols.generic.channel import Channel
 from system.storage.formats import Formats
@@ -34,6 +36,9 @@ class URLsPlugin(PluginObject):
     channels = None
     config = None
     shortened = None
+    short_urls = None
+    http_pool = None
+    rules = None
 
     shorteners = None
     handlers = None
@@ -67,7 +72,8 @@ class URLsPlugin(PluginObject):
             )
 
         self.channels = self.storage.get_file(
-            self, "data", Formats.YAML, "plugins/urls/channels.yml"
+            self, "data", Formats.YAML, "plugins/urls/channels.yml",
+            flush_interval=10
         )
 
         self.shortened = self.storage.get_file(
@@ -78,6 +84,9 @@ class URLsPlugin(PluginObject):
             "data/plugins/urls/shortened.sqlite",
             check_same_thread=False
         )
+        self.short_urls = ShortenedURLs(self.shortened)
+
+        self.http_pool = HTTPPool.from_config(self.config)
 
         self.config.add_callback(self.reload)
         self.reload()
@@ -113,15 +122,30 @@ class URLsPlugin(PluginObject):
         self.events.run_callback("URLs/PluginLoaded", URLsPluginLoaded(self))
 
     def reload(self):
-        self.shortened.runQuery("CREATE TABLE IF NOT EXISTS urls ("
-                                "url TEXT, "
-                                "shortener TEXT, "
-                                "result TEXT)")
+        # Compiling them again also forgets every remembered decision
+        self.rules = DomainRules.from_config(self.config)
+
+        for pattern, error in self.rules.invalid:
+            self.logger.warn(
+                "Invalid domain pattern '{0}': {1}", pattern, error
+            )
+
+        self.short_urls.setup().addCallbacks(
+            self._shortened_ready,
+            lambda f: self.logger.error(
+                "Error setting up the shortened URLs table: {0}",
+                f.getErrorMessage()
+            )
+        )
 
         for handler_list in self.handlers.itervalues():
             for handler in handler_list:
                 handler.reload()
 
+    def _shortened_ready(self, removed):
+        if removed:
+            self.logger.info("Removed {0} duplicate shortened URLs", removed)
+
     @inlineCallbacks
     def shorten(self, _url, shortener=None, target=None):
         if isinstance(_url, basestring):
@@ -140,33 +164,21 @@ class URLsPlugin(PluginObject):
 
         context = {"url": _url}
 
-        r = yield self.shortened.runQuery(
-            "SELECT result FROM urls WHERE url=? AND shortener=?",
-            (unicode(_url), shortener.lower())
-        )
-
-        if len(r):
-            returnValue(r[0][0])
+        if shortener in self.shorteners:
+            def do_shorten():
+                return self.shorteners[shortener].do_shorten(context)
         else:
-            if shortener in self.shorteners:
-                try:
-                    result = yield self.shorteners[shortener].do_shorten(
-                        context
-                    )
-                except ShortenerDown as e:
-                    returnValue(
-                        "Shortener \"{}\" appears to be down -"
-                        " try again later. ({})".format(shortener, e.message)
-                    )
-                except Exception:
-                    raise
-                else:
-                    self.shortened.runQuery(
-                        "INSERT INTO urls VALUES (?, ?, ?)",
-                        (unicode(_url), shortener.lower(), result)
-                    )
+            do_shorten = None
 
-                    returnValue(result)
+        try:
+            result = yield self.short_urls.get(_url, shortener, do_shorten)
+        except ShortenerDown as e:
+            returnValue(
+                "Shortener \"{}\" appears to be down -"
+                " try again later. ({})".format(shortener, e.message)
+            )
+        else:
+            returnValue(result)
 
     def get_shortener(self, target):
         shortener = (
@@ -192,6 +204,9 @@ class URLsPlugin(PluginObject):
 
         self.handlers = defaultdict(list)
 
+        if self.http_pool is not None:
+            self.http_pool.close()
+
     @inlineCallbacks
     def message_handler(self, event):
         """
@@ -243,10 +258,13 @@ class URLsPlugin(PluginObject):
             while _url.domain in domains and redirects < max_redirects:
                 redirects += 1
 
-                session = Session()
-
-                #: :type: requests.Response
-                r = yield session.get(unicode(_url), allow_redirects=False)
+                try:
+                    #: :type: requests.Response
+                    r = yield self.http_pool.get(unicode(_url),
+                                                 allow_redirects=False)
+                except PoolFullError as e:
+                    self.logger.debug("Not checking redirects: {0}", e)
+                    return
 
                 if r.is_redirect:
                     # This only ever happens when we have a well-formed
@@ -268,7 +286,8 @@ class URLsPlugin(PluginObject):
                 self.logger.debug("URL has exceeded the redirects limit")
                 return
 
-            lazy_request = LazyRequest(req_args=[unicode(_url)])
+            lazy_request = LazyRequest(self.http_pool,
+                                       req_args=[unicode(_url)])
 
             if isinstance(target, Channel):
                 with self.channels:
@@ -359,6 +378,9 @@ class URLsPlugin(PluginObject):
         Command handler for the urls command
         """
 
+        if parsed_args and parsed_args[0].lower() == "stats":
+            return self.stats_command(caller)
+
         if not isinstance(source, Channel):
             caller.respond("This command can only be used in a channel.")
             return
@@ -371,6 +393,7 @@ class URLsPlugin(PluginObject):
             caller.respond("  Shorteners: {0}".format(", ".join(
                 self.shorteners.keys()
             )))
+            caller.respond("  stats - Show how well the caches are doing")
             return
 
         operation = parsed_args[0].lower()
@@ -415,6 +438,36 @@ class URLsPlugin(PluginObject):
         else:
             caller.respond("Unknown operation: '%s'." % operation)
 
+    def stats_command(self, caller):
+        """
+        Respond with the HTTP pool's load and the hit rates of our caches
+        """
+
+        def format_stats(stats):
+            return ", ".join(
+                "{0}: {1}".format(key, value)
+                for key, value in sorted(stats.iteritems())
+                if key != "max_size"
+            )
+
+        caller.respond("HTTP pool - {0}".format(
+            format_stats(self.http_pool.stats())
+        ))
+
+        for handler_list in self.handlers.itervalues():
+            for handler in handler_list:
+                if isinstance(handler, WebsiteHandler):
+                    caller.respond("Titles - {0}".format(
+                        format_stats(handler.stats())
+                    ))
+                    caller.respond("DNS - {0}".format(
+                        format_stats(handler.resolver.stats())
+                    ))
+
+        caller.respond("Shortened URLs - {0}".format(
+            format_stats(self.short_urls.stats())
+        ))
+
     def _respond_shorten(self, result, source, handler):
         """
         Respond to a shorten command, after a successful Deferred
@@ -488,14 +541,9 @@ class URLsPlugin(PluginObject):
                 caller.respond("Error fetching short URL.")
 
     def check_blacklist(self, _url, context):
-        for entry in context["config"]["blacklist"]:
-            if re.match(
-                    entry, _url.to_string(), flags=str_to_regex_flags("ui")
-            ):
-                self.logger.debug(
-                    "Matched blacklist regex: %s" % entry
-                )
-                return True
+        if self.rules.is_blacklisted(_url.to_string()):
+            self.logger.debug("Matched blacklist regex")
+            return True
 
         return False
 
@@ -514,11 +562,10 @@ class URLsPlugin(PluginObject):
                 return proxy
 
         if _url is not None:
-            domain_proxies = self.config.get("proxies", {}).get("domains", {})
+            proxy = self.rules.lookup(_url.domain).proxy
 
-            for pattern in domain_proxies.iterkeys():
-                if re.match(pattern, _url.domain, str_to_regex_flags("iu")):
-                    return domain_proxies[pattern]
+            if proxy is not None:
+                return proxy
 
         return self.config.get("proxies", {}).get("global", None)
 
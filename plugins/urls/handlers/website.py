@@ -1,5 +1,6 @@
 # coding=utf-8
 
+from collections import namedtuple
 from contextlib import closing
 import os
 import re
@@ -7,22 +8,27 @@ import requests
 import urlparse
 
 from cookielib import LoadError
-from bs4 import BeautifulSoup
-from kitchen.text.converters import to_unicode
-from netaddr import IPAddress
 from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.python.failure import Failure
 from twisted.web._newclient import ResponseNeverReceived
-from txrequests import Session
 
 from plugins.urls.constants import STATUS_CODES, STOP_HANDLING
 from plugins.urls.cookiejar import ChocolateCookieJar
 from plugins.urls.handlers.handler import URLHandler
-from plugins.urls.proxy_session import ProxySession
+from plugins.urls.http_pool import PoolFullError
 from plugins.urls.resolver import AddressResolver
+from plugins.urls.titles import TitleExtractor, get_charset
+from utils.cache import LRUCache
 from utils.misc import str_to_regex_flags
 
 __author__ = 'Gareth Coles'
 
+#: What we found out about a URL - everything needed to respond to it
+TitleResult = namedtuple("TitleResult", "status_code title hostname")
+
+# Returned by the title cache for URLs it doesn't have
+_NOT_CACHED = object()
+
 
 class WebsiteHandler(URLHandler):
     name = "website"
@@ -33,12 +39,18 @@ class WebsiteHandler(URLHandler):
 
     global_session = None
     resolver = None
+    titles = None
+    negative_ttl = 60
 
     cookies_base_path = "data/plugins/urls/cookies"
 
     def __init__(self, plugin):
         self.group_sessions = {}
 
+        # Cache key -> [context] for every message waiting on a fetch of it
+        self._fetching = {}
+        self.coalesced = 0
+
         super(WebsiteHandler, self).__init__(plugin)
 
         if not os.path.exists(self.cookies_base_path):
@@ -56,31 +68,49 @@ class WebsiteHandler(URLHandler):
             str_to_regex_flags("iu")
         )
 
-    @inlineCallbacks
     def call(self, url, context):
-        if self.url_can_resolve(url):
-            try:
-                ip = yield self.resolver.get_host_by_name(url.domain)
-                ip = IPAddress(ip)
-            except Exception:
-                # context["event"].target.respond(
-                #     u'[Error] Failed to handle URL: {}'.format(
-                #         url.to_string()
-                #     )
-                # )
+        key = self.cache_key(url, context)
+        cached = self.titles.get(key, _NOT_CACHED)
 
-                self.plugin.logger.exception("Error while checking DNS")
-                returnValue(STOP_HANDLING)
-                return
+        if cached is not _NOT_CACHED:
+            self.plugin.logger.debug("Using cached result for {0}", key[0])
+            self.respond(cached, context)
+            return STOP_HANDLING
 
-            if ip.is_loopback() or ip.is_private() or ip.is_link_local() \
-                    or ip.is_multicast():
-                self.plugin.logger.warn(
-                    "Prevented connection to private/internal address"
-                )
+        if key in self._fetching:
+            # Someone else posted it too - we'll respond when that's done
+            self.coalesced += 1
+            self._fetching[key].append(context)
+            return STOP_HANDLING
 
-                returnValue(STOP_HANDLING)
-                return
+        self._fetching[key] = [context]
+        self.fetch(url, context).addBoth(self._fetched, key)
+
+        return STOP_HANDLING
+
+    def cache_key(self, url, context):
+        """
+        Get the key a URL's title is cached and shared under.
+
+        What a site sends back can depend on the headers we send and the
+        cookies in the session we use, so URLs are only shared between
+        messages that would fetch them the same way.
+
+        :rtype: tuple
+        """
+
+        return (
+            url.to_string(),
+            tuple(sorted(self.get_headers(url, context).iteritems())),
+            self.get_session_type(url, context)
+        )
+
+    def get_headers(self, url, context):
+        """
+        Get the headers to fetch a URL with.
+
+        :rtype: dict
+        """
 
         headers = {}
 
@@ -107,13 +137,125 @@ class WebsiteHandler(URLHandler):
                 .get("accept_language", {}) \
                 .get("default", "en")
 
+        return headers
+
+    @inlineCallbacks
+    def fetch(self, url, context):
+        """
+        Fetch a URL and find out its title.
+
+        :return: Deferred that fires with a TitleResult, or None if there's
+            nothing to respond with
+        :rtype: Deferred
+        """
+
+        if self.url_can_resolve(url):
+            try:
+                ip, internal = yield self.resolver.check_host(url.domain)
+            except Exception:
+                # context["event"].target.respond(
+                #     u'[Error] Failed to handle URL: {}'.format(
+                #         url.to_string()
+                #     )
+                # )
+
+                self.plugin.logger.exception("Error while checking DNS")
+                returnValue(None)
+                return
+
+            if internal:
+                self.plugin.logger.warn(
+                    "Prevented connection to private/internal address"
+                )
+
+                returnValue(None)
+                return
+
+        headers = self.get_headers(url, context)
         session = self.get_session(url, context)
-        session.get(unicode(url), headers=headers, stream=True,
-                    background_callback=self.background_callback) \
-            .addCallback(self.callback, url, context, session) \
-            .addErrback(self.errback, url, context, session)
+        result = yield self.http_pool.get(
+            unicode(url), session=session, headers=headers, stream=True,
+            background_callback=self.background_callback
+        ).addCallback(self.callback, url, session) \
+            .addErrback(self.errback, url, session)
+
+        returnValue(result)
+
+    def _fetched(self, result, key):
+        if isinstance(result, Failure):
+            # Don't remember that the pool was busy, as that'll pass
+            if not result.check(PoolFullError):
+                self.titles.set(key, None, self.negative_ttl)
+            result = None
+        elif result is None or result.status_code != requests.codes.ok:
+            self.titles.set(key, None if result is None else result,
+                            self.negative_ttl)
+        else:
+            self.titles.set(key, result)
+
+        for context in self._fetching.pop(key, []):
+            try:
+                self.respond(result, context)
+            except Exception:
+                self.plugin.logger.exception("Error responding to URL")
+
+    def respond(self, result, context):
+        """
+        Tell the target of a message about a URL in it.
+
+        :param result: The URL's TitleResult, or None
+        :param context: The context the URL was handled with
+        """
+
+        if result is None:
+            return
+
+        target = context["event"].target
+        title = result.title
+
+        if title:
+            title_limit = self.urls_plugin.config.get("max_title_length", 150)
+
+            if len(title) > title_limit:
+                title = title[:title_limit - 15] + u"... (truncated)"
+
+            if result.status_code == requests.codes.ok:
+                target.respond(
+                    u'"{0}" at {1}'.format(
+                        title, result.hostname
+                    )
+                )
+            else:
+                target.respond(
+                    u'[HTTP {0}] "{1}" at {2}'.format(
+                        result.status_code,
+                        title, result.hostname
+                    )
+                )
+        elif result.status_code != requests.codes.ok:
+            target.respond(
+                u'HTTP Error {0}: "{1}" at {2}'.format(
+                    result.status_code,
+                    STATUS_CODES.get(result.status_code, "Unknown"),
+                    result.hostname
+                )
+            )
+        else:
+            self.plugin.logger.debug("No title")
+
+    def stats(self):
+        """
+        Get the title cache's size and hit counts, and how many fetches were
+        saved by waiting for one that was already running.
 
-        returnValue(STOP_HANDLING)
+        :rtype: dict
+        """
+
+        stats = self.titles.stats()
+        stats["in_flight"] = len(self._fetching)
+        stats["coalesced"] = self.coalesced
+
+        return stats
 
     def teardown(self):
         # Save all our cookie stores
@@ -128,17 +270,28 @@ class WebsiteHandler(URLHandler):
         if self.resolver is not None:
             self.resolver.close()
 
+    @property
+    def http_pool(self):
+        """
+        :rtype: plugins.urls.http_pool.HTTPPool
+        """
+
+        return self.plugin.http_pool
+
     def reload(self):
         self.teardown()
         self.group_sessions = {}
-        self.resolver = AddressResolver()
+        self.resolver = AddressResolver.from_config(
+            self.plugin.config, pool=self.http_pool.pool
+        )
 
-        proxy = self.plugin.get_proxy()
+        cache_config = self.plugin.config.get("title_cache") or {}
+        self.negative_ttl = cache_config.get("negative_ttl", 60)
+        self.titles = LRUCache(cache_config.get("size", 512),
+                               cache_config.get("ttl", 600))
 
-        if not proxy:
-            self.global_session = Session()
-        else:
-            self.global_session = ProxySession(proxy)
+        proxy = self.plugin.get_proxy()
+        self.global_session = self.http_pool.session(proxy)
 
         try:
             self.global_session.cookies = self.get_cookie_jar("/global.txt")
@@ -160,11 +313,12 @@ class WebsiteHandler(URLHandler):
     def background_callback(self, session, response):
         """
         Does basic processing of the response in the background, including
-        reading the response's content. As such, response.content should not be
-        used.
+        reading just enough of the response's content to find its title. As
+        such, response.content should not be used.
         :param session:
         :param response:
-        :return: response, content
+        :return: response, title - title is None if the response isn't a
+            supported page, and u"" if it doesn't have a title
         """
         conns_conf = self.urls_plugin.config.get("connections", {})
         max_read = conns_conf.get("max_read_size", 1024 * 16)
@@ -179,10 +333,8 @@ class WebsiteHandler(URLHandler):
             response.headers["Content-Type"] = ""
 
         content_type = response.headers["content-type"].lower()
-
-        if ";" in content_type:
-            parts = content_type.split(";")
-            content_type = parts[0]
+        charset = get_charset(content_type)
+        content_type = content_type.split(";")[0].strip()
 
         if content_type not in self.urls_plugin.config["content_types"]:
             self.plugin.logger.debug(
@@ -191,62 +343,53 @@ class WebsiteHandler(URLHandler):
             )
             return response, None  # Not a supported content-type
 
-        # If the response specifies a charset in the header, let requests
-        # attempt to decode the contents. We can't use response.encoding as
-        # it falls back to ISO-8859-1 in cases such as Content-Type: text/html.
-        # In those cases, we want BeautifulSoup to perform its satanic ritual
-        # to magically figure out the encoding.
-        decode_unicode = False
-        if ";" in content_type:
-            for x in content_type.split(";"):
-                split = x.strip().split("=")
-                if len(split) > 1:
-                    if split[0].lower() == "charset":
-                        charset = split[1].lower()
-                        if charset == "binary":
-                            # Not a webpage, so return None content
-                            self.urls_plugin.logger.debug(
-                                "Unsupported charset: {0}", charset)
-                            return response, None
-                        # Contains charset header - let requests decode
-                        decode_unicode = True
-                        self.urls_plugin.logger.trace(
-                            "Charset specified in header: {0}", charset)
-                        break
-
-        amount_read = 0
-        chunks = []
+        if charset == "binary":
+            # Not a webpage, so return None content
+            self.urls_plugin.logger.debug(
+                "Unsupported charset: {0}", charset)
+            return response, None
+
+        if charset:
+            self.urls_plugin.logger.trace(
+                "Charset specified in header: {0}", charset)
+
+        # We read the raw bytes and only decode the title, so the extractor
+        # can choose between the header's charset and the page's own
+        extractor = TitleExtractor(charset)
         self.plugin.logger.trace("Starting read...")
         # We must close this when finished otherwise they'll hang if we don't
         # read everything
         with closing(response) as c_resp:
-            for chunk in c_resp.iter_content(chunk_size=chunk_size,
-                                             decode_unicode=decode_unicode):
-                # See comment beside chunk_size def - it's not a fixed limit
-                chunks.append(chunk)
-                amount_read += len(chunk)
+            for chunk in c_resp.iter_content(chunk_size=chunk_size):
                 self.plugin.logger.trace("Read a chunk of {0} bytes",
                                          len(chunk))
-                if amount_read >= max_read:
+                if extractor.feed(chunk):
+                    self.plugin.logger.trace(
+                        "Found the end of the title or head after {0} bytes",
+                        extractor.bytes_read
+                    )
+                    break
+                # See comment beside chunk_size def - it's not a fixed limit
+                if extractor.bytes_read >= max_read:
                     self.plugin.logger.debug(
                         "Stopped reading response after {0} bytes",
-                        amount_read
+                        extractor.bytes_read
                     )
                     break
         self.plugin.logger.trace("Done reading")
-        # chunks can be bytes or unicode
-        if decode_unicode:
-            joiner = u""
-        else:
-            joiner = b""
-        content = joiner.join(chunks)
+        title = extractor.finish() or u""
         self.plugin.logger.trace("background_callback done")
-        return response, content
+        return response, title
 
     @inlineCallbacks
-    def callback(self, result, url, context, session):
+    def callback(self, result, url, session):
+        """
+        Check where the request ended up, after any redirects, and turn the
+        result of background_callback into a TitleResult.
+        """
+
         response = result[0]
-        content = result[1]
+        title = result[1]
 
         self.plugin.logger.trace(
             "Headers: {0}", list(response.headers)
@@ -258,73 +401,31 @@ class WebsiteHandler(URLHandler):
 
         if self.url_can_resolve(url):
             try:
-                ip = yield self.resolver.get_host_by_name(new_url.hostname)
-                ip = IPAddress(ip)
+                ip, internal = yield self.resolver.check_host(
+                    new_url.hostname
+                )
             except Exception:
-                # context["event"].target.respond(
-                #     u'[Error] Failed to handle URL: {}'.format(
-                #         url.to_string()
-                #     )
-                # )
-
                 self.plugin.logger.exception("Error while checking DNS")
-                returnValue(STOP_HANDLING)
+                returnValue(None)
                 return
 
-            if ip.is_loopback() or ip.is_private() or ip.is_link_local() \
-                    or ip.is_multicast():
+            if internal:
                 self.plugin.logger.warn(
                     "Prevented connection to private/internal address"
                 )
 
-                returnValue(STOP_HANDLING)
+                returnValue(None)
                 return
 
-        if content is None:
+        if title is None:
             self.plugin.logger.debug("No content returned")
+            returnValue(None)
             return
 
-        soup = BeautifulSoup(content)
-
-        if soup.title and soup.title.text:
-            title = soup.title.text.strip()
-            title = re.sub("[\n\s]+", " ", title)
-            title = to_unicode(title)
-
-            title_limit = self.urls_plugin.config.get("max_title_length", 150)
-
-            if len(title) > title_limit:
-                title = title[:title_limit - 15] + u"... (truncated)"
-
-            if response.status_code == requests.codes.ok:
-                context["event"].target.respond(
-                    u'"{0}" at {1}'.format(
-                        title, new_url.hostname
-                    )
-                )
-            else:
-                context["event"].target.respond(
-                    u'[HTTP {0}] "{1}" at {2}'.format(
-                        response.status_code,
-                        title, new_url.hostname
-                    )
-                )
-
-        else:
-            if response.status_code != requests.codes.ok:
-                context["event"].target.respond(
-                    u'HTTP Error {0}: "{1}" at {2}'.format(
-                        response.status_code,
-                        STATUS_CODES.get(response.status_code, "Unknown"),
-                        new_url.hostname
-                    )
-                )
-            else:
-                self.plugin.logger.debug("No title")
-
         self.save_session(session)
+        returnValue(TitleResult(response.status_code, title, new_url.hostname))
 
-    def errback(self, error, url, context, session):
+    def errback(self, error, url, session):
         # if isinstance(error.value, SSLError):
         #     context["event"].target.respond(
         #         u'[Error] URL has SSL errors and may be unsafe: {}'.format(
@@ -336,7 +437,11 @@ class WebsiteHandler(URLHandler):
         #         u'[Error] Failed to handle URL: {}'.format(url.to_string())
         #     )
 
-        if isinstance(error.value, ResponseNeverReceived):
+        if isinstance(error.value, PoolFullError):
+            self.plugin.logger.debug(
+                "Not fetching {0}: {1}", url, error.getErrorMessage()
+            )
+        elif isinstance(error.value, ResponseNeverReceived):
             for f in error.value.reasons:
                 f.printDetailedTraceback()
                 self.plugin.logger.error(f.getErrorMessage())
@@ -345,6 +450,7 @@ class WebsiteHandler(URLHandler):
             error.printDetailedTraceback()
 
         self.save_session(session)
+        return error
 
     def get_cookie_jar(self, filename):
         cj = ChocolateCookieJar(self.cookies_base_path + filename)
@@ -362,85 +468,91 @@ class WebsiteHandler(URLHandler):
 
         return cj
 
+    def get_session_type(self, url, context):
+        """
+        Find out which session get_session would use for a URL, without
+        creating it.
+
+        :return: "global", "group/<name>" for a session group, or None if
+            no session would be used
+        :rtype: str
+        """
+
+        sessions = context.get("config", {}).get("sessions", {})
+
+        if not sessions.get("enable", False):
+            return None
+
+        decision = self.urls_plugin.rules.lookup(url.domain)
+
+        if decision.never_session:
+            return None
+
+        if decision.session_group is not None:
+            return "group/%s" % decision.session_group
+
+        return "global"
+
     def get_session(self, url, context):
         sessions = context.get("config", {}).get("sessions", {})
 
         if not sessions.get("enable", False):
             self.urls_plugin.logger.debug("Sessions are disabled.")
 
-            proxy = self.urls_plugin.get_proxy(url)
+            return self.http_pool.anonymous_session(
+                self.urls_plugin.get_proxy(url)
+            )
 
-            if not proxy:
-                s = Session()
-            else:
-                s = ProxySession(proxy)
+        decision = self.urls_plugin.rules.lookup(url.domain)
 
-            s.session_type = None
+        if decision.never_session:
+            self.urls_plugin.logger.debug(
+                "Domain {0} is blacklisted for sessions.".format(
+                    url.domain
+                )
+            )
+            return self.http_pool.anonymous_session(
+                self.urls_plugin.get_proxy(url)
+            )
 
-            return s
+        group = decision.session_group
 
-        for entry in sessions["never"]:
-            if re.match(entry, url.domain, flags=str_to_regex_flags("ui")):
-                self.urls_plugin.logger.debug(
-                    "Domain {0} is blacklisted for sessions.".format(
-                        url.domain
-                    )
+        if group is not None:
+            self.urls_plugin.logger.debug(
+                "Domain {0} uses the '{1}' group sessions.".format(
+                    url.domain, group
                 )
-                proxy = self.urls_plugin.get_proxy(url)
-
-                if not proxy:
-                    s = Session()
-                else:
-                    s = ProxySession(proxy)
-
-                s.session_type = None
-
-                return s
-
-        for group, entries in sessions["group"].iteritems():
-            for entry in entries:
-                try:
-                    if re.match(
-                            entry, url.domain, flags=str_to_regex_flags("ui")
-                    ):
-                        self.urls_plugin.logger.debug(
-                            "Domain {0} uses the '{1}' group sessions.".format(
-                                url.domain, group
-                            )
-                        )
-
-                        if group not in self.group_sessions:
-                            proxy = self.urls_plugin.get_proxy(group=group)
+            )
 
-                            if not proxy:
-                                s = Session()
-                            else:
-                                s = ProxySession(proxy)
+            try:
+                if group not in self.group_sessions:
+                    s = self.http_pool.session(
+                        self.urls_plugin.get_proxy(group=group)
+                    )
 
-                            s.cookies = (
-                                self.get_cookie_jar(
-                                    "/groups/{0}.txt".format(
-                                        group
-                                    )
-                                )
+                    s.cookies = (
+                        self.get_cookie_jar(
+                            "/groups/{0}.txt".format(
+                                group
                             )
+                        )
+                    )
 
-                            s.session_type = "group"
-                            s.cookies.set_mode(
-                                context.get("config")
-                                .get("sessions")
-                                .get("cookies")
-                                .get("group")
-                            )
+                    s.session_type = "group"
+                    s.cookies.set_mode(
+                        context.get("config")
+                        .get("sessions")
+                        .get("cookies")
+                        .get("group")
+                    )
 
-                            self.group_sessions[group] = s
+                    self.group_sessions[group] = s
 
-                        return self.group_sessions[group]
-                except ValueError as e:
-                    self.urls_plugin.logger.error(
-                        "Failed to create cookie jar: {0}".format(e)
-                    )
-                    continue
+                return self.group_sessions[group]
+            except ValueError as e:
+                self.urls_plugin.logger.error(
+                    "Failed to create cookie jar: {0}".format(e)
+                )
 
         self.urls_plugin.logger.debug(
             "Domain {0} uses the global session storage.".format(
@@ -453,7 +565,7 @@ class WebsiteHandler(URLHandler):
         if not proxy:
             return self.global_session
         else:
-            s = ProxySession(proxy)
+            s = self.http_pool.session(proxy)
             s.cookies = self.get_cookie_jar("/global.txt")
             s.session_type = "global"
             s.cookies.set_mode(
@@ -0,0 +1,263 @@
+# coding=utf-8
+
+"""
+Shared, bounded pool for the URLs plugin's HTTP requests.
+
+All requests made by the plugin and its handlers run on one thread pool,
+instead of every session starting up its own. Sessions created by the pool
+keep their connections alive, so repeated fetches from the same host reuse
+them.
+
+Requests are limited in three ways:
+
+* **Concurrency** - Only so many requests run at once, however many are
+  waiting
+* **Per-host** - Only so many requests to the same host run at once, so one
+  busy site can't take up every slot
+* **Pending** - Only so many requests may wait for a slot; after that, new
+  requests fail straight away with a PoolFullError, rather than piling up
+"""
+
+__author__ = 'Gareth Coles'
+
+import cookielib
+import urlparse
+
+from requests.adapters import HTTPAdapter
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+from twisted.python.threadpool import ThreadPool
+from txrequests import Session
+
+from plugins.urls.proxy_session import ProxySession
+
+
+class PoolFullError(Exception):
+    """
+    Raised when too many requests are waiting for the pool already.
+    """
+
+    pass
+
+
+class HTTPPool(object):
+    """
+    Runs requests on a shared thread pool, limiting how many run at once.
+    """
+
+    def __init__(self, max_concurrent=8, max_per_host=2, max_pending=64,
+                 pool=None):
+        """
+        :param max_concurrent: How many requests can run at once
+        :param max_per_host: How many requests to the same host can run at
+            once
+        :param max_pending: How many requests can be waiting for a slot
+            before new ones are refused
+        :param pool: ThreadPool to run requests on - one with
+            max_concurrent threads will be created if this isn't given
+
+        :type pool: ThreadPool
+        """
+
+        self.max_concurrent = max_concurrent
+        self.max_per_host = max_per_host
+        self.max_pending = max_pending
+
+        self.own_pool = pool is None
+
+        if pool is None:
+            pool = ThreadPool(minthreads=1, maxthreads=max_concurrent,
+                              name="URLs HTTP")
+            # unclosed ThreadPool leads to reactor hangs at shutdown
+            reactor.addSystemEventTrigger("before", "shutdown", self.close)
+            pool.start()
+
+        self.pool = pool
+
+        self._slots = defer.DeferredSemaphore(max_concurrent)
+        self._hosts = {}
+        self._anonymous = {}
+
+        self.pending = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_config(cls, config, pool=None):
+        """
+        Create a pool using the "connections" section of the plugin's
+        configuration.
+
+        :param config: The plugin's configuration
+        :param pool: ThreadPool to run requests on, if not our own
+        """
+
+        connections = config.get("connections", {})
+
+        return cls(
+            max_concurrent=connections.get("max_concurrent", 8),
+            max_per_host=connections.get("max_per_host", 2),
+            max_pending=connections.get("max_pending", 64),
+            pool=pool
+        )
+
+    def session(self, proxies=None):
+        """
+        Create a session that runs on this pool and keeps its connections
+        alive.
+
+        :param proxies: Proxy dict, as returned by URLsPlugin.get_proxy
+
+        :rtype: txrequests.Session
+        """
+
+        if proxies:
+            session = ProxySession(proxies, pool=self.pool)
+        else:
+            session = Session(pool=self.pool)
+
+        adapter = HTTPAdapter(pool_connections=self.max_concurrent,
+                              pool_maxsize=self.max_per_host)
+
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+    def anonymous_session(self, proxies=None):
+        """
+        Get a shared session that never keeps cookies between requests.
+
+        Cookies set during a chain of redirects are still sent along the
+        chain, as requests keeps those on the request itself.
+
+        :param proxies: Proxy dict, as returned by URLsPlugin.get_proxy
+
+        :rtype: txrequests.Session
+        """
+
+        if proxies:
+            key = tuple(sorted(proxies.iteritems()))
+        else:
+            key = None
+
+        session = self._anonymous.get(key)
+
+        if session is None:
+            session = self.session(proxies)
+            session.cookies.set_policy(
+                cookielib.DefaultCookiePolicy(allowed_domains=())
+            )
+            session.session_type = None
+
+            self._anonymous[key] = session
+
+        return session
+
+    def request(self, session, method, url, **kwargs):
+        """
+        Make a request with a session, once there's a slot free for it.
+
+        Takes the same keyword arguments as txrequests' Session.request,
+        including background_callback.
+
+        :param session: The session to make the request with, or None to
+            use the shared anonymous session
+        :param method: The HTTP method, eg "GET"
+        :param url: The URL to request
+
+        :type session: txrequests.Session
+
+        :return: Deferred that fires with the response, or fails with
+            PoolFullError if too many requests are waiting already
+        :rtype: Deferred
+        """
+
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return defer.fail(PoolFullError(
+                "{0} requests are already waiting".format(self.pending)
+            ))
+
+        if session is None:
+            session = self.anonymous_session()
+
+        host = (urlparse.urlsplit(url).hostname or "").lower()
+        host_lock = self._hosts.get(host)
+
+        if host_lock is None:
+            host_lock = self._hosts[host] = defer.DeferredSemaphore(
+                self.max_per_host
+            )
+
+        self.pending += 1
+
+        def run(_):
+            self.pending -= 1
+            self.in_flight += 1
+
+            return session.request(method, url, **kwargs)
+
+        def done(result):
+            self.in_flight -= 1
+
+            if isinstance(result, Failure):
+                self.failed += 1
+            else:
+                self.completed += 1
+
+            self._slots.release()
+            host_lock.release()
+
+            if host_lock.tokens == host_lock.limit:
+                # Nothing else is using it, so don't keep it around
+                self._hosts.pop(host, None)
+
+            return result
+
+        # Wait for the host first, so requests queued for a busy host don't
+        # hold on to a slot that another host could be using
+        d = host_lock.acquire()
+        d.addCallback(lambda _: self._slots.acquire())
+        d.addCallback(run)
+        d.addBoth(done)
+
+        return d
+
+    def get(self, url, session=None, **kwargs):
+        """
+        Make a GET request - see request() for more information.
+        """
+
+        return self.request(session, "GET", url, **kwargs)
+
+    def stats(self):
+        """
+        Get the pool's current load and request counts.
+
+        :rtype: dict
+        """
+
+        return {
+            "in_flight": self.in_flight,
+            "pending": self.pending,
+            "hosts": len(self._hosts),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected
+        }
+
+    def close(self):
+        """
+        Close our sessions and stop the thread pool, if it's ours.
+        """
+
+        for session in self._anonymous.itervalues():
+            session.close()
+
+        self._anonymous = {}
+
+        if self.own_pool and self.pool.started:
+            self.pool.stop()
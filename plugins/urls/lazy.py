@@ -1,36 +1,46 @@
 # coding=utf-8
 
-from txrequests import Session
-
 __author__ = 'Gareth Coles'
 
 
 class LazyRequest(object):
+    """
+    A GET request that's only made the first time something asks for it,
+    through the URLs plugin's shared HTTP pool.
+    """
+
     result = None
 
     _args = []
     _kwargs = {}
 
-    def __init__(self, pool=None, minthreads=1, maxthreads=4, req_args=None,
-                 req_kwargs=None, session_kwargs=None):
+    def __init__(self, http_pool, req_args=None, req_kwargs=None,
+                 session=None):
+        """
+        :param http_pool: The pool to make the request through
+        :param req_args: Arguments for the request, starting with the URL
+        :param req_kwargs: Keyword arguments for the request
+        :param session: Session to use, or None for the pool's shared
+            anonymous session
+
+        :type http_pool: plugins.urls.http_pool.HTTPPool
+        """
+
         if not req_args:
             req_args = []
         if not req_kwargs:
             req_kwargs = {}
-        if not session_kwargs:
-            session_kwargs = {}
 
         self._args = req_args
         self._kwargs = req_kwargs
 
-        self._session = Session(
-            pool=pool, minthreads=minthreads, maxthreads=maxthreads,
-            **session_kwargs
-        )
+        self._pool = http_pool
+        self._session = session
 
     def get(self):
         if self.result is None:
-            self.result = self._session.get(*self._args, **self._kwargs)
-            del self._session
+            self.result = self._pool.get(
+                *self._args, session=self._session, **self._kwargs
+            )
 
         return self.result
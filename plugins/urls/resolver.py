@@ -1,38 +1,228 @@
 # coding=utf-8
 
+"""
+Cached DNS resolution for the URLs plugin.
+
+Lookups run on a thread pool, as socket.gethostbyname blocks. Their results
+are cached, so the lookup made before fetching a URL and the one made after
+it has redirected usually only hit DNS once between them.
+
+* **Positive caching** - Addresses are kept for `ttl` seconds. The system
+  resolver doesn't tell us the record's real TTL, so this is a fixed time,
+  and should be kept short
+* **Negative caching** - Hosts that fail to resolve are remembered for
+  `negative_ttl` seconds, so a link to a dead domain pasted over and over
+  doesn't look it up every time
+* **Coalescing** - Lookups for a host that's already being looked up wait
+  for that lookup, rather than making another one
+* **Size** - Only `max_size` hosts are cached, and the least recently used
+  are dropped first
+
+Whether each address is private, loopback, link-local or multicast is
+worked out once and cached along with it.
+"""
+
 import socket
-from twisted.internet import defer, reactor
+
+from collections import OrderedDict
+from netaddr import IPAddress
+from twisted.internet import defer
 from twisted.python.threadpool import ThreadPool
 
 __author__ = 'Gareth Coles'
 
 
+def is_internal(ip):
+    """
+    Check whether an IP address is one we shouldn't connect to for a URL.
+
+    :type ip: IPAddress
+    :rtype: bool
+    """
+
+    return any((ip.is_loopback(), ip.is_private(), ip.is_link_local(),
+                ip.is_multicast()))
+
+
 class AddressResolver(object):
     pool = None
 
-    def __init__(self, minthreads=1, maxthreads=4):
-        self.pool = ThreadPool(minthreads=minthreads, maxthreads=maxthreads)
-        # unclosed ThreadPool leads to reactor hangs at shutdown
-        # this is a problem in many situation, so better enforce pool stop here
-        reactor.addSystemEventTrigger(
-            "before", "shutdown", self.pool.stop
-        )
+    def __init__(self, minthreads=1, maxthreads=4, pool=None, ttl=300,
+                 negative_ttl=30, max_size=1024, resolver=socket,
+                 reactor=None):
+        """
+        :param pool: ThreadPool to run lookups on - one will be created if
+            this isn't given
+        :param ttl: How long to cache addresses for, in seconds
+        :param negative_ttl: How long to cache failed lookups for, in
+            seconds
+        :param max_size: How many hosts to cache
+        :param resolver: Anything with a gethostbyname function - the
+            socket module by default
+        :param reactor: The reactor, or something else that provides
+            seconds() and callFromThread()
+        """
+
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.reactor = reactor
+        self.resolver = resolver
 
-        self.pool.start()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+
+        self.own_pool = pool is None
+
+        if pool is None:
+            pool = ThreadPool(minthreads=minthreads, maxthreads=maxthreads)
+            # unclosed ThreadPool leads to reactor hangs at shutdown
+            # this is a problem in many situation, so better enforce pool stop
+            # here
+            reactor.addSystemEventTrigger("before", "shutdown", self.close)
+
+            pool.start()
+
+        self.pool = pool
+
+        # hostname -> (expiry time, (ip, internal) or exception)
+        self._cache = OrderedDict()
+        self._waiting = {}  # hostname -> [Deferred]
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, config, pool=None):
+        """
+        Create a resolver using the "dns" part of the "connections" section
+        of the plugin's configuration.
+
+        :param config: The plugin's configuration
+        :param pool: ThreadPool to run lookups on, if not our own
+        """
+
+        dns = config.get("connections", {}).get("dns", {})
+
+        return cls(
+            pool=pool,
+            ttl=dns.get("ttl", 300),
+            negative_ttl=dns.get("negative_ttl", 30),
+            max_size=dns.get("cache_size", 1024)
+        )
 
     def get_host_by_name(self, address):
+        """
+        Look up a host's IPv4 address.
+
+        :return: Deferred that fires with the address as a string, or fails
+            with the lookup's error
+        :rtype: Deferred
+        """
+
+        return self.check_host(address).addCallback(lambda result: result[0])
+
+    def check_host(self, address):
+        """
+        Look up a host's IPv4 address, and whether it's internal - see
+        `is_internal`.
+
+        :return: Deferred that fires with a tuple of (address string,
+            whether it's internal), or fails with the lookup's error
+        :rtype: Deferred
+        """
+
+        address = address.lower()
+        entry = self._cache.get(address)
+
+        if entry is not None:
+            expires, result = entry
+
+            if expires > self.reactor.seconds():
+                # Move it to the end, as it's the most recently used now
+                del self._cache[address]
+                self._cache[address] = entry
+
+                if isinstance(result, Exception):
+                    self.negative_hits += 1
+                    return defer.fail(result)
+
+                self.hits += 1
+                return defer.succeed(result)
+
+            del self._cache[address]
+
         d = defer.Deferred()
 
+        if address in self._waiting:
+            self.coalesced += 1
+            self._waiting[address].append(d)
+            return d
+
+        self.misses += 1
+        self._waiting[address] = [d]
+
         def func():
             try:
-                reactor.callFromThread(
-                    d.callback, socket.gethostbyname(address)
-                )
+                ip = self.resolver.gethostbyname(address)
+                result = (ip, is_internal(IPAddress(ip)))
             except Exception as e:
-                reactor.callFromThread(d.errback, e)
+                result = e
+
+            self.reactor.callFromThread(self._resolved, address, result)
 
         self.pool.callInThread(func)
         return d
 
+    def _resolved(self, address, result):
+        if isinstance(result, Exception):
+            ttl = self.negative_ttl
+        else:
+            ttl = self.ttl
+
+        if ttl > 0 and self.max_size > 0:
+            self._cache[address] = (self.reactor.seconds() + ttl, result)
+
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+        for d in self._waiting.pop(address, []):
+            if isinstance(result, Exception):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def stats(self):
+        """
+        Get the cache's size and hit counts.
+
+        :rtype: dict
+        """
+
+        return {
+            "cached": len(self._cache),
+            "in_flight": len(self._waiting),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions
+        }
+
+    def clear(self):
+        """
+        Forget every cached lookup.
+        """
+
+        self._cache.clear()
+
     def close(self):
-        self.pool.stop()
+        self.clear()
+
+        if self.own_pool and self.pool.started:
+            self.pool.stop()
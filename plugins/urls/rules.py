@@ -0,0 +1,285 @@
+# coding=utf-8
+
+"""
+Compiled domain rules, for deciding how to handle each URL.
+
+The URLs plugin's configuration has several lists of regular expressions -
+the blacklist, domains that never get sessions, session groups, and proxied
+domains. These are compiled when the configuration is loaded, rather than
+being matched one by one for every URL.
+
+Rules that are just a domain, like ``google\\.com``, or a domain's
+subdomains, like ``.*\\.google\\.com``, go into a trie keyed by the domain's
+labels from right to left - so finding them costs the same however many
+there are. Note that these match whole domains, so ``google\\.com`` doesn't
+match ``google.com.example.org``. Every other rule is a true pattern, and is
+matched as before, but as part of one big alternation.
+
+Decisions for each domain are remembered, until the rules are compiled
+again.
+"""
+
+__author__ = 'Gareth Coles'
+
+import re
+
+from collections import namedtuple
+
+from utils.cache import LRUCache
+from utils.misc import str_to_regex_flags
+
+FLAGS = str_to_regex_flags("iu")
+
+PLAIN_REGEX = re.compile(
+    r"^\^?(?P<subdomains>\.\*\\\.)?"
+    r"(?P<domain>[\w-]+(?:\\?\.[\w-]+)*)\$?$"
+)
+
+#: Everything the domain rules say about a domain
+Decision = namedtuple("Decision", "never_session session_group proxy")
+
+
+class _Node(object):
+    __slots__ = ["children", "exact", "subdomains"]
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None  # (order, value) of a rule for just this domain
+        self.subdomains = None  # (order, value) of a rule for subdomains
+
+
+class RuleSet(object):
+    """
+    An ordered list of domain rules, each with a value. The first rule that
+    matches a domain decides its value.
+    """
+
+    def __init__(self, rules=(), domains=True):
+        """
+        :param rules: Iterable of (pattern, value) tuples
+        :param domains: Whether the rules are matched against domains - if
+            they aren't, none of them are put in the trie
+        """
+
+        self.domains = domains
+
+        self._root = _Node()
+        self._patterns = []  # (order, compiled, value)
+        self._combined = None
+
+        #: Patterns that failed to compile, and their errors
+        self.invalid = []
+
+        for order, (pattern, value) in enumerate(rules):
+            self._add(order, pattern, value)
+
+        self._combine()
+
+    def __len__(self):
+        return len(self._patterns) + self._count(self._root)
+
+    def _count(self, node):
+        count = (node.exact is not None) + (node.subdomains is not None)
+
+        for child in node.children.itervalues():
+            count += self._count(child)
+
+        return count
+
+    def _add(self, order, pattern, value):
+        plain = self.domains and PLAIN_REGEX.match(pattern)
+
+        if plain:
+            domain = plain.group("domain").replace("\\", "").lower()
+            node = self._root
+
+            for label in reversed(domain.split(".")):
+                node = node.children.setdefault(label, _Node())
+
+            if plain.group("subdomains"):
+                if node.subdomains is None:
+                    node.subdomains = (order, value)
+            elif node.exact is None:
+                node.exact = (order, value)
+
+            return
+
+        try:
+            compiled = re.compile(pattern, FLAGS)
+        except re.error as e:
+            self.invalid.append((pattern, e))
+        else:
+            self._patterns.append((order, compiled, value))
+
+    def _combine(self):
+        if not self._patterns:
+            return
+
+        if any(compiled.groups for _, compiled, _ in self._patterns):
+            # Wrapping each pattern in a group of its own would renumber any
+            # groups it already has, so numbered backreferences would quietly
+            # refer to the wrong group - they're matched one at a time
+            return
+
+        combined = "|".join(
+            "(?P<_rule%s>%s)" % (i, compiled.pattern)
+            for i, (_, compiled, _) in enumerate(self._patterns)
+        )
+
+        try:
+            self._combined = re.compile(combined, FLAGS)
+        except (re.error, AssertionError):
+            # Too many patterns to fit in one, so they're matched one at a
+            # time instead
+            self._combined = None
+
+    def _match_trie(self, domain):
+        node = self._root
+        found = None
+        labels = domain.split(".")
+
+        for i in xrange(len(labels) - 1, -1, -1):
+            node = node.children.get(labels[i])
+
+            if node is None:
+                return found
+
+            if i > 0 and node.subdomains is not None:
+                if found is None or node.subdomains[0] < found[0]:
+                    found = node.subdomains
+
+        if node.exact is not None:
+            if found is None or node.exact[0] < found[0]:
+                found = node.exact
+
+        return found
+
+    def _match_patterns(self, domain):
+        if self._combined is not None:
+            match = self._combined.match(domain)
+
+            if match is None:
+                return None
+
+            order, _, value = self._patterns[int(match.lastgroup[5:])]
+            return order, value
+
+        for order, compiled, value in self._patterns:
+            if compiled.match(domain):
+                return order, value
+
+        return None
+
+    def match(self, domain, default=None):
+        """
+        Find the value of the first rule that matches a domain.
+
+        :param domain: The domain, like "www.example.com"
+        :param default: Returned if no rules match
+
+        :return: The rule's value, or the default
+        """
+
+        if self.domains:
+            found = self._match_trie(domain.lower())
+        else:
+            found = None
+
+        pattern = self._match_patterns(domain)
+
+        if pattern is not None and (found is None or pattern[0] < found[0]):
+            found = pattern
+
+        if found is None:
+            return default
+
+        return found[1]
+
+
+class DomainRules(object):
+    """
+    All of the URLs plugin's domain rules, compiled.
+    """
+
+    def __init__(self, blacklist=(), never=(), groups=None, proxies=None,
+                 cache_size=1024):
+        """
+        :param blacklist: Patterns matched against whole URLs
+        :param never: Domain patterns that never get sessions
+        :param groups: Dict of session group names to lists of domain
+            patterns
+        :param proxies: Dict of domain patterns to proxy dicts
+        :param cache_size: How many domains to remember decisions for
+        """
+
+        self.blacklist = RuleSet(
+            ((pattern, True) for pattern in blacklist), domains=False
+        )
+        self.never = RuleSet((pattern, True) for pattern in never)
+        self.groups = RuleSet(
+            (pattern, group)
+            for group, patterns in (groups or {}).iteritems()
+            for pattern in patterns
+        )
+        self.proxies = RuleSet((proxies or {}).iteritems())
+
+        self.cache = LRUCache(cache_size)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Compile the rules in the plugin's configuration.
+
+        :param config: The plugin's configuration
+        """
+
+        sessions = config.get("sessions") or {}
+
+        return cls(
+            blacklist=config.get("blacklist") or [],
+            never=sessions.get("never") or [],
+            groups=sessions.get("group") or {},
+            proxies=(config.get("proxies") or {}).get("domains") or {}
+        )
+
+    @property
+    def invalid(self):
+        """
+        Every pattern that failed to compile, and its error.
+
+        :rtype: list
+        """
+
+        return sum((rules.invalid for rules in (
+            self.blacklist, self.never, self.groups, self.proxies
+        )), [])
+
+    def lookup(self, domain):
+        """
+        Decide how to handle URLs for a domain.
+
+        :rtype: Decision
+        """
+
+        decision = self.cache.get(domain)
+
+        if decision is None:
+            decision = Decision(
+                self.never.match(domain, False),
+                self.groups.match(domain),
+                self.proxies.match(domain)
+            )
+            self.cache.set(domain, decision)
+
+        return decision
+
+    def is_blacklisted(self, url):
+        """
+        Check whether a URL matches the blacklist. Blacklist patterns are
+        matched against the whole URL, so these aren't remembered.
+
+        :param url: The URL, as a string
+        :rtype: bool
+        """
+
+        return self.blacklist.match(url, False)
@@ -0,0 +1,159 @@
+# coding=utf-8
+
+"""
+Storage for URLs we've already shortened, so each one is only sent to a
+shortener once.
+
+Shortened URLs are kept in the plugin's sqlite database, with a unique index
+on the URL and shortener, and the most recently used are also kept in
+memory - looking those up doesn't need a trip to the database's thread.
+When a URL is asked for again while it's still being shortened, the second
+request waits for the first, rather than calling the shortener again.
+"""
+
+__author__ = 'Gareth Coles'
+
+from twisted.internet import defer
+from twisted.python.failure import Failure
+
+from utils.cache import LRUCache
+
+INDEX_NAME = "urls_url_shortener"
+
+
+class ShortenedURLs(object):
+    """
+    Looks up shortened URLs, and shortens the ones we don't have yet.
+    """
+
+    def __init__(self, database, cache_size=1024):
+        """
+        :param database: The plugin's DBAPI data object, or anything else
+            with adbapi's runQuery and runInteraction
+        :param cache_size: How many shortened URLs to keep in memory
+        """
+
+        self.database = database
+        self.cache = LRUCache(cache_size)
+
+        self._waiting = {}  # (url, shortener) -> [Deferred]
+
+        self.shortened = 0
+        self.coalesced = 0
+
+    def setup(self):
+        """
+        Create the table and its index, removing any duplicate rows that
+        were stored before the index existed.
+
+        :return: Deferred that fires with the number of duplicates removed
+        :rtype: Deferred
+        """
+
+        return self.database.runInteraction(self._setup_interaction)
+
+    def _setup_interaction(self, txn):
+        txn.execute("CREATE TABLE IF NOT EXISTS urls ("
+                    "url TEXT, "
+                    "shortener TEXT, "
+                    "result TEXT)")
+        txn.execute("SELECT name FROM sqlite_master "
+                    "WHERE type='index' AND name=?", (INDEX_NAME,))
+
+        if txn.fetchall():
+            return 0
+
+        # Keep the first result for each URL, as that's the one lookups
+        # have been returning
+        txn.execute("DELETE FROM urls WHERE rowid NOT IN ("
+                    "SELECT MIN(rowid) FROM urls GROUP BY url, shortener)")
+        removed = txn.rowcount
+
+        txn.execute("CREATE UNIQUE INDEX IF NOT EXISTS {0} "
+                    "ON urls (url, shortener)".format(INDEX_NAME))
+
+        return removed
+
+    def get(self, url, shortener, shorten=None):
+        """
+        Get a shortened URL, shortening it if we haven't before.
+
+        :param url: The URL to shorten
+        :param shortener: The name of the shortener
+        :param shorten: Function that shortens the URL and returns a
+            Deferred, or None to only look up URLs we already have
+
+        :return: Deferred that fires with the shortened URL, or None if we
+            don't have it and can't shorten it
+        :rtype: Deferred
+        """
+
+        key = (unicode(url), shortener.lower())
+        cached = self.cache.get(key)
+
+        if cached is not None:
+            return defer.succeed(cached)
+
+        d = defer.Deferred()
+
+        if key in self._waiting:
+            self.coalesced += 1
+            self._waiting[key].append(d)
+            return d
+
+        self._waiting[key] = [d]
+
+        lookup = self.database.runQuery(
+            "SELECT result FROM urls WHERE url=? AND shortener=?", key
+        )
+        lookup.addCallback(self._looked_up, key, shorten)
+        lookup.addBoth(self._finished, key)
+
+        return d
+
+    def _looked_up(self, rows, key, shorten):
+        if rows:
+            return rows[0][0]
+
+        if shorten is None:
+            return None
+
+        self.shortened += 1
+
+        d = defer.maybeDeferred(shorten)
+        d.addCallback(self._store, key)
+        return d
+
+    def _store(self, result, key):
+        if result:
+            self.database.runQuery(
+                "INSERT OR REPLACE INTO urls VALUES (?, ?, ?)",
+                key + (result,)
+            )
+
+        return result
+
+    def _finished(self, result, key):
+        if result and not isinstance(result, Failure):
+            self.cache.set(key, result)
+
+        for d in self._waiting.pop(key, []):
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def stats(self):
+        """
+        Get the memory cache's size and hit counts, and how many URLs were
+        sent to shorteners.
+
+        :rtype: dict
+        """
+
+        stats = self.cache.stats()
+        stats["in_flight"] = len(self._waiting)
+        stats["shortened"] = self.shortened
+        stats["coalesced"] = self.coalesced
+
+        return stats
@@ -2,8 +2,6 @@
 
 __author__ = 'Gareth Coles'
 
-from txrequests import Session
-
 from plugins.urls.shorteners.base import Shortener
 
 
@@ -12,11 +10,9 @@ class TinyURLShortener(Shortener):
     name = "tinyurl"
 
     def do_shorten(self, context):
-        session = Session()
-
         params = {"url": unicode(context["url"])}
 
-        d = session.get(self.base_url, params=params)
+        d = self.urls_plugin.http_pool.get(self.base_url, params=params)
 
         d.addCallbacks(
             self.shorten_success, self.shorten_error
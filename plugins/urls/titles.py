@@ -0,0 +1,244 @@
+# coding=utf-8
+
+"""
+Incremental extraction of page titles.
+
+A *TitleExtractor* is fed a page's body a chunk at a time as it's read, and
+says when it's seen enough - once the title has been closed, or the head of
+the page has ended without one. The rest of the body never has to be read.
+
+Pages are scanned as bytes, skipping over comments, scripts and styles, and
+only the title itself is decoded. The charset used for that comes from the
+Content-Type header, a byte order mark, or a meta tag in the page, in that
+order - failing all of those, UTF-8 is tried before Windows-1252.
+
+Pages that can't be scanned this way - ones in UTF-16, or ones whose head
+never ends within the amount we're willing to read - are handed to
+BeautifulSoup instead.
+"""
+
+__author__ = 'Gareth Coles'
+
+import codecs
+import re
+
+from bs4 import BeautifulSoup
+from HTMLParser import HTMLParser
+
+_TOKENS = re.compile(
+    r"<!--(?P<comment>.*?-->)?"
+    r"|<(?P<raw>script|style)\b[^>]*>(?P<raw_end>.*?</(?P=raw)\s*>)?"
+    r"|<(?P<close>/?)(?P<tag>title|head|body|meta)\b(?P<attrs>[^>]*)>",
+    re.I | re.S
+)
+
+_TITLE_END = re.compile(r"</title\s*>", re.I)
+_META_CHARSET = re.compile(r"""charset\s*=\s*["']?\s*([\w.:-]+)""", re.I)
+_WHITESPACE = re.compile(r"\s+", re.U)
+
+_BOMS = [
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be")
+]
+
+_parser = HTMLParser()
+
+
+def get_charset(content_type):
+    """
+    Get the charset from a Content-Type header.
+
+    :param content_type: The header, like "text/html; charset=UTF-8"
+
+    :return: The lowercase charset, or None if there isn't one
+    """
+
+    for param in (content_type or "").split(";")[1:]:
+        key, _, value = param.partition("=")
+
+        if key.strip().lower() == "charset":
+            return value.strip().strip("\"'").lower() or None
+
+    return None
+
+
+def _normalise_charset(charset):
+    """
+    :return: The codec's canonical name, or None if Python doesn't know it
+    """
+
+    if not charset:
+        return None
+
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return None
+
+
+def _decode(data, charsets):
+    for charset in charsets:
+        if charset is None:
+            continue
+
+        try:
+            return data.decode(charset)
+        except (LookupError, UnicodeDecodeError):
+            continue
+
+    return data.decode("windows-1252", "replace")
+
+
+def clean_title(title):
+    """
+    Unescape a title's entities and collapse its whitespace.
+
+    :type title: unicode
+    :rtype: unicode
+    """
+
+    return _WHITESPACE.sub(u" ", _parser.unescape(title)).strip()
+
+
+class TitleExtractor(object):
+    """
+    Finds a page's title as its body is read.
+
+    Call `feed` with each chunk of the body until it returns True or you've
+    read as much as you want to, then call `finish` to get the title.
+    """
+
+    def __init__(self, charset=None):
+        """
+        :param charset: The charset from the Content-Type header, if any
+        """
+
+        self.charset = _normalise_charset(charset)
+        self.meta_charset = None
+
+        #: Whether we've seen enough of the page to know its title
+        self.done = False
+        self.bytes_read = 0
+
+        self._data = b""
+        self._pos = 0  # Where to start scanning for tags from
+        self._title_start = None  # Where the title's text starts
+        self._title = None  # The title's undecoded bytes
+
+        # Our scanning only works for charsets that ASCII is a subset of
+        self._scannable = not (self.charset or "").startswith(
+            ("utf-16", "utf-32")
+        )
+
+    def feed(self, data):
+        """
+        Scan the next chunk of the body.
+
+        :param data: The chunk, as bytes
+
+        :return: Whether we're done, and no more needs to be read
+        :rtype: bool
+        """
+
+        if self.done:
+            return True
+
+        first = not self._data
+
+        self.bytes_read += len(data)
+        self._data += data
+
+        if first:
+            self._check_bom()
+
+        if self._scannable:
+            self._scan()
+
+        return self.done
+
+    def _check_bom(self):
+        for bom, charset in _BOMS:
+            if self._data.startswith(bom):
+                if charset != "utf-8":
+                    self._scannable = False
+                elif self.charset is None:
+                    self.charset = charset
+                return
+
+    def _scan(self):
+        data = self._data
+
+        while self._title_start is None:
+            match = _TOKENS.search(data, self._pos)
+
+            if match is None:
+                return
+
+            if match.group(0) == "<!--" or (
+                match.group("raw") and match.group("raw_end") is None
+            ):
+                # Comment or script that hasn't ended yet - wait for more
+                return
+
+            self._pos = match.end()
+            tag = (match.group("tag") or "").lower()
+
+            if match.group("close"):
+                if tag == "head":
+                    self.done = True
+                    return
+            elif tag == "body":
+                self.done = True
+                return
+            elif tag == "title":
+                self._title_start = match.end()
+            elif tag == "meta" and self.meta_charset is None:
+                charset = _META_CHARSET.search(match.group("attrs"))
+
+                if charset is not None:
+                    self.meta_charset = _normalise_charset(charset.group(1))
+
+        end = _TITLE_END.search(data, self._title_start)
+
+        if end is not None:
+            self._title = data[self._title_start:end.start()]
+            self.done = True
+
+    def finish(self):
+        """
+        Get the page's title, from what's been read.
+
+        If we never saw enough of the page to know, BeautifulSoup is given
+        what was read instead.
+
+        :return: The cleaned-up title, or None if there isn't one
+        :rtype: unicode
+        """
+
+        if self._title is not None:
+            return clean_title(_decode(
+                self._title, [self.charset, self.meta_charset, "utf-8"]
+            )) or None
+
+        if self.done or not self._data:
+            return None
+
+        # BeautifulSoup has already dealt with any entities
+        title = self._fallback()
+
+        if title is None:
+            return None
+
+        return _WHITESPACE.sub(u" ", title).strip() or None
+
+    def _fallback(self):
+        soup = BeautifulSoup(self._data, "html.parser",
+                             from_encoding=self.charset)
+
+        if soup.title and soup.title.text:
+            return soup.title.text
+
+        return None
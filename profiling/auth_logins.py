@@ -0,0 +1,168 @@
+# coding=utf-8
+
+"""
+Benchmark for reactor latency while users log in.
+
+Sets up 50 accounts, then has them all log in at once, the way they would
+after a netsplit. While that's happening, a timer ticks every 5ms and
+records how late each tick was - that's how long every connected protocol
+would have been left waiting.
+
+This is done with the blocking login, which hashed on the reactor thread, and
+with login_async, which hashes in worker processes. Run it from the root of
+the repository::
+
+    python profiling/auth_logins.py [algo] [processes]
+
+The algorithm defaults to bcrypt, and the number of processes to 2.
+"""
+
+__author__ = 'Gareth Coles'
+
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from twisted.internet import defer, reactor, task
+
+from plugins.auth.auth_handler import authHandler
+from plugins.auth.hashing import HashingPool
+from system.logging.logger import getLogger
+from utils.misc import AttrDict
+
+LOGINS = 50
+TICK = 0.005
+
+
+class FakeData(dict):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class LagMonitor(object):
+    def __init__(self):
+        self.lags = []
+        self.last = None
+        self.call = task.LoopingCall(self.tick)
+
+    def start(self):
+        self.last = time.time()
+        self.call.start(TICK, now=False)
+
+    def stop(self):
+        self.call.stop()
+
+    def tick(self):
+        now = time.time()
+        self.lags.append(max(0, now - self.last - TICK))
+        self.last = now
+
+    def report(self):
+        lags = sorted(self.lags)
+
+        return (
+            lags[-1] * 1000,
+            lags[int(len(lags) * 0.99)] * 1000
+        )
+
+
+def make_handler(algo, processes):
+    logger = getLogger("Auth")
+    logger.setLevel(logging.CRITICAL)
+
+    plugin = AttrDict(
+        config={"auth-algo": algo, "login-cache-ttl": 30},
+        logger=logger
+    )
+
+    data = FakeData(admin={})
+    handler = authHandler(plugin, data, FakeData(), HashingPool(processes))
+
+    for i in xrange(LOGINS):
+        handler.create_user("user-%s" % i, "password-%s" % i)
+
+    return handler
+
+
+def legacy_logins(handler):
+    deferreds = []
+
+    for i in xrange(LOGINS):
+        # Each login is a separate command, handled one per reactor iteration
+        d = task.deferLater(
+            reactor, 0, handler.login, AttrDict(authorized=False), None,
+            "user-%s" % i, "password-%s" % i
+        )
+        deferreds.append(d)
+
+    return defer.gatherResults(deferreds)
+
+
+def async_logins(handler):
+    return defer.gatherResults([
+        handler.login_async(
+            AttrDict(authorized=False), None, "user-%s" % i, "password-%s" % i
+        ) for i in xrange(LOGINS)
+    ])
+
+
+@defer.inlineCallbacks
+def measure(handler, logins):
+    monitor = LagMonitor()
+    monitor.start()
+
+    # Give the monitor a few ticks first
+    yield task.deferLater(reactor, TICK * 4, lambda: None)
+
+    start = time.time()
+    results = yield logins(handler)
+    taken = time.time() - start
+
+    # And a few more, so we see how late the tick after the logins was
+    yield task.deferLater(reactor, TICK * 4, lambda: None)
+
+    monitor.stop()
+    assert all(results)
+
+    defer.returnValue((taken,) + monitor.report())
+
+
+@defer.inlineCallbacks
+def run(algo, processes):
+    try:
+        handler = make_handler(algo, processes)
+
+        before = yield measure(handler, legacy_logins)
+
+        # So the async logins don't just hit the cache
+        handler.verified.clear()
+        after = yield measure(handler, async_logins)
+
+        print "%s concurrent logins, %s, %s processes" % (
+            LOGINS, algo, processes
+        )
+        print "        Total time   Max lag   99th percentile lag"
+        print "Before: %8.2fs %8.1fms %10.1fms" % before
+        print "After:  %8.2fs %8.1fms %10.1fms" % after
+
+        handler.hashing_pool.close()
+    finally:
+        reactor.stop()
+
+
+def main():
+    algo = sys.argv[1] if len(sys.argv) > 1 else "bcrypt"
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+    reactor.callWhenRunning(run, algo, processes)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+# coding=utf-8
+
+"""
+Benchmark for the bridge plugin's relaying.
+
+Sets up 100 bridging rules linking 40 channels across 6 networks, then
+relays messages from random channels (and some from channels that aren't
+bridged) and measures events per second. This is done with the old
+rule-by-rule loop, which sent every line directly, and with the compiled
+rule index and batched relay queue. Run it from the root of the
+repository::
+
+    python profiling/bridge.py
+"""
+
+__author__ = 'Gareth Coles'
+
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from plugins.bridge import BridgePlugin
+from plugins.bridge.relay import RelayQueue
+from system.logging.logger import getLogger
+from system.protocols.generic.channel import Channel
+from system.protocols.generic.user import User
+from system.translations import Translations
+from utils.misc import AttrDict
+
+_ = Translations().get()
+
+NETWORKS = ["irc-%s" % i for i in xrange(5)] + ["mumble"]
+CHANNELS = ["#channel-%s" % i for i in xrange(40)]
+RULES = 100
+EVENTS = 20000
+
+FORMATTING = {
+    "general": {
+        "message": "<{USER}> {MESSAGE}",
+        "join": "* {USER} joined {CHANNEL}",
+        "action": "* {USER} {MESSAGE}"
+    }
+}
+
+
+class FakeProtocol(object):
+    def __init__(self, name):
+        self.name = name
+        self.nickname = "Ultros"
+        self.sent = 0
+        self.lines = 0
+
+        # Mumble supports multi-line messages
+        self.multiline = name == "mumble"
+        self.message_length = 5000
+
+    def has_capability(self, capability):
+        return self.multiline
+
+    def send_msg(self, target, message, target_type=None, use_event=True):
+        self.sent += 1
+        self.lines += message.count("\n") + 1
+
+
+class FakeFactoryManager(object):
+    def __init__(self):
+        self.protocols = dict((name, FakeProtocol(name)) for name in NETWORKS)
+
+    def get_protocol(self, name):
+        return self.protocols.get(name)
+
+
+class FakeClock(object):
+    """
+    Doesn't schedule anything - the benchmark flushes the queue itself, once
+    for every batch of events.
+    """
+
+    def callLater(self, delay, func):
+        return AttrDict(active=lambda: False)
+
+
+class BenchBridge(BridgePlugin):
+    def __init__(self, rules, factory_manager):
+        self.config = {"rules": rules}
+        self.factory_manager = factory_manager
+        self.logger = getLogger("Bridge")
+        self.logger.setLevel(logging.CRITICAL)
+
+        self.compile_rules()
+        self.relay_queue = RelayQueue(factory_manager, self.logger,
+                                      FakeClock())
+
+
+class LegacyBridge(BenchBridge):
+    """
+    The pre-compilation do_rules, kept here for comparison.
+    """
+
+    def do_rules(self, msg, caller, source, target, from_user=True,
+                 to_user=True, f_str=None, tokens=None, use_event=False):
+        if not caller:
+            return
+        if not source:
+            return
+        if not target:
+            return
+        if not tokens:
+            tokens = {}
+        if not f_str:
+            f_str = ["general", "message"]
+
+        c_name = caller.name.lower()  # Protocol
+        s_name = source.nickname  # User
+        if isinstance(target, Channel):
+            t_name = target.name  # Channel
+        else:
+            t_name = target.nickname
+
+        for rule, data in self.rules.items():
+            self.logger.debug(_("Checking rule: %s - %s") % (rule, data))
+            from_ = data["from"]
+            to_ = data["to"]
+
+            if c_name != from_["protocol"].lower():
+                self.logger.trace(_("Protocol doesn't match."))
+                continue
+
+            if not self.factory_manager.get_protocol(to_["protocol"]):
+                self.logger.trace(_("Target protocol doesn't exist."))
+                continue
+
+            if isinstance(target, User):
+                if not from_user:
+                    continue
+                if from_["source-type"].lower() != "user":
+                    continue
+            elif isinstance(target, Channel):
+                if from_["source-type"].lower() != "channel":
+                    continue
+                if from_["source"].lower() != "*" \
+                   and from_["source"].lower() != t_name.lower():
+                    continue
+            else:
+                continue
+
+            if to_["target"] == "user" and not to_user:
+                continue
+
+            format_string = None
+
+            formatting = data["formatting"]
+            if f_str[0] in formatting:
+                if f_str[1] in formatting[f_str[0]]:
+                    format_string = formatting[f_str[0]][f_str[1]]
+
+            if not format_string:
+                continue
+
+            sf_name = s_name
+            tf_name = t_name
+
+            for line in msg.strip("\r").split("\n"):
+                format_string = formatting[f_str[0]][f_str[1]]
+
+                for k, v in tokens.items():
+                    format_string = format_string.replace("{%s}" % k, v)
+
+                format_string = format_string.replace("{MESSAGE}", line)
+                format_string = format_string.replace("{USER}", sf_name)
+                format_string = format_string.replace("{TARGET}", tf_name)
+                format_string = format_string.replace("{PROTOCOL}",
+                                                      caller.name)
+
+                prot = self.factory_manager.get_protocol(to_["protocol"])
+                prot.send_msg(to_["target"], format_string,
+                              target_type=to_["target-type"],
+                              use_event=use_event)
+
+
+def build_rules(rnd):
+    rules = {}
+
+    for i in xrange(RULES):
+        source, target = rnd.sample(NETWORKS, 2)
+
+        rules["rule-%s" % i] = {
+            "from": {
+                "protocol": source,
+                "source": "*" if i % 25 == 0 else rnd.choice(CHANNELS),
+                "source-type": "channel"
+            },
+            "to": {
+                "protocol": target,
+                "target": rnd.choice(CHANNELS),
+                "target-type": "channel"
+            },
+            "formatting": FORMATTING
+        }
+
+    return rules
+
+
+def build_events(rnd, factory_manager):
+    events = []
+    protocols = factory_manager.protocols
+
+    for i in xrange(EVENTS):
+        protocol = protocols[rnd.choice(NETWORKS)]
+        user = User("User%s" % rnd.randint(0, 500), protocol)
+        user.nickname = user.name
+
+        # A quarter of the messages are in channels nobody bridges
+        if rnd.random() < 0.25:
+            channel = Channel("#unbridged", protocol)
+        else:
+            channel = Channel(rnd.choice(CHANNELS), protocol)
+
+        events.append((protocol, user, channel))
+
+    return events
+
+
+def measure(bridge_class, rules, events):
+    factory_manager = FakeFactoryManager()
+    protocols = factory_manager.protocols
+    bridge = bridge_class(rules, factory_manager)
+
+    start = time.time()
+
+    for i, (protocol, user, channel) in enumerate(events):
+        bridge.do_rules("Hello, world!", protocols[protocol.name], user,
+                        channel)
+
+        if i % 50 == 49:
+            bridge.relay_queue.flush()
+
+    bridge.relay_queue.flush()
+    taken = time.time() - start
+
+    sent = sum(p.sent for p in protocols.itervalues())
+    lines = sum(p.lines for p in protocols.itervalues())
+
+    return len(events) / taken, sent, lines
+
+
+def run():
+    rnd = random.Random(1234)
+    rules = build_rules(rnd)
+    events = build_events(rnd, FakeFactoryManager())
+
+    before, before_sent, before_lines = measure(LegacyBridge, rules, events)
+    after, after_sent, after_lines = measure(BenchBridge, rules, events)
+
+    assert before_lines == after_lines
+
+    print "%s rules, %s networks, %s events" % (RULES, len(NETWORKS), EVENTS)
+    print "Before: %10.0f events/sec (%s sends)" % (before, before_sent)
+    print "After:  %10.0f events/sec (%s sends)" % (after, after_sent)
+    print "Speedup: %.2fx" % (after / before)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,108 @@
+# coding=utf-8
+
+"""
+Microbenchmark for EventManager.run_callback.
+
+Compares the compiled dispatch tables against the old per-event loop, which
+built a closure for every handler and formatted a debug string each time.
+Run it from the root of the repository::
+
+    python profiling/event_dispatch.py
+"""
+
+__author__ = 'Gareth Coles'
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from profiling.fakes import FakePlugin, FakePluginEvent
+
+from system.events.manager import EventManager
+
+events = EventManager()
+
+HANDLER_COUNTS = [1, 10, 100]
+EVENTS = 20000
+
+
+def handler(event):
+    pass
+
+
+def legacy_run_callback(manager, callback, event):
+    """
+    The pre-compilation run_callback loop, kept here for comparison.
+    """
+
+    manager.logger.trace(
+        "Running callbacks: {} -> {}".format(callback, event)
+    )
+
+    if manager.has_callback(callback):
+        event.threaded = False
+        manager.logger.trace("Event: %s" % event)
+
+        for cb in manager.get_callbacks(callback):
+            def go():
+                cb["function"](event, *cb["extra_args"],
+                               **cb["extra_kwargs"])
+            try:
+                manager.logger.debug("Running callback: %s" % cb)
+                if cb["filter"]:
+                    if callable(cb["filter"]):
+                        if not cb["filter"](event):
+                            continue
+                    else:
+                        continue
+                if event.cancelled:
+                    if cb["cancelled"]:
+                        go()
+                else:
+                    go()
+            except Exception as e:
+                manager.logger.exception(
+                    "Error running callback '%s': %s" % (callback, e)
+                )
+    return event
+
+
+def register(count):
+    for i in xrange(count):
+        plugin = FakePlugin({"name": "Bench-%03d" % i})
+        events.add_callback("Bench", plugin, handler, i % 5)
+
+
+def measure(func):
+    e = FakePluginEvent()
+    start = time.time()
+
+    for _ in xrange(EVENTS):
+        func(e)
+
+    return EVENTS / (time.time() - start)
+
+
+def run():
+    print "%8s | %14s | %14s | %7s" % (
+        "Handlers", "Before (ev/s)", "After (ev/s)", "Speedup"
+    )
+
+    for count in HANDLER_COUNTS:
+        events.remove_callbacks("Bench")
+        register(count)
+
+        before = measure(lambda e: legacy_run_callback(events, "Bench", e))
+        after = measure(lambda e: events.run_callback("Bench", e))
+
+        print "%8s | %14.0f | %14.0f | %6.2fx" % (
+            count, before, after, after / before
+        )
+
+    events.remove_callbacks("Bench")
+
+
+if __name__ == "__main__":
+    run()
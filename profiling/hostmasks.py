@@ -0,0 +1,126 @@
+# coding=utf-8
+
+"""
+Benchmark for matching users against a ban list.
+
+Checks every tracked user in a channel against every mask in its ban list,
+as a plugin enforcing bans would. This is done with the old matching, which
+built a regex for every part of every comparison, and with the compiled,
+host-indexed matcher. The ban list is a realistic mix of shapes - mostly
+*!*@host and *!*@*.domain bans, with some nick, ident and IP range bans.
+Run it from the root of the repository::
+
+    python profiling/hostmasks.py [users] [masks]
+"""
+
+__author__ = 'Sean'
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from system.protocols.irc.user import User
+from utils.irc import IRCUtils, split_hostmask
+
+USERS = 3000
+MASKS = 200
+
+
+def legacy_match(utils, user, mask):
+    """
+    The old IRCUtils.match_hostmask, kept here for comparison.
+    """
+
+    usersplit = split_hostmask(user)
+    masksplit = split_hostmask(mask)
+    usersplit[0] = utils.lowercase_nick_chan(usersplit[0])
+    masksplit[0] = utils.lowercase_nick_chan(masksplit[0])
+
+    for x in xrange(3):
+        part = re.escape(masksplit[x].lower()).replace(
+            r'\*', '.*'
+        ).replace(r'\?', '.')
+
+        if re.match(part, usersplit[x]) is None:
+            return False
+    return True
+
+
+def make_users(rnd, count):
+    users = []
+
+    for i in xrange(count):
+        if i % 3 == 0:
+            host = "%s.%s.%s.%s" % tuple(rnd.randint(1, 254) for _ in "abcd")
+        elif i % 3 == 1:
+            host = "host-%s.isp%s.example.com" % (i, i % 40)
+        else:
+            host = "user/%s" % i
+
+        users.append(User(None, "User%s" % i, "~u%s" % i, host))
+
+    return users
+
+
+def make_masks(rnd, count):
+    masks = []
+
+    for i in xrange(count):
+        roll = rnd.random()
+
+        if roll < 0.4:
+            # Half of these are for users that are here
+            user = rnd.randint(0, USERS * 2)
+            masks.append("*!*@host-%s.isp%s.example.com" % (user, user % 40))
+        elif roll < 0.6:
+            masks.append("*!*@*.isp%s.example.net" % rnd.randint(0, 99))
+        elif roll < 0.75:
+            masks.append("*!*@%s.%s.*" % (
+                rnd.randint(1, 254), rnd.randint(1, 254)
+            ))
+        elif roll < 0.85:
+            masks.append("Spammer%s*!*@*" % i)
+        elif roll < 0.95:
+            masks.append("*!~bad%s@*" % i)
+        else:
+            masks.append("*!*@user/troll%s" % i)
+
+    return masks
+
+
+def run():
+    rnd = random.Random(1)
+    utils = IRCUtils(None)
+    users = make_users(rnd, USERS)
+    masks = make_masks(rnd, MASKS)
+
+    print "%s users, %s masks" % (USERS, MASKS)
+
+    start = time.time()
+    matcher = utils.hostmask_matcher(masks)
+    matched = matcher.match_users(users)
+    after = time.time() - start
+
+    print "Matcher: %8.3fs (%s users banned)" % (after, len(matched))
+
+    start = time.time()
+    legacy = set(
+        user for user in users
+        if any(legacy_match(utils, user.fullname, mask) for mask in masks)
+    )
+    before = time.time() - start
+
+    print "Legacy:  %8.3fs (%s users banned)" % (before, len(legacy))
+    print "Speedup: %.2fx" % (before / after)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        USERS = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        MASKS = int(sys.argv[2])
+    run()
@@ -0,0 +1,204 @@
+# coding=utf-8
+
+"""
+Benchmark for extracting titles from web pages.
+
+Reads each page of a corpus a chunk at a time, as the website handler reads
+response bodies, and gets its title. This is done the old way, reading up to
+max_read_size bytes and handing them all to BeautifulSoup, and with the
+incremental extractor, which stops reading once it's seen the title. Reports
+titles per second and the bytes read per URL, and checks both ways found the
+same titles.
+
+Pass a directory of saved pages to use those as the corpus - otherwise, a
+corpus of typical page shapes is generated. Run it from the root of the
+repository::
+
+    python profiling/html_titles.py [directory]
+"""
+
+__author__ = 'Gareth Coles'
+
+import os
+import random
+import re
+import sys
+import time
+import warnings
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from bs4 import BeautifulSoup
+
+from plugins.urls.titles import TitleExtractor
+
+PAGES = 300
+MAX_READ = 1024 * 16
+CHUNK_SIZE = max(1024, MAX_READ / 16)
+ROUNDS = 3
+
+HEAD = ("<!DOCTYPE html>\n<html lang=\"en\">\n<head>\n"
+        "<meta charset=\"%(charset)s\">\n%(before)s"
+        "<title>%(title)s</title>\n%(after)s</head>\n")
+BODY = "<body>\n%s</body>\n</html>\n"
+
+PARAGRAPH = ("<p>Lorem ipsum dolor sit amet, <a href=\"/about\">consectetur"
+             "</a> adipiscing elit, sed do eiusmod tempor.</p>\n")
+SCRIPT = ("<script>\n(function(w, d) { w.dataLayer = w.dataLayer || [];"
+          " var s = d.createElement('script'); s.async = true; })"
+          "(window, document);\n</script>\n")
+STYLE = ("<style>\nbody { margin: 0; font-family: sans-serif; }\n"
+         ".nav > li { display: inline-block; padding: 4px; }\n</style>\n")
+META = ("<meta property=\"og:description\" content=\"Some words about "
+        "the page\">\n<link rel=\"stylesheet\" href=\"/static/site.css\">\n")
+
+
+def make_page(rnd, i):
+    """
+    :return: Tuple of (page, charset from the headers)
+    """
+
+    title = "Page %s &amp; things - Example Site" % i
+    charset = "utf-8"
+    header_charset = charset
+    roll = rnd.random()
+
+    if roll < 0.3:
+        # A simple blog - small head, long body
+        before, after = META, ""
+        body = PARAGRAPH * rnd.randint(50, 300)
+    elif roll < 0.55:
+        # A modern site, with a big head full of scripts and styles
+        before = (META + STYLE + SCRIPT) * rnd.randint(5, 25)
+        after = SCRIPT * rnd.randint(10, 40)
+        body = PARAGRAPH * rnd.randint(100, 400)
+    elif roll < 0.7:
+        # An old page in Latin-1, only saying so in a meta tag
+        before, after = META, STYLE
+        charset, header_charset = "iso-8859-1", None
+        title = "Caf\xe9 %s" % i
+        body = PARAGRAPH * rnd.randint(20, 100)
+    elif roll < 0.8:
+        # No title at all
+        page = (HEAD % {
+            "charset": charset, "before": META, "title": "", "after": ""
+        }).replace("<title></title>\n", "")
+        return page + BODY % (PARAGRAPH * 200), header_charset
+    else:
+        # A news site, with its title after lots of meta tags
+        before = META * rnd.randint(20, 60) + "<!-- <title>x</title> -->\n"
+        after = SCRIPT * rnd.randint(5, 10)
+        body = PARAGRAPH * rnd.randint(300, 1000)
+
+    page = HEAD % {
+        "charset": charset, "before": before, "title": title, "after": after
+    }
+    return page + BODY % body, header_charset
+
+
+def load_pages(directory):
+    pages = []
+
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+
+        if os.path.isfile(path):
+            with open(path, "rb") as fh:
+                pages.append((fh.read(), None))
+
+    return pages
+
+
+def chunks(page):
+    for i in xrange(0, len(page), CHUNK_SIZE):
+        yield page[i:i + CHUNK_SIZE]
+
+
+def legacy_title(page, charset):
+    """
+    What background_callback and callback used to do, kept here for
+    comparison.
+    """
+
+    read = []
+    amount_read = 0
+
+    for chunk in chunks(page):
+        read.append(chunk)
+        amount_read += len(chunk)
+
+        if amount_read >= MAX_READ:
+            break
+
+    soup = BeautifulSoup(b"".join(read))
+
+    if soup.title and soup.title.text:
+        title = re.sub(r"[\n\s]+", " ", soup.title.text.strip())
+        return title or None, amount_read
+
+    return None, amount_read
+
+
+def extractor_title(page, charset):
+    extractor = TitleExtractor(charset)
+
+    for chunk in chunks(page):
+        if extractor.feed(chunk) or extractor.bytes_read >= MAX_READ:
+            break
+
+    return extractor.finish(), extractor.bytes_read
+
+
+def measure(get_title, pages):
+    titles = []
+    read = 0
+    start = time.time()
+
+    for _ in xrange(ROUNDS):
+        titles = []
+        read = 0
+
+        for page, charset in pages:
+            title, amount = get_title(page, charset)
+            titles.append(title)
+            read += amount
+
+    taken = time.time() - start
+    return titles, len(pages) * ROUNDS / taken, read / float(len(pages))
+
+
+def run(directory=None):
+    warnings.simplefilter("ignore")
+
+    if directory:
+        pages = load_pages(directory)
+    else:
+        rnd = random.Random(1)
+        pages = [make_page(rnd, i) for i in xrange(PAGES)]
+
+    size = sum(len(page) for page, _ in pages) / float(len(pages))
+
+    print "%s pages, %.0f bytes on average" % (len(pages), size)
+
+    before_titles, before, before_read = measure(legacy_title, pages)
+    after_titles, after, after_read = measure(extractor_title, pages)
+
+    different = sum(1 for x, y in zip(before_titles, after_titles) if x != y)
+
+    print "Before: %8.1f titles/sec, %8.0f bytes read/URL" % (
+        before, before_read
+    )
+    print "After:  %8.1f titles/sec, %8.0f bytes read/URL" % (
+        after, after_read
+    )
+    print "Speedup: %.2fx, %.1f%% of the bytes read" % (
+        after / before, after_read * 100 / before_read
+    )
+    print "Titles found: %s before, %s after, %s different" % (
+        len(filter(None, before_titles)), len(filter(None, after_titles)),
+        different
+    )
+
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else None)
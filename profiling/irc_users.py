@@ -0,0 +1,177 @@
+# coding=utf-8
+
+"""
+Benchmark for IRC user-tracking.
+
+Replays a synthetic burst of raw lines into the IRC protocol: we join a big
+channel, the server sends NAMES and WHO replies for every user in it, then
+every user talks once and changes nick. This is done with the indexed user
+registry and, with --compare, with the old linear-scan lookups (which take
+minutes at 5,000 users). Run it from the root of the repository::
+
+    python profiling/irc_users.py [users] [--compare]
+"""
+
+__author__ = 'Sean'
+
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from twisted.test.proto_helpers import StringTransport
+
+from system.protocols.irc.protocol import Protocol
+from system.protocols.irc.registry import UserRegistry
+from utils.misc import AttrDict
+
+USERS = 5000
+CHANNEL = "#big"
+
+CONFIG = {
+    "main": {"can-flood": True},
+    "network": {"password": ""},
+    "identity": {"nick": "Ultros", "authentication": "None"},
+    "control_chars": ".",
+    "rate_limiting": {"enabled": False},
+    "channels": []
+}
+
+
+class LegacyRegistry(UserRegistry):
+    """
+    A plain list of users, searched linearly as the protocol used to.
+    """
+
+    def __init__(self, utils):
+        super(LegacyRegistry, self).__init__(utils.lowercase_nick_chan)
+        self.utils = utils
+        self.users = []
+
+    def add(self, user):
+        self.users.append(user)
+
+    def remove(self, user):
+        self.users.remove(user)
+
+    def rename(self, user):
+        pass
+
+    def reindex(self):
+        pass
+
+    def clear(self):
+        self.users = []
+
+    def find(self, nickname=None, ident=None, host=None):
+        matches = []
+        if ident:
+            ident = ident.lower()
+        if host:
+            host = host.lower()
+        for user in self.users:
+            if nickname:
+                if not self.utils.compare_nicknames(nickname, user.nickname):
+                    continue
+            if ident and ident != user.ident.lower():
+                continue
+            if host and host != user.host.lower():
+                continue
+            matches.append(user)
+        return matches
+
+    def __contains__(self, user):
+        return user in self.users
+
+    def __iter__(self):
+        return iter(list(self.users))
+
+    def __len__(self):
+        return len(self.users)
+
+
+def make_lines(count):
+    lines = [":Ultros!bot@ultros.io JOIN :%s" % CHANNEL]
+    nicks = ["User[%s]" % i for i in xrange(count)]
+
+    for i in xrange(0, count, 50):
+        lines.append(":irc.server 353 Ultros = %s :%s" % (
+            CHANNEL, " ".join("+" + nick for nick in nicks[i:i + 50])
+        ))
+
+    lines.append(":irc.server 366 Ultros %s :End of /NAMES list." % CHANNEL)
+
+    for i, nick in enumerate(nicks):
+        lines.append(
+            ":irc.server 352 Ultros %s ~u%s host-%s.example.com "
+            "irc.server %s H%s :0 Real Name" % (
+                CHANNEL, i, i % 300, nick, "+" if i % 10 else "@"
+            )
+        )
+
+    lines.append(":irc.server 315 Ultros %s :End of /WHO list." % CHANNEL)
+
+    for i, nick in enumerate(nicks):
+        lines.append(":%s!~u%s@host-%s.example.com PRIVMSG %s :Hello!" % (
+            nick, i, i % 300, CHANNEL
+        ))
+
+    for i, nick in enumerate(nicks):
+        lines.append(":%s!~u%s@host-%s.example.com NICK :Renamed%s" % (
+            nick, i, i % 300, i
+        ))
+
+    return lines
+
+
+def make_protocol(legacy):
+    protocol = Protocol("bench", AttrDict(), AttrDict(CONFIG))
+    protocol.log.setLevel(logging.CRITICAL)
+
+    # There's no reactor running, so WHO replies can't be applied in slices
+    protocol.who_replies.sync_limit = sys.maxint
+
+    if legacy:
+        protocol._users = LegacyRegistry(protocol.utils)
+
+    protocol.makeConnection(StringTransport())
+    return protocol
+
+
+def measure(lines, legacy):
+    protocol = make_protocol(legacy)
+    start = time.time()
+
+    for line in lines:
+        protocol.lineReceived(line)
+
+    taken = time.time() - start
+    assert len(protocol._users) == USERS + 1
+
+    return taken
+
+
+def run(compare):
+    lines = make_lines(USERS)
+    print "%s users, %s lines" % (USERS, len(lines))
+
+    after = measure(lines, False)
+    print "Indexed: %8.2fs (%8.0f lines/sec)" % (after, len(lines) / after)
+
+    if compare:
+        before = measure(lines, True)
+        print "Linear:  %8.2fs (%8.0f lines/sec)" % (
+            before, len(lines) / before
+        )
+
+        print "Speedup: %.2fx" % (before / after)
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--compare"]
+
+    if args:
+        USERS = int(args[0])
+    run("--compare" in sys.argv)
@@ -0,0 +1,184 @@
+# coding=utf-8
+
+"""
+Benchmark for the memory used by Mumble users' avatars.
+
+Connects 500 users to the Mumble protocol, each with an avatar of 20 to
+200KB, as UserState messages. A lot of people never change their avatar from
+the one their community uses, so half of the users share one of five
+avatars, and the rest have their own. Reports how much memory the protocol
+uses for them:
+
+* **legacy** - the old handler, where each user kept the avatar it was sent
+* **inline** - every avatar is sent along with its user, and only one copy
+  of each is kept, up to the blob store's memory limit
+* **hashes** - only the avatars' hashes are sent, as Murmur does, and no
+  plugin has looked at them yet
+* **fetched** - as above, after a plugin has asked for every user's avatar
+
+Each measurement is made in a process of its own. Run it from the root of
+the repository::
+
+    python profiling/mumble_blobs.py [users]
+"""
+
+__author__ = 'Gareth Coles'
+
+import gc
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+import logbook
+import psutil
+
+from twisted.test.proto_helpers import StringTransport
+
+from system.protocols.mumble import Mumble_pb2
+from system.protocols.mumble import protocol as mumble_protocol
+from system.protocols.mumble.blobs import blob_hash
+from system.protocols.mumble.user import User
+
+USERS = 500
+SHARED = 5
+MODES = ["legacy", "inline", "hashes", "fetched"]
+
+CONFIG = {
+    "identity": {"username": "Ultros", "password": "", "tokens": []},
+    "network": {"address": "127.0.0.1", "port": 64738},
+    "control_chars": "."
+}
+
+
+class LegacyUser(User):
+    """
+    The old user's avatar and comment attributes, kept here for comparison.
+    """
+
+    __slots__ = ("comment", "avatar")
+
+
+def legacy_update_blobs(self, user, message):
+    """
+    What handle_msg_userstate used to do with avatars and comments.
+    """
+
+    if message.HasField("comment_hash"):
+        user.comment_hash = message.comment_hash
+    if message.HasField("comment"):
+        user.comment = message.comment
+    if message.HasField("texture_hash"):
+        user.avatar_hash = message.texture_hash
+    if message.HasField("texture"):
+        user.avatar = message.texture
+
+
+def make_avatars(users):
+    rnd = random.Random(1)
+
+    shared = [os.urandom(rnd.randint(20, 200) * 1024) for _ in xrange(SHARED)]
+    avatars = []
+
+    for i in xrange(users):
+        if i % 2 == 0:
+            avatars.append(rnd.choice(shared))
+        else:
+            avatars.append(os.urandom(rnd.randint(20, 200) * 1024))
+
+    return avatars
+
+
+def frame(message):
+    data = message.SerializeToString()
+    return struct.pack(">HI", mumble_protocol.Protocol.MESSAGE_ID[
+        message.__class__
+    ], len(data)) + data
+
+
+def measure(mode, users, path):
+    logbook.NullHandler().push_application()
+
+    if mode == "legacy":
+        mumble_protocol.User = LegacyUser
+        mumble_protocol.Protocol.update_blobs = legacy_update_blobs
+
+    config = dict(CONFIG, blobs={"path": path})
+
+    protocol = mumble_protocol.Protocol("mumble-bench", None, config)
+    protocol.channels = {}
+    protocol.users = {}
+    protocol.transport = StringTransport()
+    protocol.dataReceived(frame(Mumble_pb2.ChannelState(
+        channel_id=0, name="Root"
+    )))
+
+    # Made up front, so only the protocol's own copies are measured
+    avatars = make_avatars(users)
+
+    start = rss()
+
+    for i, avatar in enumerate(avatars):
+        state = Mumble_pb2.UserState(session=i + 2, name="user%s" % i,
+                                     channel_id=0)
+
+        if mode in ("legacy", "inline"):
+            state.texture = avatar
+        else:
+            state.texture_hash = blob_hash(avatar)
+
+        protocol.dataReceived(frame(state))
+        protocol.transport.clear()
+
+    if mode == "fetched":
+        # Everyone's avatar is asked for, and the server sends them back
+        for user in protocol.users.values():
+            user.avatar  # Sends a RequestBlob
+
+            protocol.transport.clear()
+            protocol.dataReceived(frame(Mumble_pb2.UserState(
+                session=user.session, texture=avatars[user.session - 2]
+            )))
+
+    return (rss() - start) / 1024.0 / 1024.0, protocol.blobs.stats()
+
+
+def rss():
+    gc.collect()
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def run(users):
+    print "%s users, half of them sharing %s avatars" % (users, SHARED)
+    print "%-8s %10s %14s %14s" % ("Mode", "Memory", "Blobs in memory",
+                                   "Spilled")
+
+    for mode in MODES:
+        path = tempfile.mkdtemp(prefix="ultros-blobs-")
+
+        try:
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--measure",
+                 mode, str(users), path]
+            )
+        finally:
+            shutil.rmtree(path)
+
+        memory, blobs, spilled = output.split()
+
+        print "%-8s %8.1fMB %14s %14s" % (mode, float(memory), blobs,
+                                          spilled)
+
+
+if __name__ == "__main__":
+    if "--measure" in sys.argv:
+        args = sys.argv[sys.argv.index("--measure") + 1:]
+        memory, stats = measure(args[0], int(args[1]), args[2])
+        print memory, stats["blobs"], stats["spilled"]
+    else:
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else USERS)
@@ -0,0 +1,216 @@
+# coding=utf-8
+
+"""
+Benchmark for dispatching received Mumble messages.
+
+Replays a busy server's TCP stream into the Mumble protocol, as a recording:
+the server's channels and users when we connect, followed by the traffic of
+a minute on a server with a few dozen people talking - tunnelled voice,
+pings, codec and crypt renegotiation, mute toggles, user stats and context
+actions, and some chat. No plugins are loaded, so nothing listens for the
+protocol's optional events.
+
+This is done with the old dispatch, which logged two trace lines for every
+frame, decoded every message and walked a chain of isinstance checks to
+find its handler, and with the dispatch table, which only decodes (and
+traces) the messages something wants. Reports packets per
+second and how many messages were never decoded.
+
+Pass a Mumble recording - as written by a *Recorder* - to replay that
+instead. Run it from the root of the repository::
+
+    python profiling/mumble_dispatch.py [recording]
+"""
+
+__author__ = 'Gareth Coles'
+
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+import logbook
+
+from twisted.test.proto_helpers import StringTransport
+
+from profiling.replay import scenarios
+from profiling.replay.recording import Recording
+from system.protocols.mumble import Mumble_pb2
+from system.protocols.mumble.protocol import Protocol
+
+SECONDS = 60
+ROUNDS = 3
+
+CONFIG = {
+    "identity": {"username": scenarios.NICK, "password": "", "tokens": []},
+    "network": {"address": "127.0.0.1", "port": 64738},
+    "channel": {"name": scenarios.MUMBLE_CHANNEL, "id": None},
+    "control_chars": "."
+}
+
+
+def make_recording(rnd, seconds):
+    # Connecting, and the occasional chat message
+    recording = scenarios.chat(rate=5, seconds=seconds)["mumble"]
+
+    sessions = range(scenarios.OUR_SESSION + 1,
+                     scenarios.OUR_SESSION + 1 + scenarios.LOCALS)
+
+    for tick in xrange(seconds * 50):
+        offset = tick / 50.0
+
+        # A few people talking at once, in 20ms Opus frames
+        for _ in xrange(3):
+            voice = os.urandom(rnd.randint(40, 160))
+            recording.add(offset, struct.pack(
+                Protocol.PREFIX_FORMAT, 1, len(voice)
+            ) + voice)
+
+        if tick % 50 == 0:
+            recording.add_protobuf(offset, Mumble_pb2.Ping(
+                timestamp=tick, good=tick, late=1, lost=2, tcp_packets=tick,
+                tcp_ping_avg=12.5, tcp_ping_var=1.5
+            ))
+
+        if tick % 250 == 0:
+            recording.add_protobuf(offset, Mumble_pb2.CryptSetup(
+                server_nonce=os.urandom(16)
+            ))
+            recording.add_protobuf(offset, Mumble_pb2.CodecVersion(
+                alpha=-2147483637, beta=0, prefer_alpha=True, opus=True
+            ))
+
+        if tick % 10 == 0:
+            recording.add_protobuf(offset, Mumble_pb2.UserState(
+                session=rnd.choice(sessions), self_mute=rnd.random() < 0.5
+            ))
+
+        if tick % 5 == 0:
+            recording.add_protobuf(offset, Mumble_pb2.UserStats(
+                session=rnd.choice(sessions), tcp_packets=tick,
+                tcp_ping_avg=20.0, onlinesecs=tick, idlesecs=1
+            ))
+
+        if tick % 25 == 0:
+            recording.add_protobuf(offset, Mumble_pb2.ContextActionModify(
+                action="action%s" % (tick % 7), text="Do a thing",
+                context=1
+            ))
+
+    recording.records.sort(key=lambda record: record[0])
+    return recording
+
+
+class LegacyProtocol(Protocol):
+    """
+    The old dataReceived and recvProtobuf dispatch, kept here for
+    comparison. The handlers themselves haven't changed, so they're shared.
+    """
+
+    def dataReceived(self, recv):
+        frames = self.received.feed(recv)
+
+        if frames and self.instrumentation.enabled:
+            self.instrumentation.count(
+                "protocols", (self.name, "packets_in"), len(frames)
+            )
+
+        for msg_type, data in frames:
+            self.log.trace("Length: {}", len(data))
+            self.log.trace("Message type: {}", msg_type)
+
+            if msg_type == 1:
+                self.recv_UDP(data)
+            else:
+                msg = Protocol.ID_MESSAGE[msg_type]()
+                msg.ParseFromString(data)
+
+                try:
+                    self.recvProtobuf(msg_type, msg)
+                except Exception:
+                    self.log.exception("Exception while handling data.")
+
+    def recvProtobuf(self, msg_type, message):
+        if isinstance(message, Mumble_pb2.Version):
+            self.handle_msg_version(message)
+        elif isinstance(message, Mumble_pb2.Reject):
+            self.handle_msg_reject(message)
+        elif isinstance(message, Mumble_pb2.CodecVersion):
+            self.handle_msg_codecversion(message)
+        elif isinstance(message, Mumble_pb2.CryptSetup):
+            self.handle_msg_cryptsetup(message)
+        elif isinstance(message, Mumble_pb2.ChannelState):
+            self.handle_msg_channelstate(message)
+        elif isinstance(message, Mumble_pb2.PermissionQuery):
+            self.handle_msg_permissionquery(message)
+        elif isinstance(message, Mumble_pb2.UserState):
+            self.handle_msg_userstate(message)
+        elif isinstance(message, Mumble_pb2.ServerSync):
+            self.handle_msg_serversync(message)
+        elif isinstance(message, Mumble_pb2.ServerConfig):
+            self.handle_msg_serverconfig(message)
+        elif isinstance(message, Mumble_pb2.Ping):
+            self.handle_msg_ping(message)
+        elif isinstance(message, Mumble_pb2.UserRemove):
+            self.handle_msg_userremove(message)
+        elif isinstance(message, Mumble_pb2.TextMessage):
+            self.handle_msg_textmessage(message)
+        elif isinstance(message, Mumble_pb2.UserStats):
+            self.handle_msg_userstats(message)
+        else:
+            self.handle_msg_unknown(msg_type, message=message)
+
+
+def measure(protocol_class, chunks):
+    best = None
+    protocol = None
+
+    for _ in xrange(ROUNDS):
+        protocol = protocol_class("mumble-bench", None, CONFIG)
+        protocol.channels = {}
+        protocol.users = {}
+        protocol.transport = StringTransport()
+
+        start = time.time()
+
+        for chunk in chunks:
+            protocol.dataReceived(chunk)
+
+        taken = time.time() - start
+
+        if best is None or taken < best:
+            best = taken
+
+    return best, protocol.skipped
+
+
+def run(path=None):
+    logbook.NullHandler().push_application()
+
+    if path:
+        recording = Recording.load(path)
+    else:
+        recording = make_recording(random.Random(1234), SECONDS)
+
+    chunks = [data for _, data in recording.records]
+    packets = len(recording.messages())
+
+    print "%s packets, %s bytes, %.1f seconds of traffic" % (
+        packets, sum(len(chunk) for chunk in chunks), recording.duration
+    )
+
+    before, _ = measure(LegacyProtocol, chunks)
+    after, skipped = measure(Protocol, chunks)
+
+    print "Before: %8.3fs (%10.0f packets/sec)" % (before, packets / before)
+    print "After:  %8.3fs (%10.0f packets/sec)" % (after, packets / after)
+    print "Speedup: %.2fx, %s packets (%.1f%%) never decoded" % (
+        before / after, skipped, skipped * 100.0 / packets
+    )
+
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else None)
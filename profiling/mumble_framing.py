@@ -0,0 +1,160 @@
+# coding=utf-8
+
+"""
+Benchmark for framing the Mumble TCP stream.
+
+Builds a stream of 100,000 frames - mostly UDPTunnel voice packets, mixed
+with TextMessage, UserState and Ping protobuf messages - and feeds it to the
+framer in random chunk sizes, as a busy server's socket would deliver it.
+Each frame's payload is handed to a no-op handler. This is done with the old
+string concatenation and slicing and with the bytearray frame buffer. Run it
+from the root of the repository::
+
+    python profiling/mumble_framing.py [frames]
+"""
+
+__author__ = 'Gareth Coles'
+
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from system.protocols.mumble import Mumble_pb2
+from system.protocols.mumble.framing import FrameBuffer
+from system.protocols.mumble.protocol import Protocol
+
+FRAMES = 100000
+CHUNK_SIZES = [(1, 64), (512, 4096), (16384, 65536), (131072, 524288)]
+
+
+def make_stream(rnd, count):
+    text = Mumble_pb2.TextMessage(message="Hello, world! " * 4)
+    text.channel_id.append(1)
+
+    protobufs = [
+        (Protocol.MESSAGE_ID[Mumble_pb2.TextMessage],
+         text.SerializeToString()),
+        (Protocol.MESSAGE_ID[Mumble_pb2.UserState],
+         Mumble_pb2.UserState(session=12, name="Speaker",
+                              channel_id=1).SerializeToString()),
+        (Protocol.MESSAGE_ID[Mumble_pb2.Ping],
+         Mumble_pb2.Ping(timestamp=123456789).SerializeToString())
+    ]
+
+    frames = []
+
+    for _ in xrange(count):
+        if rnd.random() < 0.9:
+            # Opus voice packet, of a typical size
+            msg_type = 1
+            payload = os.urandom(rnd.randint(40, 160))
+        else:
+            msg_type, payload = rnd.choice(protobufs)
+
+        frames.append(struct.pack(">HI", msg_type, len(payload)) + payload)
+
+    return "".join(frames)
+
+
+def make_chunks(rnd, stream, low, high):
+    chunks = []
+    pos = 0
+
+    while pos < len(stream):
+        size = rnd.randint(low, high)
+        chunks.append(stream[pos:pos + size])
+        pos += size
+
+    return chunks
+
+
+class LegacyFramer(object):
+    """
+    The old dataReceived framing, kept here for comparison.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.received = ""
+
+    def dataReceived(self, recv):
+        self.received = self.received + recv
+
+        while len(self.received) >= Protocol.PREFIX_LENGTH:
+            msg_type, length = \
+                struct.unpack(Protocol.PREFIX_FORMAT,
+                              self.received[:Protocol.PREFIX_LENGTH])
+
+            full_length = Protocol.PREFIX_LENGTH + length
+
+            if msg_type not in Protocol.MESSAGE_ID.values():
+                raise ValueError(msg_type)
+
+            if len(self.received) < full_length:
+                return
+
+            self.handler(msg_type,
+                         self.received[Protocol.PREFIX_LENGTH:
+                                       Protocol.PREFIX_LENGTH + length])
+
+            self.received = self.received[full_length:]
+
+
+class BufferFramer(object):
+    def __init__(self, handler):
+        self.handler = handler
+        self.received = FrameBuffer(Protocol.MESSAGE_TYPES)
+
+    def dataReceived(self, recv):
+        for msg_type, data in self.received.feed(recv):
+            self.handler(msg_type, data)
+
+
+def measure(framer_class, chunks):
+    counter = [0]
+
+    def handler(msg_type, data):
+        counter[0] += 1
+
+    framer = framer_class(handler)
+    start = time.time()
+
+    for chunk in chunks:
+        framer.dataReceived(chunk)
+
+    taken = time.time() - start
+    assert counter[0] == FRAMES
+
+    return taken
+
+
+def run():
+    rnd = random.Random(1234)
+    stream = make_stream(rnd, FRAMES)
+
+    print "%s frames, %s bytes" % (FRAMES, len(stream))
+
+    for low, high in CHUNK_SIZES:
+        chunks = make_chunks(rnd, stream, low, high)
+
+        before = measure(LegacyFramer, chunks)
+        after = measure(BufferFramer, chunks)
+
+        print "Chunks of %s-%s bytes (%s chunks)" % (low, high, len(chunks))
+        print "    Before: %8.3fs (%10.0f frames/sec)" % (
+            before, FRAMES / before
+        )
+        print "    After:  %8.3fs (%10.0f frames/sec)" % (
+            after, FRAMES / after
+        )
+        print "    Speedup: %.2fx" % (before / after)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        FRAMES = int(sys.argv[1])
+    run()
@@ -0,0 +1,224 @@
+# coding=utf-8
+
+"""
+Benchmark for polling Mumble users for their stats.
+
+Simulates ten minutes on a server with 400 users, a quarter of whom are
+active, with a plugin listening for their stats. This is done with the old
+polling, which asked for every user's stats at once every
+userstats_request_rate seconds, and with the staggered, adaptive poller.
+Reports the most requests sent in any one second, and how many were sent in
+total.
+
+It also applies a typical UserStats reply to a user over and over, with the
+old chain of HasField checks and with the field map, and reports replies
+handled per second. Run it from the root of the repository::
+
+    python profiling/mumble_userstats.py [users]
+"""
+
+__author__ = 'Gareth Coles'
+
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from twisted.internet import task
+
+from system.protocols.mumble import Mumble_pb2
+from system.protocols.mumble.structs import Version
+from system.protocols.mumble.user import User
+from system.protocols.mumble.userstats import UserStatsPoller, \
+    apply_userstats
+from utils.misc import AttrDict
+
+USERS = 400
+SECONDS = 600
+RATE = 60
+REPLIES = 50000
+ROUNDS = 5
+
+
+class FakeProtocol(object):
+    def __init__(self, count):
+        self.users = {}
+
+        for session in xrange(2, count + 2):
+            user = User(None, session, u"user%s" % session, None, False,
+                        False, False, False, False, False, False)
+            user.idle_time = 60 if session % 4 == 0 else 3600
+            self.users[session] = user
+
+        self.event_manager = AttrDict(has_callback=lambda name: True)
+        self.requested = 0
+
+    def request_userstats(self, user, stats_only=False):
+        self.requested += 1
+
+
+def legacy_polling(protocol, clock):
+    """
+    What userstats_request_handler used to do, kept here for comparison.
+    """
+
+    def handler():
+        for user in protocol.users.itervalues():
+            protocol.request_userstats(user, True)
+
+    loop = task.LoopingCall(handler)
+    loop.clock = clock
+    loop.start(RATE, False)
+
+    return loop
+
+
+def new_polling(protocol, clock):
+    poller = UserStatsPoller(protocol, rate=RATE, idle_rate=RATE * 5,
+                             clock=clock)
+    poller.start()
+
+    return poller
+
+
+def measure_polling(start, users):
+    protocol = FakeProtocol(users)
+    clock = task.Clock()
+    poller = start(protocol, clock)
+
+    peak = 0
+
+    for _ in xrange(SECONDS):
+        before = protocol.requested
+        clock.advance(1)
+        peak = max(peak, protocol.requested - before)
+
+    poller.stop()
+    return peak, protocol.requested
+
+
+def legacy_apply(user, message):
+    """
+    What handle_msg_userstats used to do, kept here for comparison.
+    """
+
+    if len(message.certificates):
+        user.certificates = list(message.certificates)
+    if message.HasField("version"):
+        user.version = Version(
+            message.version.version,
+            message.version.release,
+            message.version.os,
+            message.version.os_version
+        )
+    if len(message.celt_versions):
+        user.celt_versions = list(message.celt_versions)
+    if message.HasField("address"):
+        user.address = message.address
+    if message.HasField("strong_certificate"):
+        user.strong_certificate = message.strong_certificate
+    if message.HasField("opus"):
+        user.opus = message.opus
+
+    if message.HasField("from_client"):
+        stats = user.packet_stats_from_client
+        if message.from_client.HasField("good"):
+            stats.good = message.from_client.good
+        if message.from_client.HasField("late"):
+            stats.late = message.from_client.late
+        if message.from_client.HasField("lost"):
+            stats.lost = message.from_client.lost
+        if message.from_client.HasField("resync"):
+            stats.resync = message.from_client.resync
+
+    if message.HasField("from_server"):
+        stats = user.packet_stats_from_server
+        if message.from_server.HasField("good"):
+            stats.good = message.from_server.good
+        if message.from_server.HasField("late"):
+            stats.late = message.from_server.late
+        if message.from_server.HasField("lost"):
+            stats.lost = message.from_server.lost
+        if message.from_server.HasField("resync"):
+            stats.resync = message.from_server.resync
+
+    if message.HasField("udp_packets"):
+        user.udp_packets_sent = message.udp_packets
+    if message.HasField("tcp_packets"):
+        user.tcp_packets_sent = message.tcp_packets
+
+    if message.HasField("udp_ping_avg"):
+        user.udp_ping_avg = message.udp_ping_avg
+    if message.HasField("udp_ping_var"):
+        user.udp_ping_var = message.udp_ping_var
+    if message.HasField("tcp_ping_avg"):
+        user.tcp_ping_avg = message.tcp_ping_avg
+    if message.HasField("tcp_ping_var"):
+        user.tcp_ping_var = message.tcp_ping_var
+
+    if message.HasField("onlinesecs"):
+        user.online_time = message.onlinesecs
+    if message.HasField("idlesecs"):
+        user.idle_time = message.idlesecs
+
+
+def make_reply():
+    # What Murmur sends for a stats_only request
+    message = Mumble_pb2.UserStats(
+        session=2, udp_packets=12000, tcp_packets=300, udp_ping_avg=30.5,
+        udp_ping_var=2.25, tcp_ping_avg=32.0, tcp_ping_var=3.5,
+        bandwidth=72000, onlinesecs=3600, idlesecs=60
+    )
+
+    for stats in (message.from_client, message.from_server):
+        stats.good = 12000
+        stats.late = 3
+        stats.lost = 7
+        stats.resync = 0
+
+    return message
+
+
+def measure_apply(apply):
+    user = User(None, 2, u"user", None, False, False, False, False, False,
+                False, False)
+    message = make_reply()
+    best = None
+
+    for _ in xrange(ROUNDS):
+        start = time.time()
+
+        for _ in xrange(REPLIES):
+            apply(user, message)
+
+        taken = time.time() - start
+
+        if best is None or taken < best:
+            best = taken
+
+    return REPLIES / best
+
+
+def run(users):
+    print "%s users, %s seconds, polled every %s seconds" % (
+        users, SECONDS, RATE
+    )
+
+    for name, start in (("Before", legacy_polling), ("After", new_polling)):
+        peak, total = measure_polling(start, users)
+        print "%-7s %5s requests in the busiest second, %6s in total" % (
+            name + ":", peak, total
+        )
+
+    before = measure_apply(legacy_apply)
+    after = measure_apply(apply_userstats)
+
+    print "Applying replies:"
+    print "    Before: %10.0f replies/sec" % before
+    print "    After:  %10.0f replies/sec" % after
+    print "    Speedup: %.2fx" % (after / before)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else USERS)
@@ -0,0 +1,204 @@
+# coding=utf-8
+
+"""
+Benchmark for the auth plugin's permissions handler.
+
+Builds a permissions file with 500 users and 50 groups (with inheritance,
+wildcard, regex and deny nodes) and measures permission checks per second,
+with and without the compiled matcher cache. Run it from the root of the
+repository::
+
+    python profiling/permissions.py
+"""
+
+__author__ = 'Gareth Coles'
+
+import fnmatch
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from plugins.auth.permissions_handler import permissionsHandler
+from system.logging.logger import getLogger
+from system.storage.data import MemoryData
+from utils.misc import AttrDict, str_to_regex_flags as s2rf
+
+USERS = 500
+GROUPS = 50
+CHECKS = 20000
+
+PROTOCOLS = ["esper", "mumble"]
+SOURCES = ["#ultros", "#bots", "#chat", "root"]
+PERMISSIONS = [
+    "urls.trigger", "urls.shorten", "factoids.get.foo", "factoids.set.foo",
+    "bridge.relay", "auth.login", "control.join", "pages.page",
+    "management.plugins", "dialectizer.set"
+]
+
+
+class FakePlugin(object):
+    def __init__(self):
+        self.logger = getLogger("Permissions")
+        self.logger.setLevel(logging.CRITICAL)
+        self.config = {"use-superuser": True}
+        self.factory_manager = AttrDict(get_protocol=lambda name: None)
+
+
+def legacy_compare_permissions(perm, permissions):
+    """
+    The pre-compilation compare_permissions, kept here for comparison.
+    """
+
+    pattern = permissionsHandler.pattern
+    perm = perm.lower()
+
+    grant = []
+    deny = []
+    for element in permissions:
+        if element.startswith("^"):
+            deny.append(element[1:])
+        else:
+            grant.append(element)
+
+    for element in deny:
+        result = pattern.match(element)
+
+        if result:
+            _pattern, flags = result.groups()
+            if re.match(_pattern, perm, s2rf(flags)):
+                return False
+        elif fnmatch.fnmatch(perm, element.lower()):
+            return False
+
+    for element in grant:
+        result = pattern.match(element)
+
+        if result:
+            _pattern, flags = result.groups()
+            if re.match(_pattern, perm, s2rf(flags)):
+                return True
+        elif fnmatch.fnmatch(perm, element.lower()):
+            return True
+
+    return False
+
+
+class LegacyMatcher(object):
+    def __init__(self, permissions):
+        self.permissions = permissions
+
+    def match(self, perm):
+        return legacy_compare_permissions(perm, self.permissions)
+
+
+class LegacyHandler(permissionsHandler):
+    """
+    Rebuilds and re-matches the effective permissions on every check, as the
+    handler used to.
+    """
+
+    def _get_matcher(self, key, builder):
+        return LegacyMatcher(builder())
+
+
+def random_nodes(rnd, count):
+    nodes = []
+
+    for _ in xrange(count):
+        kind = rnd.random()
+        perm = rnd.choice(PERMISSIONS)
+
+        if kind < 0.5:
+            nodes.append(perm)
+        elif kind < 0.75:
+            nodes.append(perm.split(".")[0] + ".*")
+        elif kind < 0.85:
+            nodes.append("^" + perm)
+        elif kind < 0.95:
+            nodes.append("/%s\\..*/i" % perm.split(".")[0])
+        else:
+            nodes.append(perm[:-1] + "?")
+
+    return nodes
+
+
+def build_data(rnd):
+    groups = {}
+    users = {}
+
+    for i in xrange(GROUPS):
+        group = {
+            "permissions": random_nodes(rnd, 5),
+            "options": {},
+            "protocols": {}
+        }
+
+        for protocol in PROTOCOLS:
+            group["protocols"][protocol] = {
+                "permissions": random_nodes(rnd, 3),
+                "sources": dict(
+                    (source, random_nodes(rnd, 2)) for source in SOURCES
+                )
+            }
+
+        if i:
+            group["inherit"] = "group-%s" % rnd.randrange(0, i)
+
+        groups["group-%s" % i] = group
+
+    groups["default"] = {
+        "permissions": ["auth.login", "urls.trigger"],
+        "options": {}
+    }
+
+    for i in xrange(USERS):
+        users["user-%s" % i] = {
+            "group": "group-%s" % rnd.randrange(0, GROUPS),
+            "permissions": random_nodes(rnd, 3),
+            "options": {"superadmin": False},
+            "protocols": {}
+        }
+
+    return {"groups": groups, "users": users}
+
+
+def measure(handler_class, data, checks):
+    handler = handler_class(FakePlugin(), data)
+
+    for user, permission, protocol, source in checks:  # Warm up
+        handler.check(permission, user, source, protocol)
+
+    start = time.time()
+
+    for user, permission, protocol, source in checks:
+        handler.check(permission, user, source, protocol)
+
+    return len(checks) / (time.time() - start)
+
+
+def run():
+    rnd = random.Random(1234)
+    data = MemoryData("permissions-benchmark", build_data(rnd))
+
+    checks = [
+        ("user-%s" % rnd.randrange(0, USERS), rnd.choice(PERMISSIONS),
+         rnd.choice(PROTOCOLS), rnd.choice(SOURCES))
+        for _ in xrange(CHECKS)
+    ]
+
+    before = measure(LegacyHandler, data, checks)
+    after = measure(permissionsHandler, data, checks)
+
+    print "%s users, %s groups, %s checks" % (USERS, GROUPS, CHECKS)
+    print "Before: %10.0f checks/sec" % before
+    print "After:  %10.0f checks/sec" % after
+    print "Speedup: %.2fx" % (after / before)
+
+
+if __name__ == "__main__":
+    run()
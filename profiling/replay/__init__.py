@@ -0,0 +1,22 @@
+# coding=utf-8
+
+"""
+Replayable protocol traffic, for load-testing the bot without a live server.
+
+Traffic is stored as a *Recording* - the raw bytes a protocol received, with
+the time each chunk arrived. Recordings can be made from a live connection
+with a *Recorder*, generated from the canned scenarios in
+`profiling.replay.scenarios`, and saved to and loaded from files.
+
+A *Harness* sets up the bot with the real plugin set - Auth, Bridge,
+Factoids and URLs, with the URLs plugin pointed at a stub HTTP server - in a
+scratch directory, connects IRC and Mumble protocols to in-memory transports
+and replays recordings into them, one message at a time. It reports messages
+per second, median and 99th percentile handling latency, and peak RSS.
+
+Run it from the root of the repository::
+
+    python profiling/replay_traffic.py --help
+"""
+
+__author__ = 'Gareth Coles'
@@ -0,0 +1,505 @@
+# coding=utf-8
+
+"""
+Runs the bot against recorded traffic.
+
+The *Harness* sets the bot up in a scratch directory, as it would be set up
+by a fresh install: configuration is copied from the examples in `config/`,
+and the Auth, Bridge, Factoids and URLs plugins are loaded by the plugin
+manager as normal. Protocols are connected to Twisted's in-memory
+`StringTransport`, so nothing goes over the network except for the URLs
+plugin's requests. Those go to a stub HTTP server on the loopback interface,
+which the plugin is configured to use as its proxy - it won't fetch titles
+from loopback addresses directly.
+"""
+
+__author__ = 'Gareth Coles'
+
+import BaseHTTPServer
+import os
+import resource
+import shutil
+import SocketServer
+import sqlite3
+import tempfile
+import threading
+import time
+import yaml
+
+import logbook
+
+from twisted.internet import defer, error, reactor, task
+from twisted.python import failure
+from twisted.test.proto_helpers import StringTransport
+
+from profiling.replay import scenarios
+from system.factory_manager import FactoryManager
+from system.storage.formats import YAML
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+PLUGINS = ["Auth", "Bridge", "Factoids", "URLs"]
+
+#: How many messages to handle between giving the reactor a turn, when
+#: replaying as fast as possible
+BATCH = 100
+
+PAGE = ("<!DOCTYPE html><html><head><title>Page %s</title></head>"
+        "<body>%s</body></html>")
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Send each response in one go, like a real server would - otherwise
+    # kept-alive connections stall on delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = PAGE % (self.path, "Lorem ipsum dolor sit amet. " * 100)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ErrorCounter(logbook.Handler):
+    """
+    Swallows log records, keeping the errors so they can be reported.
+    """
+
+    def __init__(self):
+        super(ErrorCounter, self).__init__(level=logbook.ERROR)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class ReplayFactory(object):
+    """
+    Stands in for a protocol's factory, which would normally connect it.
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.protocol = None
+
+    def clientConnected(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+def percentile(values, fraction):
+    """
+    :param values: Sorted list of values
+    :param fraction: Which percentile, between 0 and 1
+    """
+
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def peak_rss():
+    """
+    :return: Peak resident set size of this process, in megabytes
+    """
+
+    # Linux reports this in kilobytes, and OS X in bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if os.uname()[0] == "Darwin":
+        return rss / 1048576.0
+    return rss / 1024.0
+
+
+class Results(object):
+    """
+    What happened during a replay.
+    """
+
+    def __init__(self, latencies, taken, drained, output, errors):
+        self.latencies = sorted(latencies)
+        self.taken = taken
+        self.drained = drained
+        self.output = output
+        self.errors = errors
+        self.peak_rss = peak_rss()
+
+    @property
+    def messages(self):
+        return len(self.latencies)
+
+    @property
+    def rate(self):
+        return self.messages / self.taken if self.taken else 0.0
+
+    def report(self):
+        lines = [
+            "Messages:     %10s" % self.messages,
+            "Throughput:   %10.0f msg/sec" % self.rate,
+            "Latency p50:  %10.3f ms" % (
+                percentile(self.latencies, 0.5) * 1000
+            ),
+            "Latency p99:  %10.3f ms" % (
+                percentile(self.latencies, 0.99) * 1000
+            ),
+            "Latency max:  %10.3f ms" % (
+                percentile(self.latencies, 1.0) * 1000
+            ),
+            "Replay time:  %10.2f s" % self.taken,
+            "Drain time:   %10.2f s" % self.drained,
+            "Peak RSS:     %10.1f MB" % self.peak_rss
+        ]
+
+        for name, size in sorted(self.output.iteritems()):
+            lines.append("Sent (%s): %*s bytes" % (name, 16 - len(name), size))
+
+        lines.append("Errors:       %10s" % len(self.errors))
+
+        for record in self.errors[:5]:
+            lines.append("    %s: %s" % (record.channel, record.message))
+
+        return "\n".join(lines)
+
+
+class Harness(object):
+    """
+    The bot, with the real plugin set, connected to in-memory transports.
+    """
+
+    def __init__(self, workdir=None):
+        """
+        :param workdir: Directory to run the bot in - a temporary directory
+            is created and removed afterwards if this isn't given
+        """
+
+        self.workdir = workdir
+        self.own_workdir = workdir is None
+
+        self.http_server = None
+        self.manager = None
+        self.protocols = {}
+        self.transports = {}
+        self.errors = ErrorCounter()
+        self.old_cwd = None
+
+    @property
+    def http_root(self):
+        return "http://127.0.0.1:%s" % self.http_server.server_address[1]
+
+    def start_http(self):
+        self.http_server = StubServer(("127.0.0.1", 0), StubHandler)
+
+        thread = threading.Thread(target=self.http_server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @defer.inlineCallbacks
+    def setup(self):
+        """
+        Set everything up. This should be called once the reactor is
+        running.
+        """
+
+        # The logger would otherwise write everything to stderr
+        logbook.NullHandler().push_application()
+        self.errors.push_application()
+
+        self.start_http()
+        self._make_workdir()
+
+        manager = self.manager = FactoryManager()
+        manager.main_config = manager.storage.get_file(
+            manager, "config", YAML, "settings.yml"
+        )
+        manager.commands.set_factory_manager(manager)
+
+        manager.plugman.path = os.path.join(ROOT, "plugins")
+        manager.plugman.scan(output=False)
+
+        yield manager.plugman.load_plugins(PLUGINS, output=False)
+
+        for name in PLUGINS:
+            if not manager.plugman.plugin_loaded(name):
+                raise RuntimeError("Plugin failed to load: %s" % name)
+
+        auth = manager.plugman.get_plugin("Auth")
+
+        for username, password in scenarios.ACCOUNTS.iteritems():
+            yield auth.auth_h.create_user_async(username, password)
+
+        self._connect("irc", "system.protocols.irc.protocol",
+                      self._irc_config())
+        self._connect("mumble", "system.protocols.mumble.protocol",
+                      self._mumble_config())
+
+    def _make_workdir(self):
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp(prefix="ultros-replay-")
+
+        for path in ("config/plugins", "data/plugins", "logs"):
+            path = os.path.join(self.workdir, path)
+
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+        settings = self._example("settings.yml")
+        settings["plugins"] = PLUGINS
+        settings["protocols"] = ["irc", "mumble"]
+        settings["metrics"] = "off"
+        self._write("settings.yml", settings)
+
+        for name in ("auth", "factoids"):
+            path = "plugins/%s.yml" % name
+            self._write(path, self._example(path))
+
+        urls = self._example("plugins/urls.yml")
+        urls["proxies"]["global"] = {"http": self.http_root}
+        self._write("plugins/urls.yml", urls)
+
+        self._write("plugins/bridge.yml", {"rules": self._bridge_rules()})
+
+        self._seed_factoids(
+            os.path.join(self.workdir, "data/plugins/factoids.sqlite")
+        )
+
+        # Plugins and the storage manager use paths relative to the
+        # working directory
+        self.old_cwd = os.getcwd()
+        os.chdir(self.workdir)
+
+    def _example(self, path):
+        with open(os.path.join(ROOT, "config", path + ".example")) as fh:
+            return yaml.safe_load(fh)
+
+    def _write(self, path, data):
+        with open(os.path.join(self.workdir, "config", path), "w") as fh:
+            yaml.safe_dump(data, fh, default_flow_style=False)
+
+    def _bridge_rules(self):
+        formatting = {
+            "general": {
+                "message": "<{USER}> {MESSAGE}",
+                "join": "* {USER} joined {CHANNEL}",
+                "part": "* {USER} left {CHANNEL}",
+                "action": "* {USER} {MESSAGE}"
+            },
+            "irc": {"disconnect": "* {USER} disconnected ({MESSAGE})"},
+            "mumble": {"connect": "* {USER} connected"}
+        }
+
+        return {
+            "irc-to-mumble": {
+                "from": {"protocol": "irc", "source": scenarios.CHANNEL,
+                         "source-type": "channel"},
+                "to": {"protocol": "mumble",
+                       "target": scenarios.MUMBLE_CHANNEL,
+                       "target-type": "channel"},
+                "formatting": formatting
+            },
+            "mumble-to-irc": {
+                "from": {"protocol": "mumble",
+                         "source": scenarios.MUMBLE_CHANNEL,
+                         "source-type": "channel"},
+                "to": {"protocol": "irc", "target": scenarios.CHANNEL,
+                       "target-type": "channel"},
+                "formatting": formatting
+            }
+        }
+
+    def _seed_factoids(self, path):
+        conn = sqlite3.connect(path)
+
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS factoids ("
+                         "factoid_key TEXT, "
+                         "location TEXT, "
+                         "protocol TEXT, "
+                         "channel TEXT, "
+                         "factoid_name TEXT, "
+                         "info TEXT, "
+                         "UNIQUE(factoid_key, location, protocol, channel) "
+                         "ON CONFLICT REPLACE)")
+
+            for name, info in scenarios.FACTOIDS.iteritems():
+                conn.execute(
+                    "INSERT INTO factoids VALUES(?, 'global', '', '', ?, ?)",
+                    (name, name, info)
+                )
+
+        conn.close()
+
+    def _irc_config(self):
+        config = self._example("protocols/irc-esper.yml")
+
+        config["identity"]["nick"] = scenarios.NICK
+        config["channels"] = [{"name": scenarios.CHANNEL, "key": None}]
+        config["perform"] = []
+
+        # We're measuring how fast we handle lines, not how fast the server
+        # would let us send them
+        config["rate_limiting"]["enabled"] = False
+
+        return config
+
+    def _mumble_config(self):
+        config = self._example("protocols/mumble.yml")
+
+        config["identity"]["username"] = scenarios.NICK
+        config["channel"] = {"name": scenarios.MUMBLE_CHANNEL, "id": None}
+
+        return config
+
+    def _connect(self, name, module, config):
+        module = __import__(module, fromlist=["Protocol"])
+
+        factory = ReplayFactory(name, config)
+        protocol = factory.protocol = module.Protocol(name, factory, config)
+        transport = StringTransport()
+
+        self.manager.factories[name] = factory
+        self.protocols[name] = protocol
+        self.transports[name] = transport
+
+        protocol.makeConnection(transport)
+
+    @defer.inlineCallbacks
+    def replay(self, recordings, paced=False):
+        """
+        Replay recorded traffic into the protocols.
+
+        Messages from every recording are handled in the order they were
+        received. By default, they're handled as fast as possible, and the
+        latency of each message is how long it took to handle. When paced,
+        each message is handled when it was received, relative to the start
+        of the replay, and its latency also includes any time it spent
+        waiting for earlier messages to be handled.
+
+        :param recordings: Dict of protocol name to Recording
+        :param paced: Whether to replay at the recorded rate
+
+        :return: Deferred that fires with a Results object once everything's
+            been handled, including any work the plugins left running
+        """
+
+        messages = []
+
+        for name, recording in recordings.iteritems():
+            protocol = self.protocols[name]
+            messages.extend(
+                (offset, protocol, data)
+                for offset, data in recording.messages()
+            )
+
+        messages.sort(key=lambda message: message[0])
+
+        for transport in self.transports.itervalues():
+            transport.clear()
+
+        del self.errors.records[:]
+
+        latencies = []
+        clock = time.time
+        start = clock()
+
+        for i, (offset, protocol, data) in enumerate(messages):
+            if paced:
+                due = start + offset
+                now = clock()
+
+                if due > now:
+                    yield task.deferLater(reactor, due - now, lambda: None)
+            else:
+                if i and not i % BATCH:
+                    # Let the reactor deliver results from threads and
+                    # worker processes, as it would between reads
+                    yield task.deferLater(reactor, 0, lambda: None)
+
+                due = clock()
+
+            protocol.dataReceived(data)
+            latencies.append(clock() - due)
+
+        taken = clock() - start
+
+        drain_start = clock()
+        yield self.drain()
+        drained = clock() - drain_start
+
+        output = dict(
+            (name, len(transport.value()))
+            for name, transport in self.transports.iteritems()
+        )
+
+        defer.returnValue(Results(
+            latencies, taken, drained, output, list(self.errors.records)
+        ))
+
+    @defer.inlineCallbacks
+    def drain(self, timeout=60):
+        """
+        Wait for the plugins to finish what they're doing - URL titles,
+        factoid lookups and password checks.
+
+        :return: Deferred that fires when nothing's been sent for a while and
+            no HTTP requests are running, or after the timeout
+        """
+
+        urls = self.manager.plugman.get_plugin("URLs")
+        deadline = time.time() + timeout
+
+        last = None
+        quiet = 0
+
+        while quiet < 5 and time.time() < deadline:
+            yield task.deferLater(reactor, 0.1, lambda: None)
+
+            stats = urls.http_pool.stats()
+            sizes = [len(t.value()) for t in self.transports.itervalues()]
+
+            if stats["in_flight"] or stats["pending"] or sizes != last:
+                quiet = 0
+            else:
+                quiet += 1
+
+            last = sizes
+
+    @defer.inlineCallbacks
+    def close(self):
+        """
+        Disconnect the protocols, unload the plugins and clean up.
+        """
+
+        for name, protocol in self.protocols.iteritems():
+            protocol.connectionLost(failure.Failure(error.ConnectionDone()))
+            del self.manager.factories[name]
+
+        if self.manager is not None:
+            yield self.manager.plugman.unload_plugins(output=False)
+
+        if self.http_server is not None:
+            self.http_server.shutdown()
+
+        if self.old_cwd is not None:
+            os.chdir(self.old_cwd)
+
+        if self.own_workdir and self.workdir is not None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+        self.errors.pop_application()
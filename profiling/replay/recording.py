@@ -0,0 +1,220 @@
+# coding=utf-8
+
+"""
+Recording and storing raw protocol traffic.
+
+A recording file starts with a header line naming the kind of protocol the
+traffic is for, followed by one record per chunk of received data::
+
+    ULTROS-REPLAY 1 <kind>\\n
+    <offset: double><length: uint32><data>
+    ...
+
+Offsets are in seconds since the start of the recording, and everything is
+big-endian.
+"""
+
+__author__ = 'Gareth Coles'
+
+import struct
+import time
+
+from system.protocols.mumble.protocol import Protocol as MumbleProtocol
+
+MAGIC = "ULTROS-REPLAY"
+VERSION = 1
+
+RECORD = struct.Struct(">dI")
+
+KINDS = ("irc", "mumble")
+
+
+class Recording(object):
+    """
+    Raw traffic received by one protocol.
+    """
+
+    def __init__(self, kind, records=None):
+        """
+        :param kind: The kind of protocol - "irc" or "mumble"
+        :param records: List of (offset, data) tuples
+        """
+
+        if kind not in KINDS:
+            raise ValueError("Unknown kind of protocol: %s" % kind)
+
+        self.kind = kind
+        self.records = records or []
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def duration(self):
+        if not self.records:
+            return 0.0
+        return self.records[-1][0]
+
+    def add(self, offset, data):
+        """
+        Add a chunk of received data.
+
+        :param offset: When it was received, in seconds since the start
+        :param data: The raw data
+        """
+
+        self.records.append((offset, data))
+
+    def add_line(self, offset, line):
+        """
+        Add an IRC line, without its line ending.
+        """
+
+        self.add(offset, line + "\r\n")
+
+    def add_protobuf(self, offset, message):
+        """
+        Add a framed Mumble protobuf message.
+        """
+
+        data = message.SerializeToString()
+
+        self.add(offset, struct.pack(
+            MumbleProtocol.PREFIX_FORMAT,
+            MumbleProtocol.MESSAGE_ID[message.__class__],
+            len(data)
+        ) + data)
+
+    def messages(self):
+        """
+        Split the recorded data into whole messages - lines for IRC, and
+        frames for Mumble - no matter how it was chunked when it was
+        received.
+
+        :return: List of (offset, data) tuples, with one message in each
+        :rtype: list
+        """
+
+        if self.kind == "irc":
+            return self._split_lines()
+        return self._split_frames()
+
+    def _split_lines(self):
+        messages = []
+        buf = ""
+
+        for offset, data in self.records:
+            buf += data
+            lines = buf.split("\n")
+            buf = lines.pop()
+
+            for line in lines:
+                messages.append((offset, line + "\n"))
+
+        return messages
+
+    def _split_frames(self):
+        messages = []
+        buf = ""
+        prefix = MumbleProtocol.PREFIX_LENGTH
+
+        for offset, data in self.records:
+            buf += data
+            pos = 0
+
+            while len(buf) - pos >= prefix:
+                _msg_type, length = struct.unpack(
+                    MumbleProtocol.PREFIX_FORMAT, buf[pos:pos + prefix]
+                )
+
+                end = pos + prefix + length
+
+                if end > len(buf):
+                    break
+
+                messages.append((offset, buf[pos:end]))
+                pos = end
+
+            buf = buf[pos:]
+
+        return messages
+
+    def save(self, path):
+        """
+        Write the recording to a file.
+        """
+
+        with open(path, "wb") as fh:
+            fh.write("%s %s %s\n" % (MAGIC, VERSION, self.kind))
+
+            for offset, data in self.records:
+                fh.write(RECORD.pack(offset, len(data)))
+                fh.write(data)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a recording from a file.
+
+        :rtype: Recording
+        """
+
+        with open(path, "rb") as fh:
+            header = fh.readline().split()
+
+            if len(header) != 3 or header[0] != MAGIC:
+                raise ValueError("Not a recording: %s" % path)
+
+            if int(header[1]) != VERSION:
+                raise ValueError(
+                    "Unsupported recording version: %s" % header[1]
+                )
+
+            recording = cls(header[2])
+            data = fh.read()
+
+        pos = 0
+
+        while pos < len(data):
+            offset, length = RECORD.unpack_from(data, pos)
+            pos += RECORD.size
+
+            recording.add(offset, data[pos:pos + length])
+            pos += length
+
+        return recording
+
+
+class Recorder(object):
+    """
+    Records the traffic a live protocol receives.
+
+    This wraps the protocol's *dataReceived*, so it can be attached to a
+    running bot - from the Debug plugin's shell, for example::
+
+        recorder = Recorder(protocol)
+        recorder.start()
+        ...
+        recorder.stop()
+        recorder.recording.save("irc-esper.replay")
+    """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.recording = Recording(protocol.TYPE)
+        self.started = None
+
+    def start(self):
+        original = self.protocol.dataReceived
+        self.started = time.time()
+
+        def dataReceived(data):
+            self.recording.add(time.time() - self.started, data)
+            return original(data)
+
+        # Shadow the class's method on this instance only
+        self.protocol.dataReceived = dataReceived
+
+    def stop(self):
+        if "dataReceived" in self.protocol.__dict__:
+            del self.protocol.dataReceived
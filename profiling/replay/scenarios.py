@@ -0,0 +1,262 @@
+# coding=utf-8
+
+"""
+Canned traffic scenarios.
+
+Each scenario returns a dict of protocol name to *Recording*, and every
+recording starts by connecting: the IRC server welcomes us and we join
+*CHANNEL* with *LOCALS* users already in it, and the Mumble server sends its
+channels and users. The Bridge plugin relays between *CHANNEL* and the
+*MUMBLE_CHANNEL* channel.
+
+Links point at addresses from TEST-NET-3, which are never routed; the
+harness has the URLs plugin fetch them through the stub HTTP server, as a
+proxy.
+"""
+
+__author__ = 'Gareth Coles'
+
+import random
+
+from system.protocols.mumble import Mumble_pb2
+
+from profiling.replay.recording import Recording
+
+NICK = "Ultros"
+CHANNEL = "#chat"
+MUMBLE_CHANNEL = "Chat"
+
+#: How many users are already in each channel when we connect
+LOCALS = 50
+
+#: Session of our own Mumble user
+OUR_SESSION = 1
+
+#: Global factoids that scenarios ask for
+FACTOIDS = {
+    "hello": "Hello there, {sender}!",
+    "rules": "1. Be nice\n2. No spam\n3. Have fun"
+}
+
+#: Hosts that links point at
+LINK_HOSTS = ["203.0.113.%s" % i for i in xrange(1, 5)]
+
+#: Users that can log in, and their passwords
+ACCOUNTS = dict(("account%s" % i, "password%s" % i) for i in xrange(10))
+
+
+def _irc_user(i):
+    return "user%s!~u%s@host-%s.example.com" % (i, i, i % 300)
+
+
+def _irc_connect(rec):
+    rec.add_line(0, ":irc.server 001 %s :Welcome to the replay network" % NICK)
+    rec.add_line(0, ":irc.server 005 %s PREFIX=(ov)@+ CHANTYPES=# "
+                    "NETWORK=Replay :are supported by this server" % NICK)
+    rec.add_line(0, ":%s!bot@ultros.io JOIN :%s" % (NICK, CHANNEL))
+
+    nicks = ["user%s" % i for i in xrange(LOCALS)]
+
+    for i in xrange(0, LOCALS, 50):
+        rec.add_line(0, ":irc.server 353 %s = %s :%s" % (
+            NICK, CHANNEL, " ".join(nicks[i:i + 50])
+        ))
+
+    rec.add_line(0, ":irc.server 366 %s %s :End of /NAMES list." % (
+        NICK, CHANNEL
+    ))
+
+    for i in xrange(LOCALS):
+        rec.add_line(0, ":irc.server 352 %s %s ~u%s host-%s.example.com "
+                        "irc.server user%s H :0 Real Name" % (
+                            NICK, CHANNEL, i, i % 300, i
+                        ))
+
+    rec.add_line(0, ":irc.server 315 %s %s :End of /WHO list." % (
+        NICK, CHANNEL
+    ))
+
+
+def _mumble_user(rec, offset, session):
+    rec.add_protobuf(offset, Mumble_pb2.UserState(
+        session=session, name="mumbler%s" % session, channel_id=1
+    ))
+
+
+def _mumble_connect(rec):
+    rec.add_protobuf(0, Mumble_pb2.Version(
+        version=(1 << 16) | (2 << 8) | 4, release="1.2.4"
+    ))
+    rec.add_protobuf(0, Mumble_pb2.ChannelState(
+        channel_id=0, name="Root", position=0
+    ))
+    rec.add_protobuf(0, Mumble_pb2.ChannelState(
+        channel_id=1, parent=0, name=MUMBLE_CHANNEL, position=0
+    ))
+
+    for session in xrange(OUR_SESSION + 1, OUR_SESSION + 1 + LOCALS):
+        _mumble_user(rec, 0, session)
+
+    rec.add_protobuf(0, Mumble_pb2.UserState(
+        session=OUR_SESSION, name=NICK, channel_id=0
+    ))
+    rec.add_protobuf(0, Mumble_pb2.ServerSync(
+        session=OUR_SESSION, max_bandwidth=72000,
+        welcome_text="Welcome to the replay server", permissions=0xf07ff
+    ))
+
+    # The server confirms our move into the configured channel
+    rec.add_protobuf(0, Mumble_pb2.UserState(
+        session=OUR_SESSION, actor=OUR_SESSION, channel_id=1
+    ))
+
+
+def _mumble_text(rec, offset, session, message, private=False):
+    text = Mumble_pb2.TextMessage(actor=session, message=message)
+
+    if private:
+        text.session.append(OUR_SESSION)
+    else:
+        text.channel_id.append(1)
+
+    rec.add_protobuf(offset, text)
+
+
+def _connected():
+    irc = Recording("irc")
+    mumble = Recording("mumble")
+
+    _irc_connect(irc)
+    _mumble_connect(mumble)
+
+    return {"irc": irc, "mumble": mumble}
+
+
+def netjoin(users=5000):
+    """
+    A netsplit rejoins, and *users* users join the IRC channel in two
+    seconds - followed by the WHO replies for them - while a tenth as many
+    connect to Mumble.
+    """
+
+    recordings = _connected()
+    irc = recordings["irc"]
+    mumble = recordings["mumble"]
+
+    span = 2.0
+
+    for i in xrange(LOCALS, LOCALS + users):
+        offset = span * (i - LOCALS) / users
+        irc.add_line(offset, ":%s JOIN :%s" % (_irc_user(i), CHANNEL))
+
+    for i in xrange(LOCALS, LOCALS + users):
+        irc.add_line(span, ":irc.server 352 %s %s ~u%s host-%s.example.com "
+                           "irc.server user%s H :0 Real Name" % (
+                               NICK, CHANNEL, i, i % 300, i
+                           ))
+
+    irc.add_line(span, ":irc.server 315 %s %s :End of /WHO list." % (
+        NICK, CHANNEL
+    ))
+
+    first = OUR_SESSION + 1 + LOCALS
+    count = users // 10
+
+    for session in xrange(first, first + count):
+        _mumble_user(mumble, span * (session - first) / max(count, 1),
+                     session)
+
+    return recordings
+
+
+def chat(rate=200, seconds=30):
+    """
+    Busy chat on both sides of the bridge, at *rate* messages per second in
+    total. One message in twenty has a link in it, and one in fifty is an
+    action.
+    """
+
+    recordings = _connected()
+    irc = recordings["irc"]
+    mumble = recordings["mumble"]
+
+    rnd = random.Random(1)
+
+    for i in xrange(int(rate * seconds)):
+        offset = float(i) / rate
+        message = "Message number %s - lorem ipsum dolor sit amet" % i
+
+        if i % 20 == 0:
+            message = "Have a look at http://%s/page/%s" % (
+                LINK_HOSTS[i % len(LINK_HOSTS)], i % 100
+            )
+
+        if rnd.random() < 0.8:
+            user = rnd.randrange(LOCALS)
+
+            if i % 50 == 1:
+                message = "\x01ACTION %s\x01" % message
+
+            irc.add_line(offset, ":%s PRIVMSG %s :%s" % (
+                _irc_user(user), CHANNEL, message
+            ))
+        else:
+            session = OUR_SESSION + 1 + rnd.randrange(LOCALS)
+            _mumble_text(mumble, offset, session, message)
+
+    return recordings
+
+
+def command_flood(count=5000, rate=500):
+    """
+    *count* commands at *rate* per second, from both protocols - factoid
+    lookups, logins over PM with a mix of good and bad passwords, and
+    commands that don't exist.
+    """
+
+    recordings = _connected()
+    irc = recordings["irc"]
+    mumble = recordings["mumble"]
+
+    rnd = random.Random(2)
+    accounts = sorted(ACCOUNTS.iteritems())
+
+    for i in xrange(count):
+        offset = float(i) / rate
+        roll = rnd.random()
+        private = False
+
+        if roll < 0.4:
+            command = rnd.choice(["?? hello", "?? rules", "?? missing"])
+        elif roll < 0.7:
+            command = ".getfactoid %s" % rnd.choice(["hello", "rules"])
+        elif roll < 0.9:
+            username, password = rnd.choice(accounts)
+
+            if rnd.random() < 0.2:
+                password = "wrong"
+
+            command = ".login %s %s" % (username, password)
+            private = True
+        else:
+            command = ".nonsense %s" % i
+
+        if rnd.random() < 0.8:
+            irc.add_line(offset, ":%s PRIVMSG %s :%s" % (
+                _irc_user(rnd.randrange(LOCALS)),
+                NICK if private else CHANNEL,
+                command
+            ))
+        else:
+            session = OUR_SESSION + 1 + rnd.randrange(LOCALS)
+            _mumble_text(mumble, offset, session, command, private)
+
+    return recordings
+
+
+#: Scenario functions, by name
+SCENARIOS = {
+    "netjoin": netjoin,
+    "chat": chat,
+    "command-flood": command_flood
+}
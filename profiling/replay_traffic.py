@@ -0,0 +1,142 @@
+# coding=utf-8
+
+"""
+Benchmark for the bot as a whole, with replayed protocol traffic.
+
+Sets the bot up with the Auth, Bridge, Factoids and URLs plugins, connects
+IRC and Mumble protocols to in-memory transports, and replays traffic into
+them - see `profiling.replay` for how. The canned scenarios are:
+
+* **netjoin** - 5,000 users join the IRC channel after a netsplit, and 500
+  connect to Mumble
+* **chat** - 30 seconds of chat at 200 messages per second, bridged both
+  ways, with links for the URLs plugin to fetch titles for
+* **command-flood** - 5,000 commands at 500 per second: factoid lookups,
+  logins and unknown commands
+
+Run it from the root of the repository::
+
+    python profiling/replay_traffic.py [scenario or directory ...]
+
+Each scenario is run in its own process, so that peak RSS is measured for
+that scenario alone. With no arguments, every canned scenario is run.
+
+Directories are replayed from *irc.replay* and *mumble.replay* files inside
+them, as written by --save or a *Recorder*.
+"""
+
+__author__ = 'Gareth Coles'
+
+import argparse
+import os
+import subprocess
+import sys
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from twisted.internet import defer, reactor
+
+from profiling.replay import scenarios
+from profiling.replay.harness import Harness
+from profiling.replay.recording import Recording
+
+#: Which argument of each scenario --scale multiplies, and its default
+SIZES = {
+    "netjoin": ("users", 5000),
+    "chat": ("seconds", 30),
+    "command-flood": ("count", 5000)
+}
+
+p = argparse.ArgumentParser(
+    description="Replay protocol traffic into the bot and measure it"
+)
+p.add_argument("scenarios", nargs="*",
+               help="Canned scenarios or directories of recordings to "
+                    "replay - all of the canned scenarios by default")
+p.add_argument("--paced", action="store_true",
+               help="Replay at the recorded rate, instead of as fast as "
+                    "possible")
+p.add_argument("--scale", type=float, default=1.0,
+               help="Multiply the size of the canned scenarios")
+p.add_argument("--save", metavar="DIR",
+               help="Save the scenario's recordings to a directory, too")
+
+
+def load(args):
+    name = args.scenarios[0]
+
+    if name in scenarios.SCENARIOS:
+        key, default = SIZES[name]
+        kwargs = {key: type(default)(default * args.scale)}
+
+        recordings = scenarios.SCENARIOS[name](**kwargs)
+    else:
+        recordings = {}
+
+        for kind in ("irc", "mumble"):
+            path = os.path.join(name, "%s.replay" % kind)
+
+            if os.path.exists(path):
+                recordings[kind] = Recording.load(path)
+
+    if args.save:
+        if not os.path.exists(args.save):
+            os.makedirs(args.save)
+
+        for kind, recording in recordings.iteritems():
+            recording.save(os.path.join(args.save, "%s.replay" % kind))
+
+    return recordings
+
+
+@defer.inlineCallbacks
+def run(args):
+    # Paths given on the command line are relative to where we started, but
+    # the harness runs the bot in its own directory
+    args.scenarios = [
+        arg if arg in scenarios.SCENARIOS else os.path.abspath(arg)
+        for arg in args.scenarios
+    ]
+
+    if args.save:
+        args.save = os.path.abspath(args.save)
+
+    harness = Harness()
+
+    try:
+        yield harness.setup()
+
+        recordings = load(args)
+        results = yield harness.replay(recordings, args.paced)
+
+        print "Scenario: %s (%s)" % (
+            args.scenarios[0], "paced" if args.paced else "flat out"
+        )
+        print results.report()
+    finally:
+        yield harness.close()
+        reactor.stop()
+
+
+def main():
+    args = p.parse_args()
+
+    if len(args.scenarios) == 1:
+        reactor.callWhenRunning(run, args)
+        reactor.run()
+        return
+
+    # Run each scenario in a process of its own, so that peak RSS means
+    # something
+    names = args.scenarios or sorted(scenarios.SCENARIOS)
+    options = [arg for arg in sys.argv[1:] if arg not in args.scenarios]
+
+    for name in names:
+        subprocess.call(
+            [sys.executable, os.path.abspath(__file__), name] + options
+        )
+        print
+
+
+if __name__ == "__main__":
+    main()
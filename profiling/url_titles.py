@@ -0,0 +1,152 @@
+# coding=utf-8
+
+"""
+Benchmark for the URLs plugin's title fetching.
+
+Starts a stub HTTP server on the loopback interface, then fetches pages from
+it in bursts, the way URLs turn up in busy channels, and measures titles per
+second. Pages are spread over four hosts (127.0.0.1 to 127.0.0.4), and the
+server keeps connections alive.
+
+This is done the old way, with a new session and thread pool for every URL,
+and through the shared HTTP pool. Run it from the root of the repository::
+
+    python profiling/url_titles.py
+"""
+
+__author__ = 'Gareth Coles'
+
+import BaseHTTPServer
+import os
+import re
+import SocketServer
+import sys
+import threading
+import time
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+from twisted.internet import defer, reactor
+from txrequests import Session
+
+from plugins.urls.http_pool import HTTPPool
+
+HOSTS = ["127.0.0.%s" % i for i in xrange(1, 5)]
+BURSTS = 40
+BURST_SIZE = 25
+
+TITLE_REGEX = re.compile(r"<title>(.*?)</title>", re.I | re.S)
+
+PAGE = ("<!DOCTYPE html><html><head><title>Page %s</title></head>"
+        "<body>%s</body></html>")
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Send each response in one go, like a real server would - otherwise
+    # kept-alive connections stall on delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = PAGE % (self.path, "Lorem ipsum dolor sit amet. " * 100)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def get_title(response):
+    match = TITLE_REGEX.search(response.text)
+    return match.group(1) if match else None
+
+
+def legacy_fetch(url):
+    # What LazyRequest and the redirect check used to do for every URL
+    session = Session()
+    d = session.get(url)
+
+    def done(result):
+        session.close()
+        return result
+
+    return d.addBoth(done)
+
+
+@defer.inlineCallbacks
+def measure(fetch, port):
+    titles = 0
+    start = time.time()
+
+    for burst in xrange(BURSTS):
+        urls = [
+            "http://%s:%s/%s/%s" % (
+                HOSTS[i % len(HOSTS)], port, burst, i
+            ) for i in xrange(BURST_SIZE)
+        ]
+
+        responses = yield defer.gatherResults([fetch(url) for url in urls])
+
+        for response in responses:
+            if get_title(response):
+                titles += 1
+
+    taken = time.time() - start
+    defer.returnValue((titles, titles / taken))
+
+
+@defer.inlineCallbacks
+def run(port):
+    try:
+        pool = HTTPPool()
+        session = pool.session()
+
+        # Warm up the server and the pool's connections
+        yield measure(lambda url: pool.get(url, session=session), port)
+
+        before_titles, before = yield measure(legacy_fetch, port)
+        after_titles, after = yield measure(
+            lambda url: pool.get(url, session=session), port
+        )
+
+        assert before_titles == after_titles == BURSTS * BURST_SIZE
+
+        print "%s bursts of %s URLs over %s hosts" % (
+            BURSTS, BURST_SIZE, len(HOSTS)
+        )
+        print "Before: %8.1f titles/sec" % before
+        print "After:  %8.1f titles/sec" % after
+        print "Speedup: %.2fx" % (after / before)
+        print "Pool: %s" % pool.stats()
+
+        pool.close()
+    finally:
+        reactor.stop()
+
+
+def main():
+    server = StubServer(("", 0), StubHandler)
+    port = server.server_address[1]
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    reactor.callWhenRunning(run, port)
+    reactor.run()
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+# coding=utf-8
+
+"""
+Benchmark for the memory used by tracked users.
+
+Tracks 10,000 and 50,000 users on each protocol, the way the protocols do
+when they see them, and reports the memory used per user - including the
+strings and containers each user holds on to. IRC users come from WHO
+replies, with hosts shared between every 300 users as cloaks would be, and a
+tenth of them opped. Mumble users are measured when they've just connected
+and after their UserStats have come in.
+
+With --compare, the same is done with copies of the old, dict-backed
+classes. Each measurement is made in a process of its own. Run it from the
+root of the repository::
+
+    python profiling/user_memory.py [users ...] [--compare]
+"""
+
+__author__ = 'Sean'
+
+import gc
+import logging
+import os
+import subprocess
+import sys
+
+sys.path.append(os.getcwd())  # Because herp derp
+
+import psutil
+
+from system.protocols.irc import protocol as irc_protocol
+from system.protocols.irc.channel import Channel as IRCChannel
+from system.protocols.mumble.channel import Channel as MumbleChannel
+from system.protocols.mumble.structs import Version
+from system.protocols.mumble.user import User as MumbleUser
+from utils.misc import AttrDict
+
+COUNTS = [10000, 50000]
+KINDS = ["irc", "mumble", "mumble-stats"]
+
+CONFIG = {
+    "main": {"can-flood": True},
+    "network": {"password": ""},
+    "identity": {"nick": "Ultros", "authentication": "None"},
+    "control_chars": ".",
+    "rate_limiting": {"enabled": False},
+    "channels": []
+}
+
+
+class LegacyIRCUser(object):
+    """
+    The old IRC user's attributes, kept here for comparison.
+    """
+
+    authorized = False
+    auth_name = ""
+    away = False
+
+    def __init__(self, protocol, nickname, ident=None, host=None,
+                 realname=None, is_oper=False, is_tracked=False):
+        self.nickname = nickname
+        self.protocol = protocol
+        self.is_tracked = is_tracked
+        self.ident = ident
+        self.host = host
+        self.realname = realname
+        self.is_oper = is_oper
+        self.channels = set()
+        self._ranks = {}
+
+    def set_away(self, away):
+        self.away = away
+
+    def add_channel(self, channel):
+        self.channels.add(channel)
+
+    def add_rank_in_channel(self, channel, rank):
+        channel = self.protocol.utils.lowercase_nick_chan(channel.name)
+        if channel not in self._ranks:
+            self._ranks[channel] = set()
+        self._ranks[channel].add(rank)
+
+
+class LegacyStats(object):
+    def __init__(self, good=0, late=0, lost=0, resync=0):
+        self.good = good
+        self.late = late
+        self.lost = lost
+        self.resync = resync
+
+
+class LegacyMumbleUser(object):
+    """
+    The old Mumble user's attributes, kept here for comparison.
+    """
+
+    authorized = False
+    auth_name = ""
+    away = False
+
+    def __init__(self, protocol, session, name, channel, mute, deaf,
+                 suppress, self_mute, self_deaf, priority_speaker, recording):
+        self.nickname = name
+        self.protocol = protocol
+        self.is_tracked = True
+        self.session = session
+        self.channel = channel
+        self.mute = mute
+        self.deaf = deaf
+        self.suppress = suppress
+        self.self_mute = self_mute
+        self.self_deaf = self_deaf
+        self.priority_speaker = priority_speaker
+        self.recording = recording
+
+        self.comment = None
+        self.comment_hash = None
+        self.avatar = None
+        self.avatar_hash = None
+
+        self.user_id = None
+
+        self.certificate_hash = None
+
+        self.certificates = []
+        self.packet_stats_from_client = LegacyStats()
+        self.packet_stats_from_server = LegacyStats()
+        self.udp_packets_sent = 0
+        self.tcp_packets_sent = 0
+        self.udp_ping_avg = 0
+        self.udp_ping_var = 0
+        self.tcp_ping_avg = 0
+        self.tcp_ping_var = 0
+        self.version = None
+        self.celt_versions = []
+        self.address = None
+        self.bandwidth = 0
+        self.online_time = 0
+        self.idle_time = 0
+        self.strong_certificate = False
+        self.opus = False
+
+
+def track_irc(count, legacy):
+    if legacy:
+        irc_protocol.User = LegacyIRCUser
+
+    protocol = irc_protocol.Protocol("bench", AttrDict(), AttrDict(CONFIG))
+    protocol.log.setLevel(logging.CRITICAL)
+
+    channel = IRCChannel(protocol, "#big")
+    protocol.set_channel("#big", channel)
+
+    start = rss()
+
+    for i in xrange(count):
+        # Fresh strings for every user, as if they'd been parsed from a line
+        nickname, ident, host = protocol.utils.split_hostmask(
+            "User%s!~u%s@host-%s.example.com" % (i, i, i % 300)
+        )
+        protocol.channel_who_response(
+            nickname, ident, host, "irc.server",
+            "H@" if i % 10 == 0 else "H", "0 Real Name", channel
+        )
+
+    return start, protocol
+
+
+def track_mumble(count, legacy, stats):
+    cls = LegacyMumbleUser if legacy else MumbleUser
+    channel = MumbleChannel(None, 1, u"Chat", 0, 0, [])
+    users = {}
+
+    start = rss()
+
+    for session in xrange(2, count + 2):
+        user = cls(None, session, u"mumbler%s" % session, channel,
+                   False, False, False, False, False, False, False)
+        user.user_id = session
+        user.certificate_hash = u"%040x" % session
+
+        channel.add_user(user)
+        users[session] = user
+
+        if not stats:
+            continue
+
+        # What a UserStats message usually fills in
+        user.certificates = ["\x30\x82" + "-" * 1024]
+        user.version = Version(66052, u"1.2.4", u"Linux", u"Ubuntu 14.04")
+        user.celt_versions = [-2147483637, -2147483632]
+        user.address = "\x00" * 10 + "\xff\xff" + "\xc0\x00\x02" + chr(
+            session % 256
+        )
+        user.strong_certificate = True
+        user.opus = True
+
+        for packets in (user.packet_stats_from_client,
+                        user.packet_stats_from_server):
+            packets.good = session * 50
+            packets.late = session % 7
+
+        user.udp_packets_sent = session * 100
+        user.tcp_packets_sent = session
+        user.udp_ping_avg = 30.5
+        user.udp_ping_var = 2.25
+        user.online_time = session * 3
+        user.idle_time = session % 60
+
+    return start, users
+
+
+def rss():
+    gc.collect()
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def measure(kind, count, legacy):
+    if kind == "irc":
+        start, objects = track_irc(count, legacy)
+    else:
+        start, objects = track_mumble(count, legacy, kind == "mumble-stats")
+
+    return (rss() - start) / float(count)
+
+
+def run(counts, compare):
+    options = [[]]
+
+    if compare:
+        options.append(["--legacy"])
+
+    print "%-14s %8s %14s %14s" % (
+        "Users", "Count", "Bytes/user", "Old bytes/user" if compare else ""
+    )
+
+    for kind in KINDS:
+        for count in counts:
+            results = []
+
+            for extra in options:
+                output = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), "--measure",
+                     kind, str(count)] + extra
+                )
+                results.append(float(output.split()[-1]))
+
+            print "%-14s %8s %14.0f %14s" % (
+                kind, count, results[0],
+                "%.0f" % results[1] if compare else ""
+            )
+
+
+if __name__ == "__main__":
+    if "--measure" in sys.argv:
+        args = sys.argv[sys.argv.index("--measure") + 1:]
+        print measure(args[0], int(args[1]), "--legacy" in args)
+    else:
+        args = [arg for arg in sys.argv[1:] if arg != "--compare"]
+        run([int(arg) for arg in args] or COUNTS, "--compare" in sys.argv)
@@ -1,14 +1,16 @@
 # coding=utf-8
 __author__ = "Gareth Coles"
 
-import shlex
+import time
 
+from system.commands.parser import ParsedArgs
 from system.decorators.log import deprecated
 from system.decorators.ratelimit import RateLimitExceededError
 from system.enums import CommandState
 from system.events import general as events
 from system.events.manager import EventManager
 from system.logging.logger import getLogger
+from system.metrics.instrumentation import Instrumentation
 from system.singleton import Singleton
 from system.translations import Translations
 _ = Translations().get()
@@ -40,6 +42,14 @@ class CommandManager(object):
     #:     }
     aliases = {}
 
+    #: Control character prefixes, compiled for each protocol. These are
+    #: recompiled when the protocol's control characters or nickname change.
+    #:
+    #:     prefixes = {
+    #:         "protocol": (control_char, our_name, lowercase_prefix)
+    #:     }
+    prefixes = {}
+
     @property
     @deprecated("Use the singular auth_handler instead")
     def auth_handlers(self):
@@ -68,6 +78,7 @@ class CommandManager(object):
     def __init__(self):
         self.logger = getLogger("Commands")
         self.event_manager = EventManager()
+        self.instrumentation = Instrumentation()
 
     def set_factory_manager(self, factory_manager):
         """Set the factory manager.
@@ -202,18 +213,17 @@ class CommandManager(object):
             if hasattr(protocol, "nickname"):
                 our_name = protocol.nickname
 
-        if our_name is not None:
-            control_char = control_char.replace("{NAME}", our_name)
-            control_char = control_char.replace("{NICK}", our_name)
+        prefix = self.get_prefix(protocol.name, control_char, our_name)
+        length = len(prefix)
 
-        if len(in_str) < len(control_char):
+        if len(in_str) < length:
             self.logger.trace("Control character sequence is longer than the "
                               "input string, so this cannot be a command.")
             return CommandState.NotACommand, None
 
-        if in_str.lower().startswith(control_char.lower()):  # It's a command!
+        if in_str[:length].lower() == prefix:  # It's a command!
             # Remove the command char(s) from the start
-            replaced = in_str[len(control_char):]
+            replaced = in_str[length:]
 
             split = replaced.split(None, 1)
             if not split:
@@ -239,9 +249,44 @@ class CommandManager(object):
 
             return result
 
-        self.logger.debug("Command not found.")
+        # Not logged, as this is most lines - the protocols log it instead
         return CommandState.NotACommand, None
 
+    def get_prefix(self, protocol_name, control_char, our_name=None):
+        """Get the compiled control character prefix for a protocol.
+
+        This is the control character sequence with `{NAME}` and `{NICK}`
+        replaced by our name, lowercased for comparison. It's cached until
+        the control characters or our name change.
+
+        :param protocol_name: The name of the protocol
+        :param control_char: The control characters (prefix)
+        :param our_name: The name of the bot on the protocol
+
+        :type protocol_name: str
+        :type control_char: str
+        :type our_name: str
+
+        :return: The lowercase prefix
+        :rtype: str
+        """
+
+        cached = self.prefixes.get(protocol_name)
+
+        if cached is not None and cached[:2] == (control_char, our_name):
+            return cached[2]
+
+        prefix = control_char
+
+        if our_name is not None:
+            prefix = prefix.replace("{NAME}", our_name)
+            prefix = prefix.replace("{NICK}", our_name)
+
+        prefix = prefix.lower()
+        self.prefixes[protocol_name] = (control_char, our_name, prefix)
+
+        return prefix
+
     def run_command(self, command, caller, source, protocol, args):
         """Run a command, provided it's been registered.
 
@@ -262,6 +307,24 @@ class CommandManager(object):
         :rtype: tuple(CommandState, None or Exception)
         """
 
+        if not self.instrumentation.enabled:
+            return self._run_command(command, caller, source, protocol, args)
+
+        start = time.time()
+        result = self._run_command(command, caller, source, protocol, args)
+
+        # Unknown commands aren't recorded, so users can't fill the stats up
+        # with junk
+        if result[0] not in (CommandState.Unknown,
+                             CommandState.UnknownOverridden):
+            self.instrumentation.time(
+                "commands", self.aliases.get(command, command),
+                time.time() - start
+            )
+
+        return result
+
+    def _run_command(self, command, caller, source, protocol, args):
         if command not in self.commands:
             if command not in self.aliases:  # Get alias, if it exists
                 event = events.UnknownCommand(self, protocol, command, args,
@@ -274,16 +337,9 @@ class CommandManager(object):
 
                 return CommandState.Unknown, None
             command = self.aliases[command]
-        # Parse args
+        # Args are only parsed if the command uses them
         raw_args = args
-        try:
-            lex = shlex.shlex(args, posix=True)
-            lex.whitespace_split = True
-            lex.quotes = '"'
-            lex.commenters = ""
-            parsed_args = list(lex)
-        except ValueError:
-            parsed_args = None
+        parsed_args = ParsedArgs(args)
         try:
             if self.commands[command]["permission"]:
                 if not self.perm_handler:
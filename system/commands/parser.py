@@ -0,0 +1,147 @@
+# coding=utf-8
+
+"""
+Argument parsing for commands.
+
+Commands are given their arguments as a raw string and as a list of
+tokens, split on whitespace with double-quoted sections kept together -
+the way a POSIX-mode shlex does with *whitespace_split* set and only `"`
+as a quote character.
+"""
+
+__author__ = "Gareth Coles"
+
+import re
+
+WHITESPACE = frozenset(" \t\r\n")
+WORD_REGEX = re.compile(r"[^ \t\r\n]+")
+QUOTE = '"'
+ESCAPE = "\\"
+
+
+def split_args(args):
+    """
+    Split a string into tokens, like a POSIX shlex with only double quotes.
+
+    * Tokens are separated by whitespace, unless it's quoted or escaped
+    * Quotes are removed, and quoted sections join on to the surrounding
+      token - `a"b c"d` is the single token `ab cd`
+    * `""` is an empty token
+    * Outside of quotes, a backslash escapes any character. Inside them, it
+      only escapes `"` and backslashes - otherwise it's kept as-is
+
+    Unlike shlex on Python 2, this works with unicode strings.
+
+    :param args: The string to split
+    :type args: str, unicode
+
+    :raises ValueError: If there's an unclosed quote or trailing escape
+
+    :return: The tokens
+    :rtype: list
+    """
+
+    if QUOTE not in args and ESCAPE not in args:
+        return WORD_REGEX.findall(args)  # Fast path for the common case
+
+    tokens = []
+    token = []
+    in_token = False  # Whether we have a (possibly empty) token
+    quoted = False
+    escaped = False
+
+    for char in args:
+        if escaped:
+            if quoted and char != QUOTE and char != ESCAPE:
+                token.append(ESCAPE)
+            token.append(char)
+            escaped = False
+        elif char == ESCAPE:
+            escaped = True
+            in_token = True
+        elif quoted:
+            if char == QUOTE:
+                quoted = False
+            else:
+                token.append(char)
+        elif char == QUOTE:
+            quoted = True
+            in_token = True
+        elif char in WHITESPACE:
+            if in_token:
+                tokens.append("".join(token))
+                token = []
+                in_token = False
+        else:
+            token.append(char)
+            in_token = True
+
+    if quoted:
+        raise ValueError("No closing quotation")
+
+    if escaped:
+        raise ValueError("No escaped character")
+
+    if in_token:
+        tokens.append("".join(token))
+
+    return tokens
+
+
+class ParsedArgs(object):
+    """
+    Read-only sequence of the tokens in a command's arguments.
+
+    The arguments are only split the first time the tokens are needed, so
+    commands that only use the raw arguments don't pay for it.
+
+    If the arguments can't be split - for example, because there's an
+    unclosed quote - they're split on whitespace instead, as commands used
+    to do themselves when that happened.
+    """
+
+    __slots__ = ["raw", "_tokens"]
+
+    def __init__(self, raw):
+        """
+        :param raw: The raw argument string
+        """
+
+        self.raw = raw
+        self._tokens = None
+
+    @property
+    def tokens(self):
+        """
+        The list of tokens.
+        """
+
+        if self._tokens is None:
+            try:
+                self._tokens = split_args(self.raw)
+            except ValueError:
+                self._tokens = self.raw.split()
+        return self._tokens
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, item):
+        return self.tokens[item]
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def __contains__(self, item):
+        return item in self.tokens
+
+    def __eq__(self, other):
+        if isinstance(other, ParsedArgs):
+            other = other.tokens
+        return self.tokens == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.raw)
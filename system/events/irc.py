@@ -206,8 +206,12 @@ class TopicUpdatedEvent(IRCEvent):
 
 class WHOReplyEvent(IRCEvent):
     """
-    Thrown when the server sends us a WHO reply chunk - this is essentially
-    just populating a user object, but the raw data is also available
+    Thrown for each WHO reply from the server - this is essentially just
+    populating a user object, but the raw data is also available
+
+    Replies for channels we're in are buffered and thrown together, once the
+    server's sent all of them. If you want all of them, the WHOReplyEndEvent
+    has them in one go.
     """
 
     channel = None
@@ -227,17 +231,23 @@ class WHOReplyEvent(IRCEvent):
 
 class WHOReplyEndEvent(IRCEvent):
     """
-    Thrown when the server is done sending WHO replies for a channel
+    Thrown when the server is done sending WHO replies for a channel, and
+    they've been applied to user-tracking
+
+    The replies are a list of (user, data) tuples, with the same data as
+    the WHOReplyEvent.
     """
 
     channel = None
+    replies = []
 
-    def __init__(self, caller, channel):
+    def __init__(self, caller, channel, replies=None):
         """
         Initialise the event object.
         """
 
         self.channel = channel
+        self.replies = replies or []
         super(WHOReplyEndEvent, self).__init__(caller)
 
 
@@ -273,22 +283,43 @@ class BanListEvent(IRCEvent):
 class BanListEndEvent(IRCEvent):
     """
     Thrown when the server is done sending ban list replies for a channel
+
+    The whole ban list is here as a list of (mask, owner, when) tuples. To
+    check users against it, use the matcher - it's compiled the first time
+    you use it, and matches users against every ban at once.
     """
 
     channel = None
+    bans = []
 
-    def __init__(self, caller, channel):
+    _matcher = None
+
+    def __init__(self, caller, channel, bans=None):
         """
         Initialise the event object.
         """
 
         self.channel = channel
+        self.bans = bans or []
         super(BanListEndEvent, self).__init__(caller)
 
+    @property
+    def matcher(self):
+        """
+        :rtype: system.protocols.irc.hostmasks.HostmaskMatcher
+        """
+
+        if self._matcher is None:
+            self._matcher = self.caller.utils.hostmask_matcher(
+                mask for mask, owner, when in self.bans
+            )
+        return self._matcher
+
 
 class NAMESReplyEvent(IRCEvent):
     """
-    Thrown when the server sends us a NAMES reply chunk
+    Thrown when the server is done sending NAMES replies for a channel, with
+    every name from every chunk it sent
     """
 
     channel = None
@@ -313,14 +344,16 @@ class NAMESReplyEndEvent(IRCEvent):
 
     channel = None
     message = ""
+    names = []
 
-    def __init__(self, caller, channel, message):
+    def __init__(self, caller, channel, message, names=None):
         """
         Initialise the event object.
         """
 
         self.channel = channel
         self.message = message
+        self.names = names or []
         super(NAMESReplyEndEvent, self).__init__(caller)
 
 
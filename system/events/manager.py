@@ -1,6 +1,9 @@
 # coding=utf-8
 __author__ = "Gareth Coles"
 
+import time
+
+from collections import namedtuple
 from operator import itemgetter
 
 from twisted.internet import reactor
@@ -8,11 +11,25 @@ from twisted.internet import reactor
 from system.singleton import Singleton
 from system.decorators import run_async
 from system.logging.logger import getLogger
+from system.metrics.instrumentation import Instrumentation
 
 from system.translations import Translations
 _ = Translations().get()
 
 
+#: Compiled, immutable handler record used by the dispatch tables
+Handler = namedtuple(
+    "Handler", ["name", "function", "filter", "cancelled", "args", "kwargs"]
+)
+
+
+def _call_handler(handler, event):
+    handler.function(event, *handler.args, **handler.kwargs)
+
+
+_call_handler_async = run_async(_call_handler)
+
+
 class EventManager(object):
     """
     The event manager.
@@ -64,12 +81,40 @@ class EventManager(object):
     #:     }
     callbacks = {}
 
+    #: Compiled dispatch tables, rebuilt whenever the callbacks change. Each
+    #: entry is a priority-sorted tuple of `Handler` records::
+    #:
+    #:     dispatch = {
+    #:         "callback_name": (Handler(...), Handler(...))
+    #:     }
+    dispatch = {}
+
     def __init__(self):
         self.logger = getLogger("Events")
+        self.instrumentation = Instrumentation()
 
     def _sort(self, lst):
         return sorted(lst, key=itemgetter("priority", "name"), reverse=True)
 
+    def _compile(self, callback):
+        """
+        Rebuild the dispatch table for a callback from its handler dicts.
+
+        :param callback: The name of the callback
+        :type callback: str
+        """
+
+        if callback not in self.callbacks:
+            self.dispatch.pop(callback, None)
+            return
+
+        self.dispatch[callback] = tuple(
+            Handler(cb["name"], cb["function"], cb["filter"] or None,
+                    cb["cancelled"], tuple(cb["extra_args"]),
+                    cb["extra_kwargs"])
+            for cb in self.callbacks[callback]
+        )
+
     def add_callback(self, callback, plugin, function, priority, fltr=None,
                      cancelled=False, extra_args=None, extra_kwargs=None):
         """
@@ -104,6 +149,10 @@ class EventManager(object):
             extra_args = []
         if extra_kwargs is None:
             extra_kwargs = {}
+        if fltr and not callable(fltr):
+            raise ValueError(_("Plugin '%s' supplied a filter for the '%s' "
+                               "callback that is not callable: %s") %
+                             (plugin.info.name, callback, fltr))
         if not self.has_callback(callback):
             self.callbacks[callback] = []
         if self.has_plugin_callback(callback, plugin.info.name):
@@ -126,6 +175,7 @@ class EventManager(object):
         current.append(data)
 
         self.callbacks[callback] = self._sort(current)
+        self._compile(callback)
 
     def get_callback(self, callback, plugin):
         """
@@ -212,6 +262,7 @@ class EventManager(object):
                 self.callbacks[callback] = self._sort(done)
             else:
                 del self.callbacks[callback]
+            self._compile(callback)
 
     def remove_callbacks(self, callback):
         """
@@ -222,6 +273,7 @@ class EventManager(object):
         """
         if self.has_callback(callback):
             del self.callbacks[callback]
+            self._compile(callback)
 
     def remove_callbacks_for_plugin(self, plugin):
         """
@@ -245,6 +297,7 @@ class EventManager(object):
                 self.callbacks[key] = self._sort(done)
             else:
                 del self.callbacks[key]
+            self._compile(key)
 
     def run_callback(self, callback, event, threaded=False, from_thread=False):
         """
@@ -263,60 +316,46 @@ class EventManager(object):
         :type threaded: bool
         :type from_thread: bool
         """
-        self.logger.trace(
-            "Running callbacks: {} -> {}".format(callback, event)
-        )
         if from_thread:
             # Mostly useful for DB async callbacks, which are not supposed
             # to do any work.
             return reactor.callFromThread(self.run_callback, callback,
                                           event, threaded)
-        if self.has_callback(callback):
-            event.threaded = threaded  # So devs can detect it easily.
 
-            self.logger.trace("Event: %s" % event)
+        handlers = self.dispatch.get(callback)
+
+        if not handlers:
+            return event
+
+        self.logger.trace("Running callbacks: {} -> {}", callback, event)
+        event.threaded = threaded  # So devs can detect it easily.
+
+        call = _call_handler_async if threaded else _call_handler
+
+        # Threaded handlers return straight away, so there's nothing to time
+        timed = self.instrumentation.enabled and not threaded
+
+        for handler in handlers:
+            try:
+                if handler.filter is not None and not handler.filter(event):
+                    continue
+                if event.cancelled and not handler.cancelled:
+                    continue
+
+                if timed:
+                    start = time.time()
 
-            for cb in self.get_callbacks(callback):
-                if threaded:
-                    @run_async
-                    def go():
-                        """ Run the callback asynchronously """
-                        cb["function"](event, *cb["extra_args"],
-                                       **cb["extra_kwargs"])
+                    try:
+                        call(handler, event)
+                    finally:
+                        self.instrumentation.time(
+                            "callbacks", (callback, handler.name),
+                            time.time() - start
+                        )
                 else:
-                    def go():
-                        """ Run the callback synchronously """
-                        cb["function"](event, *cb["extra_args"],
-                                       **cb["extra_kwargs"])
-                try:
-                    self.logger.debug(_("Running callback: %s") % cb)
-                    if cb["filter"]:
-                        if callable(cb["filter"]):
-                            if not cb["filter"](event):
-                                self.logger.trace(_("Not running, filter "
-                                                    "function returned "
-                                                    "False."))
-                                continue
-                        else:
-                            self.logger.warn(_("Not running event, filter "
-                                               "is not actually a callable. "
-                                               "Bug the developers of the %s "
-                                               "plugin about it!") %
-                                             cb["name"])
-                            self.logger.warn(_("Value: %s") % cb["filter"])
-                            continue
-                    if event.cancelled:
-                        if cb["cancelled"]:
-                            go()
-                        else:
-                            self.logger.trace(_("Not running, event is "
-                                                "cancelled and handler "
-                                                "doesn't accept cancelled "
-                                                "events"))
-                    else:
-                        go()
-                except Exception as e:
-                    self.logger.exception(_(
-                        "Error running callback '%s': %s"
-                    ) % (callback, e))
+                    call(handler, event)
+            except Exception as e:
+                self.logger.exception(_(
+                    "Error running callback '%s': %s"
+                ) % (callback, e))
         return event
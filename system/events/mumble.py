@@ -244,21 +244,34 @@ class Unknown(MumbleEvent):
     """
     Unknown message - Called when we get a message that isn't already
     handled
+
+    The message is only decoded when its *message* attribute is used -
+    *raw* holds its undecoded bytes as a memoryview, if it was received that
+    way.
     """
 
     type = ""
-    message = None
+    raw = None
 
-    def __init__(self, caller, typ, message):
+    def __init__(self, caller, typ, message=None, raw=None):
         """
         Initialise the event object.
         """
 
         self.type = typ
-        self.message = message
+        self.raw = raw
+        self._message = message
 
         super(Unknown, self).__init__(caller)
 
+    @property
+    def message(self):
+        if self._message is None and self.raw is not None:
+            self._message = self.type()
+            self._message.ParseFromString(self.raw)
+
+        return self._message
+
 
 class UserJoined(MumbleEvent):
     """
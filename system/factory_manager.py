@@ -12,6 +12,7 @@ from system.events.general import PluginsLoadedEvent, ReactorStartedEvent
 from system.events.manager import EventManager
 from system.logging import logger
 from system.logging.logger import getLogger
+from system.metrics.instrumentation import Instrumentation
 from system.metrics.public import Metrics
 from system.plugins.manager import PluginManager
 from system.singleton import Singleton
@@ -124,6 +125,11 @@ class FactoryManager(object):
         except Exception:
             self.logger.exception(_("Error setting up metrics."))
 
+        try:
+            Instrumentation().configure(self.main_config)
+        except Exception:
+            self.logger.exception(_("Error setting up instrumentation."))
+
         self.plugman.scan()
         deferred = self.load_plugins()  # Load the configured plugins
         deferred.addCallback(self.deferred_callback)
@@ -0,0 +1,398 @@
+# coding=utf-8
+
+"""
+Built-in instrumentation, for finding out what's slowing the bot down.
+
+When enabled, this records:
+
+* **Reactor lag** - A timer ticks every *lag-interval* seconds, and how late
+  each tick is tells us how long the reactor was blocked for
+* **Callback timings** - How long each plugin's event handlers take, keyed
+  by callback and plugin
+* **Command timings** - How long each command takes to run. Commands that
+  return a Deferred are only timed until they return it, as that's the part
+  that blocks the reactor
+* **Protocol counters** - Lines or packets sent and received by each protocol
+* **Gauges** - Values that are read when they're needed rather than
+  recorded, like the depth of each IRC protocol's send queue
+
+Everything is aggregated per minute for the last hour, using
+`utils.stats.TimeDataAggregator`, as well as in totals and histograms since
+instrumentation was enabled. The results can be queried with the
+`instrumentation` command from the Management plugin, and are written to
+`data/instrumentation.json` periodically.
+
+It's configured in the "instrumentation" section of `settings.yml`, and is
+disabled by default. When it's disabled, the only cost to the hot paths is
+checking the *enabled* attribute.
+"""
+
+__author__ = 'Gareth Coles'
+
+import time
+
+from bisect import bisect_left
+
+from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+
+from system.logging.logger import getLogger
+from system.singleton import Singleton
+from system.storage.formats import JSON
+from system.storage.manager import StorageManager
+from system.translations import Translations
+from utils.stats import TimeDataAggregator
+
+_ = Translations().get()
+
+#: Length of each aggregated time period, in seconds
+TIME_PERIOD = 60
+
+#: How many time periods to keep
+SAVED_PERIODS = 60
+
+#: Upper bounds of the timing histogram buckets, in seconds
+BUCKETS = (0.0001, 0.001, 0.01, 0.1, 1.0)
+BUCKET_NAMES = ("<0.1ms", "<1ms", "<10ms", "<100ms", "<1s", ">=1s")
+
+
+class Timings(object):
+    """
+    Timing statistics for one thing we measure.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+        self.calls = TimeDataAggregator(TIME_PERIOD, SAVED_PERIODS)
+        self.time = TimeDataAggregator(TIME_PERIOD, SAVED_PERIODS, 0.0)
+
+    def record(self, duration):
+        """
+        Record how long something took.
+
+        :param duration: The duration, in seconds
+        :type duration: float
+        """
+
+        self.count += 1
+        self.total += duration
+
+        if duration > self.max:
+            self.max = duration
+
+        self.buckets[bisect_left(BUCKETS, duration)] += 1
+
+        self.calls.increment()
+        self.time.add(duration)
+
+    def snapshot(self):
+        """
+        :return: Dict of our statistics, with times in milliseconds
+        :rtype: dict
+        """
+
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "average_ms": self.total / self.count * 1000 if self.count else 0,
+            "max_ms": self.max * 1000,
+            "histogram": dict(zip(BUCKET_NAMES, self.buckets)),
+            "periods": [
+                [timestamp, calls, total * 1000]
+                for (timestamp, calls), (_t, total) in zip(
+                    self.calls.get_records(), self.time.get_records()
+                )
+            ]
+        }
+
+
+class Counter(object):
+    """
+    A count of something, in total and per time period.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.periods = TimeDataAggregator(TIME_PERIOD, SAVED_PERIODS)
+
+    def add(self, amount=1):
+        self.total += amount
+        self.periods.add(amount)
+
+    def snapshot(self):
+        return {
+            "total": self.total,
+            "periods": [list(record) for record in self.periods.get_records()]
+        }
+
+
+class Instrumentation(object):
+    """
+    Singleton that collects the bot's timings and counters.
+
+    Code on a hot path should check *enabled* before doing any work to
+    record something.
+    """
+
+    __metaclass__ = Singleton
+
+    #: Whether we're recording anything
+    enabled = False
+
+    #: Seconds between reactor lag samples
+    lag_interval = 0.5
+
+    #: Seconds between writing snapshots, or 0 to never write them
+    snapshot_interval = 60
+
+    snapshot_path = "instrumentation.json"
+
+    def __init__(self):
+        self.logger = getLogger("Instrumentation")
+        self.storage = StorageManager()
+
+        self.snapshot_file = None
+
+        self._lag_task = None
+        self._last_tick = None
+        self._snapshot_task = None
+
+        # Registered by whatever owns them, so they're kept between resets
+        self.gauges = {}
+
+        self.reset()
+
+    def reset(self):
+        """
+        Throw away everything recorded so far.
+        """
+
+        self.started = time.time()
+
+        self.lag = Timings()
+        self.timings = {}
+        self.counters = {}
+
+    def configure(self, config):
+        """
+        Configure instrumentation from the "instrumentation" section of the
+        main configuration, enabling it if necessary.
+
+        :param config: The main configuration
+        """
+
+        section = config.get("instrumentation", {})
+
+        self.lag_interval = section.get("lag-interval", 0.5)
+        self.snapshot_interval = section.get("snapshot-interval", 60)
+
+        if section.get("enabled", False):
+            self.enable()
+        else:
+            self.disable()
+
+    def enable(self):
+        """
+        Start recording.
+        """
+
+        if self.enabled:
+            return
+
+        self.enabled = True
+
+        # Lag measured before the reactor's running would just be how long
+        # startup took
+        reactor.callWhenRunning(self._start_tasks)
+
+        self.logger.info(_("Instrumentation enabled."))
+
+    def _start_tasks(self):
+        if not self.enabled or self._lag_task is not None:
+            return
+
+        self._last_tick = time.time()
+        self._lag_task = LoopingCall(self._tick)
+        self._lag_task.start(self.lag_interval, now=False)
+
+        if self.snapshot_interval:
+            self._snapshot_task = LoopingCall(self.write_snapshot)
+            self._snapshot_task.start(self.snapshot_interval, now=False)
+
+    def disable(self):
+        """
+        Stop recording. What's been recorded so far is kept.
+        """
+
+        if not self.enabled:
+            return
+
+        self.enabled = False
+
+        for task in (self._lag_task, self._snapshot_task):
+            if task is not None and task.running:
+                task.stop()
+
+        self._lag_task = None
+        self._snapshot_task = None
+
+        self.logger.info(_("Instrumentation disabled."))
+
+    def _tick(self):
+        now = time.time()
+        self.lag.record(max(0.0, now - self._last_tick - self.lag_interval))
+        self._last_tick = now
+
+    def time(self, category, key, duration):
+        """
+        Record how long something took.
+
+        :param category: What sort of thing was timed - eg "callbacks"
+        :param key: What was timed, as a string or tuple of strings
+        :param duration: How long it took, in seconds
+        """
+
+        timings = self.timings.setdefault(category, {})
+        stats = timings.get(key)
+
+        if stats is None:
+            stats = timings[key] = Timings()
+
+        stats.record(duration)
+
+    def count(self, category, key, amount=1):
+        """
+        Add to a counter.
+
+        :param category: What sort of thing was counted - eg "protocols"
+        :param key: What was counted, as a string or tuple of strings
+        :param amount: How much to add
+        """
+
+        counters = self.counters.setdefault(category, {})
+        counter = counters.get(key)
+
+        if counter is None:
+            counter = counters[key] = Counter()
+
+        counter.add(amount)
+
+    def add_gauge(self, category, key, function):
+        """
+        Register a gauge, replacing any with the same key.
+
+        :param category: What sort of thing is measured - eg "queues"
+        :param key: What's measured, as a string or tuple of strings
+        :param function: Function that returns the gauge's current value,
+            which should be something that can be dumped as JSON
+        """
+
+        self.gauges.setdefault(category, {})[key] = function
+
+    def remove_gauge(self, category, key):
+        """
+        Unregister a gauge, if it's registered.
+
+        :param category: The gauge's category
+        :param key: The gauge's key
+        """
+
+        gauges = self.gauges.get(category, {})
+        gauges.pop(key, None)
+
+        if not gauges:
+            self.gauges.pop(category, None)
+
+    def read_gauges(self, category):
+        """
+        Get the current value of every gauge in a category.
+
+        :param category: The category to read
+
+        :return: Dict of key to value
+        :rtype: dict
+        """
+
+        return dict(
+            (key, function())
+            for key, function in self.gauges.get(category, {}).iteritems()
+        )
+
+    def slowest(self, category, count=5):
+        """
+        Get the things in a category that took the most time in total.
+
+        :param category: The category to look in
+        :param count: How many to return
+
+        :return: List of (key, Timings) tuples, slowest first
+        :rtype: list
+        """
+
+        timings = self.timings.get(category, {})
+
+        return sorted(
+            timings.iteritems(), key=lambda item: item[1].total, reverse=True
+        )[:count]
+
+    def snapshot(self):
+        """
+        Get everything we've recorded, in a form that can be dumped as JSON.
+
+        :rtype: dict
+        """
+
+        def name(key):
+            if isinstance(key, tuple):
+                return "/".join(key)
+            return key
+
+        return {
+            "enabled": self.enabled,
+            "started": self.started,
+            "time": time.time(),
+            "period": TIME_PERIOD,
+            "lag": self.lag.snapshot(),
+            "timings": dict(
+                (category, dict(
+                    (name(key), stats.snapshot())
+                    for key, stats in timings.iteritems()
+                )) for category, timings in self.timings.iteritems()
+            ),
+            "counters": dict(
+                (category, dict(
+                    (name(key), counter.snapshot())
+                    for key, counter in counters.iteritems()
+                )) for category, counters in self.counters.iteritems()
+            ),
+            "gauges": dict(
+                (category, dict(
+                    (name(key), value)
+                    for key, value in self.read_gauges(category).iteritems()
+                )) for category in self.gauges
+            )
+        }
+
+    def write_snapshot(self):
+        """
+        Write a snapshot to `data/instrumentation.json`.
+        """
+
+        try:
+            if self.snapshot_file is None:
+                self.snapshot_file = self.storage.get_file(
+                    self, "data", JSON, self.snapshot_path
+                )
+
+            snapshot = self.snapshot()
+
+            with self.snapshot_file:
+                self.snapshot_file.data.clear()
+                self.snapshot_file.data.update(snapshot)
+        except Exception:
+            self.logger.exception(_("Unable to write instrumentation "
+                                    "snapshot"))
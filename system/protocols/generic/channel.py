@@ -13,8 +13,13 @@ class Channel(object):
 
     @ivar name The name of the channel
     @ivar users A set containing all the User objects in the channel
+
+    Like users, channels use __slots__ - subclasses should declare slots for
+    any attributes they add.
     """
 
+    __slots__ = ("name", "protocol", "users", "__weakref__")
+
     def __init__(self, name, protocol=None):
         """
         Initialise the channel. Remember to call super in subclasses!
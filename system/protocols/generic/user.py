@@ -7,16 +7,25 @@ _ = Translations().get()
 
 
 class User(object):
+    """
+    A user on a protocol. Subclass this!
 
-    authorized = False
-    auth_name = ""
-    away = False
+    Big networks mean a lot of users, so this and its subclasses use
+    __slots__. Subclasses should declare slots for any attributes they add.
+    """
+
+    __slots__ = ("nickname", "protocol", "is_tracked", "authorized",
+                 "auth_name", "away", "__weakref__")
 
     def __init__(self, nickname, protocol=None, is_tracked=False):
         self.nickname = nickname
         self.protocol = protocol
         self.is_tracked = is_tracked
 
+        self.authorized = False
+        self.auth_name = ""
+        self.away = False
+
     @property
     def name(self):
         return self.nickname
@@ -9,9 +9,10 @@ _ = Translations().get()
 
 
 class Channel(channel.Channel):
+    __slots__ = ("_modes",)
+
     def __init__(self, protocol, name):
         super(Channel, self).__init__(name, protocol)
-        self.users = set()
         self._modes = {}
 
     def __str__(self):
@@ -0,0 +1,315 @@
+# coding=utf-8
+
+"""
+Compiled hostmasks, for matching users against ban lists and the like.
+
+A *Hostmask* is compiled once, and each of its parts is matched in the
+cheapest way its shape allows - literal parts are compared, parts like
+``*.example.com`` and ``~user*`` are checked with endswith and startswith,
+and only parts with wildcards in the middle fall back to a regex.
+
+A *HostmaskMatcher* holds many masks, and indexes them by the literal end of
+their host part, so matching a user only checks the masks that could match
+their host. Use it to match lots of users against lots of masks.
+"""
+
+__author__ = 'Sean'
+
+import re
+
+ANY, LITERAL, PREFIX, SUFFIX, PATTERN = xrange(5)
+
+
+def _compile_part(part):
+    """
+    :return: Tuple of (kind, value) - value is a compiled regex for
+        patterns, and a string for everything else
+    """
+
+    if part.strip("*") == "":
+        return ANY, None
+
+    if "?" not in part:
+        stars = part.count("*")
+
+        if stars == 0:
+            return LITERAL, part
+        if stars == 1 and part.startswith("*"):
+            return SUFFIX, part[1:]
+        if stars == 1 and part.endswith("*"):
+            return PREFIX, part[:-1]
+
+    pattern = re.escape(part).replace(r"\*", ".*").replace(r"\?", ".")
+    return PATTERN, re.compile(pattern + r"\Z", re.DOTALL)
+
+
+def _match_part(kind, value, part):
+    if kind == ANY:
+        return True
+    if kind == LITERAL:
+        return part == value
+    if kind == SUFFIX:
+        return part.endswith(value)
+    if kind == PREFIX:
+        return part.startswith(value)
+    return value.match(part) is not None
+
+
+def split_mask(mask):
+    """
+    Split a mask into nickname, ident and host parts. Unlike a hostmask, a
+    mask can leave parts out - "nick" is "nick!*@*", and "ident@host" is
+    "*!ident@host".
+
+    :return: [nickname, ident, host]
+    """
+
+    if "@" in mask:
+        user, host = mask.split("@", 1)
+    else:
+        user, host = mask, "*"
+
+    if "!" in user:
+        nickname, ident = user.split("!", 1)
+    elif "@" in mask:
+        nickname, ident = "*", user
+    else:
+        nickname, ident = user, "*"
+
+    return [nickname or "*", ident or "*", host or "*"]
+
+
+class Hostmask(object):
+    """
+    A compiled hostmask, with * and ? wildcards.
+
+    Nicknames are compared with the server's case-mapping, and idents and
+    hosts case-insensitively.
+    """
+
+    __slots__ = ("mask", "_lower_nick", "_nickname", "_ident", "_host",
+                 "host_key")
+
+    def __init__(self, mask, lower_nick):
+        """
+        :param mask: The mask, like "*!*@*.example.com"
+        :param lower_nick: Function that case-maps a nickname
+        """
+
+        self.mask = mask
+        self._lower_nick = lower_nick
+
+        nickname, ident, host = split_mask(mask)
+
+        self._nickname = _compile_part(lower_nick(nickname))
+        self._ident = _compile_part(ident.lower())
+        self._host = _compile_part(host.lower())
+
+        self.host_key = self._get_host_key(host.lower())
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.mask)
+
+    @staticmethod
+    def _get_host_key(host):
+        """
+        Work out which of a host's dot-separated endings any matching host
+        must have - "*.example.com" needs "example.com", for example.
+
+        :return: The ending, or None if the mask could match any host
+        """
+
+        kind = _compile_part(host)[0]
+
+        if kind == LITERAL:
+            return host
+
+        tail = re.split(r"[*?]", host)[-1]
+
+        if "." not in tail:
+            return None
+
+        return tail[tail.index(".") + 1:] or None
+
+    def match(self, nickname, ident, host):
+        """
+        Check whether a user matches this mask.
+
+        :return: Whether they match
+        :rtype: bool
+        """
+
+        return self.match_lowered(self._lower_nick(nickname or ""),
+                                  (ident or "").lower(),
+                                  (host or "").lower())
+
+    def match_lowered(self, nickname, ident, host):
+        """
+        Like `match`, for a user whose nickname has already been case-mapped
+        and whose ident and host have already been lowercased.
+        """
+
+        # Hosts rule out the most users, so they're checked first
+        if not _match_part(self._host[0], self._host[1], host):
+            return False
+
+        if not _match_part(self._ident[0], self._ident[1], ident):
+            return False
+
+        return _match_part(self._nickname[0], self._nickname[1], nickname)
+
+    def match_hostmask(self, hostmask):
+        """
+        Check whether a full "nick!ident@host" hostmask matches this mask.
+        """
+
+        return self.match(*split_mask(hostmask))
+
+    def match_user(self, user):
+        """
+        Check whether a user object matches this mask.
+        """
+
+        return self.match(user.nickname, user.ident, user.host)
+
+
+class HostmaskMatcher(object):
+    """
+    Many compiled masks, indexed by host for matching in bulk.
+    """
+
+    def __init__(self, lower_nick, masks=None):
+        """
+        :param lower_nick: Function that case-maps a nickname
+        :param masks: Masks to start with
+        """
+
+        self.lower_nick = lower_nick
+
+        self._masks = {}  # mask string -> Hostmask
+        self._by_host = {}  # host ending -> [Hostmask]
+        self._any_host = []  # Masks that could match any host
+
+        for mask in masks or []:
+            self.add(mask)
+
+    def __len__(self):
+        return len(self._masks)
+
+    def __contains__(self, mask):
+        return mask in self._masks
+
+    def __iter__(self):
+        return iter(self._masks.values())
+
+    def add(self, mask):
+        """
+        Add a mask. Does nothing if it's already here.
+
+        :rtype: Hostmask
+        """
+
+        if mask in self._masks:
+            return self._masks[mask]
+
+        compiled = self._masks[mask] = Hostmask(mask, self.lower_nick)
+
+        if compiled.host_key is None:
+            self._any_host.append(compiled)
+        else:
+            self._by_host.setdefault(compiled.host_key, []).append(compiled)
+
+        return compiled
+
+    def remove(self, mask):
+        """
+        Remove a mask.
+
+        :raises KeyError: If the mask isn't here
+        """
+
+        compiled = self._masks.pop(mask)
+
+        if compiled.host_key is None:
+            self._any_host.remove(compiled)
+        else:
+            bucket = self._by_host[compiled.host_key]
+            bucket.remove(compiled)
+
+            if not bucket:
+                del self._by_host[compiled.host_key]
+
+    def clear(self):
+        self._masks.clear()
+        self._by_host.clear()
+        del self._any_host[:]
+
+    def _candidates(self, host):
+        candidates = list(self._any_host)
+
+        if not self._by_host:
+            return candidates
+
+        endings = [host]
+        pos = host.find(".")
+
+        while pos >= 0:
+            endings.append(host[pos + 1:])
+            pos = host.find(".", pos + 1)
+
+        for ending in endings:
+            candidates.extend(self._by_host.get(ending, ()))
+
+        return candidates
+
+    def match(self, nickname, ident, host):
+        """
+        Find every mask a user matches.
+
+        :return: List of matching Hostmask objects
+        :rtype: list
+        """
+
+        nickname = self.lower_nick(nickname or "")
+        ident = (ident or "").lower()
+        host = (host or "").lower()
+
+        return [
+            mask for mask in self._candidates(host)
+            if mask.match_lowered(nickname, ident, host)
+        ]
+
+    def match_hostmask(self, hostmask):
+        """
+        Find every mask a full "nick!ident@host" hostmask matches.
+        """
+
+        return self.match(*split_mask(hostmask))
+
+    def match_user(self, user):
+        """
+        Find every mask a user object matches.
+        """
+
+        return self.match(user.nickname, user.ident, user.host)
+
+    def match_users(self, users):
+        """
+        Match many users against every mask.
+
+        :param users: Iterable of user objects
+
+        :return: Dict of user to the list of Hostmasks they match, for every
+            user that matches at least one
+        :rtype: dict
+        """
+
+        matches = {}
+
+        for user in users:
+            found = self.match_user(user)
+
+            if found:
+                matches[user] = found
+
+        return matches
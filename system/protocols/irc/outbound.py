@@ -0,0 +1,202 @@
+# coding=utf-8
+
+"""
+Rate-limited, prioritised queue for lines we send to an IRC server.
+
+Lines are sent through a token bucket, so we can send a short burst but not
+flood the server. When lines have to wait, they're queued in one of three
+lanes, and a lane is only serviced when the lanes above it are empty:
+
+* **Critical** - Lines that keep the connection working, like PONG, NICK
+  and JOIN
+* **Interactive** - Normal messages, like command replies
+* **Bulk** - Long, multi-line messages and relays, which can wait
+
+Within a lane, targets take turns - a long queue of lines for one channel
+can't hold up messages to the others.
+"""
+
+__author__ = 'Sean'
+
+from collections import OrderedDict, deque
+
+from twisted.internet import reactor
+
+CRITICAL = 0
+INTERACTIVE = 1
+BULK = 2
+
+LANES = (CRITICAL, INTERACTIVE, BULK)
+LANE_NAMES = ("critical", "interactive", "bulk")
+
+#: Commands that go in the critical lane
+CRITICAL_COMMANDS = frozenset([
+    "AUTHENTICATE", "CAP", "JOIN", "NICK", "PART", "PASS", "PING", "PONG",
+    "QUIT", "USER"
+])
+
+#: Commands whose first parameter is the target of the line
+TARGETED_COMMANDS = frozenset(["NOTICE", "PRIVMSG"])
+
+
+def classify(line):
+    """
+    Work out which lane a line belongs in, and who it's for.
+
+    :param line: The line to be sent
+    :type line: str
+
+    :return: Tuple of (lane, target), where target is None if the line
+        isn't for a specific channel or user
+    :rtype: tuple
+    """
+
+    parts = line.split(" ", 2)
+    command = parts[0].upper()
+
+    if command in CRITICAL_COMMANDS:
+        return CRITICAL, None
+
+    if command in TARGETED_COMMANDS and len(parts) > 1:
+        return INTERACTIVE, parts[1].lower()
+
+    return INTERACTIVE, None
+
+
+class OutboundQueue(object):
+    """
+    Sends lines through a token bucket, queueing them by lane and target
+    when they can't be sent straight away.
+    """
+
+    def __init__(self, write, bucket=None, clock=None):
+        """
+        :param write: Function that actually sends a line
+        :param bucket: TokenBucket to send lines through, or None to send
+            them all straight away
+        :param clock: Object providing callLater and seconds (default: the
+            reactor)
+
+        :type bucket: utils.ratelimit.TokenBucket
+        """
+
+        if clock is None:
+            clock = reactor
+
+        self.write = write
+        self.bucket = bucket
+        self.clock = clock
+
+        # One dict per lane, of target -> deque of (line, time queued)
+        self._lanes = [OrderedDict() for _ in LANES]
+        self._depth = [0 for _ in LANES]
+        self._call = None
+
+        self._sent = [0 for _ in LANES]
+        self._total_wait = [0.0 for _ in LANES]
+        self._max_wait = [0.0 for _ in LANES]
+
+    def __len__(self):
+        return sum(self._depth)
+
+    def send(self, line, lane=INTERACTIVE, target=None):
+        """
+        Send a line, or queue it if we're being rate-limited.
+
+        :param line: The line to send
+        :param lane: CRITICAL, INTERACTIVE or BULK
+        :param target: The channel or user the line is for, if any
+        """
+
+        if self.bucket is None or (
+                not self._call and not len(self) and self.bucket.consume()):
+            self._sent[lane] += 1
+            self.write(line)
+            return
+
+        targets = self._lanes[lane]
+        lines = targets.get(target)
+
+        if lines is None:
+            lines = targets[target] = deque()
+
+        lines.append((line, self.clock.seconds()))
+        self._depth[lane] += 1
+
+        self._schedule()
+
+    def clear(self):
+        """
+        Throw away all queued lines - for example, when we've disconnected.
+        """
+
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+
+        for targets in self._lanes:
+            targets.clear()
+
+        self._depth = [0 for _ in LANES]
+
+    def stats(self):
+        """
+        Get the depth of each lane and how long lines have waited in them.
+
+        :return: Dict of lane name to dict of stats
+        :rtype: dict
+        """
+
+        stats = {}
+
+        for lane in LANES:
+            sent = self._sent[lane]
+
+            stats[LANE_NAMES[lane]] = {
+                "depth": self._depth[lane],
+                "targets": len(self._lanes[lane]),
+                "sent": sent,
+                "average_wait": self._total_wait[lane] / sent if sent else 0,
+                "max_wait": self._max_wait[lane]
+            }
+
+        return stats
+
+    def _schedule(self):
+        if self._call is not None or not len(self):
+            return
+
+        self._call = self.clock.callLater(
+            self.bucket.time_until(1), self._drain
+        )
+
+    def _pop(self):
+        for lane, targets in enumerate(self._lanes):
+            if not targets:
+                continue
+
+            # Take a line from the first target, then move it to the back
+            target, lines = targets.popitem(last=False)
+            line, queued = lines.popleft()
+
+            if lines:
+                targets[target] = lines
+
+            self._depth[lane] -= 1
+            return lane, line, queued
+
+    def _drain(self):
+        self._call = None
+
+        while len(self) and self.bucket.consume():
+            lane, line, queued = self._pop()
+            wait = self.clock.seconds() - queued
+
+            self._sent[lane] += 1
+            self._total_wait[lane] += wait
+            self._max_wait[lane] = max(self._max_wait[lane], wait)
+
+            self.write(line)
+
+        self._schedule()
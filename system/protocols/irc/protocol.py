@@ -14,14 +14,20 @@ from system.events import general as general_events
 from system.events import irc as irc_events
 from system.events.manager import EventManager
 from system.logging.logger import getLogger
+from system.metrics.instrumentation import Instrumentation
 from system.protocols.capabilities import Capabilities
 from system.protocols.generic.protocol import ChannelsProtocol
 from system.protocols.irc import constants
+from system.protocols.irc import outbound
 from system.protocols.irc.channel import Channel
 from system.protocols.irc.rank import Ranks
+from system.protocols.irc.registry import UserRegistry
+from system.protocols.irc.replies import ReplyBuffer
 from system.protocols.irc.user import User
 from system.translations import Translations
 from utils.irc import IRCUtils
+from utils.misc import intern_string
+from utils.ratelimit import TokenBucket
 from utils.switch import Switch
 _ = Translations().get()
 
@@ -67,6 +73,15 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
     nickname = ""
     name = "irc"
 
+    #: Messages with more lines than this are sent in the bulk lane
+    bulk_lines = 3
+
+    #: :type: system.protocols.irc.outbound.OutboundQueue
+    send_queue = None
+
+    #: :type: system.protocols.irc.replies.ReplyBuffer
+    who_replies = None
+
     control_chars = "."
 
     invite_join = False
@@ -88,8 +103,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
     def fingers(self):
         return self.config.get("fingers", [])
 
-    # TODO: Make users a set()?
-    _users = []
+    _users = None  # UserRegistry - use get_user(s)() to look users up
     ourselves = None
 
     ssl = False
@@ -118,7 +132,13 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
 
         self.event_manager = EventManager()
         self.command_manager = CommandManager()
+        self.instrumentation = Instrumentation()
         self.utils = IRCUtils(self.log)
+        self._users = UserRegistry(self.utils.lowercase_nick_chan)
+        self.who_replies = ReplyBuffer(self.utils.lowercase_nick_chan,
+                                       self.log)
+        self._names_replies = {}
+        self._ban_lists = {}
         # Three dicts for easier lookup
         self.ranks = Ranks()
         # Default prefixes in case the server doesn't send us a RPL_ISUPPORT
@@ -129,8 +149,23 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         self.identity = config["identity"]
         self.control_chars = config["control_chars"]
 
-        if config["rate_limiting"]["enabled"]:
-            self.lineRate = config["rate_limiting"]["line_delay"]
+        bucket = None
+        rate_limiting = config["rate_limiting"]
+
+        if rate_limiting["enabled"] and rate_limiting["line_delay"] > 0:
+            # Twisted's lineRate is left unset; we do our own queueing
+            bucket = TokenBucket(
+                rate_limiting.get("burst", 1),
+                1.0 / rate_limiting["line_delay"],
+                clock=reactor.seconds
+            )
+
+        self.send_queue = outbound.OutboundQueue(self._write_line, bucket)
+        self.bulk_lines = rate_limiting.get("bulk_lines", 3)
+
+        self.instrumentation.add_gauge(
+            "queues", self.name, self.send_queue.stats
+        )
 
         if "ctcp_flood_protection" in config:
             self._ctcp_flood_enabled = config["ctcp_flood_protection"][
@@ -154,9 +189,19 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         self.invite_join = self.config.get("invite_join", False)
 
     def shutdown(self):
-        self.sendLine("QUIT :%s" % _("Protocol shutdown"))
+        # Anything still queued won't make it out, so don't make QUIT wait
+        self.send_queue.clear()
+        self.instrumentation.remove_gauge("queues", self.name)
+        self._write_line(to_bytes("QUIT :%s" % _("Protocol shutdown")))
         self.transport.loseConnection()
 
+    def connectionLost(self, reason):
+        self.send_queue.clear()
+        self.who_replies.cancel()
+        self._names_replies = {}
+        self._ban_lists = {}
+        irc.IRCClient.connectionLost(self, reason)
+
     def register(self, nickname, hostname='foo', servername='bar'):
         if self.identity["authentication"].lower() == "sasl":
             self.sendLine("CAP REQ :sasl")  # It has to be sent early
@@ -171,17 +216,45 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
     # functions should be used.                                           #
     #######################################################################
 
-    def sendLine(self, line, output=False):
+    def sendLine(self, line, output=False, lane=None, target=None):
         """
         Overriding this because fuck Twisted unicode support.
+
+        Lines go through the send queue, which rate-limits them. If no lane
+        is given, it's worked out from the line's command - see
+        `system.protocols.irc.outbound` for more information.
+
+        :param line: The line to send
+        :param output: Whether to log the line
+        :param lane: The send queue lane - outbound.CRITICAL, INTERACTIVE or
+            BULK
+        :param target: The (lowercase) channel or user the line is for
         """
         if output:
             self.log.info(_("SERVER -> %s") % line)
 
         line = to_bytes(line)  # The magical line
 
+        if lane is None:
+            lane, target = outbound.classify(line)
+
+        self.send_queue.send(line, lane, target)
+
+    def _write_line(self, line):
+        """
+        Actually send a line, once the send queue lets us.
+        """
+        if self.instrumentation.enabled:
+            self.instrumentation.count("protocols", (self.name, "lines_out"))
+
         irc.IRCClient.sendLine(self, line)
 
+    def lineReceived(self, line):
+        if self.instrumentation.enabled:
+            self.instrumentation.count("protocols", (self.name, "lines_in"))
+
+        irc.IRCClient.lineReceived(self, line)
+
     # endregion
 
     # region Personal events
@@ -199,8 +272,11 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         # Reset users and channels when we connect, in case we still have them
         # from a previous connection.
         self.ourselves = None
-        self._users = []
+        self._users.clear()
         self._channels = {}
+        self.who_replies.cancel()
+        self._names_replies = {}
+        self._ban_lists = {}
 
         self.factory.clientConnected()
 
@@ -226,12 +302,23 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
                     self.sendLine(line.replace("{NICK}", self.get_nickname()),
                                   output=True)
 
-            reactor.callLater(5, do_channel_joins)
+            reactor.callLater(5, do_channel_joins,
+                              list(self.config["channels"]))
 
-        def do_channel_joins():
-            for channel in self.config["channels"]:
+        def do_channel_joins(channels):
+            # Join a few channels at a time, so the server doesn't throttle
+            # us for joining a long list all at once
+            staging = self.config.get("join_staging", {})
+            count = max(1, staging.get("channels", 5))
+
+            for channel in channels[:count]:
                 self.join_channel(channel["name"], channel["key"])
 
+            if channels[count:]:
+                reactor.callLater(staging.get("delay", 2), do_channel_joins,
+                                  channels[count:])
+                return
+
             _event = general_events.PostSetupEvent(self, self.config)
             self.event_manager.run_callback("PostSetup", _event)
 
@@ -258,6 +345,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         self.log.info(_("Parted channel: %s") % channel)
         chan_obj = self.get_channel(channel)
         # User-tracking stuff:
+        self.who_replies.cancel(channel)
         self.self_part_channel(chan_obj)
 
         event = irc_events.ChannelPartedEvent(self, chan_obj)
@@ -490,6 +578,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         chan_obj = self.get_channel(channel)
         user_obj = self.get_user(nickname=user)
         # User-tracking stuff
+        self.who_replies.depart(channel, user)
         self.user_channel_part(user_obj, chan_obj)
 
         event = irc_events.UserPartedEvent(self, chan_obj, user_obj)
@@ -503,6 +592,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         kicker_obj = self.get_user(nickname=kicker)
         channel_obj = self.get_channel(channel)
         # User-tracking stuff
+        self.who_replies.depart(channel, kickee)
         self.user_channel_part(kickee_obj, channel_obj)
 
         event = irc_events.UserKickedEvent(self,
@@ -517,7 +607,13 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         quitmessage = params[0]
         self.log.info(_("%s has left IRC: %s") % (user, quitmessage))
         # User-tracking stuff
+        mask = self.utils.split_hostmask(user)
+        self.who_replies.depart(None, mask[0])
+
         user_obj = self.get_user(fullname=user)
+        if user_obj is None:
+            # We only had a WHO reply for them, which hasn't been applied
+            user_obj = User(self, *mask, is_tracked=False)
         temp_chans = set(user_obj.channels)
         for channel in temp_chans:
             self.user_channel_part(user_obj, channel)
@@ -669,10 +765,13 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         newnick = params[0]
 
         user_obj = self.get_user(nickname=oldnick)
+        self.who_replies.rename(oldnick, newnick,
+                                lambda row, nick: (nick,) + row[1:])
 
         if not user_obj:
             user_obj = User(self, newnick, is_tracked=False)
-        user_obj.nickname = newnick
+        user_obj.nickname = intern_string(newnick)
+        self._users.rename(user_obj)
 
         self.log.info(_("%s is now known as %s") % (oldnick, newnick))
 
@@ -764,7 +863,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
 
     def irc_RPL_WHOREPLY(self, *nargs):
         """ Called when we get a WHO reply from the server.
-        I'm seriously wondering if we even need this. """
+        Replies are buffered, and applied when we get RPL_ENDOFWHO. """
         data_ = nargs[1]
 
         try:
@@ -779,40 +878,63 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
             self.log.exception("Unable to parse WHO reply")
             return
 
-        # User-tracking stuff
-        try:
-            chan_obj = self.get_channel(channel)
-            self.channel_who_response(nick,
-                                      ident,
-                                      host,
-                                      server,
-                                      status,
-                                      gecos,
-                                      chan_obj)
-        except KeyError:
-            # We got a WHO reply for a channel we're not in - doesn't matter
-            #   for user-tracking purposes.
-            pass
-        else:
-            user_obj = self.get_user(nickname=nick)
-            data_ = {"ident": ident, "host": host, "server": server,
-                     "status": status, "gecos": gecos}
+        if self.get_channel(channel) is None:
+            # Not a channel we're in - maybe a WHO for a mask - so there's
+            #   no user-tracking to batch up
+            self._apply_who_reply(None, nick, ident, host, server, status,
+                                  gecos)
+            return
 
-            event = irc_events.WHOReplyEvent(self, chan_obj, user_obj, data_)
-            self.event_manager.run_callback("IRC/WHOReply", event)
+        self.who_replies.add(channel, nick,
+                             (nick, ident, host, server, status, gecos))
 
     def irc_RPL_ENDOFWHO(self, *nargs):
         """ Called when the server's done spamming us with WHO replies. """
         data_ = nargs[1]
         channel = data_[1]
 
-        try:
-            chan_obj = self.get_channel(channel)
-        except KeyError:
-            pass
+        chan_obj = self.get_channel(channel)
+        batch = self.who_replies.finish(channel)
+
+        d = self.who_replies.apply(
+            batch, lambda row: self._apply_who_reply(chan_obj, *row)
+        )
+        d.addCallback(self._who_replies_applied, chan_obj, batch)
+        d.addErrback(
+            lambda f: self.log.error(
+                _("Error applying WHO replies for %s: %s") % (
+                    channel, f.getErrorMessage()
+                )
+            )
+        )
+
+    def _apply_who_reply(self, chan_obj, nick, ident, host, server, status,
+                         gecos):
+        if chan_obj is None:
+            user_obj = self.get_user(nickname=nick) \
+                or User(self, nick, ident, host, is_tracked=False)
         else:
-            event = irc_events.WHOReplyEndEvent(self, chan_obj)
-            self.event_manager.run_callback("IRC/EndOfWHO", event)
+            user_obj = self.channel_who_response(nick, ident, host, server,
+                                                 status, gecos, chan_obj)
+
+        data_ = {"ident": ident, "host": host, "server": server,
+                 "status": status, "gecos": gecos}
+
+        # Nothing in the core listens for these, so only build the event if
+        # a plugin does
+        if self.event_manager.has_callback("IRC/WHOReply"):
+            event = irc_events.WHOReplyEvent(self, chan_obj, user_obj, data_)
+            self.event_manager.run_callback("IRC/WHOReply", event)
+
+        return user_obj, data_
+
+    def _who_replies_applied(self, replies, chan_obj, batch):
+        if batch.cancelled:
+            # We left the channel or reconnected before they were applied
+            return
+
+        event = irc_events.WHOReplyEndEvent(self, chan_obj, replies)
+        self.event_manager.run_callback("IRC/EndOfWHO", event)
 
     def irc_RPL_ISUPPORT(self, prefix, params):
         irc.IRCClient.irc_RPL_ISUPPORT(self, prefix, params)
@@ -825,6 +947,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
             if prm == "CASEMAPPING":
                 self.utils.case_mapping =\
                     self.supported.getFeature("CASEMAPPING")[0]  # Tuple
+                self._users.reindex()
             elif prm == "PREFIX":
                 # Remove the default prefixes before storing the new ones
                 self.ranks = Ranks()
@@ -857,6 +980,10 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
             ___, channel, mask, owner, btime = params
             chan_obj = self.get_channel(channel)
 
+            self._ban_lists.setdefault(
+                self.utils.lowercase_nick_chan(channel), []
+            ).append((mask, owner, btime))
+
             event = irc_events.BanListEvent(self, chan_obj, mask, owner, btime)
             self.event_manager.run_callback("IRC/BanListReply", event)
 
@@ -864,31 +991,46 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
             # Called when the server's done spamming us with the ban list
             channel = params[1]
             chan_obj = self.get_channel(channel)
+            bans = self._ban_lists.pop(
+                self.utils.lowercase_nick_chan(channel), []
+            )
 
-            event = irc_events.BanListEndEvent(self, chan_obj)
+            event = irc_events.BanListEndEvent(self, chan_obj, bans)
             self.event_manager.run_callback("IRC/EndOfBanList", event)
 
         elif command == "RPL_NAMREPLY":
             # This is the response to a NAMES request.
             # Also includes some data that has nothing to do with channel names
+            # Names are collected until RPL_ENDOFNAMES, so there's one event
+            # per channel rather than one per chunk
             me, status, channel, names = params
-            users = names.split()
-            chan_obj = self.get_channel(channel) or Channel(self, channel)
+            key = self.utils.lowercase_nick_chan(channel)
 
             if status == "@":  # Secret channel
                 pass
             elif status == "*":  # Private channel
                 pass
 
-            event = irc_events.NAMESReplyEvent(self, chan_obj, status, users)
-            self.event_manager.run_callback("IRC/NAMESReply", event)
+            if key in self._names_replies:
+                self._names_replies[key][1].extend(names.split())
+            else:
+                self._names_replies[key] = (status, names.split())
 
         elif command == "RPL_ENDOFNAMES":
             # Called when the server's done spamming us with NAMES replies.
             me, channel, message = params
             chan_obj = self.get_channel(channel) or Channel(self, channel)
+            status, users = self._names_replies.pop(
+                self.utils.lowercase_nick_chan(channel), ("=", [])
+            )
 
-            event = irc_events.NAMESReplyEndEvent(self, chan_obj, message)
+            if users:
+                event = irc_events.NAMESReplyEvent(self, chan_obj, status,
+                                                   users)
+                self.event_manager.run_callback("IRC/NAMESReply", event)
+
+            event = irc_events.NAMESReplyEndEvent(self, chan_obj, message,
+                                                  users)
             self.event_manager.run_callback("IRC/EndOfNAMES", event)
 
         elif command == "ERR_INVITEONLYCHAN":
@@ -1024,28 +1166,15 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
 
     def get_users(self, nickname=None, ident=None, host=None, fullname=None,
                   hostmask=None):
-        matches = []
         if fullname:
             try:
                 nickname, ident, host = self.utils.split_hostmask(fullname)
             except Exception:
                 return None
-        if ident:
-            ident = ident.lower()
-        if host:
-            host = host.lower()
-        for user in self._users:
-            if (nickname and
-                    not self.utils.compare_nicknames(nickname, user.nickname)):
-                continue
-            if ident and ident != user.ident.lower():
-                continue
-            if host and host != user.host.lower():
-                continue
-            if (hostmask and
-                    not self.utils.match_hostmask(user.fullname, hostmask)):
-                continue
-            matches.append(user)
+        matches = self._users.find(nickname, ident, host)
+        if hostmask:
+            mask = self.utils.compile_hostmask(hostmask)
+            matches = [user for user in matches if mask.match_user(user)]
         return matches
 
     def get_channel(self, channel):
@@ -1078,7 +1207,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         user = self.get_user(nickname=nickname, ident=ident, host=host)
         if user is None:
             user = User(self, nickname, ident, host, is_tracked=True)
-            self._users.append(user)
+            self._users.add(user)
         user.add_channel(channel)
         channel.add_user(user)
         # For convenience
@@ -1116,6 +1245,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
                     _("Unexpected status in WHO response for user %s: %s") %
                     (user, s))
         user.realname = gecos.split(" ")[-1]
+        return user
 
     def user_channel_part(self, user, channel):
         """User-tracking related
@@ -1123,6 +1253,9 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         """
         if not isinstance(user, User):
             user = self.get_user(nickname=user)
+        if user is None:
+            # Not tracked yet - their WHO reply hasn't been applied
+            return
         # Remove user from channel and channel from user
         user.remove_channel(channel)
         channel.remove_user(user)
@@ -1357,8 +1490,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         elif isinstance(target, Channel):
             target = to_unicode(target.name)
 
-        for line in msg.split("\n"):
-            self.sendLine(u"NOTICE %s :%s" % (target, line))
+        self._send_lines(u"NOTICE", target, msg)
 
     def send_notice_no_event(self, target, message):
         """
@@ -1372,8 +1504,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
             target = to_unicode(target.name)
         msg = to_unicode(message)
 
-        for line in msg.split("\n"):
-            self.sendLine(u"NOTICE %s :%s" % (target, line))
+        self._send_lines(u"NOTICE", target, msg)
 
     def send_privmsg(self, target, message, use_event=True):
         if not message:
@@ -1395,8 +1526,26 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
         elif isinstance(target, Channel):
             target = to_unicode(target.name)
 
-        for line in msg.split("\n"):
-            self.sendLine(u"PRIVMSG %s :%s" % (target, line))
+        self._send_lines(u"PRIVMSG", target, msg)
+
+    def _send_lines(self, command, target, message):
+        """
+        Send a message as a line per line of text. Long messages go in the
+        send queue's bulk lane, so they don't hold up anything else.
+        """
+
+        lines = message.split("\n")
+
+        if len(lines) > self.bulk_lines:
+            lane = outbound.BULK
+        else:
+            lane = outbound.INTERACTIVE
+
+        key = target.lower()
+
+        for line in lines:
+            self.sendLine(u"%s %s :%s" % (command, target, line),
+                          lane=lane, target=key)
 
     def send_privmsg_no_event(self, target, message):
         """
@@ -1410,8 +1559,7 @@ class Protocol(irc.IRCClient, ChannelsProtocol):
             target = to_unicode(target.name)
         msg = to_unicode(message)
 
-        for line in msg.split("\n"):
-            self.sendLine(u"PRIVMSG %s :%s" % (target, line))
+        self._send_lines(u"PRIVMSG", target, msg)
 
     def send_ctcp(self, target, command, args=None):
         if isinstance(target, User):
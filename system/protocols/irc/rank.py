@@ -9,17 +9,52 @@ _ = Translations().get()
 class Rank(object):
     """
     A user rank in a channel.
-    We're all consenting adults here: don't change the properties after
-    creation please, or tentacles will go the wrong way.
+    Ranks are immutable, and there's only ever one Rank for each mode,
+    symbol and order - creating it again gives you the same object, so every
+    user and protocol shares it.
 
     Note: A higher order means a lower rank, and vice-versa. This class
     overrides certain operators, and does so in terms of rank, not order.
     i.e. Rank("o","@","2") > Rank("v","+","5") == True
     """
-    def __init__(self, mode, symbol, order):
-        self.mode = mode
-        self.symbol = symbol
-        self.order = order
+
+    __slots__ = ("mode", "symbol", "order")
+
+    _instances = {}
+
+    def __new__(cls, mode, symbol, order):
+        key = (cls, mode, symbol, order)
+
+        try:
+            return cls._instances[key]
+        except KeyError:
+            pass
+
+        rank = super(Rank, cls).__new__(cls)
+        object.__setattr__(rank, "mode", mode)
+        object.__setattr__(rank, "symbol", symbol)
+        object.__setattr__(rank, "order", order)
+
+        cls._instances[key] = rank
+        return rank
+
+    def __setattr__(self, name, value):
+        raise AttributeError(_("Ranks can't be changed"))
+
+    def __delattr__(self, name):
+        raise AttributeError(_("Ranks can't be changed"))
+
+    def __hash__(self):
+        return object.__hash__(self)
+
+    def __reduce__(self):
+        # So that copies are the same object too
+        return self.__class__, (self.mode, self.symbol, self.order)
+
+    def __repr__(self):
+        return "%s(%r, %r, %r)" % (
+            self.__class__.__name__, self.mode, self.symbol, self.order
+        )
 
     def __str__(self):
         return "%s%s%s" % (self.mode, self.symbol, self.order)
@@ -0,0 +1,181 @@
+# coding=utf-8
+
+"""
+Indexed storage for the users an IRC protocol is tracking.
+"""
+
+__author__ = 'Sean'
+
+from collections import OrderedDict
+
+
+class UserRegistry(object):
+    """
+    Tracked users, indexed by case-mapped nickname, ident and host.
+
+    Lookups only scan the users sharing the most specific key given, rather
+    than every user we know about. Iteration and lookup results keep the
+    order users were added in, so the first match is the oldest tracked user.
+
+    The registry doesn't notice when a user's nickname changes - call
+    `rename` after changing it, and `reindex` if the case-mapping changes.
+    """
+
+    def __init__(self, lower_nick):
+        """
+        :param lower_nick: Function that case-maps a nickname
+        """
+
+        self.lower_nick = lower_nick
+
+        self._serial = 0
+        # user -> (serial, nickname key, ident key, host key)
+        self._entries = OrderedDict()
+
+        self._by_nickname = {}
+        self._by_ident = {}
+        self._by_host = {}
+
+    def _keys(self, user):
+        return (self.lower_nick(user.nickname),
+                (user.ident or "").lower(),
+                (user.host or "").lower())
+
+    def _index(self, user, keys):
+        nickname, ident, host = keys
+
+        self._by_nickname.setdefault(nickname, []).append(user)
+        self._by_ident.setdefault(ident, []).append(user)
+        self._by_host.setdefault(host, []).append(user)
+
+    def _unindex(self, user, keys):
+        nickname, ident, host = keys
+
+        for index, key in ((self._by_nickname, nickname),
+                           (self._by_ident, ident),
+                           (self._by_host, host)):
+            bucket = index[key]
+            bucket.remove(user)
+
+            if not bucket:
+                del index[key]
+
+    def add(self, user):
+        """
+        Start tracking a user. Does nothing if the user is already tracked.
+        """
+
+        if user in self._entries:
+            return
+
+        keys = self._keys(user)
+
+        self._serial += 1
+        self._entries[user] = (self._serial,) + keys
+        self._index(user, keys)
+
+    def remove(self, user):
+        """
+        Stop tracking a user.
+
+        :raises ValueError: If the user isn't tracked
+        """
+
+        try:
+            entry = self._entries.pop(user)
+        except KeyError:
+            raise ValueError("User is not tracked: %s" % user)
+
+        self._unindex(user, entry[1:])
+
+    def rename(self, user):
+        """
+        Update the indexes after a tracked user's nickname, ident or host
+        changed. Does nothing if the user isn't tracked.
+        """
+
+        entry = self._entries.get(user)
+
+        if entry is None:
+            return
+
+        keys = self._keys(user)
+
+        self._unindex(user, entry[1:])
+        self._entries[user] = (entry[0],) + keys
+        self._index(user, keys)
+
+    def reindex(self):
+        """
+        Rebuild every index, for example after the case-mapping changed.
+        """
+
+        self._by_nickname = {}
+        self._by_ident = {}
+        self._by_host = {}
+
+        for user, entry in self._entries.items():
+            keys = self._keys(user)
+
+            self._entries[user] = (entry[0],) + keys
+            self._index(user, keys)
+
+    def clear(self):
+        """
+        Stop tracking all users.
+        """
+
+        self._entries.clear()
+        self._by_nickname = {}
+        self._by_ident = {}
+        self._by_host = {}
+
+    def find(self, nickname=None, ident=None, host=None):
+        """
+        Find tracked users matching all of the given (case-insensitive)
+        criteria. With no criteria, every tracked user is returned.
+
+        :return: Matching users, oldest first
+        :rtype: list
+        """
+
+        if ident:
+            ident = ident.lower()
+        if host:
+            host = host.lower()
+
+        if nickname:
+            nickname = self.lower_nick(nickname)
+            candidates = self._by_nickname.get(nickname, ())
+        elif ident:
+            candidates = self._by_ident.get(ident, ())
+        elif host:
+            candidates = self._by_host.get(host, ())
+        else:
+            return list(self._entries)
+
+        entries = self._entries
+        matches = []
+
+        for user in candidates:
+            entry = entries[user]
+
+            if ident and ident != entry[2]:
+                continue
+            if host and host != entry[3]:
+                continue
+            matches.append(user)
+
+        if len(matches) > 1:
+            matches.sort(key=lambda u: entries[u][0])
+
+        return matches
+
+    def __contains__(self, user):
+        return user in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,215 @@
+# coding=utf-8
+
+"""
+Buffering for multi-line WHO replies.
+
+When we join a channel, the server sends a WHO reply line for every user in
+it. Rather than updating user-tracking for each line as it arrives, replies
+are collected per channel and applied as one batch when the server says
+it's done. Big batches are applied a slice at a time with a Twisted
+cooperator, so the reactor can keep servicing other connections.
+
+Users can part or quit between their WHO reply arriving and it being
+applied. When they do, the protocol calls `depart`, and any reply for them
+that arrived before that is skipped. When they change nick, the protocol
+calls `rename` instead, and their replies are applied under the new one.
+"""
+
+__author__ = 'Sean'
+
+from twisted.internet import defer, task
+
+
+class ReplyBatch(object):
+    """
+    WHO replies for one channel.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.rows = []  # (lowercase nickname, or None if stale, row)
+        self.departed = {}  # lowercase nickname -> number of rows when gone
+        self.cancelled = False
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class ReplyBuffer(object):
+    """
+    Collects WHO replies per channel, and applies them in batches.
+    """
+
+    #: Batches with more rows than this are applied a slice at a time
+    sync_limit = 200
+
+    def __init__(self, lower, log=None, cooperator=None):
+        """
+        :param lower: Function that case-maps a nickname or channel name
+        :param log: Logger for errors raised while applying rows
+        :param cooperator: twisted.internet.task.Cooperator to apply big
+            batches with (default: Twisted's global cooperator)
+        """
+
+        self.lower = lower
+        self.log = log
+        self.cooperator = cooperator
+
+        self._collecting = {}  # lowercase channel -> ReplyBatch
+        self._applying = []
+
+    def _batches(self, channel=None):
+        if channel is None:
+            batches = list(self._collecting.itervalues())
+            batches.extend(self._applying)
+            return batches
+
+        channel = self.lower(channel)
+        batches = [b for b in self._applying if b.channel == channel]
+
+        if channel in self._collecting:
+            batches.append(self._collecting[channel])
+
+        return batches
+
+    def add(self, channel, nickname, row):
+        """
+        Buffer a WHO reply for a channel.
+
+        :param channel: The channel the reply is for
+        :param nickname: The nickname of the user the reply is about
+        :param row: Anything - passed to the handler when it's applied
+        """
+
+        key = self.lower(channel)
+        batch = self._collecting.get(key)
+
+        if batch is None:
+            batch = self._collecting[key] = ReplyBatch(key)
+
+        batch.rows.append((self.lower(nickname), row))
+
+    def finish(self, channel):
+        """
+        Stop collecting replies for a channel, ready for them to be applied.
+
+        :return: The channel's batch, which is empty if no replies came in
+        :rtype: ReplyBatch
+        """
+
+        key = self.lower(channel)
+        batch = self._collecting.pop(key, None)
+
+        if batch is None:
+            batch = ReplyBatch(key)
+
+        self._applying.append(batch)
+        return batch
+
+    def depart(self, channel, nickname):
+        """
+        Note that a user left a channel, so replies about them that we
+        already have are out of date.
+
+        :param channel: The channel they left, or None for all of them
+        :param nickname: Their nickname, before any change
+        """
+
+        nickname = self.lower(nickname)
+
+        for batch in self._batches(channel):
+            batch.departed[nickname] = len(batch.rows)
+
+    def rename(self, old, new, update):
+        """
+        Note that a user changed nick, so replies about them that we already
+        have should be applied under their new one.
+
+        :param old: Their old nickname
+        :param new: Their new nickname
+        :param update: Function taking a row and the new nickname, and
+            returning the row to apply instead
+        """
+
+        new_key = self.lower(new)
+        old = self.lower(old)
+
+        if old == new_key:
+            return
+
+        for batch in self._batches():
+            rows = batch.rows
+            stale_old = batch.departed.get(old, 0)
+
+            # Rows for whoever had the new nick before are still stale, but
+            # the rows we're about to move there mustn't be
+            stale_new = batch.departed.pop(new_key, 0)
+
+            for index, (nickname, row) in enumerate(rows):
+                if nickname == new_key and index < stale_new:
+                    rows[index] = (None, row)
+                elif nickname == old and index >= stale_old:
+                    rows[index] = (new_key, update(row, new))
+
+    def cancel(self, channel=None):
+        """
+        Drop pending replies for a channel we're no longer in.
+
+        :param channel: The channel, or None for every channel
+        """
+
+        for batch in self._batches(channel):
+            batch.cancelled = True
+
+        if channel is None:
+            self._collecting.clear()
+        else:
+            self._collecting.pop(self.lower(channel), None)
+
+    def apply(self, batch, handler):
+        """
+        Call a handler for every row in a finished batch that's still valid.
+
+        :param batch: A batch from `finish`
+        :param handler: Function to call with each row
+
+        :return: Deferred that fires with a list of the handler's results,
+            once every row's been handled
+        :rtype: Deferred
+        """
+
+        results = []
+        work = self._work(batch, handler, results)
+
+        if len(batch) <= self.sync_limit:
+            for _ in work:
+                pass
+
+            return defer.succeed(results)
+
+        d = (self.cooperator or task).coiterate(work)
+        d.addCallback(lambda _: results)
+        return d
+
+    def _work(self, batch, handler, results):
+        try:
+            for index, (nickname, row) in enumerate(batch.rows):
+                if batch.cancelled:
+                    return
+
+                if nickname is None:
+                    continue  # Stale, and renamed over
+
+                if batch.departed.get(nickname, -1) > index:
+                    continue
+
+                try:
+                    results.append(handler(row))
+                except Exception:
+                    if self.log is None:
+                        raise
+                    self.log.exception("Error applying WHO reply")
+
+                yield
+        finally:
+            self._applying.remove(batch)
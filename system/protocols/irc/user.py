@@ -5,19 +5,26 @@ from system.protocols.generic import user
 from system.protocols.irc.channel import Channel
 
 from system.translations import Translations
+from utils.misc import intern_string
 _ = Translations().get()
 
 
 class User(user.User):
+    __slots__ = ("ident", "host", "realname", "is_oper", "channels",
+                 "_ranks")
+
     def __init__(self, protocol, nickname, ident=None, host=None,
                  realname=None, is_oper=False, is_tracked=False):
-        super(User, self).__init__(nickname, protocol, is_tracked)
-        self.ident = ident
-        self.host = host
+        # Lots of users share idents and hosts (cloaks, bouncers), and
+        # nicknames are looked up all the time, so keep one copy of each
+        super(User, self).__init__(intern_string(nickname), protocol,
+                                   is_tracked)
+        self.ident = intern_string(ident)
+        self.host = intern_string(host)
         self.realname = realname
         self.is_oper = is_oper
         self.channels = set()
-        self._ranks = {}
+        self._ranks = None  # Most users have no ranks - created when needed
 
     @property
     def fullname(self):
@@ -47,7 +54,7 @@ class User(user.User):
         channel = self.protocol.utils.lowercase_nick_chan(channel)
         try:
             return self._ranks[channel]
-        except KeyError:
+        except (KeyError, TypeError):
             return []
 
     def get_highest_rank_in_channel(self, channel):
@@ -62,6 +69,8 @@ class User(user.User):
         if isinstance(channel, Channel):
             channel = channel.name
         channel = self.protocol.utils.lowercase_nick_chan(channel)
+        if self._ranks is None:
+            self._ranks = {}
         if channel not in self._ranks:
             self._ranks[channel] = set()
         self._ranks[channel].add(rank)
@@ -72,9 +81,9 @@ class User(user.User):
         channel = self.protocol.utils.lowercase_nick_chan(channel)
         try:
             self._ranks[channel].remove(rank)
-        except KeyError:
+        except (KeyError, TypeError):
             # Note: This can be thrown either by the dict lookup or the set
-            # - remove()
+            # - remove(), or if we have no ranks at all
             pass
 
     def respond(self, message):
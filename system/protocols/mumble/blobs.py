@@ -0,0 +1,217 @@
+# coding=utf-8
+
+"""
+Content-addressed storage for Mumble's blobs - user avatars and comments.
+
+Murmur identifies each blob by the SHA-1 hash of its contents, and usually
+only sends us the hash, leaving the blob itself to be asked for with a
+RequestBlob message. Users only keep these hashes, and the blobs are kept
+here, once each, however many users share them.
+
+The most recently used blobs are kept in memory, up to `max_bytes` of them.
+Blobs pushed out of memory are spilled to files in `path`, named after their
+hashes, and read back from there when they're next needed. Since the files
+never change, they're kept between runs, and a blob that's been seen before
+never has to be asked for again.
+"""
+
+__author__ = 'Gareth Coles'
+
+import hashlib
+import os
+
+from collections import OrderedDict
+
+from system.logging.logger import getLogger
+
+DEFAULT_PATH = "data/mumble/blobs"
+
+
+def blob_hash(data):
+    """
+    Get the hash Murmur uses to identify a blob.
+
+    :param data: The blob, as bytes
+
+    :return: The raw SHA-1 digest
+    :rtype: str
+    """
+
+    return hashlib.sha1(data).digest()
+
+
+class BlobStore(object):
+    """
+    Blobs by hash, in memory and spilled to disk.
+    """
+
+    def __init__(self, max_bytes=4 * 1024 * 1024, path=DEFAULT_PATH):
+        """
+        :param max_bytes: How many bytes of blobs to keep in memory
+        :param path: Directory to spill blobs to, or None to drop them
+            instead
+        """
+
+        self.max_bytes = max_bytes
+        self.path = path
+
+        self.log = getLogger("Mumble blobs")
+
+        self._blobs = OrderedDict()  # hash -> data
+        self._size = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.duplicates = 0
+        self.spilled = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create a store using the "blobs" section of a Mumble protocol's
+        configuration.
+        """
+
+        blobs = config.get("blobs") or {}
+
+        return cls(
+            max_bytes=blobs.get("memory", 4 * 1024 * 1024),
+            path=blobs.get("path", DEFAULT_PATH)
+        )
+
+    def __contains__(self, digest):
+        return digest in self._blobs or (
+            self.path is not None and os.path.exists(self._file(digest))
+        )
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def _file(self, digest):
+        return os.path.join(self.path, digest.encode("hex"))
+
+    def put(self, data):
+        """
+        Store a blob, if we don't already have it.
+
+        :param data: The blob, as bytes
+
+        :return: The blob's hash
+        :rtype: str
+        """
+
+        digest = blob_hash(data)
+
+        if digest in self._blobs:
+            self.duplicates += 1
+            self._blobs[digest] = self._blobs.pop(digest)
+        else:
+            self._remember(digest, data)
+
+        return digest
+
+    def get(self, digest):
+        """
+        Get a blob by its hash.
+
+        :param digest: The blob's raw SHA-1 digest
+
+        :return: The blob, or None if we don't have it
+        :rtype: str
+        """
+
+        data = self._blobs.pop(digest, None)
+
+        if data is not None:
+            self.hits += 1
+            self._blobs[digest] = data
+            return data
+
+        data = self._load(digest)
+
+        if data is None:
+            self.misses += 1
+            return None
+
+        self.disk_hits += 1
+        self._remember(digest, data)
+
+        return data
+
+    def _remember(self, digest, data):
+        self._blobs[digest] = data
+        self._size += len(data)
+
+        while self._size > self.max_bytes and self._blobs:
+            old_digest, old_data = self._blobs.popitem(last=False)
+            self._size -= len(old_data)
+            self._spill(old_digest, old_data)
+
+    def _load(self, digest):
+        if self.path is None:
+            return None
+
+        try:
+            with open(self._file(digest), "rb") as fh:
+                data = fh.read()
+        except IOError:
+            return None
+
+        if blob_hash(data) != digest:
+            # Truncated or otherwise damaged - we'll have to ask for it
+            return None
+
+        return data
+
+    def _spill(self, digest, data):
+        if self.path is None:
+            return
+
+        filename = self._file(digest)
+
+        if os.path.exists(filename):
+            return
+
+        try:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+
+            # Write it under another name first, so nothing ever reads a
+            # half-written blob
+            temp = filename + ".tmp"
+
+            with open(temp, "wb") as fh:
+                fh.write(data)
+
+            os.rename(temp, filename)
+        except (IOError, OSError) as e:
+            self.log.warning("Unable to spill blob to disk: {}", e)
+        else:
+            self.spilled += 1
+
+    def stats(self):
+        """
+        Get the store's size and hit counts.
+
+        :rtype: dict
+        """
+
+        return {
+            "blobs": len(self._blobs),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "duplicates": self.duplicates,
+            "spilled": self.spilled
+        }
+
+    def clear(self):
+        """
+        Forget every blob in memory. Spilled blobs are kept.
+        """
+
+        self._blobs.clear()
+        self._size = 0
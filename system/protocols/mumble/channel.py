@@ -8,13 +8,14 @@ _ = Translations().get()
 
 
 class Channel(channel.Channel):
+    __slots__ = ("channel_id", "parent", "position", "links")
+
     def __init__(self, protocol, channel_id, name, parent, position, links):
         super(Channel, self).__init__(name, protocol)
         self.channel_id = channel_id
         self.parent = parent
         self.position = position
         self.links = links
-        self.users = set()
 
     def __str__(self):
         return "%s (%s)" % (self.name, self.channel_id)
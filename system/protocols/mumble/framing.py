@@ -0,0 +1,141 @@
+# coding=utf-8
+
+"""
+Framing for the Mumble TCP stream.
+
+Every message on the control channel is a 6-byte prefix - a big-endian
+16-bit message type and 32-bit payload length - followed by the payload.
+"""
+
+__author__ = 'Gareth Coles'
+
+import struct
+
+PREFIX = struct.Struct(">HI")
+
+
+class InvalidMessageTypeError(Exception):
+    """
+    Raised when a frame header has a message type we don't know about. The
+    stream can't be resynchronised after this, so the connection should be
+    dropped.
+    """
+
+    def __init__(self, msg_type):
+        super(InvalidMessageTypeError, self).__init__(
+            "Invalid message type: %s" % msg_type
+        )
+        self.msg_type = msg_type
+
+
+class FrameBuffer(object):
+    """
+    Accumulates received data and splits it into frames without copying.
+
+    Data is appended to a single bytearray and frames are read from it in
+    place, with a moving read offset. Payloads are handed out as memoryviews
+    of the buffer, so they're only valid until the next call to `feed` -
+    copy them (with `tobytes`) if you need to keep them for longer. Consumed
+    data is discarded from the front of the buffer once it makes up at least
+    half of it, keeping the cost of framing linear in the amount of data
+    received.
+    """
+
+    def __init__(self, valid_types):
+        """
+        :param valid_types: Collection of the message types we accept
+        """
+
+        self.valid_types = frozenset(valid_types)
+
+        self._buffer = bytearray()
+        self._offset = 0
+        # Buffer length needed before the next frame can be read
+        self._wanted = PREFIX.size
+
+    def __len__(self):
+        """
+        The number of buffered bytes that haven't been framed yet.
+        """
+
+        return len(self._buffer) - self._offset
+
+    def _compact(self):
+        buf = self._buffer
+        offset = self._offset
+
+        try:
+            del buf[:offset]
+        except BufferError:
+            self._detach()
+        else:
+            self._offset = 0
+            self._wanted -= offset
+
+    def _detach(self):
+        # Someone kept a view of an old payload, so the buffer can't be
+        # resized. Leave them the old buffer and carry on with a copy of
+        # what's left.
+        offset = self._offset
+
+        self._buffer = self._buffer[offset:]
+        self._offset = 0
+        self._wanted -= offset
+
+    def feed(self, data):
+        """
+        Add received data to the buffer and read every complete frame.
+
+        :param data: The received bytes
+
+        :raises InvalidMessageTypeError: If a frame header has an unknown
+            message type - this is raised as soon as the header is received
+
+        :return: A list of (message type, payload memoryview) tuples
+        """
+
+        offset = self._offset
+
+        if offset and offset * 2 >= len(self._buffer):
+            self._compact()
+
+        try:
+            self._buffer.extend(data)
+        except BufferError:
+            self._detach()
+            self._buffer.extend(data)
+
+        buf = self._buffer
+        size = len(buf)
+
+        if size < self._wanted:
+            return []  # Still waiting for the rest of a header or payload
+
+        frames = []
+        view = memoryview(buf)
+        offset = self._offset  # May have been changed by compaction
+        prefix_length = PREFIX.size
+        unpack_from = PREFIX.unpack_from
+        valid_types = self.valid_types
+
+        while size - offset >= prefix_length:
+            msg_type, length = unpack_from(buf, offset)
+
+            if msg_type not in valid_types:
+                self._offset = offset
+                raise InvalidMessageTypeError(msg_type)
+
+            start = offset + prefix_length
+            end = start + length
+
+            if end > size:
+                self._offset = offset
+                self._wanted = end
+                return frames
+
+            frames.append((msg_type, view[start:end]))
+            offset = end
+
+        self._offset = offset
+        self._wanted = offset + prefix_length
+        return frames
@@ -4,7 +4,7 @@ import os
 import platform
 import struct
 
-from twisted.internet import reactor, ssl, task
+from twisted.internet import reactor, ssl
 
 from system.commands.manager import CommandManager
 
@@ -15,6 +15,7 @@ from system.events import general as general_events
 from system.events import mumble as mumble_events
 
 from system.logging.logger import getLogger
+from system.metrics.instrumentation import Instrumentation
 
 from system.protocols.capabilities import Capabilities
 
@@ -24,7 +25,11 @@ from system.protocols.mumble import Mumble_pb2
 from system.protocols.mumble.user import User
 from system.protocols.mumble.channel import Channel
 from system.protocols.mumble.acl import Perms
-from system.protocols.mumble.structs import Version
+from system.protocols.mumble.blobs import BlobStore
+from system.protocols.mumble.framing import FrameBuffer, \
+    InvalidMessageTypeError
+from system.protocols.mumble.userstats import UserStatsPoller, \
+    apply_userstats
 
 from system.translations import Translations
 
@@ -94,6 +99,28 @@ class Protocol(SingleChannelProtocol):
 
     # Reversing the IDs, so we are able to backreference.
     MESSAGE_ID = dict([(v, k) for k, v in enumerate(ID_MESSAGE)])
+    MESSAGE_TYPES = frozenset(MESSAGE_ID.values())
+
+    # Message class -> (handler method name, event name). Messages with an
+    # event name are only decoded if something is listening for that event,
+    # as that's all their handlers do - the rest are always decoded. Types
+    # that aren't here are only decoded for Mumble/Unknown listeners.
+    MESSAGE_HANDLERS = {
+        Mumble_pb2.Version: ("handle_msg_version", None),
+        Mumble_pb2.Reject: ("handle_msg_reject", None),
+        Mumble_pb2.CodecVersion: ("handle_msg_codecversion",
+                                  "Mumble/CodecVersion"),
+        Mumble_pb2.CryptSetup: ("handle_msg_cryptsetup", "Mumble/CryptoSetup"),
+        Mumble_pb2.ChannelState: ("handle_msg_channelstate", None),
+        Mumble_pb2.PermissionQuery: ("handle_msg_permissionquery", None),
+        Mumble_pb2.UserState: ("handle_msg_userstate", None),
+        Mumble_pb2.ServerSync: ("handle_msg_serversync", None),
+        Mumble_pb2.ServerConfig: ("handle_msg_serverconfig", None),
+        Mumble_pb2.Ping: ("handle_msg_ping", "Mumble/Ping"),
+        Mumble_pb2.UserRemove: ("handle_msg_userremove", None),
+        Mumble_pb2.TextMessage: ("handle_msg_textmessage", None),
+        Mumble_pb2.UserStats: ("handle_msg_userstats", None),
+    }
 
     PING_REPEAT_TIME = 5
 
@@ -125,12 +152,26 @@ class Protocol(SingleChannelProtocol):
         self.factory = factory
         self.config = config
 
-        self.received = ""
+        self.received = FrameBuffer(Protocol.MESSAGE_TYPES)
+
+        # Message type ID -> (bound handler, event name), built once so
+        # dispatching a message is a single lookup
+        self._handlers = dict(
+            (Protocol.MESSAGE_ID[cls], (getattr(self, name), event))
+            for cls, (name, event) in self.MESSAGE_HANDLERS.iteritems()
+        )
+        self.skipped = 0  # Messages that nothing wanted, so weren't decoded
+
+        # Users' avatars and comments, by hash
+        self.blobs = BlobStore.from_config(config)
+        self._blob_requests = set()  # Hashes we've asked the server for
+
         self.log = getLogger(self.name)
         self.log.info("Setting up..")
 
         self.command_manager = CommandManager()
         self.event_manager = EventManager()
+        self.instrumentation = Instrumentation()
 
         self.username = config["identity"]["username"]
         self.password = config["identity"]["password"]
@@ -143,7 +184,7 @@ class Protocol(SingleChannelProtocol):
         self.should_mute_self = audio_conf.get("should_mute_self", True)
         self.should_deafen_self = audio_conf.get("should_deafen_self", True)
 
-        self.userstats_request_rate = config.get("userstats_request_rate", 60)
+        self.userstats = UserStatsPoller.from_config(self, config)
 
     def _get_client_context(self):
         # Check if a cert file is specified in config
@@ -277,55 +318,55 @@ class Protocol(SingleChannelProtocol):
 
     def connectionLost(self, reason=None):
         self.pinging = False
+        self._blob_requests.clear()
         self.stop_userstats_requests()
 
     def dataReceived(self, recv):
-        # Append our received data
-        self.received = self.received + recv
-
-        # If we have enough bytes to read the header, we do that
-        while len(self.received) >= Protocol.PREFIX_LENGTH:
-            msg_type, length = \
-                struct.unpack(Protocol.PREFIX_FORMAT,
-                              self.received[:Protocol.PREFIX_LENGTH])
-
-            full_length = Protocol.PREFIX_LENGTH + length
-
-            self.log.trace("Length: %d" % length)
-            self.log.trace("Message type: %d" % msg_type)
-
-            # Check if this this a valid message ID
-            if msg_type not in Protocol.MESSAGE_ID.values():
-                self.log.error(_("Message ID not available."))
-                self.transport.loseConnection()
-                return
+        # Append our received data and read any complete messages
+        try:
+            frames = self.received.feed(recv)
+        except InvalidMessageTypeError:
+            self.log.error(_("Message ID not available."))
+            self.transport.loseConnection()
+            return
 
-            # We need to check if we have enough bytes to fully read the
-            # message
-            if len(self.received) < full_length:
-                self.log.trace(_("Need to fill data"))
-                return
+        if frames and self.instrumentation.enabled:
+            self.instrumentation.count(
+                "protocols", (self.name, "packets_in"), len(frames)
+            )
 
+        for msg_type, data in frames:
             # Read and handle the specific message
             if msg_type == 1:
                 # Non-Protobuf messages
                 # 1 is taken from the position of UDPTunnel in ID_MESSAGE
-                self.recv_UDP(self.received[Protocol.PREFIX_LENGTH:
-                                            Protocol.PREFIX_LENGTH + length])
-            else:
-                # Regular (Protobuf) messages
-                msg = Protocol.ID_MESSAGE[msg_type]()
-                msg.ParseFromString(
-                    self.received[Protocol.PREFIX_LENGTH:
-                                  Protocol.PREFIX_LENGTH + length])
+                self.recv_UDP(data)
+                continue
 
-                # Handle the message
-                try:
-                    self.recvProtobuf(msg_type, msg)
-                except Exception:
-                    self.log.exception(_("Exception while handling data."))
+            # Regular (Protobuf) messages
+            handler, event = self._handlers.get(
+                msg_type, (None, "Mumble/Unknown")
+            )
+
+            if event is not None and \
+                    not self.event_manager.has_callback(event):
+                # Nothing wants it, so don't bother decoding it
+                self.skipped += 1
+                continue
 
-            self.received = self.received[full_length:]
+            self.log.trace("Message type: {}, length: {}", msg_type,
+                           len(data))
+
+            try:
+                if handler is None:
+                    # Listeners decode it themselves, if they need to
+                    self.handle_msg_unknown(msg_type, data=data)
+                else:
+                    msg = Protocol.ID_MESSAGE[msg_type]()
+                    msg.ParseFromString(data)
+                    handler(msg)
+            except Exception:
+                self.log.exception(_("Exception while handling data."))
 
     def sendProtobuf(self, message):
         # We find the message ID
@@ -337,161 +378,174 @@ class Protocol(SingleChannelProtocol):
         # Compile the data with the header
         data = struct.pack(Protocol.PREFIX_FORMAT, msg_type, length) + msg_data
 
+        if self.instrumentation.enabled:
+            self.instrumentation.count("protocols", (self.name, "packets_out"))
+
         # Send the data
         self.transport.write(data)
 
     def recvProtobuf(self, msg_type, message):
-        if isinstance(message, Mumble_pb2.Version):
-            # version, release, os, os_version
-            self.log.info(_("Connected to Murmur v%s") % message.release)
-            event = general_events.PostSetupEvent(self, self.config)
-            self.event_manager.run_callback("PostSetup", event)
-        elif isinstance(message, Mumble_pb2.Reject):
-            # version, release, os, os_version
-            self.log.info(_("Could not connect to server: %s - %s") %
-                          (message.type, message.reason))
+        handler = self._handlers.get(msg_type, (None, None))[0]
 
-            self.transport.loseConnection()
-            self.pinging = False
-        elif isinstance(message, Mumble_pb2.CodecVersion):
-            # alpha, beta, prefer_alpha, opus
-            alpha = message.alpha
-            beta = message.beta
-            prefer_alpha = message.prefer_alpha
-            opus = message.opus
-
-            event = mumble_events.CodecVersion(self, alpha, beta, prefer_alpha,
-                                               opus)
-            self.event_manager.run_callback("Mumble/CodecVersion", event)
-        elif isinstance(message, Mumble_pb2.CryptSetup):
-            # key, client_nonce, server_nonce
-            key = message.key
-            c_n = message.client_nonce
-            s_n = message.server_nonce
-
-            event = mumble_events.CryptoSetup(self, key, c_n, s_n)
-            self.event_manager.run_callback("Mumble/CryptoSetup", event)
-        elif isinstance(message, Mumble_pb2.ChannelState):
-            # channel_id, name, position, [parent]
-            self.handle_msg_channelstate(message)
-        elif isinstance(message, Mumble_pb2.PermissionQuery):
-            # channel_id, permissions, flush
-            channel = self.channels[message.channel_id]
-            permissions = message.permissions
-            flush = message.flush
-            self.set_permissions(channel, permissions, flush)
-            self.log.trace("PermissionQuery received: channel: '%s', "
-                           "permissions: '%s', flush:'%s'" %
-                           (channel,
-                            Perms.get_permissions_names(permissions),
-                            flush))
-            event = mumble_events.PermissionsQuery(self, channel, permissions,
-                                                   flush)
-            self.event_manager.run_callback("Mumble/PermissionsQuery", event)
-        elif isinstance(message, Mumble_pb2.UserState):
-            # session, name,
-            # [user_id, suppress, hash, actor, self_mute, self_deaf]
-            self.handle_msg_userstate(message)
-        elif isinstance(message, Mumble_pb2.ServerSync):
-            # session, max_bandwidth, welcome_text, permissions
-            session = message.session
+        if handler is None:
+            self.handle_msg_unknown(msg_type, message=message)
+        else:
+            handler(message)
+
+    def handle_msg_version(self, message):
+        # version, release, os, os_version
+        self.log.info(_("Connected to Murmur v%s") % message.release)
+        event = general_events.PostSetupEvent(self, self.config)
+        self.event_manager.run_callback("PostSetup", event)
+
+    def handle_msg_reject(self, message):
+        # version, release, os, os_version
+        self.log.info(_("Could not connect to server: %s - %s") %
+                      (message.type, message.reason))
+
+        self.transport.loseConnection()
+        self.pinging = False
+
+    def handle_msg_codecversion(self, message):
+        # alpha, beta, prefer_alpha, opus
+        alpha = message.alpha
+        beta = message.beta
+        prefer_alpha = message.prefer_alpha
+        opus = message.opus
+
+        event = mumble_events.CodecVersion(self, alpha, beta, prefer_alpha,
+                                           opus)
+        self.event_manager.run_callback("Mumble/CodecVersion", event)
+
+    def handle_msg_cryptsetup(self, message):
+        # key, client_nonce, server_nonce
+        key = message.key
+        c_n = message.client_nonce
+        s_n = message.server_nonce
+
+        event = mumble_events.CryptoSetup(self, key, c_n, s_n)
+        self.event_manager.run_callback("Mumble/CryptoSetup", event)
+
+    def handle_msg_permissionquery(self, message):
+        # channel_id, permissions, flush
+        channel = self.channels[message.channel_id]
+        permissions = message.permissions
+        flush = message.flush
+        self.set_permissions(channel, permissions, flush)
+        self.log.trace("PermissionQuery received: channel: '%s', "
+                       "permissions: '%s', flush:'%s'" %
+                       (channel,
+                        Perms.get_permissions_names(permissions),
+                        flush))
+        event = mumble_events.PermissionsQuery(self, channel, permissions,
+                                               flush)
+        self.event_manager.run_callback("Mumble/PermissionsQuery", event)
+
+    def handle_msg_serversync(self, message):
+        # session, max_bandwidth, welcome_text, permissions
+        session = message.session
+        self.max_bandwidth = message.max_bandwidth
+        permissions = message.permissions
+        # TODO: Check this permissions relevancy - root chan? We don't know
+        # what channel we're in yet, so it must be
+        self.set_permissions(0, permissions)
+        self.welcome_text = html_to_text(message.welcome_text, True)
+        self.log.info(_("===   Welcome message   ==="))
+        self.log.trace("ServerSync received: max_bandwidth: '%s', "
+                       "permissions: '%s', welcome text: [below]" %
+                       (self.max_bandwidth,
+                        Perms.get_permissions_names(permissions)))
+        for line in self.welcome_text.split("\n"):
+            self.log.info(line)
+        self.log.info(_("=== End welcome message ==="))
+
+        event = mumble_events.ServerSync(self, session, self.max_bandwidth,
+                                         self.welcome_text, permissions)
+        self.event_manager.run_callback("Mumble/ServerSync", event)
+
+    def handle_msg_serverconfig(self, message):
+        # max_bandwidth, welcome_text, allow_html, message_length,
+        # image_message_length
+        if message.HasField("max_bandwidth"):
             self.max_bandwidth = message.max_bandwidth
-            permissions = message.permissions
-            # TODO: Check this permissions relevancy - root chan? We don't know
-            # what channel we're in yet, so it must be
-            self.set_permissions(0, permissions)
-            self.welcome_text = html_to_text(message.welcome_text, True)
-            self.log.info(_("===   Welcome message   ==="))
-            self.log.trace("ServerSync received: max_bandwidth: '%s', "
-                           "permissions: '%s', welcome text: [below]" %
-                           (self.max_bandwidth,
-                            Perms.get_permissions_names(permissions)))
-            for line in self.welcome_text.split("\n"):
-                self.log.info(line)
-            self.log.info(_("=== End welcome message ==="))
-
-            event = mumble_events.ServerSync(self, session, self.max_bandwidth,
-                                             self.welcome_text, permissions)
-            self.event_manager.run_callback("Mumble/ServerSync", event)
-        elif isinstance(message, Mumble_pb2.ServerConfig):
-            # max_bandwidth, welcome_text, allow_html, message_length,
-            # image_message_length
-            if message.HasField("max_bandwidth"):
-                self.max_bandwidth = message.max_bandwidth
-            if message.HasField("welcome_text"):
-                self.welcome_text = message.welcome_text
-            if message.HasField("allow_html"):
-                self.allow_html = message.allow_html
-            if message.HasField("message_length"):
-                self.message_length = message.message_length
-            if message.HasField("image_message_length"):
-                self.image_message_length = message.image_message_length
-
-            # TODO: FIXME: Not all of these are necessarily set by this packet,
-            # but the event acts as if they are.
-            event = mumble_events.ServerConfig(self, self.max_bandwidth,
-                                               self.welcome_text,
-                                               self.allow_html,
-                                               self.message_length,
-                                               self.image_message_length)
-            self.event_manager.run_callback("Mumble/ServerConfig", event)
-        elif isinstance(message, Mumble_pb2.Ping):
-            # timestamp, good, late, lost, resync, udp_packets, tcp_packets,
-            # udp_ping_avg, udp_ping_var, tcp_ping_avg, tcp_ping_var
-            timestamp = message.timestamp
-            good = message.good
-            late = message.late
-            lost = message.lost
-            resync = message.resync
-            udp = message.udp_packets
-            tcp = message.tcp_packets
-            udp_a = message.udp_ping_avg
-            udp_v = message.udp_ping_var
-            tcp_a = message.tcp_ping_avg
-            tcp_v = message.tcp_ping_var
-
-            event = mumble_events.Ping(self, timestamp, good, late, lost,
-                                       resync, tcp, udp, tcp_a, udp_a, tcp_v,
-                                       udp_v)
-
-            self.event_manager.run_callback("Mumble/Ping", event)
-        elif isinstance(message, Mumble_pb2.UserRemove):
-            # session, actor, reason, ban
-            session = message.session
-            actor = message.actor
-            reason = message.reason
-            ban = message.ban
-
-            if message.session in self.users:
-                user = self.users[message.session]
-                user.is_tracked = False
-                self.log.info(_("User left: %s") %
-                              user)
-                user.channel.remove_user(user)
-                del self.users[message.session]
-            else:
-                user = None
-
-            if actor in self.users:
-                event = mumble_events.UserRemove(self, session, actor, user,
-                                                 reason, ban,
-                                                 self.users[actor])
-                self.event_manager.run_callback("Mumble/UserRemove", event)
-
-            s_event = general_events.UserDisconnected(self, user)
-            self.event_manager.run_callback("UserDisconnected", s_event)
-        elif isinstance(message, Mumble_pb2.TextMessage):
-            # actor, channel_id, message
-            self.handle_msg_textmessage(message)
-        elif isinstance(message, Mumble_pb2.UserStats):
-            self.handle_msg_userstats(message)
+        if message.HasField("welcome_text"):
+            self.welcome_text = message.welcome_text
+        if message.HasField("allow_html"):
+            self.allow_html = message.allow_html
+        if message.HasField("message_length"):
+            self.message_length = message.message_length
+        if message.HasField("image_message_length"):
+            self.image_message_length = message.image_message_length
+
+        # TODO: FIXME: Not all of these are necessarily set by this packet,
+        # but the event acts as if they are.
+        event = mumble_events.ServerConfig(self, self.max_bandwidth,
+                                           self.welcome_text,
+                                           self.allow_html,
+                                           self.message_length,
+                                           self.image_message_length)
+        self.event_manager.run_callback("Mumble/ServerConfig", event)
+
+    def handle_msg_ping(self, message):
+        # timestamp, good, late, lost, resync, udp_packets, tcp_packets,
+        # udp_ping_avg, udp_ping_var, tcp_ping_avg, tcp_ping_var
+        timestamp = message.timestamp
+        good = message.good
+        late = message.late
+        lost = message.lost
+        resync = message.resync
+        udp = message.udp_packets
+        tcp = message.tcp_packets
+        udp_a = message.udp_ping_avg
+        udp_v = message.udp_ping_var
+        tcp_a = message.tcp_ping_avg
+        tcp_v = message.tcp_ping_var
+
+        event = mumble_events.Ping(self, timestamp, good, late, lost,
+                                   resync, tcp, udp, tcp_a, udp_a, tcp_v,
+                                   udp_v)
+
+        self.event_manager.run_callback("Mumble/Ping", event)
+
+    def handle_msg_userremove(self, message):
+        # session, actor, reason, ban
+        session = message.session
+        actor = message.actor
+        reason = message.reason
+        ban = message.ban
+
+        if message.session in self.users:
+            user = self.users[message.session]
+            user.is_tracked = False
+            self.log.info(_("User left: %s") %
+                          user)
+            user.channel.remove_user(user)
+            del self.users[message.session]
         else:
-            self.log.trace(_("Unknown message type: %s") % message.__class__)
-            self.log.trace(_("Received message '%s' (%d):\n%s")
-                           % (message.__class__, msg_type, str(message)))
+            user = None
+
+        if actor in self.users:
+            event = mumble_events.UserRemove(self, session, actor, user,
+                                             reason, ban,
+                                             self.users[actor])
+            self.event_manager.run_callback("Mumble/UserRemove", event)
 
-            event = mumble_events.Unknown(self, type(message), message)
-            self.event_manager.run_callback("Mumble/Unknown", event)
+        s_event = general_events.UserDisconnected(self, user)
+        self.event_manager.run_callback("UserDisconnected", s_event)
+
+    def handle_msg_unknown(self, msg_type, message=None, data=None):
+        """
+        Handle a message we don't do anything with ourselves. The event's
+        message is decoded from the raw data on demand, if it hasn't been
+        already.
+        """
+
+        message_class = Protocol.ID_MESSAGE[msg_type]
+
+        self.log.trace(_("Unknown message type: %s") % message_class)
+
+        event = mumble_events.Unknown(self, message_class, message, data)
+        self.event_manager.run_callback("Mumble/Unknown", event)
 
     def recv_UDP(self, data):
         """
@@ -542,22 +596,10 @@ class Protocol(SingleChannelProtocol):
         self.init_ping()
 
     def start_userstats_requests(self):
-        self._userstats_requests_task = task.LoopingCall(
-            self.userstats_request_handler
-        )
-        self._userstats_requests_task.start(self.userstats_request_rate, False)
+        self.userstats.start()
 
     def stop_userstats_requests(self):
-        if self._userstats_requests_task and \
-                self._userstats_requests_task.running:
-            self._userstats_requests_task.stop()
-
-    def userstats_request_handler(self):
-        try:
-            for user in self.users.itervalues():
-                self.request_userstats(user, True)
-        except Exception:
-            self.log.exception("Error in UserStats request loop")
+        self.userstats.stop()
 
     def handle_msg_channelstate(self, message):
         if message.channel_id not in self.channels:
@@ -624,15 +666,7 @@ class Protocol(SingleChannelProtocol):
             self.users[message.session] = user
 
             # TODO: plugin_identity and plugin_context
-            # TODO: Handle comments and avatars properly
-            if message.HasField("comment_hash"):
-                user.comment_hash = message.comment_hash
-            if message.HasField("comment"):
-                user.comment = message.comment
-            if message.HasField("texture_hash"):
-                user.avatar_hash = message.texture_hash
-            if message.HasField("texture"):
-                user.avatar = message.texture
+            self.update_blobs(user, message)
 
             if message.HasField("user_id"):
                 user_id = message.user_id
@@ -797,18 +831,8 @@ class Protocol(SingleChannelProtocol):
                                                           user.recording)
                 self.event_manager.run_callback("Mumble/UserRecordingToggle",
                                                 event)
-            # TODO: Events
-            # - Comments/avatars may want higher level events. For example, we
-            # - may want to automatically request the full comment/avatar if we
-            # - get a hash, and only provide an API for the full thing.
-            if message.HasField("comment_hash"):
-                user.comment_hash = message.comment_hash
-            if message.HasField("comment"):
-                user.comment = message.comment
-            if message.HasField("texture_hash"):
-                user.avatar_hash = message.texture_hash
-            if message.HasField("texture"):
-                user.avatar = message.texture
+            # TODO: Events for comment and avatar changes
+            self.update_blobs(user, message)
 
             if message.HasField("user_id"):
                 user_id = message.user_id
@@ -832,6 +856,74 @@ class Protocol(SingleChannelProtocol):
                     event_type = "Mumble/UserUnregistered"
                 self.event_manager.run_callback(event_type, event)
 
+    def update_blobs(self, user, message):
+        """
+        Update a user's comment and avatar hashes from a UserState message,
+        storing the blobs themselves if they were sent.
+        """
+
+        if message.HasField("comment"):
+            if message.comment:
+                user.comment_hash = self.blobs.put(
+                    message.comment.encode("utf-8")
+                )
+                self._blob_requests.discard(user.comment_hash)
+            else:
+                user.comment_hash = None
+        elif message.HasField("comment_hash"):
+            user.comment_hash = message.comment_hash or None
+
+        if message.HasField("texture"):
+            if message.texture:
+                user.avatar_hash = self.blobs.put(message.texture)
+                self._blob_requests.discard(user.avatar_hash)
+            else:
+                user.avatar_hash = None
+        elif message.HasField("texture_hash"):
+            user.avatar_hash = message.texture_hash or None
+
+    def get_blob(self, user, blob_hash, kind):
+        """
+        Get a user's comment or avatar from the blob store, asking the server
+        for it if we don't have it.
+
+        :param user: The user the blob belongs to
+        :param blob_hash: The blob's hash
+        :param kind: "comment" or "texture"
+
+        :return: The blob, or None if it hasn't been received yet
+        :rtype: str
+        """
+
+        data = self.blobs.get(blob_hash)
+
+        if data is None:
+            self.request_blob(user, blob_hash, kind)
+
+        return data
+
+    def request_blob(self, user, blob_hash, kind):
+        """
+        Ask the server for a user's comment or avatar. It's sent back in a
+        UserState message. Blobs that have already been asked for aren't
+        asked for again.
+
+        :param user: The user the blob belongs to
+        :param blob_hash: The blob's hash
+        :param kind: "comment" or "texture"
+        """
+
+        if blob_hash in self._blob_requests or self.transport is None:
+            return
+
+        self._blob_requests.add(blob_hash)
+
+        request = Mumble_pb2.RequestBlob()
+        getattr(request, "session_%s" % kind).append(user.session)
+
+        self.log.trace("Requesting {} for {}", kind, user)
+        self.sendProtobuf(request)
+
     def handle_msg_textmessage(self, message):
         if message.actor in self.users:
             user_obj = self.users[message.actor]
@@ -900,7 +992,7 @@ class Protocol(SingleChannelProtocol):
                 )
 
     def handle_msg_userstats(self, message):
-        user = self.users[message.session]
+        user = self.users.get(message.session)
 
         # Not sure if this would ever go over UDP, but if it does, then it's
         # possible to arrive after the user has disconnected.
@@ -910,70 +1002,11 @@ class Protocol(SingleChannelProtocol):
             )
             return
 
-        # You'd think the stats_only flag would avoid us having to do all these
-        # HasField checks, but the server doesn't appear to ever send it.
-        # There are some fields that appear to exist or not in a group, but
-        # I'm not certain if that's always the case, and 3rd party
-        # implementations may do it differently anyway.
-
-        if len(message.certificates):
-            user.certificates = list(message.certificates)
-        if message.HasField("version"):
-            user.version = Version(
-                message.version.version,
-                message.version.release,
-                message.version.os,
-                message.version.os_version
-            )
-        if len(message.celt_versions):
-            user.celt_versions = list(message.celt_versions)
-        if message.HasField("address"):
-            user.address = message.address
-        if message.HasField("strong_certificate"):
-            user.strong_certificate = message.strong_certificate
-        if message.HasField("opus"):
-            user.opus = message.opus
-
-        if message.HasField("from_client"):
-            stats = user.packet_stats_from_client
-            if message.from_client.HasField("good"):
-                stats.good = message.from_client.good
-            if message.from_client.HasField("late"):
-                stats.late = message.from_client.late
-            if message.from_client.HasField("lost"):
-                stats.lost = message.from_client.lost
-            if message.from_client.HasField("resync"):
-                stats.resync = message.from_client.resync
-
-        if message.HasField("from_server"):
-            stats = user.packet_stats_from_server
-            if message.from_server.HasField("good"):
-                stats.good = message.from_server.good
-            if message.from_server.HasField("late"):
-                stats.late = message.from_server.late
-            if message.from_server.HasField("lost"):
-                stats.lost = message.from_server.lost
-            if message.from_server.HasField("resync"):
-                stats.resync = message.from_server.resync
-
-        if message.HasField("udp_packets"):
-            user.udp_packets_sent = message.udp_packets
-        if message.HasField("tcp_packets"):
-            user.tcp_packets_sent = message.tcp_packets
-
-        if message.HasField("udp_ping_avg"):
-            user.udp_ping_avg = message.udp_ping_avg
-        if message.HasField("udp_ping_var"):
-            user.udp_ping_var = message.udp_ping_var
-        if message.HasField("tcp_ping_avg"):
-            user.tcp_ping_avg = message.tcp_ping_avg
-        if message.HasField("tcp_ping_var"):
-            user.tcp_ping_var = message.tcp_ping_var
-
-        if message.HasField("onlinesecs"):
-            user.online_time = message.onlinesecs
-        if message.HasField("idlesecs"):
-            user.idle_time = message.idlesecs
+        # You'd think the stats_only flag would avoid us having to check for
+        # every field, but the server doesn't appear to ever send it. Only
+        # the fields that are there are applied.
+        apply_userstats(user, message)
+        self.userstats.received(user, message.ByteSize())
 
         event = mumble_events.UserStats(self, user)
         self.event_manager.run_callback("Mumble/UserStats", event)
@@ -13,6 +13,8 @@ class Stats(object):
     Mumble user connection stats
     """
 
+    __slots__ = ("good", "late", "lost", "resync")
+
     def __init__(self, good=0, late=0, lost=0, resync=0):
         self.good = good
         self.late = late
@@ -27,3 +29,47 @@ class Stats(object):
             self.lost,
             self.resync
         )
+
+
+class UserDetails(object):
+    """
+    The parts of a Mumble user that only come from UserStats messages.
+
+    Most of these are rarely looked at, so users only get one of these
+    once something's set - see `system.protocols.mumble.user.User`.
+    """
+
+    __slots__ = ("certificates", "packet_stats_from_client",
+                 "packet_stats_from_server", "udp_packets_sent",
+                 "tcp_packets_sent", "udp_ping_avg", "udp_ping_var",
+                 "tcp_ping_avg", "tcp_ping_var", "version", "celt_versions",
+                 "address", "bandwidth", "online_time", "idle_time",
+                 "strong_certificate", "opus")
+
+    #: Attributes holding objects that get changed in place - reading one of
+    #: these creates the details, so there's something to change
+    MUTABLE = frozenset(["certificates", "packet_stats_from_client",
+                         "packet_stats_from_server", "celt_versions"])
+
+    def __init__(self):
+        self.certificates = []
+        self.packet_stats_from_client = Stats()
+        self.packet_stats_from_server = Stats()
+        self.udp_packets_sent = 0
+        self.tcp_packets_sent = 0
+        self.udp_ping_avg = 0
+        self.udp_ping_var = 0
+        self.tcp_ping_avg = 0
+        self.tcp_ping_var = 0
+        self.version = None
+        self.celt_versions = []
+        self.address = None
+        self.bandwidth = 0
+        self.online_time = 0
+        self.idle_time = 0
+        self.strong_certificate = False
+        self.opus = False
+
+
+#: What users without details read - never change this
+NO_DETAILS = UserDetails()
@@ -1,13 +1,57 @@
 # coding=utf-8
 from system.protocols.mumble.acl import Perms
-from system.protocols.mumble.structs import Stats
+from system.protocols.mumble.structs import NO_DETAILS, UserDetails
 
 __author__ = 'Sean'
 
 from system.protocols.generic import user
 
 
+def _detail(name):
+    """
+    Property for an attribute that's stored in the user's details.
+    """
+
+    mutable = name in UserDetails.MUTABLE
+
+    def fget(self):
+        details = self._details
+
+        if details is None:
+            if not mutable:
+                return getattr(NO_DETAILS, name)
+            details = self._details = UserDetails()
+
+        return getattr(details, name)
+
+    def fset(self, value):
+        if self._details is None:
+            self._details = UserDetails()
+
+        setattr(self._details, name, value)
+
+    return property(fget, fset)
+
+
 class User(user.User):
+    """
+    A Mumble user.
+
+    The attributes that come from UserStats messages, like *version* and
+    *packet_stats_from_client*, live in a `UserDetails` that's only created
+    when one of them is set.
+
+    Users only keep the hashes of their comments and avatars. The blobs
+    themselves are in the protocol's `BlobStore`, and are only asked for
+    from the server when *comment* or *avatar* is used - until they arrive,
+    those are None.
+    """
+
+    __slots__ = ("session", "channel", "mute", "deaf", "suppress",
+                 "self_mute", "self_deaf", "priority_speaker", "recording",
+                 "comment_hash", "avatar_hash", "user_id",
+                 "certificate_hash", "_details")
+
     def __init__(self, protocol, session, name, channel, mute, deaf,
                  suppress, self_mute, self_deaf, priority_speaker, recording):
         # Mumble is always "tracked"
@@ -22,32 +66,82 @@ class User(user.User):
         self.priority_speaker = priority_speaker
         self.recording = recording
 
-        self.comment = None
         self.comment_hash = None
-        self.avatar = None
         self.avatar_hash = None
 
         self.user_id = None
 
         self.certificate_hash = None
 
-        self.certificates = []
-        self.packet_stats_from_client = Stats()
-        self.packet_stats_from_server = Stats()
-        self.udp_packets_sent = 0
-        self.tcp_packets_sent = 0
-        self.udp_ping_avg = 0
-        self.udp_ping_var = 0
-        self.tcp_ping_avg = 0
-        self.tcp_ping_var = 0
-        self.version = None
-        self.celt_versions = []
-        self.address = None
-        self.bandwidth = 0
-        self.online_time = 0
-        self.idle_time = 0
-        self.strong_certificate = False
-        self.opus = False
+        self._details = None
+
+    certificates = _detail("certificates")
+    packet_stats_from_client = _detail("packet_stats_from_client")
+    packet_stats_from_server = _detail("packet_stats_from_server")
+    udp_packets_sent = _detail("udp_packets_sent")
+    tcp_packets_sent = _detail("tcp_packets_sent")
+    udp_ping_avg = _detail("udp_ping_avg")
+    udp_ping_var = _detail("udp_ping_var")
+    tcp_ping_avg = _detail("tcp_ping_avg")
+    tcp_ping_var = _detail("tcp_ping_var")
+    version = _detail("version")
+    celt_versions = _detail("celt_versions")
+    address = _detail("address")
+    bandwidth = _detail("bandwidth")
+    online_time = _detail("online_time")
+    idle_time = _detail("idle_time")
+    strong_certificate = _detail("strong_certificate")
+    opus = _detail("opus")
+
+    @property
+    def comment(self):
+        """
+        The user's comment, if they have one and we've received it.
+
+        :rtype: unicode
+        """
+
+        if self.comment_hash is None or self.protocol is None:
+            return None
+
+        data = self.protocol.get_blob(self, self.comment_hash, "comment")
+
+        if data is None:
+            return None
+
+        return data.decode("utf-8")
+
+    @property
+    def avatar(self):
+        """
+        The user's avatar image, if they have one and we've received it.
+
+        :rtype: str
+        """
+
+        if self.avatar_hash is None or self.protocol is None:
+            return None
+
+        return self.protocol.get_blob(self, self.avatar_hash, "texture")
+
+    @property
+    def details(self):
+        """
+        The user's `UserDetails`, created if they haven't got any yet.
+        """
+
+        if self._details is None:
+            self._details = UserDetails()
+
+        return self._details
+
+    @property
+    def has_details(self):
+        """
+        Whether we've had any UserStats for this user yet.
+        """
+
+        return self._details is not None
 
     def __str__(self):
         return "%s (%s)" % (self.nickname, self.session)
@@ -0,0 +1,325 @@
+# coding=utf-8
+
+"""
+Polling Mumble users for their stats.
+
+Rather than asking for every user's stats at once, every so often, the
+*UserStatsPoller* wakes up every `tick` seconds and asks for a few of them,
+working through the users' sessions in order with a round-robin cursor - so
+the requests, and the server's replies, are spread out evenly.
+
+How often each user is asked depends on how active they are. Users who've
+been idle for less than `idle_after` seconds are polled every `rate`
+seconds, and the rest every `idle_rate` seconds, as their stats hardly
+change. Each tick only sends as many requests as fit in its `byte_budget`,
+going by the size of the replies received so far - users that don't fit
+wait for the next tick.
+
+Since nothing in the protocol itself uses the stats, polling is skipped
+entirely while no plugin is listening for Mumble/UserStats events, unless
+it's configured to always poll.
+
+Replies are applied to users by `apply_userstats`, which only visits the
+fields a reply actually has, using a map of fields built when this module is
+loaded.
+"""
+
+__author__ = 'Gareth Coles'
+
+import math
+
+from twisted.internet import task
+
+from system.protocols.mumble import Mumble_pb2
+from system.protocols.mumble.structs import Version
+
+#: The size we assume replies are until we've had some, in bytes
+DEFAULT_REPLY_SIZE = 128
+
+
+def _set_list(attribute):
+    def apply(details, value):
+        setattr(details, attribute, list(value))
+    return apply
+
+
+def _set_version(details, value):
+    details.version = Version(value.version, value.release, value.os,
+                              value.os_version)
+
+
+#: UserStats.Stats fields, by descriptor, to their names
+STATS_FIELDS = dict(
+    (field, field.name)
+    for field in Mumble_pb2.UserStats.Stats.DESCRIPTOR.fields
+)
+
+
+def _set_stats(attribute):
+    def apply(details, value):
+        stats = getattr(details, attribute)
+
+        for field, field_value in value.ListFields():
+            setattr(stats, STATS_FIELDS[field], field_value)
+    return apply
+
+
+def _field_map(attributes, special):
+    fields = Mumble_pb2.UserStats.DESCRIPTOR.fields_by_name
+
+    return (
+        dict((fields[name], attribute)
+             for name, attribute in attributes.iteritems()),
+        dict((fields[name], apply) for name, apply in special.iteritems())
+    )
+
+
+#: UserStats message fields that are copied straight to a user's details,
+#: and the ones that need converting first - keyed by their descriptors,
+#: which is how ListFields gives them to us
+ATTRIBUTES, SPECIAL = _field_map({
+    "udp_packets": "udp_packets_sent",
+    "tcp_packets": "tcp_packets_sent",
+    "udp_ping_avg": "udp_ping_avg",
+    "udp_ping_var": "udp_ping_var",
+    "tcp_ping_avg": "tcp_ping_avg",
+    "tcp_ping_var": "tcp_ping_var",
+    "address": "address",
+    "onlinesecs": "online_time",
+    "idlesecs": "idle_time",
+    "strong_certificate": "strong_certificate",
+    "opus": "opus"
+}, {
+    "certificates": _set_list("certificates"),
+    "celt_versions": _set_list("celt_versions"),
+    "from_client": _set_stats("packet_stats_from_client"),
+    "from_server": _set_stats("packet_stats_from_server"),
+    "version": _set_version
+})
+
+
+def apply_userstats(user, message):
+    """
+    Copy the fields a UserStats message has to a user's details.
+
+    Only the fields that are present are visited, so this doesn't have to
+    check for each of them in turn.
+    """
+
+    details = user.details
+
+    for field, value in message.ListFields():
+        attribute = ATTRIBUTES.get(field)
+
+        if attribute is not None:
+            setattr(details, attribute, value)
+        else:
+            apply = SPECIAL.get(field)
+
+            if apply is not None:
+                apply(details, value)
+
+
+class UserStatsPoller(object):
+    """
+    Asks the server for users' stats, a few at a time.
+    """
+
+    def __init__(self, protocol, rate=60, idle_rate=300, idle_after=300,
+                 tick=1, byte_budget=4096, always=False, clock=None):
+        """
+        :param protocol: The Mumble protocol
+        :param rate: How often to poll active users, in seconds
+        :param idle_rate: How often to poll idle users, in seconds
+        :param idle_after: How long a user has to be idle for before
+            they're polled at the idle rate, in seconds
+        :param tick: How often to send requests, in seconds
+        :param byte_budget: Roughly how many bytes of replies to ask for
+            each tick
+        :param always: Whether to poll even when nothing's listening for
+            Mumble/UserStats events
+        :param clock: The reactor, or a task.Clock
+        """
+
+        self.protocol = protocol
+
+        self.rate = rate
+        self.idle_rate = idle_rate
+        self.idle_after = idle_after
+        self.tick = tick
+        self.byte_budget = byte_budget
+        self.always = always
+
+        if clock is None:
+            from twisted.internet import reactor
+            clock = reactor
+
+        self.clock = clock
+
+        self.reply_size = DEFAULT_REPLY_SIZE  # Moving average
+
+        self._due = {}  # session -> when it should next be polled
+        self._cursor = -1  # The last session we looked at
+        self._task = None
+
+        self.requested = 0
+        self.skipped_ticks = 0
+
+    @classmethod
+    def from_config(cls, protocol, config):
+        """
+        Create a poller using the "userstats" section of a Mumble protocol's
+        configuration. The old "userstats_request_rate" setting is used as
+        the rate, if there's no "userstats" section.
+        """
+
+        rate = config.get("userstats_request_rate", 60)
+        userstats = config.get("userstats") or {}
+
+        return cls(
+            protocol,
+            rate=userstats.get("rate", rate),
+            idle_rate=userstats.get("idle_rate", rate * 5),
+            idle_after=userstats.get("idle_after", 300),
+            tick=userstats.get("tick", 1),
+            byte_budget=userstats.get("byte_budget", 4096),
+            always=userstats.get("always", False)
+        )
+
+    @property
+    def running(self):
+        return self._task is not None and self._task.running
+
+    def start(self):
+        self.stop()
+
+        self._task = task.LoopingCall(self._poll)
+        self._task.clock = self.clock
+        self._task.start(self.tick, False)
+
+    def stop(self):
+        if self.running:
+            self._task.stop()
+
+        self._task = None
+        self._due.clear()
+        self._cursor = -1
+
+    @property
+    def wanted(self):
+        """
+        Whether anything wants users' stats at the moment.
+        """
+
+        return self.always or self.protocol.event_manager.has_callback(
+            "Mumble/UserStats"
+        )
+
+    def interval(self, user):
+        """
+        How long to wait before polling a user again.
+        """
+
+        if user.has_details and user.idle_time >= self.idle_after:
+            return self.idle_rate
+
+        return self.rate
+
+    def received(self, user, size):
+        """
+        Note that a user's stats have arrived.
+
+        :param user: The user
+        :param size: The size of the UserStats message, in bytes
+        """
+
+        self.reply_size += (size - self.reply_size) / 8.0
+
+        if user.session in self._due:
+            now = self.clock.seconds()
+            self._due[user.session] = now + self.interval(user)
+
+    def _poll(self):
+        try:
+            self.poll()
+        except Exception:
+            self.protocol.log.exception("Error in UserStats request loop")
+
+    def poll(self):
+        """
+        Ask for the stats of the users that are due, as far as this tick's
+        budget goes.
+
+        :return: How many users were asked for
+        :rtype: int
+        """
+
+        if not self.wanted:
+            self.skipped_ticks += 1
+            return 0
+
+        users = self.protocol.users
+        now = self.clock.seconds()
+        due = self._due
+
+        for session in due.keys():
+            if session not in users:
+                del due[session]
+
+        sessions = sorted(users)
+
+        if not sessions:
+            return 0
+
+        # Spread the users over the interval, with a budget for bursts
+        limit = min(
+            int(math.ceil(len(sessions) * self.tick / float(self.rate))),
+            max(1, int(self.byte_budget / self.reply_size))
+        )
+
+        # Start from the first session after the cursor, wrapping around
+        start = 0
+
+        while start < len(sessions) and sessions[start] <= self._cursor:
+            start += 1
+
+        sent = 0
+
+        for i in xrange(len(sessions)):
+            session = sessions[(start + i) % len(sessions)]
+            user = users[session]
+
+            if session not in due:
+                # They were asked for everything when they joined
+                due[session] = now + self.interval(user)
+                continue
+
+            if due[session] > now:
+                continue
+
+            if sent >= limit:
+                break
+
+            self.protocol.request_userstats(user, True)
+            due[session] = now + self.interval(user)
+
+            self._cursor = session
+            sent += 1
+
+        self.requested += sent
+        return sent
+
+    def stats(self):
+        """
+        Get how many requests have been sent, and how many ticks were
+        skipped because nothing wanted them.
+
+        :rtype: dict
+        """
+
+        return {
+            "tracked": len(self._due),
+            "requested": self.requested,
+            "skipped_ticks": self.skipped_ticks,
+            "reply_size": self.reply_size
+        }
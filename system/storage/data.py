@@ -17,16 +17,19 @@ import uuid
 __author__ = "Gareth Coles"
 
 import datetime
+import hashlib
 import json
 import os
 import pprint
 import pymongo
 import redis
 
+from kitchen.text.converters import to_bytes
 from ruamel import yaml
 
 from threading import Lock
 from twisted.enterprise import adbapi
+from twisted.internet import reactor, threads
 
 from system.storage import formats
 from system.logging.logger import getLogger
@@ -54,6 +57,12 @@ class Data(object):
     #: Whether the file exists
     exists = True
 
+    #: Incremented whenever the data may have changed - when the file is
+    #: (re)loaded or a `with` block exits. Compare this against a stored
+    #: value to find out whether anything derived from the data is stale.
+    #: :type: int
+    revision = 0
+
     @property
     def mtime(self):
         """
@@ -128,6 +137,21 @@ class Data(object):
 
         pass
 
+    def flush(self):
+        """
+        Write any changes that haven't been saved yet, if applicable.
+        """
+
+        pass
+
+    def released(self):
+        """
+        Called by the storage manager when the file is released. Pending
+        changes should be flushed here.
+        """
+
+        self.flush()
+
     def __json__(self):  # TODO
         """
         Return a representation of your object that can be json-encoded
@@ -139,7 +163,188 @@ class Data(object):
         raise NotImplementedError("This method must be overridden")
 
 
-class YamlData(Data):
+class FileData(Data):
+    """
+    Base class for data objects that are stored in a single file.
+
+    Saves are written atomically - to a temporary file which is then renamed
+    over the original - and are skipped entirely if the serialized data
+    hasn't changed since the last write.
+
+    If you pass a *flush_interval*, the file is in write-behind mode. Exiting
+    a *with* block then only marks the file as dirty, and a snapshot is
+    written from a background thread at most once every *flush_interval*
+    seconds. Pending changes are also written on shutdown, when the file is
+    released and when `save` or `flush` are called.
+
+    Subclasses must implement `_serialize`, call `_setup_writes` from their
+    constructor and call `_loaded` after (re)loading the file.
+    """
+
+    #: Seconds between write-behind flushes, or None to write on every save
+    #: :type: int, float, None
+    flush_interval = None
+
+    _dirty = False
+    _flush_call = None
+    _shutdown_trigger = None
+
+    _last_digest = None
+    _sequence = 0
+    _written_sequence = 0
+    _write_lock = None
+
+    def _setup_writes(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._write_lock = Lock()
+
+        if flush_interval is not None:
+            self._shutdown_trigger = reactor.addSystemEventTrigger(
+                "before", "shutdown", self.flush
+            )
+
+    def _serialize(self):
+        """
+        Serialize the data to a string, ready to be written to the file.
+        """
+
+        raise NotImplementedError("This method must be overridden")
+
+    def _loaded(self):
+        self._cancel_flush()
+        self._dirty = False
+
+        # The file already holds this data, so saving it unchanged needn't
+        # write it again
+        self._last_digest = hashlib.sha1(
+            to_bytes(self._serialize())
+        ).digest()
+
+        self.revision += 1
+
+    def _cancel_flush(self):
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+
+    def _snapshot(self):
+        """
+        Serialize the data for writing.
+
+        :return: The serialized data and its write sequence number, or
+            (None, None) if the data hasn't changed since it was last written
+        """
+
+        self._dirty = False
+
+        data = to_bytes(self._serialize())
+        digest = hashlib.sha1(data).digest()
+
+        if digest == self._last_digest:
+            return None, None
+
+        self._last_digest = digest
+        self._sequence += 1
+
+        return data, self._sequence
+
+    def _write_file(self, data, sequence):
+        with self._write_lock:
+            if sequence <= self._written_sequence:
+                return  # A newer snapshot has already been written
+
+            temp = "%s.tmp" % self.filename
+
+            try:
+                fh = open(temp, "w")
+                fh.write(data)
+                fh.flush()
+                fh.close()
+
+                if os.name == "nt" and os.path.exists(self.filename):
+                    os.remove(self.filename)  # Windows won't rename over it
+
+                os.rename(temp, self.filename)
+            except Exception:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+
+            self._written_sequence = sequence
+
+    def _write_failed(self, failure):
+        self.logger.failure(_("Error writing file %s") % self.filename,
+                            failure)
+
+        self._last_digest = None
+        self.mark_dirty()
+
+    def _background_flush(self):
+        self._flush_call = None
+
+        if not self._dirty:
+            return
+
+        if self._context_guarded:
+            # Someone's in the middle of a with block; try again later
+            return self.mark_dirty()
+
+        with self.mutex:
+            data, sequence = self._snapshot()
+
+        if data is None:
+            return
+
+        d = threads.deferToThread(self._write_file, data, sequence)
+        d.addErrback(self._write_failed)
+
+    def _save(self):
+        self._cancel_flush()
+        data, sequence = self._snapshot()
+
+        if data is None:
+            return
+
+        try:
+            self._write_file(data, sequence)
+        except Exception:
+            self._last_digest = None
+            raise
+
+    def mark_dirty(self):
+        """
+        Mark the data as changed. In write-behind mode this schedules a
+        background write, otherwise the file is saved immediately.
+        """
+
+        if self.flush_interval is None:
+            return self.save()
+
+        self._dirty = True
+
+        if self._flush_call is None:
+            self._flush_call = reactor.callLater(
+                self.flush_interval, self._background_flush
+            )
+
+    def flush(self):
+        """
+        Write any pending write-behind changes to the file immediately.
+        """
+
+        if self._dirty:
+            self.save()
+
+    def released(self):
+        self.flush()
+
+        if self._shutdown_trigger is not None:
+            reactor.removeSystemEventTrigger(self._shutdown_trigger)
+            self._shutdown_trigger = None
+
+
+class YamlData(FileData):
     """
     Data object that uses YAML files for storage.
 
@@ -172,6 +377,9 @@ class YamlData(Data):
 
     For sanity's sake, all YAML files should end in .yml - but this is not
     enforced.
+
+    This object supports write-behind mode - see `FileData` for more
+    information.
     """
 
     editable = True
@@ -191,7 +399,7 @@ class YamlData(Data):
             os.path.getmtime(self.filename)
         )
 
-    def __init__(self, filename):
+    def __init__(self, filename, flush_interval=None):
         self.callbacks = []
 
         self.logger = getLogger("Data")
@@ -205,6 +413,7 @@ class YamlData(Data):
             os.makedirs(folders)
 
         self.filename = filename
+        self._setup_writes(flush_interval)
         self.reload(False)
 
     def reload(self, run_callbacks=True):
@@ -242,6 +451,7 @@ class YamlData(Data):
         fh.close()
         if not self.data:
             self.data = {}
+        self._loaded()
 
     def save(self):
         """
@@ -253,12 +463,8 @@ class YamlData(Data):
         else:
             self._save()
 
-    def _save(self):
-        data = yaml.dump(self.data, default_flow_style=False, version=(1, 1))
-        fh = open(self.filename, "w")
-        fh.write(data)
-        fh.flush()
-        fh.close()
+    def _serialize(self):
+        return yaml.dump(self.data, default_flow_style=False, version=(1, 1))
 
     def validate(self, data):
         try:
@@ -328,7 +534,8 @@ class YamlData(Data):
             self._context_guarded = True
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.save()
+        self.mark_dirty()
+        self.revision += 1
         self._context_guarded = False
         if exc_type is None:
             return True
@@ -465,6 +672,7 @@ class MemoryData(Data):
             self._context_guarded = True
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.revision += 1
         self._context_guarded = False
         if exc_type is None:
             return True
@@ -495,7 +703,7 @@ class MemoryData(Data):
         return True
 
 
-class JSONData(Data):
+class JSONData(FileData):
     """
     Data object that uses JSON files for storage.
 
@@ -506,6 +714,9 @@ class JSONData(Data):
 
     For sanity's sake, all JSON files should end in .json - but this is not
     enforced.
+
+    This object supports write-behind mode - see `FileData` for more
+    information.
     """
 
     editable = True
@@ -524,7 +735,7 @@ class JSONData(Data):
             os.path.getmtime(self.filename)
         )
 
-    def __init__(self, filename):
+    def __init__(self, filename, flush_interval=None):
         self.callbacks = []
 
         self.logger = getLogger("Data")
@@ -538,6 +749,7 @@ class JSONData(Data):
             os.makedirs(folders)
 
         self.filename = filename
+        self._setup_writes(flush_interval)
         self.reload(False)
 
     def reload(self, run_callbacks=True):
@@ -578,6 +790,7 @@ class JSONData(Data):
         fh.close()
         if not self.data:
             self.data = {}
+        self._loaded()
 
     def save(self):
         """
@@ -589,13 +802,9 @@ class JSONData(Data):
         else:
             self._save()
 
-    def _save(self):
-        data = json.dumps(self.data, indent=4, sort_keys=True,
+    def _serialize(self):
+        return json.dumps(self.data, indent=4, sort_keys=True,
                           separators=(",", ": "))
-        fh = open(self.filename, "w")
-        fh.write(data)
-        fh.flush()
-        fh.close()
 
     def validate(self, data):
         try:
@@ -671,7 +880,8 @@ class JSONData(Data):
             self._context_guarded = True
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.save()
+        self.mark_dirty()
+        self.revision += 1
         self._context_guarded = False
         if exc_type is None:
             return True
@@ -128,6 +128,8 @@ class StorageFile(object):
         """
 
         if isinstance(caller, self.manager_class):
+            self.before_release()
+
             del self.obj
             self.obj = None
             self._owner = None
@@ -135,11 +137,26 @@ class StorageFile(object):
         else:
             raise TypeError(_("Only the storage manager can release files."))
 
+    def before_release(self):
+        """
+        Called before the file object is released.
+        """
+
+        pass
+
 
 class DataFile(StorageFile):
     formats = Formats.DATA
     file_type = "data"
 
+    def before_release(self):
+        """
+        Flush any pending writes before the data object is released.
+        """
+
+        if self.obj is not None:
+            self.obj.released()
+
 
 class ConfigFile(StorageFile):
     formats = Formats.CONF
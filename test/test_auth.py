@@ -0,0 +1,121 @@
+# coding=utf-8
+import hashlib
+
+import nose.tools as nosetools
+
+from mock import MagicMock as Mock
+
+from plugins.auth.auth_handler import authHandler
+from plugins.auth.hashing import HashingPool
+from utils.misc import AttrDict
+
+__author__ = 'Gareth Coles'
+
+"""
+Tests for the auth handler's non-blocking logins
+"""
+
+
+class FakeData(dict):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class CountingPool(HashingPool):
+    def __init__(self):
+        super(CountingPool, self).__init__(0)
+        self.calls = 0
+
+    def _run(self, func, *args):
+        self.calls += 1
+        return super(CountingPool, self)._run(func, *args)
+
+
+def result_of(d):
+    results = []
+    d.addBoth(results.append)
+    return results[0]
+
+
+class test_auth:
+    """
+    AUTH  | Tests for the auth handler
+    """
+
+    def __init__(self):
+        plugin = AttrDict(
+            config={"auth-algo": "pbkdf2", "replace-hashes": True},
+            logger=Mock(name="logger")
+        )
+
+        self.pool = CountingPool()
+        self.data = FakeData(someone={})
+        self.handler = authHandler(plugin, self.data, FakeData(), self.pool)
+
+    def test_login_cache(self):
+        """
+        AUTH  | Test repeated logins are checked once
+        """
+
+        user = AttrDict(authorized=False)
+
+        nosetools.assert_true(result_of(
+            self.handler.create_user_async("Bob", "hunter2")
+        ))
+        nosetools.assert_false(result_of(
+            self.handler.create_user_async("bob", "hunter3")
+        ))
+        nosetools.eq_(self.pool.calls, 1)
+
+        # Registering remembers the password
+        nosetools.assert_true(result_of(
+            self.handler.login_async(user, None, "bob", "hunter2")
+        ))
+        nosetools.assert_true(user.authorized)
+        nosetools.eq_(self.pool.calls, 1)
+
+        for _ in xrange(3):
+            nosetools.assert_false(result_of(
+                self.handler.check_login_async("bob", "hunter3")
+            ))
+
+        nosetools.eq_(self.pool.calls, 2)
+
+    def test_change_password(self):
+        """
+        AUTH  | Test changing passwords without blocking
+        """
+
+        self.handler.create_user("bob", "hunter2")
+
+        nosetools.assert_false(result_of(
+            self.handler.change_password_async("bob", "wrong", "hunter3")
+        ))
+        nosetools.assert_true(result_of(
+            self.handler.change_password_async("bob", "hunter2", "hunter3")
+        ))
+
+        nosetools.assert_false(result_of(
+            self.handler.check_login_async("bob", "hunter2")
+        ))
+        nosetools.assert_true(self.handler.check_login("bob", "hunter3"))
+
+    def test_replace_hashes(self):
+        """
+        AUTH  | Test old hashes are replaced after a successful login
+        """
+
+        self.data["bob"] = {
+            "algo": "sha512",
+            "salt": "salt",
+            "password": hashlib.sha512("salthunter2").hexdigest()
+        }
+
+        nosetools.assert_true(result_of(
+            self.handler.check_login_async("bob", "hunter2")
+        ))
+        nosetools.eq_(self.data["bob"]["algo"], "pbkdf2")
+        nosetools.assert_true(self.handler.check_login("bob", "hunter2"))
@@ -0,0 +1,113 @@
+# coding=utf-8
+import nose.tools as nosetools
+
+from mock import MagicMock as Mock
+
+from plugins.bridge.relay import RelayQueue
+from plugins.bridge.rules import RuleIndex, Template
+
+__author__ = 'Gareth Coles'
+
+"""
+Tests for the bridge plugin's compiled rules and relay queue
+"""
+
+
+def rule(protocol, source, source_type="channel", target="#target"):
+    return {
+        "from": {
+            "protocol": protocol,
+            "source": source,
+            "source-type": source_type
+        },
+        "to": {
+            "protocol": "other",
+            "target": target,
+            "target-type": "channel"
+        },
+        "formatting": {
+            "general": {"message": "<{USER}> {MESSAGE}", "join": ""}
+        }
+    }
+
+
+class test_bridge:
+    """
+    BRDGE | Tests for the bridge plugin
+    """
+
+    def test_template(self):
+        """
+        BRDGE | Test pre-parsed format strings
+        """
+
+        template = Template("* {USER} was {BANNED?} ({MESSAGE}) {UNKNOWN}")
+
+        nosetools.eq_(
+            template.render({"USER": "Bob", "BANNED?": "kicked",
+                             "MESSAGE": "{USER}"}),
+            "* Bob was kicked ({USER}) {UNKNOWN}"
+        )
+
+    def test_rule_index(self):
+        """
+        BRDGE | Test matching rules by source
+        """
+
+        index = RuleIndex({
+            "a": rule("IRC", "#Ultros"),
+            "b": rule("irc", "*"),
+            "c": rule("irc", "", "user"),
+            "d": rule("mumble", "#Ultros")
+        })
+
+        nosetools.eq_(len(index), 4)
+        nosetools.eq_([r.name for r in index.match("irc", "channel",
+                                                   "#ULTROS")],
+                      ["a", "b"])
+        nosetools.eq_([r.name for r in index.match("irc", "channel",
+                                                   "#other")],
+                      ["b"])
+        nosetools.eq_([r.name for r in index.match("irc", "user")], ["c"])
+        nosetools.eq_(index.match("esper", "channel", "#Ultros"), [])
+
+        formatting = index.match("irc", "user")[0].formatting
+        nosetools.assert_true(("general", "message") in formatting)
+        nosetools.assert_false(("general", "join") in formatting)
+
+    def test_relay_queue(self):
+        """
+        BRDGE | Test coalescing relayed lines per target
+        """
+
+        irc = Mock(name="irc")
+        irc.has_capability.return_value = False
+        mumble = Mock(name="mumble")
+        mumble.has_capability.return_value = True
+        mumble.message_length = 10
+
+        protocols = {"irc": irc, "mumble": mumble}
+        factory_manager = Mock(name="factory_manager")
+        factory_manager.get_protocol.side_effect = protocols.get
+        clock = Mock(name="clock")
+
+        queue = RelayQueue(factory_manager, Mock(name="logger"), clock)
+
+        for line in ("one", "two", "three"):
+            queue.add("irc", "#a", "channel", line)
+            queue.add("mumble", "#a", "channel", line)
+
+        nosetools.eq_(clock.callLater.call_count, 1)
+        nosetools.eq_(len(queue), 6)
+
+        queue.flush()
+
+        nosetools.eq_(len(queue), 0)
+        nosetools.eq_(
+            [c[0][1] for c in irc.send_msg.call_args_list],
+            ["one", "two", "three"]
+        )
+        nosetools.eq_(
+            [c[0][1] for c in mumble.send_msg.call_args_list],
+            ["one\ntwo", "three"]
+        )
@@ -6,6 +6,7 @@ import nose.tools as nosetools
 from mock import MagicMock as Mock
 
 from system.commands.manager import CommandManager
+from system.commands.parser import ParsedArgs, split_args
 from system.enums import CommandState
 
 __author__ = 'Gareth Coles'
@@ -29,6 +30,7 @@ class test_commands:
         self.manager.aliases = {}
         self.manager.auth_handler = None
         self.manager.perm_handler = None
+        self.manager.prefixes = {}
 
         self.plugin.reset_mock()
         self.plugin.handler.reset_mock()
@@ -246,3 +248,71 @@ class test_commands:
         r = self.manager.run_command("test7", caller, source, protocol, "")
         nosetools.assert_equals(r, (CommandState.Unknown, None))
         nosetools.assert_equals(self.plugin.handler.call_count, 0)
+
+    @nose.with_setup(teardown=teardown)
+    def test_parsed_args(self):
+        """CMNDS | Test lazily splitting command arguments"""
+
+        args = ParsedArgs('one "two three" fo"ur" "" \\"five\\"')
+
+        nosetools.assert_equals(args._tokens, None)
+        nosetools.assert_equals(
+            list(args), ["one", "two three", "four", "", '"five"']
+        )
+        nosetools.assert_equals(len(args), 5)
+        nosetools.assert_equals(args[1], "two three")
+
+        nosetools.assert_equals(split_args(u"caf\xe9 \"d\xe9j\xe0 vu\""),
+                                [u"caf\xe9", u"d\xe9j\xe0 vu"])
+
+        # Unbalanced quotes fall back to splitting on whitespace
+        args = ParsedArgs('reload "data')
+        nosetools.assert_equals(list(args), ["reload", '"data'])
+        nosetools.assert_equals(len(args), 2)
+        nosetools.assert_true(args)
+
+    @nose.with_setup(teardown=teardown)
+    def test_run_commands_unclosed_quote(self):
+        """CMNDS | Test running commands directly | Unclosed quote"""
+
+        def handler(protocol, caller, source, command, raw_args, args):
+            self.plugin.handler(args[0], args[1:], len(args))
+
+        self.manager.register_command("storage", handler, self.plugin,
+                                      default=True)
+
+        caller = Mock(name="caller")
+        source = Mock(name="source")
+        protocol = Mock(name="protocol")
+
+        r = self.manager.run_command("storage", caller, source, protocol,
+                                     'reload "data')
+        nosetools.assert_equals(r, (CommandState.Success, None))
+
+        self.plugin.handler.assert_called_with("reload", ['"data'], 2)
+
+    @nose.with_setup(teardown=teardown)
+    def test_process_input_prefix(self):
+        """CMNDS | Test control character prefixes follow nick changes"""
+
+        self.manager.register_command("test8", self.plugin.handler,
+                                      self.plugin, default=True)
+
+        caller = Mock(name="caller")
+        source = Mock(name="source")
+        protocol = Mock(name="protocol")
+        protocol.name = "test"
+
+        r = self.manager.process_input("Bot: test8 a", caller, source,
+                                       protocol, "{NAME}: ", "Bot")
+        nosetools.assert_equals(r, (CommandState.Success, None))
+
+        r = self.manager.process_input("bot: test8 a", caller, source,
+                                       protocol, "{NAME}: ", "Other")
+        nosetools.assert_equals(r, (CommandState.NotACommand, None))
+
+        r = self.manager.process_input("OTHER: test8 a", caller, source,
+                                       protocol, "{NAME}: ", "Other")
+        nosetools.assert_equals(r, (CommandState.Success, None))
+
+        nosetools.assert_equals(self.plugin.handler.call_count, 2)
@@ -0,0 +1,117 @@
+# coding=utf-8
+import logging
+import nose
+import nose.tools as nosetools
+
+from mock import MagicMock as Mock
+
+from system.events.base import BaseEvent
+from system.events.manager import EventManager
+from system.metrics.instrumentation import Instrumentation
+from utils.misc import AttrDict
+
+__author__ = 'Gareth Coles'
+
+"""Tests for the event manager's compiled dispatch tables"""
+
+
+class FakePlugin(object):
+    def __init__(self, name):
+        self.info = AttrDict(name=name)
+
+
+class test_events:
+
+    def __init__(self):
+        self.manager = EventManager()
+        self.manager.logger.setLevel(logging.CRITICAL)  # Shut up, logger
+
+    @nosetools.nottest
+    def teardown(self):
+        self.manager.remove_callbacks("Test")
+
+    @nose.with_setup(teardown=teardown)
+    def test_priority_order(self):
+        """EVNTS | Test handlers run from highest to lowest priority"""
+        order = []
+
+        self.manager.add_callback("Test", FakePlugin("low"),
+                                  lambda e: order.append("low"), 0)
+        self.manager.add_callback("Test", FakePlugin("high"),
+                                  lambda e: order.append("high"), 10)
+
+        self.manager.run_callback("Test", BaseEvent(None))
+        nosetools.eq_(order, ["high", "low"])
+
+    @nose.with_setup(teardown=teardown)
+    def test_filters_and_cancelled(self):
+        """EVNTS | Test filtered and cancelled events"""
+        handler = Mock(name="handler")
+        cancelled_handler = Mock(name="cancelled_handler")
+
+        self.manager.add_callback("Test", FakePlugin("one"), handler, 0,
+                                  lambda e: e.caller == "yes",
+                                  extra_args=["arg"])
+        self.manager.add_callback("Test", FakePlugin("two"),
+                                  cancelled_handler, 0, cancelled=True)
+
+        event = BaseEvent("no")
+        self.manager.run_callback("Test", event)
+        nosetools.eq_(handler.call_count, 0)
+        nosetools.eq_(cancelled_handler.call_count, 1)
+
+        event = BaseEvent("yes")
+        self.manager.run_callback("Test", event)
+        handler.assert_called_with(event, "arg")
+
+        event = BaseEvent("yes")
+        event.cancelled = True
+        self.manager.run_callback("Test", event)
+        nosetools.eq_(handler.call_count, 1)
+        nosetools.eq_(cancelled_handler.call_count, 3)
+
+    @nose.with_setup(teardown=teardown)
+    def test_remove_callback(self):
+        """EVNTS | Test removing handlers updates the dispatch table"""
+        handler = Mock(name="handler")
+
+        self.manager.add_callback("Test", FakePlugin("one"), handler, 0)
+        self.manager.remove_callback("Test", "one")
+
+        nosetools.assert_false("Test" in self.manager.dispatch)
+
+        self.manager.run_callback("Test", BaseEvent(None))
+        nosetools.eq_(handler.call_count, 0)
+
+    @nose.with_setup(teardown=teardown)
+    @nosetools.raises(ValueError)
+    def test_invalid_filter(self):
+        """EVNTS | Test non-callable filters are rejected"""
+        self.manager.add_callback("Test", FakePlugin("one"), Mock(), 0,
+                                  "not callable")
+
+    @nose.with_setup(teardown=teardown)
+    def test_instrumentation(self):
+        """EVNTS | Test handlers are timed when instrumentation is on"""
+        instrumentation = Instrumentation()
+        instrumentation.reset()
+
+        self.manager.add_callback("Test", FakePlugin("one"), Mock(), 0)
+        self.manager.run_callback("Test", BaseEvent(None))
+        nosetools.eq_(instrumentation.timings, {})
+
+        instrumentation.enabled = True
+
+        try:
+            self.manager.run_callback("Test", BaseEvent(None))
+            self.manager.run_callback("Test", BaseEvent(None))
+        finally:
+            instrumentation.enabled = False
+
+        timings = instrumentation.timings["callbacks"][("Test", "one")]
+        nosetools.eq_(timings.count, 2)
+        nosetools.eq_(sum(timings.buckets), 2)
+
+        snapshot = instrumentation.snapshot()
+        nosetools.eq_(snapshot["timings"]["callbacks"]["Test/one"]["count"],
+                      2)
@@ -0,0 +1,113 @@
+# coding=utf-8
+import logging
+
+import nose.tools as nosetools
+
+from mock import MagicMock as Mock
+from twisted.internet import defer
+
+from plugins.factoids import FactoidsPlugin, MissingFactoidError
+from system.logging.logger import getLogger
+from system.protocols.generic.channel import Channel
+from utils.cache import LRUCache
+
+__author__ = 'Sean'
+
+"""
+Tests for the factoids plugin's lookup cache
+"""
+
+
+class FakeDatabase(object):
+    def __init__(self):
+        self.rows = {}
+        self.lookups = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def runInteraction(self, func, factoid_key, location, protocol,
+                       *args):
+        if func.__name__ == "_get_factoid_interaction":
+            self.lookups += 1
+
+            if factoid_key in self.rows:
+                return defer.succeed(self.rows[factoid_key])
+            return defer.fail(MissingFactoidError(factoid_key))
+
+        del self.rows[factoid_key]
+        return defer.succeed(None)
+
+    def runQuery(self, query, params):
+        self.rows[params[0]] = (params[4], params[5].split("\n"))
+        return defer.succeed([])
+
+
+class FakeFactoidsPlugin(FactoidsPlugin):
+    def __init__(self):
+        self.logger = getLogger("Factoids")
+        self.logger.setLevel(logging.CRITICAL)
+        self.commands = Mock(name="commands")
+        self.database = FakeDatabase()
+        self.cache = LRUCache(16)
+
+
+class test_factoids:
+    """
+    FACTS | Tests for the factoids plugin
+    """
+
+    def __init__(self):
+        self.plugin = FakeFactoidsPlugin()
+        self.protocol = Mock(name="protocol")
+        self.protocol.name = "Test"
+        self.caller = Mock(name="caller")
+        self.channel = Channel("#Test", self.protocol)
+
+    def get(self):
+        results = []
+        d = self.plugin.get_factoid(self.caller, self.channel, self.protocol,
+                                    None, "Foo")
+        d.addCallbacks(results.append, lambda f: results.append(f.type))
+        return results[0]
+
+    def set(self, info, location="global"):
+        self.plugin.set_factoid(self.caller, self.channel, self.protocol,
+                                location, "Foo", info)
+
+    def test_cache_hits(self):
+        """
+        FACTS | Test repeated lookups are served from the cache
+        """
+
+        self.set("bar")
+
+        nosetools.eq_(self.get(), ("Foo", ["bar"]))
+        nosetools.eq_(self.get(), ("Foo", ["bar"]))
+        nosetools.eq_(self.plugin.database.lookups, 1)
+
+        stats = self.plugin.cache_stats()
+        nosetools.eq_((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_cache_invalidation(self):
+        """
+        FACTS | Test changing factoids invalidates cached lookups
+        """
+
+        nosetools.eq_(self.get(), MissingFactoidError)
+        nosetools.eq_(self.get(), MissingFactoidError)
+        nosetools.eq_(self.plugin.database.lookups, 1)
+
+        self.set("bar", "channel")
+        nosetools.eq_(self.get(), ("Foo", ["bar"]))
+
+        self.set("baz\nqux", "protocol")
+        nosetools.eq_(self.get(), ("Foo", ["baz", "qux"]))
+
+        self.plugin.delete_factoid(self.caller, self.channel, self.protocol,
+                                   "protocol", "Foo")
+        nosetools.eq_(self.get(), MissingFactoidError)
+        nosetools.eq_(self.plugin.database.lookups, 4)
@@ -0,0 +1,269 @@
+# coding=utf-8
+import nose.tools as nosetools
+
+from twisted.internet import task
+
+from system.metrics.instrumentation import Instrumentation
+from system.protocols.irc import outbound
+from system.protocols.irc.hostmasks import HostmaskMatcher
+from system.protocols.irc.rank import Rank, Ranks
+from system.protocols.irc.registry import UserRegistry
+from system.protocols.irc.replies import ReplyBuffer
+from system.protocols.irc.user import User
+from utils.irc import IRCUtils
+from utils.ratelimit import TokenBucket
+
+__author__ = 'Sean'
+
+"""
+Tests for the IRC protocol's user-tracking, send queue, WHO reply batching,
+hostmask matching and utilities
+"""
+
+
+def make_user(nickname, ident, host):
+    return User(None, nickname, ident, host, is_tracked=True)
+
+
+class test_irc:
+    """
+    IRC   | Tests for IRC user-tracking and utilities
+    """
+
+    def __init__(self):
+        self.utils = IRCUtils(None)
+        self.registry = UserRegistry(self.utils.lowercase_nick_chan)
+
+        self.first = make_user("Nick[1]", "~ident", "Host.example.com")
+        self.second = make_user("other", "~ident", "host.example.com")
+
+        self.registry.add(self.first)
+        self.registry.add(self.second)
+
+    def test_registry_find(self):
+        """
+        IRC   | Test registry lookups by nickname, ident and host
+        """
+
+        nosetools.eq_(self.registry.find("nick{1}"), [self.first])
+        nosetools.eq_(self.registry.find("NICK[1]", "~IDENT"), [self.first])
+        nosetools.eq_(self.registry.find("nick[1]", host="elsewhere"), [])
+        nosetools.eq_(self.registry.find(ident="~ident"),
+                      [self.first, self.second])
+        nosetools.eq_(self.registry.find(host="HOST.example.com"),
+                      [self.first, self.second])
+        nosetools.eq_(self.registry.find(), [self.first, self.second])
+
+    def test_registry_rename(self):
+        """
+        IRC   | Test registry updates on nick changes
+        """
+
+        self.first.nickname = "Renamed"
+        self.registry.rename(self.first)
+
+        nosetools.eq_(self.registry.find("nick[1]"), [])
+        nosetools.eq_(self.registry.find("renamed"), [self.first])
+
+    def test_registry_remove(self):
+        """
+        IRC   | Test removing users from the registry
+        """
+
+        self.registry.remove(self.second)
+
+        nosetools.assert_false(self.second in self.registry)
+        nosetools.eq_(self.registry.find(ident="~ident"), [self.first])
+        nosetools.eq_(len(self.registry), 1)
+
+        nosetools.assert_raises(ValueError, self.registry.remove, self.second)
+
+    def test_outbound_queue(self):
+        """
+        IRC   | Test send queue lanes and per-target fairness
+        """
+
+        clock = task.Clock()
+        sent = []
+        queue = outbound.OutboundQueue(
+            sent.append, TokenBucket(1, 1, clock=clock.seconds), clock
+        )
+
+        queue.send("PRIVMSG #a :first", outbound.INTERACTIVE, "#a")
+
+        for i in xrange(3):
+            queue.send("PRIVMSG #a :bulk %s" % i, outbound.BULK, "#a")
+        queue.send("PRIVMSG #b :bulk", outbound.BULK, "#b")
+        queue.send("PRIVMSG #c :reply", outbound.INTERACTIVE, "#c")
+        queue.send("PONG :server", *outbound.classify("PONG :server"))
+
+        nosetools.eq_(sent, ["PRIVMSG #a :first"])
+        nosetools.eq_(len(queue), 6)
+
+        clock.pump([1] * 6)
+
+        nosetools.eq_(sent, [
+            "PRIVMSG #a :first", "PONG :server", "PRIVMSG #c :reply",
+            "PRIVMSG #a :bulk 0", "PRIVMSG #b :bulk", "PRIVMSG #a :bulk 1",
+            "PRIVMSG #a :bulk 2"
+        ])
+
+        stats = queue.stats()
+        nosetools.eq_(stats["bulk"]["sent"], 4)
+        nosetools.eq_(stats["bulk"]["max_wait"], 6)
+        nosetools.eq_(stats["critical"]["depth"], 0)
+
+        instrumentation = Instrumentation()
+        instrumentation.add_gauge("queues", "irc-test", queue.stats)
+
+        try:
+            snapshot = instrumentation.snapshot()
+            nosetools.eq_(snapshot["gauges"]["queues"]["irc-test"], stats)
+        finally:
+            instrumentation.remove_gauge("queues", "irc-test")
+
+        nosetools.eq_(instrumentation.read_gauges("queues"), {})
+
+    def test_who_replies(self):
+        """
+        IRC   | Test WHO reply batching, skipping users that have left
+        """
+
+        replies = ReplyBuffer(self.utils.lowercase_nick_chan)
+
+        replies.add("#Chan", "Nick[1]", 1)
+        replies.add("#chan", "other", 2)
+        replies.depart("#CHAN", "nick{1}")
+        replies.add("#chan", "nick[1]", 3)  # Rejoined
+        replies.add("#elsewhere", "other", 4)
+        replies.depart(None, "OTHER")
+
+        applied = []
+        replies.apply(replies.finish("#chan"), applied.append).addCallback(
+            lambda results: nosetools.eq_(results, [None])
+        )
+        nosetools.eq_(applied, [3])
+
+        replies.cancel("#elsewhere")
+        batch = replies.finish("#elsewhere")
+        nosetools.eq_(len(batch), 0)
+
+    def test_who_replies_renamed(self):
+        """
+        IRC   | Test that WHO replies follow users that change nick
+        """
+
+        replies = ReplyBuffer(self.utils.lowercase_nick_chan)
+
+        def update(row, nickname):
+            return nickname, row[1]
+
+        replies.add("#chan", "Taken", ("Taken", 1))
+        replies.depart(None, "taken")  # Quit, freeing up the nick
+        replies.add("#chan", "Nick[1]", ("Nick[1]", 2))
+        replies.add("#chan", "other", ("other", 3))
+        replies.rename("nick{1}", "Taken", update)
+        replies.add("#chan", "Nick[1]", ("Nick[1]", 4))  # Someone new
+
+        applied = []
+        replies.apply(replies.finish("#chan"), applied.append)
+        nosetools.eq_(applied, [("Taken", 2), ("other", 3), ("Nick[1]", 4)])
+
+    def test_who_replies_sliced(self):
+        """
+        IRC   | Test that big WHO reply batches are applied in slices
+        """
+
+        clock = task.Clock()
+        cooperator = task.Cooperator(
+            terminationPredicateFactory=lambda: iter(
+                [False] * 9 + [True]
+            ).next,
+            scheduler=lambda x: clock.callLater(1, x)
+        )
+        replies = ReplyBuffer(self.utils.lowercase_nick_chan,
+                              cooperator=cooperator)
+        replies.sync_limit = 10
+
+        for i in xrange(25):
+            replies.add("#chan", "user%s" % i, i)
+
+        applied = []
+        results = []
+        batch = replies.finish("#chan")
+        replies.apply(batch, applied.append).addCallback(results.append)
+
+        nosetools.eq_(applied, [])
+
+        clock.advance(1)
+        nosetools.eq_(len(applied), 10)
+
+        replies.depart("#chan", "user20")
+        clock.advance(1)
+        clock.advance(1)
+
+        nosetools.eq_(applied, [i for i in xrange(25) if i != 20])
+        nosetools.eq_(len(results), 1)
+        nosetools.eq_(replies.finish("#chan").rows, [])
+
+    def test_ranks_shared(self):
+        """
+        IRC   | Test that ranks are shared and can't be changed
+        """
+
+        first, second = Ranks(), Ranks()
+        first.add_rank("o", "@", 0)
+        second.add_rank("o", "@", 0)
+        second.add_rank("v", "+", 1)
+
+        nosetools.assert_true(first.by_mode("o") is second.by_symbol("@"))
+        nosetools.assert_true(Rank("o", "@", 0) > second.by_mode("v"))
+        nosetools.assert_raises(AttributeError, setattr,
+                                first.by_mode("o"), "order", 5)
+
+    def test_hostmask_shapes(self):
+        """
+        IRC   | Test compiled hostmasks of each shape
+        """
+
+        mask = self.utils.compile_hostmask
+
+        nosetools.assert_true(mask("*!*@*.Example.com").match_user(self.first))
+        nosetools.assert_true(mask("nick{1}!~*@*").match_user(self.first))
+        nosetools.assert_true(mask("*!*@host.example.com").match_user(
+            self.second
+        ))
+        nosetools.assert_true(mask("o?h*r").match_user(self.second))
+        nosetools.assert_true(mask("~ident@*").match_user(self.second))
+
+        # Masks have to match all of a part, not just the start of it
+        nosetools.assert_false(mask("*!*@host").match_user(self.first))
+        nosetools.assert_false(mask("nick!*@*").match_user(self.first))
+
+    def test_hostmask_matcher(self):
+        """
+        IRC   | Test bulk hostmask matching against the host index
+        """
+
+        masks = ["*!*@*.example.com", "*!*@host.example.com", "other!*@*",
+                 "*!*@*.example.org", "*!~ident@*", "*!*@host.*",
+                 "*!*@*st.example.com"]
+        matcher = HostmaskMatcher(self.utils.lowercase_nick_chan, masks)
+
+        users = [self.first, self.second,
+                 make_user("third", "ident", "elsewhere.example.org")]
+        matches = matcher.match_users(users)
+
+        for user in users:
+            expected = set(
+                m for m in masks
+                if self.utils.compile_hostmask(m).match_user(user)
+            )
+            nosetools.eq_(
+                set(m.mask for m in matches.get(user, [])), expected
+            )
+
+        nosetools.eq_(len(matches[self.first]), 5)
+
+        matcher.remove("*!*@*.example.com")
+        nosetools.eq_(len(matcher.match_user(self.first)), 4)
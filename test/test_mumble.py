@@ -0,0 +1,406 @@
+# coding=utf-8
+import os
+import shutil
+import struct
+import tempfile
+
+import nose.tools as nosetools
+
+from twisted.internet import task
+from twisted.test.proto_helpers import StringTransport
+
+from system.events.manager import EventManager
+from system.protocols.mumble import Mumble_pb2
+from system.protocols.mumble.blobs import BlobStore, blob_hash
+from system.protocols.mumble.framing import FrameBuffer, \
+    InvalidMessageTypeError
+from system.protocols.mumble.protocol import Protocol
+from system.protocols.mumble.user import User
+from system.protocols.mumble.userstats import UserStatsPoller, \
+    apply_userstats
+from utils.misc import AttrDict
+
+__author__ = 'Gareth Coles'
+
+"""
+Tests for the Mumble protocol's stream framing, dispatch, users, blobs and
+user stats
+"""
+
+CONFIG = {
+    "identity": {"username": "Ultros", "password": "", "tokens": []},
+    "network": {"address": "127.0.0.1", "port": 64738},
+    "blobs": {"path": None},
+    "control_chars": "."
+}
+
+
+def frame(msg_type, payload):
+    return struct.pack(">HI", msg_type, len(payload)) + payload
+
+
+def message_frame(message):
+    return frame(Protocol.MESSAGE_ID[message.__class__],
+                 message.SerializeToString())
+
+
+class FakePlugin(object):
+    info = AttrDict(name="test_mumble")
+
+
+class FakeProtocol(object):
+    def __init__(self, count):
+        self.users = dict(
+            (session, User(None, session, u"user%s" % session, None, False,
+                           False, False, False, False, False, False))
+            for session in xrange(2, count + 2)
+        )
+        self.event_manager = AttrDict(has_callback=lambda name: True)
+        self.requested = []
+
+    def request_userstats(self, user, stats_only=False):
+        self.requested.append(user.session)
+
+
+class test_mumble:
+    """
+    MUMBL | Tests for Mumble stream framing, dispatch, users, blobs and stats
+    """
+
+    def __init__(self):
+        self.manager = EventManager()
+
+    @nosetools.nottest
+    def teardown(self):
+        self.manager.remove_callbacks_for_plugin("test_mumble")
+
+    def make_protocol(self):
+        protocol = Protocol("mumble-test", None, CONFIG)
+        protocol.channels = {}
+        protocol.users = {}
+
+        return protocol
+
+    def test_framing_chunks(self):
+        """
+        MUMBL | Test reading frames split across arbitrary chunks
+        """
+
+        frames = [(1, "voice" * 10), (11, "text"), (3, ""), (1, "x" * 300)]
+        stream = "".join(frame(t, p) for t, p in frames)
+        received = []
+
+        for size in (1, 3, 7, 64, len(stream)):
+            buf = FrameBuffer(xrange(26))
+            received = []
+
+            for i in xrange(0, len(stream), size):
+                for msg_type, data in buf.feed(stream[i:i + size]):
+                    received.append((msg_type, data.tobytes()))
+
+            nosetools.eq_(received, frames)
+            nosetools.eq_(len(buf), 0)
+
+    def test_framing_kept_views(self):
+        """
+        MUMBL | Test that kept payload views stay valid
+        """
+
+        buf = FrameBuffer(xrange(26))
+        kept = buf.feed(frame(1, "first") + frame(1, "sec"))
+
+        buf.feed(frame(2, "x" * 100))
+
+        nosetools.eq_([data.tobytes() for _, data in kept],
+                      ["first", "sec"])
+
+    def test_framing_invalid_type(self):
+        """
+        MUMBL | Test that unknown message types are rejected early
+        """
+
+        buf = FrameBuffer(xrange(26))
+
+        nosetools.assert_raises(InvalidMessageTypeError, buf.feed,
+                                struct.pack(">HI", 99, 1000))
+
+    def test_user_details(self):
+        """
+        MUMBL | Test that user stats details are only created when needed
+        """
+
+        user = User(None, 2, u"Someone", None, False, False, False, False,
+                    False, False, False)
+
+        nosetools.eq_(user.opus, False)
+        nosetools.eq_(user.version, None)
+        nosetools.assert_false(user.has_details)
+
+        user.packet_stats_from_client.good = 10
+
+        nosetools.assert_true(user.has_details)
+        nosetools.eq_(user.packet_stats_from_client.good, 10)
+        nosetools.eq_(user.packet_stats_from_server.good, 0)
+
+        other = User(None, 3, u"Other", None, False, False, False, False,
+                     False, False, False)
+        other.online_time = 30
+
+        nosetools.eq_(other.online_time, 30)
+        nosetools.eq_(user.online_time, 0)
+        nosetools.assert_raises(AttributeError, setattr, user, "made_up", 1)
+
+    def test_dispatch_table(self):
+        """
+        MUMBL | Test that messages are dispatched to their handlers
+        """
+
+        protocol = self.make_protocol()
+
+        nosetools.eq_(
+            protocol._handlers[Protocol.MESSAGE_ID[Mumble_pb2.ChannelState]],
+            (protocol.handle_msg_channelstate, None)
+        )
+
+        # Always decoded, as the protocol keeps track of channels itself
+        protocol.dataReceived(message_frame(
+            Mumble_pb2.ChannelState(channel_id=0, name="Root")
+        ))
+
+        nosetools.eq_(protocol.channels[0].name, "Root")
+        nosetools.eq_(protocol.skipped, 0)
+
+    def test_dispatch_skips_unwanted(self):
+        """
+        MUMBL | Test that messages nothing listens for aren't decoded
+        """
+
+        protocol = self.make_protocol()
+
+        protocol.dataReceived("".join(message_frame(message) for message in (
+            Mumble_pb2.Ping(timestamp=1234),
+            Mumble_pb2.CodecVersion(alpha=1, beta=2, prefer_alpha=True),
+            Mumble_pb2.ContextAction(action="test")
+        )))
+
+        nosetools.eq_(protocol.skipped, 3)
+
+    def test_dispatch_decodes_wanted(self):
+        """
+        MUMBL | Test that messages are decoded when something listens
+        """
+
+        protocol = self.make_protocol()
+        pings = []
+
+        self.manager.add_callback("Mumble/Ping", FakePlugin(), pings.append,
+                                  0)
+        protocol.dataReceived("".join(message_frame(message) for message in (
+            Mumble_pb2.Ping(timestamp=1234),
+            Mumble_pb2.CodecVersion(alpha=1, beta=2, prefer_alpha=True)
+        )))
+
+        nosetools.eq_(len(pings), 1)
+        nosetools.eq_(pings[0].timestamp, 1234)
+        nosetools.eq_(protocol.skipped, 1)
+
+    def test_dispatch_unknown_lazy(self):
+        """
+        MUMBL | Test that unknown messages are only decoded on demand
+        """
+
+        protocol = self.make_protocol()
+        events = []
+
+        self.manager.add_callback("Mumble/Unknown", FakePlugin(),
+                                  events.append, 0)
+        protocol.dataReceived(message_frame(
+            Mumble_pb2.ContextAction(action="test", session=5)
+        ))
+
+        nosetools.eq_(len(events), 1)
+
+        event = events[0]
+
+        nosetools.eq_(event.type, Mumble_pb2.ContextAction)
+        nosetools.eq_(event._message, None)
+        nosetools.eq_(event.raw.tobytes(), Mumble_pb2.ContextAction(
+            action="test", session=5
+        ).SerializeToString())
+
+        nosetools.eq_(event.message.action, "test")
+        nosetools.eq_(event.message.session, 5)
+        nosetools.eq_(protocol.skipped, 0)
+
+    def test_blob_store(self):
+        """
+        MUMBL | Test that blobs are deduplicated and spilled to disk
+        """
+
+        path = tempfile.mkdtemp()
+
+        try:
+            store = BlobStore(max_bytes=100, path=path)
+
+            first = store.put("a" * 60)
+
+            nosetools.eq_(first, blob_hash("a" * 60))
+            nosetools.eq_(store.put("a" * 60), first)
+            nosetools.eq_(store.stats()["duplicates"], 1)
+            nosetools.eq_(store.stats()["bytes"], 60)
+
+            # Pushes the first one out of memory, and on to disk
+            second = store.put("b" * 60)
+
+            nosetools.eq_(len(store), 1)
+            nosetools.eq_(os.listdir(path), [first.encode("hex")])
+            nosetools.assert_true(first in store)
+
+            nosetools.eq_(store.get(first), "a" * 60)
+            nosetools.eq_(store.get(first), "a" * 60)
+            nosetools.eq_(store.get(second), "b" * 60)
+            nosetools.eq_(store.stats()["hits"], 1)
+            nosetools.eq_(store.stats()["disk_hits"], 2)
+
+            # Damaged files are ignored
+            store.clear()
+
+            with open(os.path.join(path, first.encode("hex")), "wb") as fh:
+                fh.write("a" * 10)
+
+            nosetools.eq_(store.get(first), None)
+            nosetools.eq_(store.stats()["misses"], 1)
+        finally:
+            shutil.rmtree(path)
+
+    def test_blobs_fetched_lazily(self):
+        """
+        MUMBL | Test that avatars and comments are only requested when used
+        """
+
+        protocol = self.make_protocol()
+        transport = protocol.transport = StringTransport()
+        avatar = "\x89PNG" + "x" * 1000
+
+        protocol.dataReceived("".join(message_frame(message) for message in (
+            Mumble_pb2.ChannelState(channel_id=0, name="Root"),
+            Mumble_pb2.UserState(session=2, name="One", channel_id=0,
+                                 texture_hash=blob_hash(avatar),
+                                 comment=u"Hello \u2603"),
+            Mumble_pb2.UserState(session=3, name="Two", channel_id=0,
+                                 texture_hash=blob_hash(avatar))
+        )))
+
+        one, two = protocol.users[2], protocol.users[3]
+        transport.clear()  # The stats requests for new users
+
+        # Short comments come with the user, so don't need requesting
+        nosetools.eq_(one.comment, u"Hello \u2603")
+        nosetools.eq_(transport.value(), "")
+
+        nosetools.eq_(one.avatar, None)
+        nosetools.eq_(two.avatar, None)
+
+        # Both users have the same avatar, so it's only requested once
+        request = Mumble_pb2.RequestBlob()
+        request.session_texture.append(2)
+
+        nosetools.eq_(transport.value(), message_frame(request))
+
+        protocol.dataReceived(message_frame(
+            Mumble_pb2.UserState(session=2, texture=avatar)
+        ))
+
+        nosetools.eq_(one.avatar, avatar)
+        nosetools.eq_(two.avatar, avatar)
+        nosetools.eq_(len(protocol.blobs), 2)
+
+        # Removing the avatar
+        protocol.dataReceived(message_frame(
+            Mumble_pb2.UserState(session=3, texture="")
+        ))
+
+        nosetools.eq_(two.avatar_hash, None)
+        nosetools.eq_(two.avatar, None)
+
+    def test_apply_userstats(self):
+        """
+        MUMBL | Test that only the UserStats fields that are sent are applied
+        """
+
+        user = User(None, 2, u"Someone", None, False, False, False, False,
+                    False, False, False)
+        message = Mumble_pb2.UserStats(session=2, tcp_packets=5,
+                                       idlesecs=30, opus=True)
+        message.from_client.good = 10
+        message.celt_versions.append(-2147483637)
+        message.version.release = "1.2.4"
+
+        apply_userstats(user, message)
+
+        nosetools.eq_(user.tcp_packets_sent, 5)
+        nosetools.eq_(user.idle_time, 30)
+        nosetools.eq_(user.opus, True)
+        nosetools.eq_(user.packet_stats_from_client.good, 10)
+        nosetools.eq_(user.packet_stats_from_client.lost, 0)
+        nosetools.eq_(user.celt_versions, [-2147483637])
+        nosetools.eq_(user.version.release, "1.2.4")
+
+        # Fields that aren't there are left alone
+        apply_userstats(user, Mumble_pb2.UserStats(session=2, idlesecs=40))
+
+        nosetools.eq_(user.tcp_packets_sent, 5)
+        nosetools.eq_(user.idle_time, 40)
+
+    def test_userstats_polling(self):
+        """
+        MUMBL | Test that UserStats requests are spread out and adaptive
+        """
+
+        protocol = FakeProtocol(400)
+        clock = task.Clock()
+        poller = UserStatsPoller(protocol, rate=60, idle_rate=300,
+                                 idle_after=300, tick=1,
+                                 byte_budget=100000, clock=clock)
+
+        # Idle users are asked for less often
+        for session in xrange(2, 102):
+            protocol.users[session].idle_time = 600
+
+        poller.start()
+        clock.advance(1)  # Everyone was asked when they joined
+
+        nosetools.eq_(protocol.requested, [])
+
+        counts = []
+
+        for _ in xrange(600):
+            before = len(protocol.requested)
+            clock.advance(1)
+            counts.append(len(protocol.requested) - before)
+
+        nosetools.assert_true(max(counts) <= 7)
+
+        requested = protocol.requested
+
+        # Active users every minute, and idle users every five, starting
+        # that long after they joined
+        nosetools.eq_(requested.count(200), 9)
+        nosetools.eq_(requested.count(50), 1)
+
+        # The byte budget limits each tick
+        poller.byte_budget = poller.reply_size * 2
+        protocol.requested = []
+        clock.pump([1] * 300)
+
+        nosetools.eq_(len(protocol.requested), 600)
+
+        # No polling when nothing wants the stats
+        protocol.event_manager.has_callback = lambda name: False
+        protocol.requested = []
+        clock.pump([1] * 120)
+
+        nosetools.eq_(protocol.requested, [])
+        nosetools.eq_(poller.stats()["skipped_ticks"], 120)
+
+        poller.stop()
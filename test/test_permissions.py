@@ -273,3 +273,30 @@ class TestPlugin(PluginObject):
         """
         PERMS | Test typical permissions handler usage
         """
+
+    def test_cache_invalidation(self):
+        """
+        PERMS | Test compiled permissions are rebuilt when data changes
+        """
+        with self.data:
+            self.data["groups"]["cached"] = {
+                "options": {},
+                "permissions": ["cache.*", "^cache.denied"],
+            }
+
+        nosetools.eq_(self.handler.group_has_permission("cached",
+                                                        "cache.test"),
+                      True)
+        nosetools.eq_(self.handler.group_has_permission("cached",
+                                                        "cache.denied"),
+                      False)
+
+        with self.data:
+            self.data["groups"]["cached"]["permissions"] = ["cache.denied"]
+
+        nosetools.eq_(self.handler.group_has_permission("cached",
+                                                        "cache.test"),
+                      False)
+        nosetools.eq_(self.handler.group_has_permission("cached",
+                                                        "cache.denied"),
+                      True)
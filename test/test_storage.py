@@ -0,0 +1,107 @@
+# coding=utf-8
+import os
+import shutil
+import tempfile
+
+import nose.tools as nosetools
+
+from system.storage.data import JSONData, YamlData
+
+__author__ = 'Gareth Coles'
+
+"""
+Tests for file-backed storage objects
+"""
+
+
+def count_writes(obj):
+    writes = []
+    write_file = obj._write_file
+
+    def _write_file(data, sequence):
+        writes.append(sequence)
+        write_file(data, sequence)
+
+    obj._write_file = _write_file
+    return writes
+
+
+class test_storage:
+    """
+    DATA  | Tests for file-backed storage objects
+    """
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_storage_write_through(self):
+        """
+        DATA  | Test that unchanged data isn't written again
+        """
+
+        path = os.path.join(self.directory, "data.json")
+        obj = JSONData(path)
+        writes = count_writes(obj)
+
+        with obj:
+            obj["key"] = "value"
+
+        with obj:
+            obj["key"] = "value"
+
+        nosetools.eq_(len(writes), 1)
+        nosetools.eq_(JSONData(path)["key"], "value")
+        nosetools.assert_false(os.path.exists(path + ".tmp"))
+
+    def test_storage_load_unchanged(self):
+        """
+        DATA  | Test that saving data unchanged after loading doesn't write it
+        """
+
+        path = os.path.join(self.directory, "data.json")
+
+        obj = JSONData(path)
+
+        with obj:
+            obj["key"] = "value"
+
+        obj = JSONData(path)
+        writes = count_writes(obj)
+
+        with obj:
+            obj["key"] = "value"
+
+        nosetools.eq_(len(writes), 0)
+
+        obj.reload()
+
+        with obj:
+            obj["key"] = "other"
+
+        nosetools.eq_(len(writes), 1)
+        nosetools.eq_(JSONData(path)["key"], "other")
+
+    def test_storage_write_behind(self):
+        """
+        DATA  | Test that write-behind changes are coalesced until flushed
+        """
+
+        path = os.path.join(self.directory, "data.yml")
+        obj = YamlData(path, flush_interval=60)
+        writes = count_writes(obj)
+
+        for i in xrange(10):
+            with obj:
+                obj["key"] = i
+
+        nosetools.eq_(len(writes), 0)
+        nosetools.assert_false("key" in YamlData(path))
+
+        obj.released()
+
+        nosetools.eq_(len(writes), 1)
+        nosetools.eq_(YamlData(path)["key"], 9)
+        nosetools.eq_(obj._flush_call, None)
@@ -0,0 +1,510 @@
+# coding=utf-8
+import nose.tools as nosetools
+
+from mock import MagicMock as Mock
+import socket
+import sqlite3
+
+from twisted.internet import defer, task
+
+from plugins.urls.constants import STOP_HANDLING
+from plugins.urls.handlers.website import TitleResult, WebsiteHandler
+from plugins.urls.http_pool import HTTPPool, PoolFullError
+from plugins.urls.resolver import AddressResolver
+from plugins.urls.rules import DomainRules, RuleSet
+from plugins.urls.shortened import ShortenedURLs
+from plugins.urls.titles import TitleExtractor, get_charset
+from utils.cache import LRUCache
+
+__author__ = 'Gareth Coles'
+
+"""
+Tests for the URLs plugin's shared HTTP pool and title extraction
+"""
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        d = defer.Deferred()
+        self.requests.append((url, d))
+        return d
+
+    def finish(self, url):
+        for i, (_url, d) in enumerate(self.requests):
+            if _url == url:
+                del self.requests[i]
+                d.callback(url)
+                return
+
+
+class FakeResolver(object):
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.lookups = []
+
+    def gethostbyname(self, host):
+        self.lookups.append(host)
+
+        if host not in self.hosts:
+            raise socket.gaierror(-2, "Name or service not known")
+        return self.hosts[host]
+
+
+class FakeThreadPool(object):
+    def __init__(self):
+        self.calls = []
+
+    def callInThread(self, func):
+        self.calls.append(func)
+
+    def run(self):
+        while self.calls:
+            self.calls.pop(0)()
+
+
+class FakeReactor(task.Clock):
+    def callFromThread(self, func, *args):
+        func(*args)
+
+
+class FakeDatabase(object):
+    """
+    Runs queries straight away, rather than on adbapi's threads
+    """
+
+    def __init__(self):
+        self.connection = sqlite3.connect(":memory:")
+        self.queries = []
+
+    def runInteraction(self, func, *args):
+        cursor = self.connection.cursor()
+        result = func(cursor, *args)
+        self.connection.commit()
+        return defer.succeed(result)
+
+    def runQuery(self, query, args=()):
+        self.queries.append(query)
+        return self.runInteraction(
+            lambda cursor: cursor.execute(query, args).fetchall()
+        )
+
+
+def extract(page, charset=None, chunk_size=7, max_read=None):
+    extractor = TitleExtractor(charset)
+
+    for i in xrange(0, len(page), chunk_size):
+        if extractor.feed(page[i:i + chunk_size]):
+            break
+        if max_read is not None and extractor.bytes_read >= max_read:
+            break
+
+    return extractor
+
+
+class test_urls:
+    """
+    URLS  | Tests for the URLs plugin
+    """
+
+    def test_http_pool_limits(self):
+        """
+        URLS  | Test the HTTP pool's concurrency and per-host limits
+        """
+
+        pool = HTTPPool(max_concurrent=3, max_per_host=2, max_pending=2,
+                        pool=Mock(name="pool"))
+        session = FakeSession()
+        results = []
+
+        for url in ("http://a/1", "http://a/2", "http://a/3",
+                    "http://b/1", "http://c/1"):
+            pool.get(url, session=session).addBoth(results.append)
+
+        # a/3 waits for its host, c/1 for a free slot
+        nosetools.eq_([url for url, _ in session.requests],
+                      ["http://a/1", "http://a/2", "http://b/1"])
+        nosetools.eq_(pool.stats()["pending"], 2)
+
+        # Too many requests are waiting now
+        pool.get("http://d/1", session=session).addBoth(results.append)
+        nosetools.eq_(results[0].type, PoolFullError)
+
+        # c/1 has been waiting for a slot the longest, so it goes first
+        session.finish("http://a/1")
+        nosetools.eq_([url for url, _ in session.requests],
+                      ["http://a/2", "http://b/1", "http://c/1"])
+
+        session.finish("http://b/1")
+        nosetools.eq_([url for url, _ in session.requests],
+                      ["http://a/2", "http://c/1", "http://a/3"])
+
+        for url in ("http://a/2", "http://a/3", "http://c/1"):
+            session.finish(url)
+
+        stats = pool.stats()
+        nosetools.eq_(
+            (stats["completed"], stats["rejected"], stats["in_flight"],
+             stats["pending"], stats["hosts"]),
+            (5, 1, 0, 0, 0)
+        )
+
+    def test_resolver_cache(self):
+        """
+        URLS  | Test the DNS cache's expiry, coalescing and eviction
+        """
+
+        fake = FakeResolver({"example.com": "93.184.216.34",
+                             "local.example": "127.0.0.1",
+                             "lan.example": "192.168.0.1"})
+        pool = FakeThreadPool()
+        clock = FakeReactor()
+        resolver = AddressResolver(pool=pool, resolver=fake, reactor=clock,
+                                   ttl=60, negative_ttl=10, max_size=2)
+        results = []
+
+        # Both of these share the one lookup
+        resolver.check_host("example.com").addBoth(results.append)
+        resolver.get_host_by_name("EXAMPLE.com").addBoth(results.append)
+        pool.run()
+
+        nosetools.eq_(fake.lookups, ["example.com"])
+        nosetools.eq_(results, [("93.184.216.34", False), "93.184.216.34"])
+
+        # Cached now
+        clock.advance(59)
+        resolver.check_host("example.com").addBoth(results.append)
+        nosetools.eq_(results[-1], ("93.184.216.34", False))
+        nosetools.eq_(pool.calls, [])
+
+        # Failed lookups are cached too, for less time
+        resolver.check_host("nope.example").addBoth(results.append)
+        pool.run()
+        resolver.check_host("nope.example").addBoth(results.append)
+        nosetools.eq_(results[-1].type, socket.gaierror)
+        nosetools.eq_(results[-2].type, socket.gaierror)
+        nosetools.eq_(pool.calls, [])
+
+        clock.advance(10)
+        resolver.check_host("nope.example").addBoth(results.append)
+        nosetools.eq_(len(pool.calls), 1)
+        pool.run()
+
+        # Only two hosts fit, so the least recently used go first
+        resolver.check_host("local.example").addBoth(results.append)
+        pool.run()
+        nosetools.eq_(results[-1], ("127.0.0.1", True))
+        nosetools.ok_("example.com" not in resolver._cache)
+
+        resolver.check_host("lan.example").addBoth(results.append)
+        resolver.check_host("example.com").addBoth(results.append)
+        pool.run()
+        nosetools.eq_(results[-2:], [("192.168.0.1", True),
+                                     ("93.184.216.34", False)])
+
+        nosetools.eq_(fake.lookups, ["example.com", "nope.example",
+                                     "nope.example", "local.example",
+                                     "lan.example", "example.com"])
+        nosetools.eq_(resolver.stats(), {
+            "cached": 2, "in_flight": 0, "hits": 1, "negative_hits": 1,
+            "misses": 6, "coalesced": 1, "evictions": 3
+        })
+
+    def test_shortened_urls(self):
+        """
+        URLS  | Test storing shortened URLs, and shortening each only once
+        """
+
+        database = FakeDatabase()
+        database.runQuery("CREATE TABLE urls (url TEXT, shortener TEXT, "
+                          "result TEXT)")
+
+        for row in (("http://a", "tinyurl", "short-a"),
+                    ("http://a", "tinyurl", "short-a2"),
+                    ("http://a", "other", "other-a"),
+                    ("http://b", "tinyurl", "short-b"),
+                    ("http://a", "tinyurl", "short-a3")):
+            database.runQuery("INSERT INTO urls VALUES (?, ?, ?)", row)
+
+        urls = ShortenedURLs(database)
+        results = []
+
+        # Duplicates are removed once, keeping the first of each
+        urls.setup().addCallback(results.append)
+        urls.setup().addCallback(results.append)
+        nosetools.eq_(results, [2, 0])
+        nosetools.eq_(
+            database.runQuery("SELECT * FROM urls ORDER BY rowid").result,
+            [(u"http://a", u"tinyurl", u"short-a"),
+             (u"http://a", u"other", u"other-a"),
+             (u"http://b", u"tinyurl", u"short-b")]
+        )
+
+        # Requests for the same URL share one call to the shortener
+        pending = []
+
+        def shorten():
+            pending.append(defer.Deferred())
+            return pending[-1]
+
+        del results[:]
+        urls.get("http://c", "TinyURL", shorten).addBoth(results.append)
+        urls.get("http://c", "tinyurl", shorten).addBoth(results.append)
+        nosetools.eq_(len(pending), 1)
+
+        pending[0].callback("short-c")
+        nosetools.eq_(results, ["short-c", "short-c"])
+
+        # It's in memory now, and in the database for next time
+        queries = len(database.queries)
+        urls.get("http://c", "tinyurl", shorten).addBoth(results.append)
+        nosetools.eq_(results[-1], "short-c")
+        nosetools.eq_(len(database.queries), queries)
+
+        ShortenedURLs(database).get("http://c", "tinyurl").addBoth(
+            results.append
+        )
+        nosetools.eq_(results[-1], "short-c")
+
+        # Failures aren't kept, and are passed to everyone waiting
+        urls.get("http://d", "tinyurl", shorten).addBoth(results.append)
+        urls.get("http://d", "tinyurl", shorten).addBoth(results.append)
+        pending[-1].errback(ValueError("Down"))
+        nosetools.eq_([r.type for r in results[-2:]], [ValueError] * 2)
+
+        urls.get("http://d", "tinyurl").addBoth(results.append)
+        nosetools.eq_(results[-1], None)
+        nosetools.eq_(len(pending), 2)
+
+        stats = urls.stats()
+        nosetools.eq_((stats["hits"], stats["shortened"],
+                       stats["coalesced"]), (1, 2, 2))
+
+    def test_domain_rules(self):
+        """
+        URLS  | Test compiled domain rules and the decisions they make
+        """
+
+        rules = RuleSet([
+            (r"example\.com", "exact"),
+            (r".*\.example\.com", "subdomains"),
+            (r"mail\.example\.com", "too late"),
+            (r"(www|beta)\.test\..*", "pattern"),
+            (r"^foo\.test$", "anchored"),
+            (r".*\.test", "test")
+        ])
+
+        nosetools.eq_(len(rules), 6)
+        nosetools.eq_(rules.match("EXAMPLE.com"), "exact")
+        nosetools.eq_(rules.match("mail.example.com"), "subdomains")
+        nosetools.eq_(rules.match("example.com.evil.org"), None)
+        nosetools.eq_(rules.match("notexample.com", "default"), "default")
+        nosetools.eq_(rules.match("beta.test.org"), "pattern")
+        nosetools.eq_(rules.match("foo.test"), "anchored")
+        nosetools.eq_(rules.match("bar.foo.test"), "test")
+
+        # Patterns that can't be combined are matched one at a time
+        rules = RuleSet([(r"(a)\1\.org", 1), (r"(?P<b>b)\.org", 2),
+                         (r"(?P<b>bb)\.org", 3), (r"[", 4)])
+        nosetools.eq_(
+            [rules.match(d) for d in ("aa.org", "b.org", "bb.org", "[")],
+            [1, 2, 3, None]
+        )
+        nosetools.eq_([pattern for pattern, _ in rules.invalid], ["["])
+
+        # Backreferences would point at the wrong group if combined
+        rules = RuleSet([(r"x+\.org", 0), (r"(a)\1\.org", 1)])
+        nosetools.eq_(rules.match("aa.org"), 1)
+        nosetools.eq_(rules._combined, None)
+
+        rules = DomainRules.from_config({
+            "blacklist": [r".*//spam\.com($|/).*"],
+            "sessions": {
+                "never": [r".*\.facebook\.com"],
+                "group": {"google": [r"google\.com", r".*\.google\.com"]}
+            },
+            "proxies": {"domains": {r".*\.onion": {"http": "tor"}}}
+        })
+
+        nosetools.ok_(rules.is_blacklisted("http://spam.com/x"))
+        nosetools.ok_(not rules.is_blacklisted("http://spam.com.au/x"))
+
+        nosetools.eq_(rules.lookup("www.facebook.com"), (True, None, None))
+        nosetools.eq_(rules.lookup("mail.google.com"),
+                      (False, "google", None))
+        nosetools.eq_(rules.lookup("abc.onion"),
+                      (False, None, {"http": "tor"}))
+        nosetools.eq_(rules.lookup("example.org"), (False, None, None))
+
+        rules.lookup("mail.google.com")
+        nosetools.eq_(rules.cache.stats()["hits"], 1)
+
+    def test_title_cache(self):
+        """
+        URLS  | Test sharing and caching the titles of fetched URLs
+        """
+
+        # Without its sessions and cookie jars, which aren't needed here
+        handler = WebsiteHandler.__new__(WebsiteHandler)
+        handler.plugin = Mock(name="plugin")
+        handler.urls_plugin = Mock(name="urls_plugin", config={})
+        handler.titles = LRUCache(10, 600, clock=lambda: 1000)
+        handler._fetching = {}
+        handler.coalesced = 0
+
+        fetches = {}
+
+        def fetch(url, context):
+            fetches.setdefault(url.to_string(), []).append(defer.Deferred())
+            return fetches[url.to_string()][-1]
+
+        handler.fetch = fetch
+
+        def url(string):
+            return Mock(to_string=lambda: string, domain=string[7:])
+
+        def context(language="en"):
+            return {"event": Mock(name="event"), "config": {
+                "spoofing": {}, "accept_language": {"default": language}
+            }}
+
+        def responses(context):
+            return [args[0] for args, _ in
+                    context["event"].target.respond.call_args_list]
+
+        # Three channels post the same link at once
+        contexts = [context() for _ in xrange(3)]
+
+        for c in contexts:
+            nosetools.eq_(handler.call(url("http://a"), c), STOP_HANDLING)
+
+        nosetools.eq_(len(fetches["http://a"]), 1)
+
+        fetches["http://a"][0].callback(TitleResult(200, u"A", "a"))
+
+        for c in contexts:
+            nosetools.eq_(responses(c), [u'"A" at a'])
+
+        # And then someone posts it again
+        later = context()
+        handler.call(url("http://a"), later)
+        nosetools.eq_(responses(later), [u'"A" at a'])
+        nosetools.eq_(len(fetches["http://a"]), 1)
+
+        # Errors are remembered, for less time, unless the pool was busy
+        handler.call(url("http://b"), context())
+        fetches["http://b"][0].errback(ValueError("Broken"))
+        handler.call(url("http://b"), context())
+        nosetools.eq_(len(fetches["http://b"]), 1)
+        nosetools.eq_(
+            handler.titles._data[handler.cache_key(url("http://b"),
+                                                   context())],
+            (None, 1060)
+        )
+
+        handler.call(url("http://c"), context())
+        fetches["http://c"][0].errback(PoolFullError("Busy"))
+        handler.call(url("http://c"), context())
+        nosetools.eq_(len(fetches["http://c"]), 2)
+
+        # Pages are only shared between messages that would fetch them the
+        # same way
+        german = context("de")
+        handler.call(url("http://a"), german)
+        nosetools.eq_(len(fetches["http://a"]), 2)
+        nosetools.eq_(responses(german), [])
+
+        stats = handler.stats()
+        nosetools.eq_((stats["hits"], stats["coalesced"], stats["in_flight"]),
+                      (2, 2, 2))
+
+    def test_title_extractor(self):
+        """
+        URLS  | Test extracting titles as pages are read
+        """
+
+        page = ("<!DOCTYPE html><html><head>"
+                "<!-- <title>Not this</title> -->"
+                "<script>var s = '<title>Or this</title>';</script>"
+                "<meta charset=\"utf-8\">"
+                "<TITLE lang=\"en\">\n  Fish &amp; Chips \xe2\x80\x94\n"
+                "  Menu&#x21; </title></head><body>%s</body></html>"
+                % ("x" * 10000))
+
+        title_end = page.index("</head>")
+
+        # However the page is split up, we stop reading after the title
+        for chunk_size in (1, 2, 3, 7, 64, 1024):
+            extractor = extract(page, chunk_size=chunk_size)
+
+            nosetools.ok_(extractor.done)
+            nosetools.ok_(extractor.bytes_read < title_end + chunk_size)
+            nosetools.eq_(extractor.finish(), u"Fish & Chips \u2014 Menu!")
+
+        # The head ended without a title
+        extractor = extract("<html><head><link rel=x></head><body>"
+                            "<svg><title>Icon</title></svg></body></html>")
+        nosetools.ok_(extractor.done)
+        nosetools.eq_(extractor.finish(), None)
+
+        extractor = extract("<html><body><p>Hi</p>" + "x" * 1000)
+        nosetools.ok_(extractor.done)
+        nosetools.ok_(extractor.bytes_read < 100)
+        nosetools.eq_(extractor.finish(), None)
+
+        nosetools.eq_(extract("<title> \n </title>").finish(), None)
+
+    def test_title_extractor_charsets(self):
+        """
+        URLS  | Test the charsets titles are decoded with
+        """
+
+        latin1 = "<title>Caf\xe9</title>"
+        utf8 = "<title>Caf\xc3\xa9</title>"
+
+        # Header, then meta tag, then UTF-8, then Windows-1252
+        nosetools.eq_(extract(latin1, "iso-8859-1").finish(), u"Caf\xe9")
+        meta = ('<meta http-equiv="Content-Type" '
+                'content="text/html; charset=ISO-8859-1">')
+        nosetools.eq_(extract(meta + latin1).finish(), u"Caf\xe9")
+        nosetools.eq_(
+            extract('<meta charset="utf-8">' + latin1, "latin-1").finish(),
+            u"Caf\xe9"
+        )
+        nosetools.eq_(extract(utf8).finish(), u"Caf\xe9")
+        nosetools.eq_(extract(latin1).finish(), u"Caf\xe9")
+        nosetools.eq_(extract(utf8, "no-such-charset").finish(), u"Caf\xe9")
+        nosetools.eq_(extract("\xef\xbb\xbf" + utf8).finish(), u"Caf\xe9")
+
+        # UTF-16 can't be scanned as bytes, so BeautifulSoup deals with it
+        page = u"<html><head><title>Caf\xe9</title></head></html>"
+        extractor = extract(page.encode("utf-16"))
+        nosetools.ok_(not extractor.done)
+        nosetools.eq_(extractor.finish(), u"Caf\xe9")
+
+        nosetools.eq_(get_charset("text/html; charset=\"UTF-8\""), "utf-8")
+        nosetools.eq_(get_charset("text/html;charset=binary"), "binary")
+        nosetools.eq_(get_charset("text/html"), None)
+
+    def test_title_extractor_fallback(self):
+        """
+        URLS  | Test falling back to BeautifulSoup for unfinished heads
+        """
+
+        page = "<html><head><title>Long\n " + "x" * 100
+
+        # The title never ends within what we'd read
+        extractor = extract(page, max_read=50)
+        nosetools.ok_(not extractor.done)
+        nosetools.eq_(extractor.bytes_read, 56)
+        nosetools.eq_(extractor.finish(), u"Long " + u"x" * 31)
+
+        extractor = extract("<html><head><title>Short</title>", max_read=50)
+        nosetools.eq_(extractor.finish(), u"Short")
+
+        # Scripts that never end
+        extractor = extract("<head><script>" + "x" * 100, max_read=50)
+        nosetools.ok_(not extractor.done)
+        nosetools.eq_(extractor.finish(), None)
@@ -4,19 +4,24 @@ import sys
 
 import nose.tools as nosetools
 
-from utils import irc, misc, password, strings, html, console
+from mock_time import StoppedTime
+from utils import cache, irc, misc, password, ratelimit, stats, strings, \
+    html, console
 
 __author__ = 'Gareth Coles'
 
 """
 Tests for the utils module. There's a set of functions for each module..
 
+cache    - In-memory caches
 config   - Configuration file objects
 data     - Data file objects
 html     - HTML utilities
 irc      - Utilities for the IRC protocol
 misc     - Uncategorised utilities
 password - Password generation utilities
+ratelimit - Rate-limiting utilities
+stats    - Stats recording and aggregation
 strings  - String manipulation utilities
 """
 
@@ -26,6 +31,43 @@ class test_utils:
     UTILS | Test modules in the utils package
     """
 
+    # Cache
+
+    def test_cache_lru_eviction(self):
+        """
+        UTILS | Test LRU cache eviction order
+        """
+
+        lru = cache.LRUCache(2)
+
+        lru.set("a", 1)
+        lru.set("b", 2)
+        nosetools.eq_(lru.get("a"), 1)
+
+        lru.set("c", 3)  # Evicts "b", which is least recently used
+
+        nosetools.assert_false("b" in lru)
+        nosetools.eq_(lru.get("a"), 1)
+        nosetools.eq_(lru.get("c"), 3)
+        nosetools.eq_(lru.get("b", "missing"), "missing")
+        nosetools.eq_((lru.hits, lru.misses), (3, 1))
+
+    def test_cache_lru_ttl(self):
+        """
+        UTILS | Test LRU cache entry expiry
+        """
+
+        clock = StoppedTime(start_time=0)
+        lru = cache.LRUCache(10, ttl=5, clock=clock.time)
+
+        lru.set("a", 1)
+        lru.set("b", 2, ttl=20)
+
+        clock.sleep(10)
+
+        nosetools.eq_(lru.get("a"), None)
+        nosetools.eq_(lru.get("b"), 2)
+
     # Config
 
     # Console
@@ -125,6 +167,46 @@ class test_utils:
 
         irc.split_hostmask("aaa!bbbccc")
 
+    def test_irc_case_mapping(self):
+        """
+        UTILS | Test IRC nick lowercasing for each case-mapping
+        """
+
+        utils = irc.IRCUtils(None)
+
+        nosetools.eq_(utils.lowercase_nick_chan("Nick[A]^\\"), "nick{a}~|")
+        nosetools.eq_(utils.lowercase_nick_chan(u"Nick[\xc9]"), u"nick{\xe9}")
+        nosetools.assert_true(utils.compare_nicknames("NICK^", "nick~"))
+
+        # Equal str and unicode nicks are lowercased to their own types
+        nosetools.eq_(type(utils.lowercase_nick_chan("Nick")), str)
+        nosetools.eq_(type(utils.lowercase_nick_chan(u"Nick")), unicode)
+
+        utils.case_mapping = "strict-rfc1459"
+        nosetools.eq_(utils.lowercase_nick_chan("Nick[A]^\\"), "nick{a}^|")
+
+        utils.case_mapping = "ascii"
+        nosetools.eq_(utils.lowercase_nick_chan("Nick[A]^\\"), "nick[a]^\\")
+
+    def test_irc_match_hostmask(self):
+        """
+        UTILS | Test IRC hostmask matching with wildcards
+        """
+
+        utils = irc.IRCUtils(None)
+
+        nosetools.assert_true(
+            utils.match_hostmask("Nick[1]!~id@host.example.com",
+                                 "nick{1}!*@*.example.com")
+        )
+        nosetools.assert_true(
+            utils.match_hostmask("Nick!~id@host.example.com", "*!?id@*")
+        )
+        nosetools.assert_false(
+            utils.match_hostmask("Nick!~id@host.example.com",
+                                 "*!*@*.example.org")
+        )
+
     # Misc
 
     def test_misc_chunker(self):
@@ -228,6 +310,55 @@ exception
 
         nosetools.eq_(0, len(duplicates), "1000 passwords")
 
+    # Ratelimit
+
+    def test_ratelimit_token_bucket(self):
+        """
+        UTILS | Test token bucket refills
+        """
+
+        clock = StoppedTime(start_time=0)
+        bucket = ratelimit.TokenBucket(2, 1, clock=clock.time)
+
+        nosetools.assert_true(bucket.consume(2))
+        nosetools.assert_false(bucket.consume())
+        nosetools.eq_(bucket.time_until(1), 1)
+
+        clock.sleep(0.5)
+        nosetools.assert_false(bucket.consume())
+        nosetools.eq_(bucket.time_until(1), 0.5)
+
+        clock.sleep(0.5)
+        nosetools.assert_true(bucket.consume())
+        nosetools.assert_false(bucket.consume())
+
+        clock.sleep(10)
+        nosetools.eq_(bucket.time_until(2), 0)
+        nosetools.assert_false(bucket.consume(3))
+
+    # Stats
+
+    def test_stats_aggregator_add(self):
+        """
+        UTILS | Test adding amounts to aggregated time periods
+        """
+
+        real_time = stats.time
+        clock = StoppedTime(start_time=100)
+        stats.time = clock
+
+        try:
+            aggregator = stats.TimeDataAggregator(10, 3, 0.0)
+
+            aggregator.add(1.5)
+            aggregator.add(2)
+            clock.sleep(10)
+            aggregator.add(4)
+
+            nosetools.eq_(aggregator.get_records(), [(100, 3.5), (110, 4.0)])
+        finally:
+            stats.time = real_time
+
     # Strings
 
     def test_strings_formatter_replacements(self):
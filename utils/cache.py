@@ -0,0 +1,162 @@
+# coding=utf-8
+
+"""
+Small in-memory caching utilities
+"""
+
+__author__ = 'Gareth Coles'
+
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    A size-bounded dict-like cache that evicts the least recently used entry,
+    with an optional time-to-live for entries.
+
+    Hit and miss counts are recorded in *hits* and *misses* so callers can
+    report on how effective the cache is.
+    """
+
+    def __init__(self, max_size=1024, ttl=None, clock=None):
+        """
+        :param max_size: Maximum number of entries to keep, or None for no
+            limit
+        :param ttl: Default number of seconds an entry is valid for, or None
+            for no expiry
+        :param clock: Function returning the current time (default:
+            time.time)
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        if clock is None:
+            clock = time.time
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+
+    def __repr__(self):
+        return "%s(max_size=%r, ttl=%r)" % (
+            self.__class__.__name__,
+            self.max_size,
+            self.ttl
+        )
+
+    def get(self, key, default=None):
+        """
+        Get an entry, marking it as recently used.
+
+        :param key: The key to look up
+        :param default: Returned if the key is missing or has expired
+
+        :return: The cached value, or *default*
+        """
+
+        try:
+            value, expires = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if expires is not None and expires <= self.clock():
+            self.misses += 1
+            return default
+
+        self._data[key] = (value, expires)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store an entry, evicting the least recently used entries if the cache
+        is full.
+
+        :param key: The key to store the value under
+        :param value: The value to store
+        :param ttl: Seconds this entry is valid for (default: the cache's TTL)
+        """
+
+        if ttl is None:
+            ttl = self.ttl
+
+        if ttl is None:
+            expires = None
+        else:
+            expires = self.clock() + ttl
+
+        self._data.pop(key, None)
+        self._data[key] = (value, expires)
+
+        if self.max_size is not None:
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Remove an entry, returning its value if it was present and valid.
+        """
+
+        try:
+            value, expires = self._data.pop(key)
+        except KeyError:
+            return default
+
+        if expires is not None and expires <= self.clock():
+            return default
+        return value
+
+    def discard_where(self, predicate):
+        """
+        Remove every entry whose key matches a predicate.
+
+        :param predicate: Function taking a key and returning True if the
+            entry should be removed
+
+        :return: The number of entries removed
+        :rtype: int
+        """
+
+        keys = [key for key in self._data if predicate(key)]
+
+        for key in keys:
+            del self._data[key]
+
+        return len(keys)
+
+    def clear(self):
+        """
+        Remove all entries. Hit and miss counts are kept.
+        """
+
+        self._data.clear()
+
+    def stats(self):
+        """
+        Get a summary of the cache's size and effectiveness.
+
+        :rtype: dict
+        """
+
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+    def __contains__(self, key):
+        try:
+            expires = self._data[key][1]
+        except KeyError:
+            return False
+        return expires is None or expires > self.clock()
+
+    def __len__(self):
+        return len(self._data)
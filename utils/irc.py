@@ -8,7 +8,10 @@ that make direct use of it.
 """
 
 import re
+import string
+
 from system.protocols.irc import constants
+from system.protocols.irc.hostmasks import Hostmask, HostmaskMatcher
 
 from system.translations import Translations
 _ = Translations().get()
@@ -91,6 +94,25 @@ def strip_formatting(message):
     return _re_formatting.sub("", message)
 
 
+def _case_tables(upper, lower):
+    """
+    Build the translation tables for a case-mapping.
+
+    :param upper: Characters that are lowercased, besides A-Z
+    :param lower: What each of them is lowercased to
+
+    :return: Tuple of (str.translate() table, unicode.translate() table).
+        The unicode table is used after unicode.lower(), so it only has the
+        extra characters.
+    """
+
+    return (
+        string.maketrans(string.ascii_uppercase + upper,
+                         string.ascii_lowercase + lower),
+        dict((ord(u), ord(l)) for u, l in zip(upper, lower))
+    )
+
+
 class IRCUtils(object):
     """
     Because rakiru is a stickler for perfection, sometimes.
@@ -114,10 +136,30 @@ class IRCUtils(object):
                      "rfc1459": RFC1459,
                      "strict-rfc1459": STRICT_RFC1459}
 
+    # Translation tables for each case-mapping - see _case_tables()
+    _TABLES = {ASCII: _case_tables("", ""),
+               RFC1459: _case_tables("[]\\^", "{}|~"),
+               STRICT_RFC1459: _case_tables("[]\\", "{}|")}
+
+    #: How many lowercased nicks and channels to remember
+    memo_size = 4096
+
+    #: How many compiled hostmasks (and hostmask parts) to remember
+    mask_cache_size = 1024
+
     _case_mapping = RFC1459
 
     def __init__(self, log, case_mapping="rfc1459", chan_types="&#+!"):
         self.log = log
+        # Separate memos, as equal str and unicode nicks hash the same, but
+        # should be lowercased to their own types
+        self._byte_memo = {}
+        self._unicode_memo = {}
+        self._mask_cache = {}
+        self._part_cache = {}
+        self._byte_table, self._unicode_table = self._TABLES[
+            self._case_mapping
+        ]
         self.case_mapping = case_mapping
         self.chan_types = chan_types
 
@@ -144,6 +186,15 @@ class IRCUtils(object):
             self._case_mapping = self.CASE_MAPPINGS[val.lower()]
         except Exception:
             self.log.warning(_("Invalid case mapping: %s") % val)
+            return
+
+        # Anything we lowercased before may be wrong now
+        self._byte_table, self._unicode_table = self._TABLES[
+            self._case_mapping
+        ]
+        self._byte_memo.clear()
+        self._unicode_memo.clear()
+        self._mask_cache.clear()
 
     def lowercase_nick_chan(self, nick):
         """
@@ -152,13 +203,28 @@ class IRCUtils(object):
         :param nick: Nick/channel to make lowercase
         :return: Lowercase nick/channel
         """
-        nick = nick.lower()
-        if ((self.case_mapping == self.RFC1459 or
-             self.case_mapping == self.STRICT_RFC1459)):
-            nick = nick.replace('[', '{').replace(']', '}').replace('\\', '|')
-            if self.case_mapping == self.RFC1459:
-                nick.replace('^', '~')
-        return nick
+        if isinstance(nick, str):
+            memo = self._byte_memo
+        else:
+            memo = self._unicode_memo
+
+        try:
+            return memo[nick]
+        except KeyError:
+            pass
+
+        if memo is self._byte_memo:
+            lowered = nick.translate(self._byte_table)
+        else:
+            lowered = nick.lower().translate(self._unicode_table)
+
+        if len(memo) >= self.memo_size:
+            # Cheaper than keeping track of what was used least recently,
+            # and the nicks that are still around soon come back
+            memo.clear()
+
+        memo[nick] = lowered
+        return lowered
 
     def compare_nicknames(self, nickone, nicktwo):
         """
@@ -182,6 +248,40 @@ class IRCUtils(object):
         """
         return split_hostmask(hostmask)
 
+    def compile_hostmask(self, mask):
+        """
+        Compile a hostmask, for matching lots of users against it. Compiled
+        masks are cached, so this is cheap for masks we've seen recently.
+
+        Compiled masks use the current case-mapping, so don't keep them
+        around if it might change.
+
+        :param mask: The mask, with * and ? wildcards
+        :rtype: system.protocols.irc.hostmasks.Hostmask
+        """
+        try:
+            return self._mask_cache[mask]
+        except KeyError:
+            pass
+
+        compiled = Hostmask(mask, self.lowercase_nick_chan)
+
+        if len(self._mask_cache) >= self.mask_cache_size:
+            self._mask_cache.clear()
+        self._mask_cache[mask] = compiled
+
+        return compiled
+
+    def hostmask_matcher(self, masks=None):
+        """
+        Create a matcher for matching many users against many masks, like a
+        ban list.
+
+        :param masks: Masks to start with
+        :rtype: system.protocols.irc.hostmasks.HostmaskMatcher
+        """
+        return HostmaskMatcher(self.lowercase_nick_chan, masks)
+
     def match_hostmask(self, user, mask):
         """
         Match a user's hostmask with another one. Wildcards are supported.
@@ -190,17 +290,8 @@ class IRCUtils(object):
         :param mask: Second hostmask to match against
         :return: Whether the two hostmasks match
         """
-        usersplit = split_hostmask(user)
-        masksplit = split_hostmask(mask)
-        # Case-insensitive match for nickname
-        # match_hostmask_part() does a regular lower() too
-        # which is fine for the other parts
-        usersplit[0] = self.lowercase_nick_chan(usersplit[0])
-        masksplit[0] = self.lowercase_nick_chan(masksplit[0])
-        for x in xrange(3):
-            if not self.match_hostmask_part(usersplit[x], masksplit[x]):
-                return False
-        return True
+        split_hostmask(mask)  # Raises ValueError for broken masks
+        return self.compile_hostmask(mask).match(*split_hostmask(user))
 
     def match_hostmask_part(self, user, mask):
         """
@@ -215,8 +306,19 @@ class IRCUtils(object):
         #   ? - match any character, exactly once
         # Here, we convert the mask into its regex counterpart
         # and use that to compare
-        mask = re.escape(mask.lower()).replace(r'\*', '.*').replace(r'\?', '.')
-        return re.match(mask, user) is not None
+        try:
+            regex = self._part_cache[mask]
+        except KeyError:
+            pattern = re.escape(mask.lower())
+            regex = re.compile(
+                pattern.replace(r'\*', '.*').replace(r'\?', '.')
+            )
+
+            if len(self._part_cache) >= self.mask_cache_size:
+                self._part_cache.clear()
+            self._part_cache[mask] = regex
+
+        return regex.match(user) is not None
 
     def format_string(self, value, values=None):
         """
@@ -54,6 +54,21 @@ def dict_swap(d):
     return done
 
 
+def intern_string(value):
+    """
+    Intern a string, so that equal strings share one copy in memory.
+
+    Only byte strings can be interned - anything else, including unicode
+    strings and None, is returned as-is.
+
+    :param value: The string to intern
+    """
+
+    if type(value) is str:
+        return intern(value)
+    return value
+
+
 def chunker(iterable, chunksize):
     """
     Split an iterable into chunks of size *chunksize* and return them in a
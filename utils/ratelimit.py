@@ -14,18 +14,24 @@ class TokenBucket(object):
     it was about to perform. This is a form of rate limiting.
     """
 
-    def __init__(self, capacity, fill_rate, initial_capacity=None):
+    def __init__(self, capacity, fill_rate, initial_capacity=None,
+                 clock=None):
         """
         :param capacity: Max token count
         :param fill_rate: Token count increase per second
         :param initial_capacity: Initial token count
+        :param clock: Function returning the current time (default:
+            time.time)
         """
         self.capacity = capacity
         self.fill_rate = fill_rate
         if initial_capacity is None:
             initial_capacity = capacity
+        if clock is None:
+            clock = time.time
+        self.clock = clock
         self._tokens = initial_capacity
-        self._last_fill = time.time()
+        self._last_fill = clock()
 
     def __repr__(self):
         return "%s(capacity=%r, fill_rate=%r, initial_capacity=%r)" % (
@@ -56,11 +62,24 @@ class TokenBucket(object):
         else:
             return False
 
+    def time_until(self, tokens=1):
+        """
+        Get how long it'll be until tokens can be consumed.
+        :param tokens: Number of tokens that will be consumed
+        :return: Number of seconds to wait, 0 if they're available now
+        """
+        self._update_tokens()
+        if tokens <= self._tokens:
+            return 0
+        return (tokens - self._tokens) / float(self.fill_rate)
+
     def _update_tokens(self):
         """
         Increase token count based on time passed since last fill, up to
         capacity.
         """
-        time_passed = time.time() - self._last_fill
+        now = self.clock()
+        time_passed = now - self._last_fill
         new_tokens = time_passed * self.fill_rate
         self._tokens = min(self._tokens + new_tokens, self.capacity)
+        self._last_fill = now
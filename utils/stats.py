@@ -72,7 +72,7 @@ class TimeDataAggregator(object):
             self._last_index = self._index
             self._index = (self._index + 1) % self.SAVED_PERIODS
             self._records[self._index][self._TIME] = time_slot
-            self._records[self._index][self._VALUE] = 0
+            self._records[self._index][self._VALUE] = self.initial_value
 
         return self._records[self._index]
 
@@ -99,6 +99,17 @@ class TimeDataAggregator(object):
         record = self._get_current_record()
         record[self._VALUE] = self._increment_function(record[self._VALUE])
 
+    def add(self, amount):
+        """
+        Add an amount to the stored value for the current record - for
+        example, to total up durations rather than count events.
+
+        :param amount: The amount to add
+        """
+
+        record = self._get_current_record()
+        record[self._VALUE] += amount
+
     def decrement(self):
         """
         Decrement the stored value for the current record.